@@ -1,76 +1,270 @@
-from flask import Flask, render_template, request, redirect, url_for, flash, jsonify
+from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, send_from_directory, session, abort, get_template_attribute, Response, stream_with_context
 from flask_login import LoginManager, UserMixin, login_user, logout_user, login_required, current_user
 from flask_sqlalchemy import SQLAlchemy
-from sqlalchemy import func
-from datetime import datetime, date, timedelta
+from jinja2 import FileSystemBytecodeCache
+from markupsafe import Markup
+from sqlalchemy import func, inspect, tuple_
+from sqlalchemy.exc import IntegrityError
+from datetime import datetime, date, time as dtime, timedelta, timezone
 import calendar
-from authlib.integrations.flask_client import OAuth
+import click
 from dotenv import load_dotenv
 import os
+import threading
+from werkzeug.http import is_resource_modified
+from urllib.parse import urlencode
 from werkzeug.middleware.proxy_fix import ProxyFix
-from authlib.jose import jwt
-import requests
 import json
-import base64
+import math
+import time
+from collections import namedtuple
+import random
+import hmac
+import itertools
+import secrets
+import uuid
+import zlib
+import ics
+import metrics
+import profiler
+from assets import ASSETS
+from cache import LRUCache, VERSIONS, VersionedCache, bump_version
+from concurrency import sqlite_connect_args
+from sharding import ROUTER, ShardedSession, ensure_schema, using_shard
+# 注意：authlib / requests / oidc 只在登入流程裡才 import（見 get_oauth_client），
+# 只服務行事曆頁面的 worker 不必載入整套 OAuth / HTTP 套件
 
 load_dotenv()
 
-app = Flask(__name__)
-app.wsgi_app = ProxyFix(app.wsgi_app, x_proto=1, x_host=1)
-app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite:///calendar.db"
-app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
-app.config["SECRET_KEY"] = os.environ.get("SECRET_KEY", "devkey") # 建議連 Secret Key 也改用變數
-
-# ===== [修改] 改成從環境變數讀取 =====
-app.config['GOOGLE_CLIENT_ID'] = os.environ.get('GOOGLE_CLIENT_ID')
-app.config['GOOGLE_CLIENT_SECRET'] = os.environ.get('GOOGLE_CLIENT_SECRET')
-app.config['LINE_CLIENT_ID'] = os.environ.get('LINE_CLIENT_ID')
-app.config['LINE_CLIENT_SECRET'] = os.environ.get('LINE_CLIENT_SECRET')
-db = SQLAlchemy(app)
-
-#=====環境變數debug=====
-if not app.config['GOOGLE_CLIENT_ID']:
-    print("⚠️ 警告：未偵測到 GOOGLE_CLIENT_ID 環境變數！")
-
+db = SQLAlchemy(session_options={"class_": ShardedSession})  # 分檔模式的路由見 sharding.py
 login_manager = LoginManager()
-login_manager.init_app(app)
 login_manager.login_view = "login"  # 沒登入時踢去哪裡
-oauth = OAuth(app)
 
-# 修改 app.py 裡的 Google 註冊部分
+app = Flask(__name__)
 
-google = oauth.register(
-    name='google',
-    client_id=app.config['GOOGLE_CLIENT_ID'],
-    client_secret=app.config['GOOGLE_CLIENT_SECRET'],
-    
-    # [修正] 移除手動寫死的 access_token_url, authorize_url, api_base_url
-    # 改用這個自動設定檔：
-    server_metadata_url='https://accounts.google.com/.well-known/openid-configuration',
-    
-    client_kwargs={'scope': 'openid email profile'},
-)
+def create_app():
+    """
+    初始化這個模組唯一的全域 app：讀設定、初始化 extension，回傳同一個 app 物件。
+    不是可以產生多個獨立 app 的 factory——路由、CLI、hook 都在 import 時直接掛在全域的 app 上，
+    模組最後已經呼叫過一次；之後再呼叫不會重設，只會拿回同一個 app
+    （所以 gunicorn 用 "app:app" 或 "app:create_app()" 都一樣）。
+    這裡只讀設定，不碰資料庫也不連外：
+    建表 / schema 檢查由 `flask --app app init-db` 或 gunicorn master（gunicorn.conf.py）各做一次。
+    """
+    if "sqlalchemy" in app.extensions:  # 已經初始化過
+        return app
+
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_proto=1, x_host=1)
+    app.config["SQLALCHEMY_DATABASE_URI"] = os.environ.get("DATABASE_URL", "sqlite:///calendar.db")
+    app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+    # worker.py 與網頁同時寫入 SQLite 時，等鎖最多 15 秒而不是立刻丟 "database is locked"
+    # （gevent worker 下改成讓出給其他 greenlet 的重試，見 concurrency.py）
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {"connect_args": sqlite_connect_args(15)}
+    if ":memory:" not in app.config["SQLALCHEMY_DATABASE_URI"]:
+        # 量測向連線池借連線的等待時間（/metrics 的 db_pool_checkout_wait_seconds）
+        from sqlalchemy.pool import QueuePool
+        app.config["SQLALCHEMY_ENGINE_OPTIONS"]["poolclass"] = metrics.timed_pool_class(QueuePool)
+        # 連線池大小 = 每個 worker 同時處理的請求數（gunicorn.conf.py 依 gthread 的 thread 數設定 DB_POOL_SIZE）
+        app.config["SQLALCHEMY_ENGINE_OPTIONS"]["pool_size"] = int(os.environ.get("DB_POOL_SIZE", "5"))
+        app.config["SQLALCHEMY_ENGINE_OPTIONS"]["max_overflow"] = int(os.environ.get("DB_POOL_OVERFLOW", "10"))
+    app.config["SECRET_KEY"] = os.environ.get("SECRET_KEY", "devkey") # 建議連 Secret Key 也改用變數
+
+    # ===== [修改] 改成從環境變數讀取 =====
+    app.config['GOOGLE_CLIENT_ID'] = os.environ.get('GOOGLE_CLIENT_ID')
+    app.config['GOOGLE_CLIENT_SECRET'] = os.environ.get('GOOGLE_CLIENT_SECRET')
+    app.config['LINE_CLIENT_ID'] = os.environ.get('LINE_CLIENT_ID')
+    app.config['LINE_CLIENT_SECRET'] = os.environ.get('LINE_CLIENT_SECRET')
+    # OIDC discovery 網址（可改指到本機 stub provider 做離線測試）
+    app.config['GOOGLE_METADATA_URL'] = os.environ.get(
+        'GOOGLE_METADATA_URL', 'https://accounts.google.com/.well-known/openid-configuration')
+    app.config['LINE_METADATA_URL'] = os.environ.get(
+        'LINE_METADATA_URL', 'https://access.line.me/.well-known/openid-configuration')
+
+    #=====環境變數debug=====
+    if not app.config['GOOGLE_CLIENT_ID']:
+        print("⚠️ 警告：未偵測到 GOOGLE_CLIENT_ID 環境變數！")
+
+    # /metrics：各 worker 的累計值寫在 instance/metrics/，抓取時加總；沒有設定 METRICS_TOKEN 時等於不存在
+    app.config['METRICS_TOKEN'] = os.environ.get('METRICS_TOKEN')
+    metrics.REGISTRY.set_directory(
+        os.environ.get('METRICS_DIR', os.path.join(app.instance_path, "metrics")))
+
+    # 效能剖析：ADMIN_EMAILS（逗號分隔）可以到 /admin/profiles 看結果、產生剖析 token；
+    # PROFILE_SAMPLE_PERCENT 設成 > 0 時隨機剖析該比例的請求
+    app.config['ADMIN_EMAILS'] = {
+        e.strip().lower() for e in os.environ.get('ADMIN_EMAILS', '').split(',') if e.strip()
+    }
+    app.config['PROFILE_SAMPLE_PERCENT'] = float(os.environ.get('PROFILE_SAMPLE_PERCENT', '0'))
+    app.config['PROFILE_DIR'] = os.environ.get('PROFILE_DIR', os.path.join(app.instance_path, "profiles"))
+
+    # 壓力測試用的登入捷徑（benchmarks/loadtest.py）：只有設定 TEST_LOGIN_TOKEN 才會開放，正式環境不要設
+    app.config['TEST_LOGIN_TOKEN'] = os.environ.get('TEST_LOGIN_TOKEN')
+
+    # 跨 worker 快取失效用的版本號（見 cache.py），所有 worker 映射同一個檔案
+    VERSIONS.set_path(os.environ.get(
+        'CACHE_VERSIONS_PATH', os.path.join(app.instance_path, "cache_versions.bin")))
+
+    # 選用：每位使用者的資料各自一個 SQLite 檔（SHARD_BY_USER=1），users / jobs 留在 DATABASE_URL
+    app.config['SHARD_BY_USER'] = os.environ.get('SHARD_BY_USER', '0') == '1'
+    app.config['SHARD_DIR'] = os.environ.get('SHARD_DIR', os.path.join(app.instance_path, "shards"))
+    app.config['SHARD_MAX_OPEN'] = int(os.environ.get('SHARD_MAX_OPEN', '64'))
+    if app.config['SHARD_BY_USER']:
+        ROUTER.configure(
+            app.config['SHARD_DIR'],
+            [model.__table__ for model in SHARDED_MODELS],
+            max_open=app.config['SHARD_MAX_OPEN'],
+            engine_options=app.config["SQLALCHEMY_ENGINE_OPTIONS"],
+        )
+        ROUTER.on_engine_created += [metrics.instrument_engine, profiler.instrument_engine]
+
+    # 模板編譯結果存到磁碟，worker 重啟後直接載入 bytecode，不用重新 parse / compile
+    app.config['JINJA_CACHE_DIR'] = os.environ.get('JINJA_CACHE_DIR', os.path.join(app.instance_path, "jinja_cache"))
+    os.makedirs(app.config['JINJA_CACHE_DIR'], exist_ok=True)
+    app.jinja_env.bytecode_cache = FileSystemBytecodeCache(app.config['JINJA_CACHE_DIR'])
+
+    # 靜態檔：`python assets.py build` 之後改用指紋檔名 + immutable 快取（見 assets.py）
+    app.config['ASSET_DIST_DIR'] = os.environ.get('ASSET_DIST_DIR', os.path.join(app.static_folder, "dist"))
+    # HTML / JSON 回應超過 COMPRESS_MIN_SIZE bytes 就 gzip；前面的 proxy 已經會壓縮時設 COMPRESS_RESPONSES=0
+    app.config['COMPRESS_RESPONSES'] = os.environ.get('COMPRESS_RESPONSES', '1') == '1'
+    app.config['COMPRESS_MIN_SIZE'] = int(os.environ.get('COMPRESS_MIN_SIZE', '1024'))
+    app.config['COMPRESS_LEVEL'] = int(os.environ.get('COMPRESS_LEVEL', '6'))
+
+    # 行事曆訂閱 / 匯入：課表訂閱的學期起訖（YYYY-MM-DD，不設就依今天推算上 / 下學期）、上傳檔案大小上限
+    app.config['TIMETABLE_TERM_START'] = os.environ.get('TIMETABLE_TERM_START')
+    app.config['TIMETABLE_TERM_END'] = os.environ.get('TIMETABLE_TERM_END')
+    app.config['ICS_IMPORT_MAX_MB'] = int(os.environ.get('ICS_IMPORT_MAX_MB', '20'))
+    # 匯入時帶時區的時間（...Z、TZID=...）換算成哪個時區，例如 Asia/Taipei；不設就用伺服器的時區
+    app.config['ICS_TIMEZONE'] = os.environ.get('ICS_TIMEZONE')
+
+    # 提醒（reminders.py 負責送出）：重要事項沒有時間，提前量從當天 REMINDER_ALL_DAY_AT 起算；
+    # 有設定 REMINDER_SMTP_HOST / REMINDER_WEBHOOK_URL 才會出現 email / webhook 選項
+    app.config['REMINDER_ALL_DAY_AT'] = datetime.strptime(
+        os.environ.get('REMINDER_ALL_DAY_AT', '09:00'), "%H:%M").time()
+    app.config['REMINDER_SMTP_HOST'] = os.environ.get('REMINDER_SMTP_HOST')
+    app.config['REMINDER_SMTP_PORT'] = int(os.environ.get('REMINDER_SMTP_PORT', '25'))
+    app.config['REMINDER_MAIL_FROM'] = os.environ.get('REMINDER_MAIL_FROM', 'calendar@localhost')
+    app.config['REMINDER_WEBHOOK_URL'] = os.environ.get('REMINDER_WEBHOOK_URL')
+    # email / webhook 裡的連結要用完整網址（例如 https://calendar.example.com）
+    app.config['PUBLIC_BASE_URL'] = os.environ.get('PUBLIC_BASE_URL', '').rstrip('/')
+
+    # 冷資料封存（flask --app app archive / python maintenance.py archive）：
+    # 行事曆 / 飲食 / 重訓 / 日記超過 ARCHIVE_AFTER_DAYS 天的月份壓縮搬進 archive_partitions
+    app.config['ARCHIVE_AFTER_DAYS'] = int(os.environ.get('ARCHIVE_AFTER_DAYS', '365'))
+
+    db.init_app(app)
+    login_manager.init_app(app)
+    ASSETS.init_app(app)
+    with app.app_context():
+        metrics.instrument_engine(db.engine)
+        profiler.instrument_engine(db.engine)
+    profiler.instrument_flask(app)
+    return app
+
+def init_schema():
+    """建立缺少的資料表與索引。每次部署只需要跑一次。"""
+    with app.app_context():
+        # 分檔模式下，每人一份的表由 sharding.py 在第一次開啟該使用者的檔案時建立
+        tables = [t for t in db.metadata.sorted_tables if t.name not in ROUTER.table_names]
+        legacy = legacy_lookup_tables(db.engine, [t.name for t in tables])
+        if legacy:
+            raise RuntimeError(
+                f"{', '.join(legacy)} 還是舊版的文字欄位，請先執行 python tools/migrate_lookups.py")
+        ensure_schema(db.engine, tables)
+        seed_lookups()
+
+def warm_templates():
+    """先把所有模板編譯好（gunicorn master 在 fork 前呼叫，worker 直接共用編譯好的模板）"""
+    for name in app.jinja_env.list_templates(extensions=["html"]):
+        app.jinja_env.get_template(name)
+
+@app.cli.command("init-db")
+def init_db_command():
+    """flask --app app init-db：建立 / 檢查資料表"""
+    init_schema()
+    print("資料表建立 / 檢查完成")
+
+@app.cli.command("recompute")
+@click.argument("tasks", nargs=-1)
+@click.option("-w", "--workers", type=int, default=None, help="幾個 process（預設 min(CPU 數, 4)）")
+@click.option("--user", "user_ids", type=int, multiple=True, help="只算這位使用者（可重複）")
+@click.option("--duty", type=float, default=None, help="worker 忙碌時間的上限比例，0~1（預設 RECOMPUTE_DUTY）")
+@click.option("--restart", is_flag=True, help="忽略 checkpoint，從頭開始")
+@click.option("--queue", is_flag=True, help="不在這裡算，每位使用者排一筆 recompute 背景工作給 worker.py")
+def recompute_command(tasks, workers, user_ids, duty, restart, queue):
+    """flask --app app recompute [工作...]：平行重算所有使用者的衍生資料（見 recompute.py）"""
+    import recompute
+    if queue:
+        print(f"[recompute] 排入 {recompute.enqueue(tasks, list(user_ids)):,} 筆背景工作")
+        return
+    recompute.run(tasks, list(user_ids), workers=workers, duty=duty, restart=restart)
+
+# ===== OAuth（延遲載入）=====
+_oauth = None
+_oidc_cache = None
+_oauth_lock = threading.Lock()
+
+def get_oidc_cache():
+    # discovery metadata / JWKS 快取在記憶體與 instance/oidc_cache/，所有 worker 共用磁碟那份
+    global _oidc_cache
+    if _oidc_cache is None:
+        with _oauth_lock:  # gthread 下兩個登入請求可能同時走到這裡
+            if _oidc_cache is None:
+                from oidc import OIDCCache
+                _oidc_cache = OIDCCache(os.path.join(app.instance_path, "oidc_cache"))
+    return _oidc_cache
+
+def get_oauth_client(name):
+    """第一次有人按登入時才 import Authlib 並註冊 Google / LINE client"""
+    global _oauth
+    if _oauth is None:
+        with _oauth_lock:
+            if _oauth is None:
+                from authlib.integrations.flask_client import OAuth
+                from oidc import HTTP_TIMEOUT
+
+                oauth = OAuth(app)
+
+                # 修改 app.py 裡的 Google 註冊部分
+                oauth.register(
+                    name='google',
+                    client_id=app.config['GOOGLE_CLIENT_ID'],
+                    client_secret=app.config['GOOGLE_CLIENT_SECRET'],
+
+                    # [修正] 移除手動寫死的 access_token_url, authorize_url, api_base_url
+                    # 改用這個自動設定檔：
+                    server_metadata_url=app.config['GOOGLE_METADATA_URL'],
+
+                    client_kwargs={'scope': 'openid email profile', 'default_timeout': HTTP_TIMEOUT},
+                )
 
-# 修改 app.py 裡的 LINE 註冊部分
+                # 修改 app.py 裡的 LINE 註冊部分
+                oauth.register(
+                    name='line',
+                    client_id=app.config['LINE_CLIENT_ID'],
+                    client_secret=app.config['LINE_CLIENT_SECRET'],
+
+                    # 使用自動發現，讓它自己處理網址
+                    server_metadata_url=app.config['LINE_METADATA_URL'],
+
+                    # 只需要指定 scope 和 Auth Method
+                    client_kwargs={
+                        'scope': 'profile openid email',
+                        'token_endpoint_auth_method': 'client_secret_post',
+                        'default_timeout': HTTP_TIMEOUT,
+                    },
+                )
+                _oauth = oauth
 
-line = oauth.register(
-    name='line',
-    client_id=app.config['LINE_CLIENT_ID'],
-    client_secret=app.config['LINE_CLIENT_SECRET'],
-    
-    # 使用自動發現，讓它自己處理網址
-    server_metadata_url='https://access.line.me/.well-known/openid-configuration',
-    
-    # 只需要指定 scope 和 Auth Method
-    client_kwargs={
-        'scope': 'profile openid email',
-        'token_endpoint_auth_method': 'client_secret_post',
-    },
-)
+    client = _oauth.create_client(name)
+    metadata_url = app.config['GOOGLE_METADATA_URL' if name == 'google' else 'LINE_METADATA_URL']
+    return get_oidc_cache().prime_oauth_client(client, metadata_url)
 
 # ===== 常數 =====
-# [修改] 加入 "重要" 選項
+# 項目類型 / 餐別 / 部位 / 動作存在代碼表（item_types、meal_types、body_parts、exercises），
+# 這裡是內建的初始值：init_schema 會補上缺少的列，之後一律從記憶體裡的代碼表讀（見 lookups()）。
+# "重要" 不是行事曆項目的類型，只是表單上「改存成重要事項」的選項
 ITEM_TYPES = [("工作", "工作"), ("提醒", "提醒"), ("活動", "活動"), ("重要", "重要事項")]
+IMPORTANT_CHOICE = ("重要", "重要事項")
 MEAL_TYPES = [("早餐", "早餐"), ("午餐", "午餐"), ("晚餐", "晚餐"), ("點心", "點心")]
 
 STRENGTH_CATEGORIES = {
@@ -121,18 +315,92 @@ class SocialAuth(db.Model):
     # 確保同一個平台不會有重複的 social_id
     __table_args__ = (db.UniqueConstraint('provider', 'social_id', name='_provider_social_uc'),)
 
+class FeedToken(db.Model):
+    """
+    行事曆訂閱網址裡的 token（每人一組，重新產生就換掉舊的）。
+    訂閱請求沒有登入狀態，要靠 token 反查使用者，所以跟 users 放在一起、不分檔。
+    """
+    __tablename__ = "feed_tokens"
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), primary_key=True)
+    token = db.Column(db.String(64), nullable=False, unique=True)
+    created_at = db.Column(db.DateTime, default=func.now())
+
+class CalendarShare(db.Model):
+    """
+    行事曆共用：owner 把行事曆項目與重要事項開放給 viewer 看；can_write 時 viewer 也能新增 / 修改 / 刪除 owner 的行事曆項目。
+    每個月曆 / 週 / 單日頁都要知道「我看得到誰」，而且跨使用者，所以跟 users 放在一起、不分檔。
+    """
+    __tablename__ = "calendar_shares"
+    id = db.Column(db.Integer, primary_key=True)
+    owner_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    viewer_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    can_write = db.Column(db.Boolean, nullable=False, default=False)
+    created_at = db.Column(db.DateTime, default=func.now())
+
+    owner = db.relationship('User', foreign_keys=[owner_id])
+    viewer = db.relationship('User', foreign_keys=[viewer_id])
+
+    # 共用設定頁依 owner 列出（unique 的索引就夠）；月曆依 viewer 找、依 owner 排（見 visible_calendar_owners）
+    __table_args__ = (
+        db.UniqueConstraint('owner_id', 'viewer_id', name='_calendar_share_uc'),
+        db.Index('ix_calendar_shares_viewer_owner', 'viewer_id', 'owner_id'),
+    )
+
+# ----- 代碼表：名稱只存一次，資料列只存 SmallInteger id -----
+# 放在共用資料庫、不分檔（分檔模式下各使用者的檔案也是存這裡的 id，不能 JOIN，一律查記憶體裡的 lookups()）。
+# 主鍵要是 INTEGER 才會是 SQLite 的 rowid（自動編號）；SQLite 的整數本來就依大小用 1~8 bytes 存
+class ItemType(db.Model):
+    __tablename__ = "item_types"
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(10), nullable=False, unique=True)
+    sort_order = db.Column(db.SmallInteger, nullable=False, default=0)
+
+class MealType(db.Model):
+    __tablename__ = "meal_types"
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(10), nullable=False, unique=True)
+    sort_order = db.Column(db.SmallInteger, nullable=False, default=0)
+
+class BodyPart(db.Model):
+    __tablename__ = "body_parts"
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(10), nullable=False, unique=True)
+    sort_order = db.Column(db.SmallInteger, nullable=False, default=0)
+
+class Exercise(db.Model):
+    """重訓動作；user_id 是 None 的是內建動作，其餘是該使用者自訂的（只有自己看得到）"""
+    __tablename__ = "exercises"
+    id = db.Column(db.Integer, primary_key=True)
+    body_part_id = db.Column(db.SmallInteger, db.ForeignKey('body_parts.id'), nullable=False)
+    name = db.Column(db.String(50), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=True)
+    sort_order = db.Column(db.SmallInteger, nullable=False, default=0)
+
+    __table_args__ = (db.Index('ix_exercises_user_id', 'user_id'),)
+
 class CalendarItem(db.Model):
     __tablename__ = "calendar_items"
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
     id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.String(120), nullable=False)
-    item_type = db.Column(db.String(10), nullable=False)
+    item_type_id = db.Column(db.SmallInteger, db.ForeignKey('item_types.id'), nullable=False)
     date = db.Column(db.Date, nullable=False)
     start_time = db.Column(db.Time, nullable=False)
     end_time = db.Column(db.Time, nullable=False)
     content = db.Column(db.Text, nullable=True)
     created_at = db.Column(db.DateTime, default=func.now())
 
+    # 月曆 / 週 / 單日都是「某人某段日期」
+    # AUTOINCREMENT：封存會刪掉舊的列，id 不能被新列重用（ICS UID、提醒都用 id 對應；見 ARCHIVE_MODELS）
+    __table_args__ = (db.Index('ix_calendar_items_user_date', 'user_id', 'date'), {"sqlite_autoincrement": True})
+
+    # 從冷資料解壓出來的唯讀物件會設成 True（不在資料表裡，頁面上不顯示編輯 / 刪除）
+    archived = False
+
+    @property
+    def item_type(self):
+        return lookups().item_types.name(self.item_type_id)
+
     def time_range_str(self):
         return f"{self.start_time.strftime('%H:%M')}–{self.end_time.strftime('%H:%M')}"
 
@@ -141,7 +409,7 @@ class DietEntry(db.Model):
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
     id = db.Column(db.Integer, primary_key=True)
     date = db.Column(db.Date, nullable=False, index=True)
-    meal_type = db.Column(db.String(10), nullable=False)
+    meal_type_id = db.Column(db.SmallInteger, db.ForeignKey('meal_types.id'), nullable=False)
     food_name = db.Column(db.String(120), nullable=False)
     kcal = db.Column(db.Float, default=0.0)
     protein_g = db.Column(db.Float, default=0.0)
@@ -149,17 +417,48 @@ class DietEntry(db.Model):
     carb_g = db.Column(db.Float, default=0.0)
     created_at = db.Column(db.DateTime, default=func.now())
 
+    __table_args__ = (
+        db.Index('ix_diet_entries_user_date', 'user_id', 'date'),
+        db.Index('ix_diet_entries_user_food', 'user_id', 'food_name'),  # /api/diet/suggest 依名稱分組
+        {"sqlite_autoincrement": True},  # 見 CalendarItem
+    )
+
+    archived = False  # 見 CalendarItem.archived
+
+    @property
+    def meal_type(self):
+        return lookups().meal_types.name(self.meal_type_id)
+
 class StrengthSet(db.Model):
     __tablename__ = "strength_sets"
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
     id = db.Column(db.Integer, primary_key=True)
     date = db.Column(db.Date, nullable=False, index=True)
-    body_part = db.Column(db.String(10), nullable=False)
-    exercise_name = db.Column(db.String(50), nullable=False)
+    exercise_id = db.Column(db.Integer, db.ForeignKey('exercises.id'), nullable=False)  # 部位由動作決定
     weight_kg = db.Column(db.Float, default=0.0)
     reps = db.Column(db.Integer, default=0)
     created_at = db.Column(db.DateTime, default=func.now())
 
+    __table_args__ = (
+        db.Index('ix_strength_sets_user_date', 'user_id', 'date'),
+        db.Index('ix_strength_sets_user_exercise_date', 'user_id', 'exercise_id', 'date'),  # progress 圖表
+        {"sqlite_autoincrement": True},  # 見 CalendarItem
+    )
+
+    archived = False  # 見 CalendarItem.archived
+
+    @property
+    def exercise(self):
+        return exercise_catalog(self.user_id).by_id[self.exercise_id]
+
+    @property
+    def exercise_name(self):
+        return self.exercise.name
+
+    @property
+    def body_part(self):
+        return self.exercise.body_part
+
 class TimetableEntry(db.Model):
     __tablename__ = "timetable_entries"
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
@@ -173,12 +472,14 @@ class TimetableEntry(db.Model):
     teacher = db.Column(db.String(50), nullable=True)
     note = db.Column(db.String(200), nullable=True)
 
+    __table_args__ = (db.Index('ix_timetable_entries_user_slot', 'user_id', 'weekday_code', 'section'),)
+
 class DailyNutritionGoal(db.Model):
     """
     全域營養目標：只使用表中的第一筆（用 GLOBAL_GOAL_DATE 存）
     """
     __tablename__ = "daily_nutrition_goals"
-    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False, index=True)
     id = db.Column(db.Integer, primary_key=True)
     date = db.Column(db.Date, nullable=False, unique=True)
     kcal_target = db.Column(db.Float, default=0.0)
@@ -195,6 +496,8 @@ class ImportantItem(db.Model):
     description = db.Column(db.Text, nullable=True)
     created_at = db.Column(db.DateTime, default=func.now())
 
+    __table_args__ = (db.Index('ix_important_items_user_date', 'user_id', 'date'),)
+
 class DiaryEntry(db.Model):
     __tablename__ = "diary_entries"
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
@@ -206,6 +509,10 @@ class DiaryEntry(db.Model):
     content = db.Column(db.Text, nullable=True)
     created_at = db.Column(db.DateTime, default=func.now())
 
+    __table_args__ = (db.Index('ix_diary_entries_user_date', 'user_id', 'date'), {"sqlite_autoincrement": True})
+
+    archived = False  # 見 CalendarItem.archived
+
 class WeightEntry(db.Model):
     __tablename__ = "weight_entries"
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
@@ -214,9 +521,229 @@ class WeightEntry(db.Model):
     weight_kg = db.Column(db.Float, nullable=False)
     created_at = db.Column(db.DateTime, default=func.now())
 
+    __table_args__ = (db.Index('ix_weight_entries_user_date', 'user_id', 'date'),)
+
+class WeightTrendDay(db.Model):
+    """
+    體重趨勢（每天一列）：當天所有紀錄的總和 / 筆數，以及 EWMA 平滑後的趨勢值。
+    由 update_weight_trend() 在新增 / 刪除體重紀錄時增量維護，不要直接寫。
+    """
+    __tablename__ = "weight_trend_days"
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    id = db.Column(db.Integer, primary_key=True)
+    date = db.Column(db.Date, nullable=False)
+    weight_sum = db.Column(db.Float, nullable=False)
+    count = db.Column(db.Integer, nullable=False)
+    trend = db.Column(db.Float, nullable=False)
+
+    __table_args__ = (db.Index('ux_weight_trend_days_user_date', 'user_id', 'date', unique=True),)
+
+    @property
+    def weight(self):
+        return self.weight_sum / self.count
+
+class WeightTrend(db.Model):
+    """體重趨勢摘要（每人一列）：最新趨勢值、7 / 30 天變化率（kg/週）、目標體重與預估達成日"""
+    __tablename__ = "weight_trends"
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), primary_key=True)
+    target_kg = db.Column(db.Float, nullable=True)
+    last_date = db.Column(db.Date, nullable=True)   # 沒有任何體重紀錄時是 None
+    trend = db.Column(db.Float, nullable=True)
+    rate_7 = db.Column(db.Float, nullable=True)
+    rate_30 = db.Column(db.Float, nullable=True)
+    projected_date = db.Column(db.Date, nullable=True)
+    updated_at = db.Column(db.DateTime, default=func.now(), onupdate=func.now())
+
+    def to_dict(self):
+        return {
+            "target_kg": self.target_kg,
+            "last_date": self.last_date.isoformat() if self.last_date else None,
+            "trend": round(self.trend, 2) if self.trend is not None else None,
+            "rate_7": round(self.rate_7, 2) if self.rate_7 is not None else None,
+            "rate_30": round(self.rate_30, 2) if self.rate_30 is not None else None,
+            "projected_date": self.projected_date.isoformat() if self.projected_date else None,
+            "reached": self.reached,
+        }
+
+    @property
+    def reached(self):
+        return (self.target_kg is not None and self.trend is not None
+                and abs(self.trend - self.target_kg) <= WEIGHT_TARGET_TOLERANCE)
+
+# ----- 冷資料封存（見「冷資料封存」一節）-----
+class ArchivePartition(db.Model):
+    """
+    某人某張表某個月已封存的資料列：{"columns": [...], "rows": [[...], ...]} 的 JSON 用 zlib 壓縮後存成一個 BLOB。
+    熱資料表只留最近 ARCHIVE_AFTER_DAYS 天左右，查到舊日期時才解壓（見 archived_rows）。
+    """
+    __tablename__ = "archive_partitions"
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    id = db.Column(db.Integer, primary_key=True)
+    table_name = db.Column(db.String(30), nullable=False)
+    month = db.Column(db.Date, nullable=False)          # 該月 1 號
+    row_count = db.Column(db.Integer, nullable=False)
+    payload = db.Column(db.LargeBinary, nullable=False)
+    created_at = db.Column(db.DateTime, default=func.now(), onupdate=func.now())
+
+    __table_args__ = (db.Index('ux_archive_partitions_user_table_month', 'user_id', 'table_name', 'month', unique=True),)
+
+class ArchivedDay(db.Model):
+    """
+    已封存日期的每日彙總（留在熱資料，封存時寫入）：TDEE 的每日攝取、單日頁的上次重訓總量、月曆的重訓標記。
+    只涵蓋已封存的部分；同一天後來又補記在熱資料表的，讀取時兩邊加總。
+    """
+    __tablename__ = "archived_days"
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    id = db.Column(db.Integer, primary_key=True)
+    date = db.Column(db.Date, nullable=False)
+    diet_entries = db.Column(db.Integer, nullable=False, default=0)
+    kcal = db.Column(db.Float, nullable=False, default=0.0)
+    strength_sets = db.Column(db.Integer, nullable=False, default=0)
+    strength_volume = db.Column(db.Float, nullable=False, default=0.0)   # SUM(weight_kg * reps)
+
+    __table_args__ = (db.Index('ux_archived_days_user_date', 'user_id', 'date', unique=True),)
+
+class ArchivedExerciseDay(db.Model):
+    """已封存日期每個動作當天的最大重量（留在熱資料）：progress 圖表與單日頁的「上次最大重量」"""
+    __tablename__ = "archived_exercise_days"
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    id = db.Column(db.Integer, primary_key=True)
+    exercise_id = db.Column(db.Integer, db.ForeignKey('exercises.id'), nullable=False)
+    date = db.Column(db.Date, nullable=False)
+    max_weight = db.Column(db.Float, nullable=False, default=0.0)
+
+    __table_args__ = (
+        db.Index('ux_archived_exercise_days_user_exercise_date', 'user_id', 'exercise_id', 'date', unique=True),
+    )
+
+class Job(db.Model):
+    """
+    背景工作佇列：由 worker.py 在獨立程序中執行，網頁請求只負責排入佇列
+    status: queued -> running -> done / failed（失敗會依 max_attempts 重試）
+    """
+    __tablename__ = "jobs"
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=True, index=True)
+    kind = db.Column(db.String(50), nullable=False)
+    payload = db.Column(db.Text, nullable=True)   # JSON 字串
+    status = db.Column(db.String(10), nullable=False, default="queued")
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    max_attempts = db.Column(db.Integer, nullable=False, default=3)
+    progress = db.Column(db.Float, nullable=False, default=0.0)  # 0 ~ 100
+    message = db.Column(db.String(200), nullable=True)
+    result = db.Column(db.Text, nullable=True)    # JSON 字串
+    error = db.Column(db.Text, nullable=True)
+    run_after = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    locked_by = db.Column(db.String(64), nullable=True)
+    locked_at = db.Column(db.DateTime, nullable=True)
+    created_at = db.Column(db.DateTime, default=func.now())
+    updated_at = db.Column(db.DateTime, default=func.now(), onupdate=func.now())
+
+    # worker 取工作時用 (status, run_after) 找下一筆
+    __table_args__ = (db.Index('ix_jobs_status_run_after', 'status', 'run_after'),)
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "kind": self.kind,
+            "status": self.status,
+            "attempts": self.attempts,
+            "max_attempts": self.max_attempts,
+            "progress": round(self.progress or 0.0, 1),
+            "message": self.message,
+            "result": json.loads(self.result) if self.result else None,
+            "error": self.error if self.status == "failed" else None,
+            "created_at": self.created_at.isoformat() if self.created_at else None,
+            "updated_at": self.updated_at.isoformat() if self.updated_at else None,
+        }
+
+
+class Reminder(db.Model):
+    """
+    行事曆項目 / 重要事項的提醒（一個提前時間一列），由 reminders.py 在時間到時送到 channel。
+    next_fire_at 是下一次要送的時間（已送出或放棄時是 None），排程器只用這個索引載入快到期的提醒。
+    排程器要看到所有人的提醒，所以放在共用資料庫、不分檔；item_id 只在同一位使用者內唯一。
+    """
+    __tablename__ = "reminders"
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    source = db.Column(db.String(10), nullable=False)        # calendar / important
+    item_id = db.Column(db.Integer, nullable=False)
+    title = db.Column(db.String(120), nullable=False)        # 建立 / 修改項目時的標題（送出時不必再查分檔）
+    event_at = db.Column(db.DateTime, nullable=False)
+    lead_minutes = db.Column(db.Integer, nullable=False)
+    channel = db.Column(db.String(10), nullable=False, default="inbox")
+    next_fire_at = db.Column(db.DateTime, nullable=True)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    fired_at = db.Column(db.DateTime, nullable=True)
+    error = db.Column(db.String(200), nullable=True)
+    created_at = db.Column(db.DateTime, default=func.now())
+
+    __table_args__ = (
+        db.Index('ix_reminders_next_fire_at', 'next_fire_at'),
+        db.Index('ix_reminders_user_item', 'user_id', 'source', 'item_id'),
+    )
+
+class InboxMessage(db.Model):
+    """站內通知（提醒的 inbox channel 寫進來）；跟 reminders 一樣由排程器批次寫入，放在共用資料庫"""
+    __tablename__ = "inbox_messages"
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    title = db.Column(db.String(200), nullable=False)
+    body = db.Column(db.String(500), nullable=True)
+    link = db.Column(db.String(200), nullable=True)
+    read_at = db.Column(db.DateTime, nullable=True)
+    created_at = db.Column(db.DateTime, default=func.now())
+
+    __table_args__ = (db.Index('ix_inbox_messages_user_id', 'user_id', 'id'),)
+
+
+# ===== 唯讀頁面用的輕量資料列 (read models) =====
+# 月曆、週檢視、重要事項、體重這些頁面只讀幾個欄位給模板用，
+# 不需要完整的 ORM 物件（identity map、變更追蹤、每個物件一個 __dict__）。
+# 這裡只 SELECT 需要的欄位，直接組成 namedtuple（__slots__ = ()，沒有 __dict__）。
+# 要修改資料的路由（edit / delete…）還是照常用 ORM model。
+class ReadRow:
+    """namedtuple 子類別共用：COLUMNS 依欄位順序列出要 SELECT 的運算式"""
+    __slots__ = ()
+    COLUMNS = ()
+
+    @classmethod
+    def query(cls):
+        return db.session.query(*cls.COLUMNS)
+
+    @classmethod
+    def fetch(cls, rows):
+        return [cls._make(r) for r in rows]
+
+# 格子裡的內容只顯示 content|truncate(60)：Jinja 的 truncate 超過 60+5 個字才會截斷，
+# 而且只看前 57 個字，所以取前 66 個字顯示結果完全一樣，不用把整篇內容讀出來
+CONTENT_PREVIEW_CHARS = 66
+
+class CalendarItemRow(ReadRow, namedtuple("CalendarItemRow", "id title item_type_id date start_time end_time content user_id")):
+    __slots__ = ()
+    COLUMNS = (
+        CalendarItem.id, CalendarItem.title, CalendarItem.item_type_id, CalendarItem.date,
+        CalendarItem.start_time, CalendarItem.end_time,
+        func.substr(CalendarItem.content, 1, CONTENT_PREVIEW_CHARS), CalendarItem.user_id,
+    )
+    item_type = CalendarItem.item_type
+    time_range_str = CalendarItem.time_range_str
+    archived = False
+
+class CalendarDayRow(CalendarItemRow):
+    """單日頁：內容整篇顯示"""
+    __slots__ = ()
+    COLUMNS = CalendarItemRow.COLUMNS[:6] + (CalendarItem.content, CalendarItem.user_id)
+
+class ImportantRow(ReadRow, namedtuple("ImportantRow", "id date title description user_id")):
+    __slots__ = ()
+    COLUMNS = (ImportantItem.id, ImportantItem.date, ImportantItem.title, ImportantItem.description,
+               ImportantItem.user_id)
 
-with app.app_context():
-    db.create_all()
+class WeightRow(ReadRow, namedtuple("WeightRow", "id date weight_kg")):
+    __slots__ = ()
+    COLUMNS = (WeightEntry.id, WeightEntry.date, WeightEntry.weight_kg)
 
 
 @login_manager.user_loader
@@ -252,7 +779,14 @@ def strength_dates_between(start_d: date, end_d: date):
         .group_by(StrengthSet.date)
         .all()
     )
-    return {r.date for r in rows}
+    dates = {r.date for r in rows}
+    if archived_months(current_user.id, "strength_sets", start_d, end_d):
+        dates.update(d for (d,) in (
+            db.session.query(ArchivedDay.date)
+            .filter(ArchivedDay.user_id == current_user.id)
+            .filter(ArchivedDay.date.between(start_d, end_d), ArchivedDay.strength_sets > 0)
+        ))
+    return dates
 
 def get_global_nutrition_goal():
     """取得全域營養目標（如果沒有就回傳 None）"""
@@ -266,28 +800,647 @@ def get_global_nutrition_goal():
         .first()
     )
 
+# ===== 程序內快取（寫入後用 bump_version 讓所有 worker 失效）=====
+# 領域：goals / diet / strength / timetable / weight / calendar / important / inbox / exercises / archive / sharing，寫入對應資料的路由 commit 後要 bump
+NutritionTargets = namedtuple("NutritionTargets", "kcal_target carb_target protein_target fat_target")
+GOAL_CACHE = VersionedCache("nutrition_goal", "goals", maxsize=4096)
+DIET_SUGGEST_CACHE = VersionedCache("diet_suggest", "diet", maxsize=8192)
+DIET_FOODS_CACHE = VersionedCache("diet_foods", "diet", maxsize=2048)
+PROGRESS_CACHE = VersionedCache("strength_progress", "strength", maxsize=4096)
+# 自適應 TDEE 同時用到飲食與體重，任何一邊有新資料就重算
+TDEE_CACHE = VersionedCache("tdee", ("diet", "weight"), maxsize=4096)
+NEXT_IMPORTANT_CACHE = VersionedCache("next_important", "important", maxsize=4096)
+# HTML 片段：月曆骨架每個月所有人都一樣；課表格子只在該使用者改課表時重畫
+MONTH_SKELETON_CACHE = LRUCache("month_skeleton", maxsize=256)
+TIMETABLE_GRID_CACHE = VersionedCache("timetable_grid", "timetable", maxsize=2048)
+MonthCell = namedtuple("MonthCell", "date head tail")
+
+def month_skeleton(year, month):
+    """
+    月曆每一格固定的 HTML（日期連結、today 標記、＋ 按鈕），回傳 [[MonthCell, ...] 每週]。
+    每格的重訓標記與行事曆項目由 index.html 在 head / tail 之間與之後填入。
+    """
+    today = date.today()
+
+    def load():
+        head = get_template_attribute("_month_cell.html", "head")
+        tail = get_template_attribute("_month_cell.html", "tail")
+        weeks = calendar.Calendar(firstweekday=0).monthdatescalendar(year, month)
+        return tuple(
+            tuple(MonthCell(d, Markup(head(d, month, today)), Markup(tail(d))) for d in week)
+            for week in weeks
+        )
+
+    # url_for 產生的網址跟掛載路徑有關，一起放進 key
+    return MONTH_SKELETON_CACHE.get_or_load((year, month, today, request.script_root), load)
+
+def get_nutrition_targets():
+    """唯讀頁面用的全域營養目標（快取版，沒有就回傳 None）；要修改請用 get_global_nutrition_goal()"""
+    if not current_user.is_authenticated:
+        return None
+
+    def load():
+        goal = get_global_nutrition_goal()
+        if goal is None:
+            return None
+        return NutritionTargets(goal.kcal_target, goal.carb_target, goal.protein_target, goal.fat_target)
+
+    return GOAL_CACHE.get_or_load(current_user.id, "global", load)
+
 def get_next_important():
-    """取得最近一個尚未過期的重要事項與剩餘天數"""
+    """取得最近一個尚未過期的重要事項與剩餘天數（重要事項沒變動、日期沒換就不再查）"""
     if not current_user.is_authenticated:
         return None, None
 
     today = date.today()
-    row = (
-        ImportantItem.query
-        .filter(ImportantItem.user_id == current_user.id)
-        .filter(ImportantItem.date >= today)
-        .order_by(ImportantItem.date.asc())
-        .first()
-    )
+
+    def load():
+        row = (
+            ImportantRow.query()
+            .filter(ImportantItem.user_id == current_user.id)
+            .filter(ImportantItem.date >= today)
+            .order_by(ImportantItem.date.asc())
+            .first()
+        )
+        return ImportantRow._make(row) if row else None
+
+    row = NEXT_IMPORTANT_CACHE.get_or_load(current_user.id, today, load)
     if row:
-        days_left = (row.date - today).days
-        return row, days_left
+        return row, (row.date - today).days
     return None, None
 
 
+# ===== 代碼表（項目類型 / 餐別 / 部位 / 動作）=====
+# 代碼表很小、幾乎不會變：整張載入程序記憶體（gunicorn master 在 fork 前先載入，見 warm_lookups），
+# 之後 id <-> 名稱的轉換與表單驗證都不查資料庫。
+# 內建代碼只在部署時（init_schema、tools/migrate_lookups.py）新增，新增後 bump "lookups"（user_id 0）；
+# 使用者自訂動作寫入後 bump 該使用者的 "exercises"。
+class CodeTable:
+    """一張代碼表：依 sort_order 排好的 (id, name)，以及兩個方向的 dict"""
+    __slots__ = ("rows", "by_id", "by_name")
+
+    def __init__(self, rows):
+        self.rows = tuple(tuple(r) for r in rows)
+        self.by_id = dict(self.rows)
+        self.by_name = {name: code for code, name in self.rows}
+
+    def id(self, name):
+        return self.by_name.get(name)
+
+    def name(self, code):
+        return self.by_id.get(code)
+
+    def choices(self):
+        """表單 <select> 用的 [(value, label)]"""
+        return [(name, name) for _, name in self.rows]
+
+ExerciseRow = namedtuple("ExerciseRow", "id body_part name user_id")
+Lookups = namedtuple("Lookups", "item_types meal_types body_parts exercises")
+# by_key: (部位, 動作名稱) -> id；同名動作可能掛在不同部位（例如啞鈴飛鳥），ids_by_name 給 progress 圖表合併用
+ExerciseCatalog = namedtuple("ExerciseCatalog", "by_id by_key ids_by_name categories")
+
+LOOKUP_CACHE = VersionedCache("lookups", "lookups", maxsize=1)
+EXERCISE_CATALOG_CACHE = VersionedCache("exercise_catalog", "exercises", maxsize=4096)
+# 舊版資料表直接存名稱的欄位；還在的話要先跑 tools/migrate_lookups.py
+LEGACY_LOOKUP_COLUMNS = {"calendar_items": "item_type", "diet_entries": "meal_type", "strength_sets": "exercise_name"}
+
+def _load_code_table(model):
+    return CodeTable(db.session.query(model.id, model.name).order_by(model.sort_order, model.id).all())
+
+def lookups():
+    """內建的代碼表（整個程序共用，內容不可變）"""
+    def load():
+        body_parts = _load_code_table(BodyPart)
+        part_order = {code: i for i, (code, _) in enumerate(body_parts.rows)}
+        rows = sorted(
+            db.session.query(Exercise.id, Exercise.body_part_id, Exercise.name, Exercise.sort_order)
+            .filter(Exercise.user_id.is_(None)).all(),
+            key=lambda r: (part_order.get(r.body_part_id, len(part_order)), r.sort_order, r.id),
+        )
+        return Lookups(
+            item_types=_load_code_table(ItemType),
+            meal_types=_load_code_table(MealType),
+            body_parts=body_parts,
+            exercises=tuple(ExerciseRow(r.id, body_parts.name(r.body_part_id), r.name, None) for r in rows),
+        )
+
+    return LOOKUP_CACHE.get_or_load(0, None, load)
+
+def exercise_catalog(user_id):
+    """內建 + 這位使用者自訂的動作；categories 是 {部位: (動作名稱, ...)}，給新增重訓的下拉選單"""
+    def load():
+        base = lookups()
+        rows = (
+            db.session.query(Exercise.id, Exercise.body_part_id, Exercise.name)
+            .filter(Exercise.user_id == user_id)
+            .order_by(Exercise.id.asc())
+            .all()
+        )
+        exercises = base.exercises + tuple(
+            ExerciseRow(r.id, base.body_parts.name(r.body_part_id), r.name, user_id) for r in rows)
+        categories = {part: [] for _, part in base.body_parts.rows}
+        ids_by_name = {}
+        for ex in exercises:
+            categories[ex.body_part].append(ex.name)
+            ids_by_name.setdefault(ex.name, []).append(ex.id)
+        return ExerciseCatalog(
+            by_id={ex.id: ex for ex in exercises},
+            by_key={(ex.body_part, ex.name): ex.id for ex in exercises},
+            ids_by_name={name: tuple(ids) for name, ids in ids_by_name.items()},
+            categories={part: tuple(names) for part, names in categories.items()},
+        )
+
+    # 內建代碼表有變（部署時新增）也要重建，所以把它的版本號放進 key
+    return EXERCISE_CATALOG_CACHE.get_or_load(user_id, VERSIONS.get("lookups", 0), load)
+
+def item_type_choices():
+    return lookups().item_types.choices() + [IMPORTANT_CHOICE]
+
+def seed_lookups():
+    """補上缺少的內建代碼（只新增，不改名也不刪除，資料列裡已經存的 id 不會變）；回傳新增幾筆"""
+    added = 0
+    seeds = (
+        (ItemType, [value for value, _ in ITEM_TYPES if value != IMPORTANT_CHOICE[0]]),
+        (MealType, [value for value, _ in MEAL_TYPES]),
+        (BodyPart, list(STRENGTH_CATEGORIES)),
+    )
+    for model, names in seeds:
+        existing = {name for (name,) in db.session.query(model.name)}
+        for order, name in enumerate(names):
+            if name not in existing:
+                db.session.add(model(name=name, sort_order=order))
+                added += 1
+    db.session.flush()
+
+    parts = dict(db.session.query(BodyPart.name, BodyPart.id).all())
+    existing = set(db.session.query(Exercise.body_part_id, Exercise.name).filter(Exercise.user_id.is_(None)))
+    for part, names in STRENGTH_CATEGORIES.items():
+        for order, name in enumerate(names):
+            if (parts[part], name) not in existing:
+                db.session.add(Exercise(body_part_id=parts[part], name=name, sort_order=order))
+                added += 1
+    db.session.commit()
+    if added:
+        bump_version(0, "lookups")
+    return added
+
+def legacy_lookup_tables(engine, table_names):
+    """table_names 裡還是舊版文字欄位（尚未轉成代碼表 id）的資料表"""
+    insp = inspect(engine)
+    return [
+        name for name in table_names
+        if name in LEGACY_LOOKUP_COLUMNS and insp.has_table(name)
+        and LEGACY_LOOKUP_COLUMNS[name] in {c["name"] for c in insp.get_columns(name)}
+    ]
+
+def warm_lookups():
+    """gunicorn master 在 fork 前先載入代碼表，worker 直接共用"""
+    with app.app_context():
+        lookups()
+        db.session.remove()
+
+
+# ===== 冷資料封存 =====
+# 行事曆 / 飲食 / 重訓 / 日記的熱資料表只留最近一段時間：早於 archive_cutoff() 的「整個月」
+# 由 archive_user() 搬進 archive_partitions（每人每表每月一列、zlib 壓縮的 JSON）。
+# 熱資料表與索引變小，單日頁「上次最大重量 / 上次總量」這類往回掃整段歷史的查詢跟著變快。
+# - 分析用的彙總在封存時一併寫進 archived_days / archived_exercise_days（留在熱資料）：
+#   TDEE、progress 圖表、上次最大重量 / 總量、月曆的重訓標記都不必解壓
+# - 單日 / 週 / 月檢視、匯出、ICS 訂閱碰到已封存的月份才解壓，跟熱資料表的列合併；
+#   封存的列唯讀（archived=True），之後補記在舊日期的資料照樣寫進熱資料表，下次封存時併進同一個月
+# - 食物字典 / 自動完成只看熱資料（最近吃過的食物）
+# - 這幾張表是 AUTOINCREMENT：沒有的話 SQLite 用 max(id) + 1，封存刪掉最新的列後新列會拿到封存裡已有的 id。
+#   舊資料庫先跑 python tools/migrate_autoincrement.py，還沒轉的表 archive_user 會拒絕封存
+# 封存後 bump 該使用者的 "archive"。月曆 / 週 / 單日、統計看到的內容不變，那些快取不用失效；
+# 但食物字典 / 自動完成的結果會變（封存的食物不再出現），有搬到飲食時再 bump "diet"
+ARCHIVE_MODELS = {model.__tablename__: model for model in (CalendarItem, DietEntry, StrengthSet, DiaryEntry)}
+ARCHIVE_ZLIB_LEVEL = 9        # 封存寫一次、讀很多次：壓縮率優先
+ARCHIVE_DELETE_BATCH = 500    # 刪熱資料時 IN (...) 一次幾個 id
+# 每位使用者有哪些已封存的 (表, 月)：沒有封存資料的人、最近的日期都只多讀一次版本號，不查資料庫
+ARCHIVE_INDEX_CACHE = VersionedCache("archive_index", "archive", maxsize=4096)
+# 解壓後的月份 (欄位名稱, 列 tuple)：單日頁前後翻頁都落在同一個月
+ARCHIVE_PARTITION_CACHE = VersionedCache("archive_partition", "archive", maxsize=256)
+_ISO_PARSERS = {date: date.fromisoformat, datetime: datetime.fromisoformat, dtime: dtime.fromisoformat}
+
+def next_month_start(d: date):
+    return (d.replace(day=28) + timedelta(days=4)).replace(day=1)
+
+def archive_cutoff(days=None, today=None):
+    """這一天（不含）之前的月份可以封存：今天往回 days 天（預設 ARCHIVE_AFTER_DAYS）那個月的 1 號"""
+    days = app.config['ARCHIVE_AFTER_DAYS'] if days is None else days
+    return ((today or date.today()) - timedelta(days=days)).replace(day=1)
+
+def encode_partition(columns, rows):
+    body = json.dumps({"columns": columns, "rows": rows}, ensure_ascii=False, separators=(",", ":"))
+    return zlib.compress(body.encode("utf-8"), ARCHIVE_ZLIB_LEVEL)
+
+def decode_partition(payload):
+    """(欄位名稱 list, 列 list)；日期 / 時間還是 ISO 字串"""
+    data = json.loads(zlib.decompress(payload))
+    return data["columns"], data["rows"]
+
+def archive_index(user_id):
+    """{表名: (已封存的月份, ...)}"""
+    def load():
+        index = {}
+        rows = (
+            db.session.query(ArchivePartition.table_name, ArchivePartition.month)
+            .filter(ArchivePartition.user_id == user_id)
+            .order_by(ArchivePartition.month.asc())
+        )
+        for table, month in rows:
+            index.setdefault(table, []).append(month)
+        return {table: tuple(months) for table, months in index.items()}
+
+    return ARCHIVE_INDEX_CACHE.get_or_load(user_id, None, load)
+
+def archived_months(user_id, table, start=None, end=None):
+    """跟 [start, end] 有重疊的已封存月份（None 表示不限）"""
+    first = start.replace(day=1) if start else None
+    return [m for m in archive_index(user_id).get(table, ())
+            if (first is None or m >= first) and (end is None or m <= end)]
+
+def _load_partition(user_id, model, month):
+    payload = (
+        db.session.query(ArchivePartition.payload)
+        .filter(ArchivePartition.user_id == user_id,
+                ArchivePartition.table_name == model.__tablename__,
+                ArchivePartition.month == month)
+        .scalar()
+    )
+    if payload is None:  # 剛好被重新封存（版本號還沒 bump）
+        return (), ()
+    columns, rows = decode_partition(payload)
+    types = {c.name: c.type.python_type for c in model.__table__.columns}
+    parsers = [_ISO_PARSERS.get(types.get(c)) for c in columns]
+    return tuple(columns), tuple(
+        tuple(v if v is None or parse is None else parse(v) for v, parse in zip(row, parsers))
+        for row in rows
+    )
+
+def archived_rows(user_id, model, start=None, end=None):
+    """已封存、日期在 [start, end] 的列（dict，依月份與 id 排序）"""
+    rows = []
+    for month in archived_months(user_id, model.__tablename__, start, end):
+        columns, data = ARCHIVE_PARTITION_CACHE.get_or_load(
+            user_id, (model.__tablename__, month), lambda: _load_partition(user_id, model, month))
+        if not columns:
+            continue
+        i = columns.index("date")
+        rows += [dict(zip(columns, r)) for r in data
+                 if (start is None or r[i] >= start) and (end is None or r[i] <= end)]
+    return rows
+
+def archived_objects(user_id, model, start=None, end=None):
+    """archived_rows 包成唯讀的 model 物件（不加進 session），模板裡跟熱資料表的物件混用"""
+    names = set(model.__table__.columns.keys())
+    objs = []
+    for row in archived_rows(user_id, model, start, end):
+        obj = model(user_id=user_id, **{k: v for k, v in row.items() if k in names})
+        obj.archived = True
+        objs.append(obj)
+    return objs
+
+def with_archived(hot, user_id, model, start, end, key):
+    """熱資料表查到的列加上已封存的列，依 key 排序；沒有封存資料時原樣回傳 hot"""
+    cold = archived_objects(user_id, model, start, end)
+    if not cold:
+        return hot
+    return sorted([*hot, *cold], key=key)
+
+def rollup_archive_month(user_id, table, month, columns, rows):
+    """依整個月的封存內容重算 archived_days / archived_exercise_days 裡這個月、這張表負責的欄位"""
+    if table not in ("diet_entries", "strength_sets"):
+        return
+    end = next_month_start(month) - timedelta(days=1)
+    col = {c: i for i, c in enumerate(columns)}
+    per_day = {}
+    per_exercise = {}
+    for r in rows:
+        d = date.fromisoformat(r[col["date"]])
+        count, total = per_day.get(d, (0, 0.0))
+        if table == "diet_entries":
+            per_day[d] = (count + 1, total + (r[col["kcal"]] or 0.0))
+        else:
+            weight = r[col["weight_kg"]] or 0.0
+            per_day[d] = (count + 1, total + weight * (r[col["reps"]] or 0))
+            key = (r[col["exercise_id"]], d)
+            per_exercise[key] = max(per_exercise.get(key, weight), weight)
+
+    fields = ("diet_entries", "kcal") if table == "diet_entries" else ("strength_sets", "strength_volume")
+    days = {
+        day.date: day for day in
+        ArchivedDay.query.filter(ArchivedDay.user_id == user_id, ArchivedDay.date.between(month, end))
+    }
+    for d, day in days.items():
+        if d not in per_day:
+            setattr(day, fields[0], 0)
+            setattr(day, fields[1], 0.0)
+    for d, (count, total) in per_day.items():
+        day = days.get(d)
+        if day is None:
+            day = ArchivedDay(user_id=user_id, date=d, diet_entries=0, kcal=0.0, strength_sets=0, strength_volume=0.0)
+            db.session.add(day)
+        setattr(day, fields[0], count)
+        setattr(day, fields[1], total)
+
+    if table == "strength_sets":
+        (ArchivedExerciseDay.query
+         .filter(ArchivedExerciseDay.user_id == user_id, ArchivedExerciseDay.date.between(month, end))
+         .delete(synchronize_session=False))
+        db.session.add_all(
+            ArchivedExerciseDay(user_id=user_id, exercise_id=ex_id, date=d, max_weight=w)
+            for (ex_id, d), w in per_exercise.items()
+        )
+
+def _archive_month(user_id, model, month):
+    """
+    把 user_id 在 month 這個月的熱資料併進該月的封存（沒有就新建）、重算彙總、刪掉熱資料，一個交易完成。
+    回傳搬了幾列；途中有人刪了這個月的資料時整個月回滾並回傳 None（下次再搬）。
+    """
+    table = model.__tablename__
+    end = next_month_start(month) - timedelta(days=1)
+    columns = [c.name for c in model.__table__.columns if c.name != "user_id"]
+    rows = (
+        db.session.query(*[getattr(model, c) for c in columns])
+        .filter(model.user_id == user_id, model.date.between(month, end))
+        .order_by(model.id.asc())
+        .all()
+    )
+    if not rows:
+        return 0
+
+    part = ArchivePartition.query.filter_by(user_id=user_id, table_name=table, month=month).first()
+    merged = []
+    if part is not None:
+        old_columns, old_rows = decode_partition(part.payload)
+        merged = [[record.get(c) for c in columns] for record in (dict(zip(old_columns, r)) for r in old_rows)]
+    else:
+        part = ArchivePartition(user_id=user_id, table_name=table, month=month)
+        db.session.add(part)
+    merged += [[_json_value(v) for v in r] for r in rows]
+    part.row_count = len(merged)
+    part.payload = encode_partition(columns, merged)
+    rollup_archive_month(user_id, table, month, columns, merged)
+
+    ids = [r.id for r in rows]
+    deleted = 0
+    for i in range(0, len(ids), ARCHIVE_DELETE_BATCH):
+        deleted += (
+            model.query
+            .filter(model.user_id == user_id, model.id.in_(ids[i:i + ARCHIVE_DELETE_BATCH]))
+            .delete(synchronize_session=False)
+        )
+    if deleted != len(ids):
+        db.session.rollback()
+        return None
+    db.session.commit()
+    return len(ids)
+
+def tables_without_autoincrement():
+    """目前的資料庫（分檔模式是目前使用者的檔案）裡還不是 AUTOINCREMENT 的封存表"""
+    rows = db.session.execute(
+        db.select(db.column("name"), db.column("sql")).select_from(db.table("sqlite_master"))
+        .where(db.column("type") == "table", db.column("name").in_(list(ARCHIVE_MODELS)))
+    )
+    return sorted(name for name, sql in rows if "AUTOINCREMENT" not in (sql or "").upper())
+
+def archive_user(user_id, cutoff, dry_run=False):
+    """把 user_id 在 cutoff 之前的資料依月份封存；回傳 {表名: 搬了（dry_run 時是會搬）幾列}"""
+    moved = {}
+    with using_shard(user_id):
+        legacy = tables_without_autoincrement()
+        if legacy and not dry_run:
+            raise RuntimeError(
+                f"{', '.join(legacy)} 還沒有 AUTOINCREMENT（封存後 id 會被重用），請先執行 python tools/migrate_autoincrement.py")
+        for table, model in ARCHIVE_MODELS.items():
+            months = (
+                db.session.query(func.strftime("%Y-%m", model.date), func.count())
+                .filter(model.user_id == user_id, model.date < cutoff)
+                .group_by(func.strftime("%Y-%m", model.date))
+                .all()
+            )
+            for ym, count in months:
+                if dry_run:
+                    n = count
+                else:
+                    n = _archive_month(user_id, model, date.fromisoformat(f"{ym}-01"))
+                    if n is None:
+                        print(f"[archive] user {user_id} {table} {ym}：搬移途中資料有變動，跳過（下次再搬）")
+                        continue
+                if n:
+                    moved[table] = moved.get(table, 0) + n
+        db.session.commit()
+    if moved and not dry_run:
+        bump_version(user_id, "archive")
+        if DietEntry.__tablename__ in moved:
+            bump_version(user_id, "diet")
+    return moved
+
+def archive_all(days=None, user_ids=None, dry_run=False):
+    """封存所有（或指定的）使用者；回傳 (cutoff, {表名: 列數}, 有資料被封存的人數)"""
+    cutoff = archive_cutoff(days)
+    if not user_ids:
+        user_ids = [uid for (uid,) in db.session.query(User.id).order_by(User.id.asc())]
+    totals, users = {}, 0
+    for user_id in user_ids:
+        moved = archive_user(user_id, cutoff, dry_run=dry_run)
+        users += bool(moved)
+        for table, n in moved.items():
+            totals[table] = totals.get(table, 0) + n
+    return cutoff, totals, users
+
+def archive_summary(totals, users, dry_run=False):
+    if not totals:
+        return "沒有需要封存的資料"
+    detail = "、".join(f"{table} {n}" for table, n in totals.items())
+    return f"{'會封存' if dry_run else '已封存'} {users} 位使用者的 {detail} 列"
+
+@app.cli.command("archive")
+@click.option("--days", type=int, default=None, help="保留最近幾天在熱資料表（預設 ARCHIVE_AFTER_DAYS）")
+@click.option("--user", "user_ids", type=int, multiple=True, help="只封存這位使用者（可重複）")
+@click.option("--dry-run", is_flag=True, help="只數會搬幾列，不改資料")
+def archive_command(days, user_ids, dry_run):
+    """flask --app app archive：把舊月份搬進壓縮的冷資料（可重複執行）"""
+    t0 = time.perf_counter()
+    cutoff, totals, users = archive_all(days, list(user_ids), dry_run=dry_run)
+    print(f"{cutoff.isoformat()} 之前：{archive_summary(totals, users, dry_run)}（{time.perf_counter() - t0:.1f}s）")
+
+# ===== Keyset 分頁 =====
+# 依 (date, id) 接續上一頁最後一筆往後取，不用 OFFSET：
+# 走 (user_id, date) 索引直接定位（SQLite 的索引本身就帶著 id），不管歷史資料多長每頁成本都一樣。
+PAGE_SIZE_MAX = 100
+
+def encode_cursor(row):
+    return f"{row.date.isoformat()}.{row.id}"
+
+def decode_cursor(cursor):
+    """'2026-03-18.42' -> (date, id)；格式錯誤回 400"""
+    try:
+        date_str, row_id = cursor.split(".")
+        return datetime.strptime(date_str, "%Y-%m-%d").date(), int(row_id)
+    except ValueError:
+        abort(400)
+
+def page_size(default):
+    return max(1, min(request.args.get("limit", default, type=int), PAGE_SIZE_MAX))
+
+def keyset_page(query, model, cursor=None, limit=20, descending=False, row_type=None):
+    """
+    回傳 (這一頁的資料, 下一頁的 cursor)；沒有下一頁時 cursor 是 None。
+    query 是 row_type.query() 時給 row_type，結果會轉成該 read model。
+    """
+    key = tuple_(model.date, model.id)
+    if cursor:
+        after = decode_cursor(cursor)
+        query = query.filter(key < after if descending else key > after)
+    if descending:
+        query = query.order_by(model.date.desc(), model.id.desc())
+    else:
+        query = query.order_by(model.date.asc(), model.id.asc())
+
+    rows = query.limit(limit + 1).all()  # 多抓一筆判斷還有沒有下一頁
+    if row_type is not None:
+        rows = row_type.fetch(rows)
+    next_cursor = encode_cursor(rows[limit - 1]) if len(rows) > limit else None
+    return rows[:limit], next_cursor
+
+def keyset_json(rows, next_cursor, items, rows_html, endpoint, **args):
+    """無限捲動用的 JSON：資料本身、同一個模板 macro 產生的 <tr>、下一頁的網址"""
+    return jsonify({
+        "items": items,
+        "html": str(rows_html),
+        "next": next_cursor,
+        "next_url": url_for(endpoint, after=next_cursor, limit=request.args.get("limit"), **args) if next_cursor else None,
+    })
+
+
+# ===== 背景工作佇列 =====
+# 耗時的工作（匯出、匯入、重算統計）不在 gunicorn worker 裡做，
+# 只寫一筆 Job 進資料表，由 `python worker.py` 取出執行。
+JOB_HANDLERS = {}
+EXPORT_DIR = os.path.join(app.instance_path, "exports")
+
+def job_handler(kind):
+    """註冊背景工作：handler(job, payload) 回傳值會以 JSON 存進 job.result"""
+    def decorator(fn):
+        JOB_HANDLERS[kind] = fn
+        return fn
+    return decorator
+
+def enqueue_job(kind, payload=None, user_id=None, max_attempts=3):
+    if kind not in JOB_HANDLERS:
+        raise ValueError(f"未知的工作類型：{kind}")
+    job = Job(
+        kind=kind,
+        payload=json.dumps(payload or {}, ensure_ascii=False),
+        user_id=user_id,
+        max_attempts=max_attempts,
+    )
+    db.session.add(job)
+    db.session.commit()
+    return job
+
+def job_progress(job, progress, message=None):
+    """在 handler 裡回報進度（0~100），/jobs/<id> 會看到；順便更新 locked_at 當作心跳（見 worker.py）"""
+    job.progress = max(0.0, min(100.0, float(progress)))
+    if message is not None:
+        job.message = message[:200]
+    job.locked_at = datetime.utcnow()
+    db.session.commit()
+
+# 每人一份的資料表：分檔模式（SHARD_BY_USER=1）時放在各自的 SQLite 檔
+SHARDED_MODELS = [
+    CalendarItem, ImportantItem, DietEntry, StrengthSet,
+    WeightEntry, DiaryEntry, TimetableEntry, DailyNutritionGoal,
+    WeightTrendDay, WeightTrend,
+    ArchivePartition, ArchivedDay, ArchivedExerciseDay,
+]
+
+EXPORT_MODELS = [
+    ("calendar_items", CalendarItem),
+    ("important_items", ImportantItem),
+    ("diet_entries", DietEntry),
+    ("strength_sets", StrengthSet),
+    ("weight_entries", WeightEntry),
+    ("diary_entries", DiaryEntry),
+    ("timetable_entries", TimetableEntry),
+    ("daily_nutrition_goals", DailyNutritionGoal),
+]
+
+def _export_lookup_names(user_id):
+    """匯出檔裡代碼表 id 旁邊附上名稱：{id 欄位: [(名稱欄位, id -> 名稱)]}"""
+    base, catalog = lookups(), exercise_catalog(user_id)
+    return {
+        "item_type_id": [("item_type", base.item_types.name)],
+        "meal_type_id": [("meal_type", base.meal_types.name)],
+        "exercise_id": [("body_part", lambda i: catalog.by_id[i].body_part),
+                        ("exercise_name", lambda i: catalog.by_id[i].name)],
+    }
+
+def _json_value(v):
+    # date / datetime / time 都轉成 ISO 字串
+    if hasattr(v, "isoformat"):
+        return v.isoformat()
+    return v
+
+@job_handler("export_user_data")
+def export_user_data(job, payload):
+    """把使用者所有資料匯出成 instance/exports/ 底下的 JSON 檔"""
+    data = {}
+    total_rows = 0
+    decoders = _export_lookup_names(job.user_id)
+    for i, (name, model) in enumerate(EXPORT_MODELS):
+        cols = [c.name for c in model.__table__.columns if c.name != "user_id"]
+        rows = (
+            db.session.query(*[getattr(model, c) for c in cols])
+            .filter(model.user_id == job.user_id)
+            .order_by(model.id.asc())
+            .yield_per(1000)
+        )
+        data[name] = [{c: _json_value(v) for c, v in zip(cols, r)} for r in rows]
+        if name in ARCHIVE_MODELS:  # 已封存的月份也要匯出
+            archived = [{c: _json_value(row.get(c)) for c in cols} for row in archived_rows(job.user_id, model)]
+            if archived:
+                data[name] = sorted(data[name] + archived, key=lambda record: record["id"])
+        for col in decoders.keys() & set(cols):
+            for record in data[name]:
+                record.update((key, decode(record[col])) for key, decode in decoders[col])
+        total_rows += len(data[name])
+        job_progress(job, (i + 1) * 100.0 / len(EXPORT_MODELS), f"已匯出 {name}")
+
+    os.makedirs(EXPORT_DIR, exist_ok=True)
+    filename = f"user{job.user_id}_job{job.id}.json"
+    with open(os.path.join(EXPORT_DIR, filename), "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False)
+    return {"filename": filename, "rows": total_rows}
+
+@job_handler("recompute")
+def recompute_user_data(job, payload):
+    """重算這位使用者的衍生資料（recompute.py 的工作，payload["tasks"] 沒給時全部），跟 flask recompute 一樣分批、節流"""
+    import recompute
+    tasks = recompute.resolve_tasks(payload.get("tasks"))
+    writer = recompute.ChunkWriter(recompute.RECOMPUTE_DUTY)
+    rows = {}
+    for i, name in enumerate(tasks):
+        before = writer.rows
+        recompute.RECOMPUTE_TASKS[name](job.user_id, writer)
+        rows[name] = writer.rows - before
+        job_progress(job, (i + 1) * 100.0 / len(tasks), f"已重算 {name}")
+    return {"rows": rows}
+
+
 #====建立或取得使用者=====
 
 def get_or_create_user(provider, social_id, email, name):
+    try:
+        return _get_or_create_user(provider, social_id, email, name)
+    except IntegrityError:
+        # 同一個人同時有兩個登入請求（gthread / gevent 下同一個 worker 也會並行）：另一個剛建好，改用它建的
+        db.session.rollback()
+        return _get_or_create_user(provider, social_id, email, name)
+
+def _get_or_create_user(provider, social_id, email, name):
     # 1. 檢查是否已經有這個 SocialAuth 紀錄
     social = SocialAuth.query.filter_by(provider=provider, social_id=social_id).first()
     
@@ -309,7 +1462,7 @@ def get_or_create_user(provider, social_id, email, name):
             # 情境 B-2: 完全的新手 (建立新帳號)
             new_user = User(email=email, name=name)
             db.session.add(new_user)
-            db.session.commit()
+            db.session.flush()  # 拿到 id；帳號與綁定在同一個交易裡建立
             
             new_social = SocialAuth(user_id=new_user.id, provider=provider, social_id=social_id)
             db.session.add(new_social)
@@ -343,13 +1496,30 @@ def logout():
     flash('已登出', 'info')
     return redirect(url_for('login'))
 
+@app.route('/login/test', methods=['POST'])
+def test_login():
+    """離線壓測用：帶正確的 TEST_LOGIN_TOKEN 就直接以 email 登入（沒設定 token 時等於不存在）"""
+    expected = app.config.get('TEST_LOGIN_TOKEN')
+    if not expected:
+        abort(404)
+    if not hmac.compare_digest(request.form.get('token', ''), expected):
+        abort(403)
+    email = (request.form.get('email') or '').strip().lower()
+    if not email:
+        abort(400)
+    user = get_or_create_user('test', email, email, request.form.get('name') or email.split('@')[0])
+    login_user(user)
+    return jsonify({"user_id": user.id})
+
 @app.route('/login/google')
 def google_login():
+    google = get_oauth_client('google')
     redirect_uri = url_for('google_auth', _external=True)
     return google.authorize_redirect(redirect_uri)
 
 @app.route('/auth/google/callback')
 def google_auth():
+    google = get_oauth_client('google')
     token = google.authorize_access_token()
     
     # [修改 1] 不要再發 request 去要 userinfo 了
@@ -376,19 +1546,34 @@ def google_auth():
 
 @app.route('/login/line')
 def line_login():
+    line = get_oauth_client('line')
     redirect_uri = url_for('line_auth', _external=True)
     return line.authorize_redirect(redirect_uri)
 
 @app.route('/auth/line/callback')
 def line_auth():
-    # 1. 取得 Code
+    import requests
+    from oidc import IdTokenError, http_session, verify_id_token
+
+    line = get_oauth_client('line')
+    oidc_cache = get_oidc_cache()
+
+    # 1. 取得 Code，並用 state 找回 line_login 時存下的 nonce（順便擋 CSRF）
     code = request.args.get('code')
     if not code:
         flash("錯誤：沒有收到認證碼", "danger")
         return redirect(url_for('login'))
 
-    # 2. 準備換 Token
-    token_url = 'https://api.line.me/oauth2/v2.1/token'
+    state = request.args.get('state')
+    state_data = line.framework.get_state_data(session, state) if state else None
+    if not state_data:
+        flash("LINE 登入逾時或狀態不符，請重新登入", "danger")
+        return redirect(url_for('login'))
+    line.framework.clear_state_data(session, state)
+
+    # 2. 準備換 Token（token endpoint 從快取的 discovery metadata 取得）
+    metadata = oidc_cache.metadata(app.config['LINE_METADATA_URL'])
+    token_url = metadata.get('token_endpoint', 'https://api.line.me/oauth2/v2.1/token')
     redirect_uri = url_for('line_auth', _external=True)
     
     payload = {
@@ -399,8 +1584,12 @@ def line_auth():
         'client_secret': app.config['LINE_CLIENT_SECRET'],
     }
 
-    # 3. 發送請求換 Token
-    resp = requests.post(token_url, data=payload)
+    # 3. 發送請求換 Token（共用連線池，一定有 timeout）
+    try:
+        resp = http_session().post(token_url, data=payload)
+    except requests.RequestException as e:
+        flash(f"LINE 登入失敗：無法連線 ({e.__class__.__name__})", "danger")
+        return redirect(url_for('login'))
     if resp.status_code != 200:
         flash(f"LINE 登入失敗: {resp.text}", "danger")
         return redirect(url_for('login'))
@@ -408,24 +1597,20 @@ def line_auth():
     token_data = resp.json()
     id_token = token_data.get('id_token')
 
-    # ==========================================
-    # [重點修改] 手動暴力解碼 (不依賴任何 JWT 套件)
-    # ==========================================
-    
-    # JWT 的結構是: header.payload.signature
-    # 我們只需要中間的 payload
-    parts = id_token.split('.')
-    payload_segment = parts[1]
-    
-    # Base64 解碼需要補齊長度 (Padding)
-    padding = '=' * (4 - len(payload_segment) % 4)
-    payload_segment += padding
-    
-    # 解碼並轉成 JSON
-    decoded_bytes = base64.urlsafe_b64decode(payload_segment)
-    user_info = json.loads(decoded_bytes)
-    
-    # ==========================================
+    # 4. 驗證 id_token 簽章與 iss / aud / exp / nonce
+    #    ES256 用快取的 JWKS、HS256 用 channel secret，快取命中時不需要任何網路請求
+    try:
+        user_info = verify_id_token(
+            oidc_cache,
+            id_token or '',
+            app.config['LINE_METADATA_URL'],
+            client_id=app.config['LINE_CLIENT_ID'],
+            client_secret=app.config['LINE_CLIENT_SECRET'],
+            nonce=state_data.get('nonce'),
+        )
+    except IdTokenError as e:
+        flash(f"LINE 登入失敗：id_token 驗證失敗 ({e})", "danger")
+        return redirect(url_for('login'))
 
     # 5. 取得資料
     social_id = user_info['sub']
@@ -449,6 +1634,135 @@ def line_auth():
     return redirect(url_for('index'))
 
 
+# ===== 行事曆共用 =====
+# 家人 / 讀書會互相看行事曆：owner 在 /sharing 輸入對方的 Email，給「只能看」或「可編輯」。
+# 月曆 / 週 / 單日頁一次查出「自己 + 分享給我的人」的項目（calendar_rows）：
+# - 共用資料庫時是一句 user_id IN (...) AND date BETWEEN ...，SQLite 在 (user_id, date) 索引上
+#   對每個 user_id 各做一段範圍掃描，10 個人還是一句查詢，不是 10 句
+# - 分檔模式（SHARD_BY_USER=1）每人的資料在自己的檔案，只能每個 owner 各查一次再合併
+# 「我看得到誰」每位 viewer 快取一份；新增 / 取消分享、改權限後 bump viewer 的 "sharing"。
+# 可編輯只涵蓋行事曆項目：重要事項與提醒是個人的，幫別人新增的項目不設提醒，修改時對方的提醒跟著新的時間走。
+SharedOwner = namedtuple("SharedOwner", "id name can_write color")
+SHARE_COLORS = ("#2563eb", "#db2777", "#059669", "#d97706", "#7c3aed",
+                "#0891b2", "#dc2626", "#65a30d", "#9333ea", "#ea580c")
+CALENDAR_OWNERS_CACHE = VersionedCache("calendar_owners", "sharing", maxsize=4096)
+
+def visible_calendar_owners():
+    """目前使用者看得到的行事曆 (SharedOwner, ...)：自己排第一，其餘依 owner id，顏色依序取 SHARE_COLORS"""
+    viewer_id, viewer_name = current_user.id, current_user.name
+
+    def load():
+        rows = (
+            db.session.query(CalendarShare.owner_id, User.name, User.email, CalendarShare.can_write)
+            .join(User, User.id == CalendarShare.owner_id)
+            .filter(CalendarShare.viewer_id == viewer_id)
+            .order_by(CalendarShare.owner_id.asc())
+            .all()
+        )
+        owners = [(viewer_id, viewer_name, True)] + [(oid, name or email, w) for oid, name, email, w in rows]
+        return tuple(SharedOwner(oid, name, can_write, SHARE_COLORS[i % len(SHARE_COLORS)])
+                     for i, (oid, name, can_write) in enumerate(owners))
+
+    return CALENDAR_OWNERS_CACHE.get_or_load(viewer_id, None, load)
+
+def calendar_owner_map():
+    """{owner id: SharedOwner}（依 visible_calendar_owners 的順序），模板用來替項目上色"""
+    return {o.id: o for o in visible_calendar_owners()}
+
+def writable_owner(owner_id):
+    """current_user 可以寫入 owner_id 的行事曆（自己，或對方給了可編輯）就回傳 SharedOwner，否則 404"""
+    for owner in visible_calendar_owners():
+        if owner.id == owner_id and owner.can_write:
+            return owner
+    abort(404)
+
+def calendar_rows(row_type, model, owner_ids, start, end, key):
+    """owner_ids 這些人日期在 [start, end] 的 row_type 列，加上已封存的月份，依 key 排序"""
+    archived = model.__tablename__ in ARCHIVE_MODELS
+    rows = []
+    if ROUTER.enabled:
+        for uid in owner_ids:
+            with using_shard(uid):
+                rows += row_type.fetch(
+                    row_type.query().filter(model.user_id == uid, model.date.between(start, end)))
+                if archived:
+                    rows += archived_objects(uid, model, start, end)
+    else:
+        rows = row_type.fetch(
+            row_type.query().filter(model.user_id.in_(owner_ids), model.date.between(start, end)))
+        if archived:
+            for uid in owner_ids:  # 封存索引有快取，沒封存過的人不會多查
+                rows += archived_objects(uid, model, start, end)
+    return sorted(rows, key=key)
+
+def group_by_date(rows):
+    by_date = {}
+    for row in rows:
+        by_date.setdefault(row.date, []).append(row)
+    return by_date
+
+# 週 / 單日頁與 /api/batch 共用、一個請求只拿一次的資料（本身都有程序內快取，寫入後自動失效）
+PageLookups = namedtuple("PageLookups", "goal catalog owners")
+
+def page_lookups():
+    return PageLookups(get_nutrition_targets(), exercise_catalog(current_user.id), calendar_owner_map())
+
+@app.route("/sharing")
+@login_required
+def sharing_page():
+    given = (
+        CalendarShare.query.options(db.joinedload(CalendarShare.viewer))
+        .filter(CalendarShare.owner_id == current_user.id)
+        .order_by(CalendarShare.id.asc())
+        .all()
+    )
+    received = (
+        CalendarShare.query
+        .filter(CalendarShare.viewer_id == current_user.id)
+        .order_by(CalendarShare.owner_id.asc())
+        .all()
+    )
+    return render_template("sharing.html", given=given, received=received, owners=calendar_owner_map())
+
+@app.route("/sharing/add", methods=["POST"])
+@login_required
+def sharing_add():
+    """分享給某個 Email；已經分享過就改成這次選的權限"""
+    email = request.form.get("email", "").strip()
+    can_write = request.form.get("permission") == "write"
+    viewer = User.query.filter(User.email == email).first() if email else None
+    if viewer is None:
+        flash("找不到這個 Email 的使用者（對方要先登入過一次）", "warning")
+        return redirect(url_for("sharing_page"))
+    if viewer.id == current_user.id:
+        flash("不用分享給自己", "warning")
+        return redirect(url_for("sharing_page"))
+
+    share = CalendarShare.query.filter_by(owner_id=current_user.id, viewer_id=viewer.id).first()
+    if share is None:
+        share = CalendarShare(owner_id=current_user.id, viewer_id=viewer.id)
+        db.session.add(share)
+    share.can_write = can_write
+    db.session.commit()
+    bump_version(viewer.id, "sharing")
+    flash(f"已分享給 {viewer.name or viewer.email}（{'可編輯' if can_write else '只能看'}）", "success")
+    return redirect(url_for("sharing_page"))
+
+@app.route("/sharing/delete/<int:share_id>", methods=["POST"])
+@login_required
+def sharing_delete(share_id):
+    """owner 取消分享，或 viewer 不想再看對方的行事曆"""
+    share = CalendarShare.query.filter(
+        CalendarShare.id == share_id,
+        (CalendarShare.owner_id == current_user.id) | (CalendarShare.viewer_id == current_user.id),
+    ).first_or_404()
+    viewer_id = share.viewer_id
+    db.session.delete(share)
+    db.session.commit()
+    bump_version(viewer_id, "sharing")
+    flash("已取消共用", "info")
+    return redirect(url_for("sharing_page"))
+
 # ===== 首頁（月檢視） =====
 @app.route("/")
 @login_required
@@ -461,24 +1775,18 @@ def index():
 
     first_day, last_day = month_range(year, month)
 
-    items = (
-        CalendarItem.query
-        .filter(CalendarItem.user_id == current_user.id)
-        .filter(CalendarItem.date.between(first_day, last_day))
-        .order_by(CalendarItem.date.asc(), CalendarItem.start_time.asc())
-        .all()
-    )
-    items_by_date = {}
-    for it in items:
-        items_by_date.setdefault(it.date, []).append(it)
-
-    cal = calendar.Calendar(firstweekday=0)
-    weeks = cal.monthdatescalendar(year, month)
+    # 自己 + 分享給我的人：人數再多都是行事曆、重要事項各一句 IN 查詢（見 calendar_rows）
+    # 已封存的月份：解壓出來的 CalendarItem 跟 CalendarItemRow 有同樣的欄位 / 方法，模板不用分
+    owners = calendar_owner_map()
+    items = calendar_rows(CalendarItemRow, CalendarItem, tuple(owners), first_day, last_day,
+                          key=lambda it: (it.date, it.start_time))
+    importants = calendar_rows(ImportantRow, ImportantItem, tuple(owners), first_day, last_day,
+                               key=lambda it: (it.date, it.id))
 
     (prev_y, prev_m), (next_y, next_m) = month_nav(year, month)
     strength_dates = strength_dates_between(first_day, last_day)
 
-    nutrition_goal = get_global_nutrition_goal()
+    nutrition_goal = get_nutrition_targets()
 
     next_important, next_important_days = get_next_important()
 
@@ -487,8 +1795,10 @@ def index():
         "index.html",
         year=year,
         month=month,
-        weeks=weeks,
-        items_by_date=items_by_date,
+        month_cells=month_skeleton(year, month),
+        items_by_date=group_by_date(items),
+        important_by_date=group_by_date(importants),
+        owners=owners,
         prev_year=prev_y,
         prev_month=prev_m,
         next_year=next_y,
@@ -503,79 +1813,92 @@ def index():
 @app.route("/timetable", methods=["GET"])
 @login_required
 def timetable():
-    # 依星期、節次排序顯示
-    entries = (
-        TimetableEntry.query
-        .filter(TimetableEntry.user_id == current_user.id)
-        .order_by(TimetableEntry.weekday_code.asc(), TimetableEntry.section.asc())
-        .all()
-    )
-
-    # 做一個 dict，讓模板好用：key = (weekday_code, section)
-    entries_by_key = {}
-    for e in entries:
-        entries_by_key.setdefault((e.weekday_code, e.section), []).append(e)
-
-    # ===== 合併相同課名且時間連續的格子（用 rowspan） =====
-    merged_cells = {}  # key: (weekday_code, section) -> {"entry": e, "rowspan": n}
-    skip_slots = set()  # 被上方合併覆蓋掉的 (weekday_code, section)
-
-    for weekday_code, _ in WEEKDAY_CHOICES:
-        sec_list = SECTION_CHOICES
-        i = 0
-        while i < len(sec_list):
-            sec = sec_list[i]
-            key = (weekday_code, sec)
-            slot_entries = entries_by_key.get(key, [])
-
-            # 如果這一節沒有課，直接下一節
-            if len(slot_entries) != 1:
-                i += 1
-                continue
-
-            # 先假設只有一門課，抓第一筆當代表
-            e0 = slot_entries[0]
-            span = 1
-            j = i + 1
-
-            # 往下面找連續節次，判斷是否可以合併
-            while j < len(sec_list):
-                next_sec = sec_list[j]
-                key2 = (weekday_code, next_sec)
-                slot_entries2 = entries_by_key.get(key2, [])
-
-                # 只在「下一節也只有一門課」的情況下考慮合併
-                if len(slot_entries2) != 1:
-                    break
-
-                e2 = slot_entries2[0]
-                # 判斷「相同課」：課名 + 教室 + 老師 + 備註 都相同就視為同一門課
-                if (
-                    e2.course_name == e0.course_name
-                    and (e2.classroom or "") == (e0.classroom or "")
-                    and (e2.teacher or "") == (e0.teacher or "")
-                    and (e2.note or "") == (e0.note or "")
-                ):
-                    span += 1
-                    skip_slots.add((weekday_code, next_sec))
-                    j += 1
-                else:
-                    break
-
-            # 這一節是合併區塊的起點
-            merged_cells[key] = {"entry": e0, "rowspan": span}
-            i = j
-
     return render_template(
         "timetable.html",
         WEEKDAY_CHOICES=WEEKDAY_CHOICES,
         SECTION_CHOICES=SECTION_CHOICES,
-        entries_by_key=entries_by_key,
-        entries=entries,
-        merged_cells=merged_cells,
-        skip_slots=skip_slots,
+        grid=timetable_grid(),
     )
 
+def timetable_grid():
+    """課表表格的 HTML；課表沒變（timetable 版本號相同）時連資料庫都不用查"""
+
+    def load():
+        # 依星期、節次排序顯示
+        entries = (
+            TimetableEntry.query
+            .filter(TimetableEntry.user_id == current_user.id)
+            .order_by(TimetableEntry.weekday_code.asc(), TimetableEntry.section.asc())
+            .all()
+        )
+
+        # 做一個 dict，讓模板好用：key = (weekday_code, section)
+        entries_by_key = {}
+        for e in entries:
+            entries_by_key.setdefault((e.weekday_code, e.section), []).append(e)
+
+        # ===== 合併相同課名且時間連續的格子（用 rowspan） =====
+        merged_cells = {}  # key: (weekday_code, section) -> {"entry": e, "rowspan": n}
+        skip_slots = set()  # 被上方合併覆蓋掉的 (weekday_code, section)
+
+        for weekday_code, _ in WEEKDAY_CHOICES:
+            sec_list = SECTION_CHOICES
+            i = 0
+            while i < len(sec_list):
+                sec = sec_list[i]
+                key = (weekday_code, sec)
+                slot_entries = entries_by_key.get(key, [])
+
+                # 如果這一節沒有課，直接下一節
+                if len(slot_entries) != 1:
+                    i += 1
+                    continue
+
+                # 先假設只有一門課，抓第一筆當代表
+                e0 = slot_entries[0]
+                span = 1
+                j = i + 1
+
+                # 往下面找連續節次，判斷是否可以合併
+                while j < len(sec_list):
+                    next_sec = sec_list[j]
+                    key2 = (weekday_code, next_sec)
+                    slot_entries2 = entries_by_key.get(key2, [])
+
+                    # 只在「下一節也只有一門課」的情況下考慮合併
+                    if len(slot_entries2) != 1:
+                        break
+
+                    e2 = slot_entries2[0]
+                    # 判斷「相同課」：課名 + 教室 + 老師 + 備註 都相同就視為同一門課
+                    if (
+                        e2.course_name == e0.course_name
+                        and (e2.classroom or "") == (e0.classroom or "")
+                        and (e2.teacher or "") == (e0.teacher or "")
+                        and (e2.note or "") == (e0.note or "")
+                    ):
+                        span += 1
+                        skip_slots.add((weekday_code, next_sec))
+                        j += 1
+                    else:
+                        break
+
+                # 這一節是合併區塊的起點
+                merged_cells[key] = {"entry": e0, "rowspan": span}
+                i = j
+
+        return Markup(render_template(
+            "_timetable_grid.html",
+            WEEKDAY_CHOICES=WEEKDAY_CHOICES,
+            SECTION_CHOICES=SECTION_CHOICES,
+            entries_by_key=entries_by_key,
+            entries=entries,
+            merged_cells=merged_cells,
+            skip_slots=skip_slots,
+        ))
+
+    return TIMETABLE_GRID_CACHE.get_or_load(current_user.id, request.script_root, load)
+
 
 
 @app.route("/timetable/add", methods=["POST"])
@@ -609,6 +1932,7 @@ def timetable_add():
     )
     db.session.add(entry)
     db.session.commit()
+    bump_version(current_user.id, "timetable")
     flash("已新增課表項目", "success")
     return redirect(url_for("timetable"))
 
@@ -619,14 +1943,161 @@ def timetable_delete(entry_id):
     entry = TimetableEntry.query.filter(TimetableEntry.user_id == current_user.id, TimetableEntry.id == entry_id).first_or_404()
     db.session.delete(entry)
     db.session.commit()
+    bump_version(current_user.id, "timetable")
     flash("已刪除課表項目", "info")
     return redirect(url_for("timetable"))
 
+# ===== 自適應 TDEE（由飲食與體重紀錄反推每日消耗）=====
+# 能量守恆：每日消耗 ≈ 平均攝取 − 7700 kcal/kg × 體重每天的變化。
+# 每個 TDEE_WINDOW_DAYS 天的視窗裡，攝取取有記錄那幾天的平均，體重變化用 weight_trend_days
+# 的趨勢值做線性迴歸取斜率。攝取與迴歸需要的總和都先做成前綴和，視窗往後滑一天只要 O(1)，
+# 整段歷史一次算完是 O(天數)，跟視窗長度無關。
+KCAL_PER_KG = 7700
+TDEE_WINDOW_DAYS = 28
+TDEE_MIN_INTAKE_DAYS = 14   # 視窗內至少要有幾天飲食紀錄
+TDEE_MIN_DAY_KCAL = 500     # 一整天低於這個熱量多半只記了一部分，不採用
+TDEE_MIN_WEIGHT_DAYS = 4    # 視窗內至少要有幾天體重
+TDEE_SERIES_STEP = 7        # 歷史曲線每隔幾個視窗取一點（連續記錄時就是每週一點）
+TdeeWindow = namedtuple("TdeeWindow", "end kcal intake_kcal weekly_change_kg intake_days weight_days")
+TdeeEstimate = namedtuple("TdeeEstimate", TdeeWindow._fields + ("series",))
+
+def _prefix_sums(values):
+    sums = [0.0]
+    for v in values:
+        sums.append(sums[-1] + v)
+    return sums
+
+def rolling_tdee(intake, trend, window=TDEE_WINDOW_DAYS):
+    """
+    intake: [(date, 當天總熱量)]、trend: [(date, 趨勢體重)]，都依日期由舊到新。
+    回傳每一天（視窗的最後一天）的 TdeeWindow，資料不足的日子略過。
+    """
+    intake = [(d, kcal) for d, kcal in intake if kcal >= TDEE_MIN_DAY_KCAL]
+    if not intake or len(trend) < TDEE_MIN_WEIGHT_DAYS:
+        return []
+    start = min(intake[0][0], trend[0][0])
+    n_days = (max(intake[-1][0], trend[-1][0]) - start).days + 1
+
+    # 攝取：每天一格（沒記錄是 0，另外記有沒有記錄）
+    kcal, logged = [0.0] * n_days, [0] * n_days
+    for d, total in intake:
+        i = (d - start).days
+        kcal[i], logged[i] = total, 1
+    kcal_sum, logged_sum = _prefix_sums(kcal), _prefix_sums(logged)
+
+    # 體重：不是每天都有，x 是距離 start 的天數
+    xs = [(d - start).days for d, _ in trend]
+    ys = [t for _, t in trend]
+    sx, sy = _prefix_sums(xs), _prefix_sums(ys)
+    sxx = _prefix_sums(x * x for x in xs)
+    sxy = _prefix_sums(x * y for x, y in zip(xs, ys))
+
+    windows = []
+    lo = hi = 0  # 視窗內的體重點是 xs[lo:hi]
+    for i in range(n_days):
+        first = max(0, i - window + 1)
+        while hi < len(xs) and xs[hi] <= i:
+            hi += 1
+        while lo < hi and xs[lo] < first:
+            lo += 1
+        days, n = int(logged_sum[i + 1] - logged_sum[first]), hi - lo
+        if days < TDEE_MIN_INTAKE_DAYS or n < TDEE_MIN_WEIGHT_DAYS:
+            continue
+        Sx, Sy = sx[hi] - sx[lo], sy[hi] - sy[lo]
+        denom = n * (sxx[hi] - sxx[lo]) - Sx * Sx
+        if denom <= 0:
+            continue
+        slope = (n * (sxy[hi] - sxy[lo]) - Sx * Sy) / denom  # kg/天
+        mean = (kcal_sum[i + 1] - kcal_sum[first]) / days
+        windows.append(TdeeWindow(start + timedelta(days=i), mean - KCAL_PER_KG * slope, mean, slope * 7, days, n))
+    return windows
+
+def get_tdee_estimate(user_id):
+    """最新的自適應 TDEE（資料不足時回傳 None），飲食或體重有變動才重算"""
+    # 今天還沒記完，只算到昨天
+    end = date.today() - timedelta(days=1)
+
+    def load():
+        get_weight_trend(user_id)  # 第一次用到時先把趨勢建好
+        intake = (
+            db.session.query(DietEntry.date, func.sum(DietEntry.kcal))
+            .filter(DietEntry.user_id == user_id, DietEntry.date <= end)
+            .group_by(DietEntry.date)
+            .order_by(DietEntry.date.asc())
+            .all()
+        )
+        trend = (
+            db.session.query(WeightTrendDay.date, WeightTrendDay.trend)
+            .filter(WeightTrendDay.user_id == user_id, WeightTrendDay.date <= end)
+            .order_by(WeightTrendDay.date.asc())
+            .all()
+        )
+        if archived_months(user_id, "diet_entries", end=end):
+            # 已封存的日子用 archived_days 的每日熱量（同一天熱資料表也有補記時相加）
+            daily = {d: k or 0.0 for d, k in intake}
+            archived = (
+                db.session.query(ArchivedDay.date, ArchivedDay.kcal)
+                .filter(ArchivedDay.user_id == user_id, ArchivedDay.date <= end, ArchivedDay.diet_entries > 0)
+            )
+            for d, kcal in archived:
+                daily[d] = daily.get(d, 0.0) + kcal
+            intake = sorted(daily.items())
+        windows = rolling_tdee([(d, k or 0.0) for d, k in intake], trend)
+        if not windows:
+            return None
+        series = tuple((w.end, round(w.kcal)) for w in windows[::-TDEE_SERIES_STEP])[::-1]
+        return TdeeEstimate(*windows[-1], series)
+
+    return TDEE_CACHE.get_or_load(user_id, end, load)
+
+def macro_targets(maintenance_kcal, weight_kg, goal_type):
+    """依維持熱量、體重與目標（lose / maintain / gain）算出每日熱量與三大營養素建議"""
+    # 1. 依目標調整總熱量
+    if goal_type == "lose":
+        target_kcal = maintenance_kcal - 500.0
+    elif goal_type == "gain":
+        target_kcal = maintenance_kcal + 250.0
+    else:
+        target_kcal = maintenance_kcal
+
+    # 不要太低
+    if target_kcal < 1000:
+        target_kcal = 1000.0
+
+    # 2. 蛋白質（g/kg）
+    if goal_type == "lose":
+        protein_per_kg = 2.0
+    elif goal_type == "gain":
+        protein_per_kg = 1.8
+    else:
+        protein_per_kg = 1.6
+
+    protein_g = protein_per_kg * weight_kg
+
+    # 3. 脂肪（g/kg）
+    fat_per_kg = 0.8
+    fat_g = fat_per_kg * weight_kg
+
+    # 4. 碳水：用剩餘熱量計算
+    kcal_from_protein = protein_g * 4.0
+    kcal_from_fat = fat_g * 9.0
+    carb_kcal = max(target_kcal - (kcal_from_protein + kcal_from_fat), 0.0)
+    carb_g = carb_kcal / 4.0
+
+    return {
+        "kcal": target_kcal,
+        "maintenance_kcal": maintenance_kcal,
+        "protein_g": protein_g,
+        "fat_g": fat_g,
+        "carb_g": carb_g,
+    }
+
 # ===== 全域營養目標設定頁（含建議計算） =====
 @app.route("/nutrition_goal", methods=["GET", "POST"])
 @login_required
 def nutrition_goal_page():
     goal = get_global_nutrition_goal()
+    tdee = get_tdee_estimate(current_user.id)
 
     suggestion = None
     calc_input = {
@@ -660,6 +2131,8 @@ def nutrition_goal_page():
                 nutrition_goal=goal,
                 suggestion=None,
                 calc_input=calc_input,
+                tdee=tdee,
+                tdee_window=TDEE_WINDOW_DAYS,
             )
 
         # 1. 維持熱量估計（kcal/kg）
@@ -674,53 +2147,26 @@ def nutrition_goal_page():
         elif age >= 50:
             base_per_kg -= 2.0
 
-        maintenance_kcal = base_per_kg * weight_kg
+        suggestion = macro_targets(base_per_kg * weight_kg, weight_kg, goal_type)
 
-        # 2. 依目標調整總熱量
-        if goal_type == "lose":
-            target_kcal = maintenance_kcal - 500.0
-        elif goal_type == "gain":
-            target_kcal = maintenance_kcal + 250.0
-        else:
-            target_kcal = maintenance_kcal
-
-        # 不要太低
-        if target_kcal < 1000:
-            target_kcal = 1000.0
-
-        # 3. 蛋白質（g/kg）
-        if goal_type == "lose":
-            protein_per_kg = 2.0
-        elif goal_type == "gain":
-            protein_per_kg = 1.8
+    elif request.method == "POST" and request.form.get("action") == "adaptive":
+        # 維持熱量改用飲食 + 體重紀錄反推的 TDEE，體重用最新的趨勢值
+        goal_type = request.form.get("calc_goal") or "maintain"
+        calc_input["goal_type"] = goal_type
+        trend = get_weight_trend(current_user.id)
+        if tdee is None or trend.trend is None:
+            flash("飲食或體重紀錄還不夠，暫時無法估計。", "warning")
         else:
-            protein_per_kg = 1.6
-
-        protein_g = protein_per_kg * weight_kg
-
-        # 4. 脂肪（g/kg）
-        fat_per_kg = 0.8
-        fat_g = fat_per_kg * weight_kg
-
-        # 5. 碳水：用剩餘熱量計算
-        kcal_from_protein = protein_g * 4.0
-        kcal_from_fat = fat_g * 9.0
-        carb_kcal = max(target_kcal - (kcal_from_protein + kcal_from_fat), 0.0)
-        carb_g = carb_kcal / 4.0
-
-        suggestion = {
-            "kcal": target_kcal,
-            "maintenance_kcal": maintenance_kcal,
-            "protein_g": protein_g,
-            "fat_g": fat_g,
-            "carb_g": carb_g,
-        }
+            suggestion = macro_targets(tdee.kcal, trend.trend, goal_type)
+            suggestion["adaptive"] = True
 
     return render_template(
         "nutrition_goal.html",
         nutrition_goal=goal,
         suggestion=suggestion,
         calc_input=calc_input,
+        tdee=tdee,
+        tdee_window=TDEE_WINDOW_DAYS,
     )
 
 # ===== 週檢視 =====
@@ -736,34 +2182,35 @@ def week_view():
     else:
         monday = week_start(date.today())
 
-    days = week_range_from_start(monday)
-    start_d, end_d = days[0], days[-1]
-
-    items = (
-        CalendarItem.query
-        .filter(CalendarItem.user_id == current_user.id)
-        .filter(CalendarItem.date.between(start_d, end_d))
-        .order_by(CalendarItem.date.asc(), CalendarItem.start_time.asc())
-        .all()
-    )
-    items_by_date = {}
-    for it in items:
-        items_by_date.setdefault(it.date, []).append(it)
-
-    strength_dates = strength_dates_between(start_d, end_d)
-
     prev_week = monday - timedelta(days=7)
     next_week = monday + timedelta(days=7)
 
     return render_template(
         "week.html",
-        days=days,
-        items_by_date=items_by_date,
+        **load_week(monday, page_lookups()),
         monday=monday,
         prev_start=prev_week.strftime("%Y-%m-%d"),
         next_start=next_week.strftime("%Y-%m-%d"),
         today=date.today(),
-        strength_dates=strength_dates,
+    )
+
+def load_week(monday, shared):
+    """週檢視的資料（dict，key 就是 week.html 的變數）；/api/batch 的 week: 也用這裡"""
+    days = week_range_from_start(monday)
+    start_d, end_d = days[0], days[-1]
+
+    owners = shared.owners
+    items = calendar_rows(CalendarItemRow, CalendarItem, tuple(owners), start_d, end_d,
+                          key=lambda it: (it.date, it.start_time))
+    importants = calendar_rows(ImportantRow, ImportantItem, tuple(owners), start_d, end_d,
+                               key=lambda it: (it.date, it.id))
+
+    return dict(
+        days=days,
+        items_by_date=group_by_date(items),
+        important_by_date=group_by_date(importants),
+        owners=owners,
+        strength_dates=strength_dates_between(start_d, end_d),
     )
 
 # ===== 日檢視 =====
@@ -777,17 +2224,29 @@ def day_view(datestr):
         flash("日期格式錯誤", "warning")
         return redirect(url_for("index"))
 
+    shared = page_lookups()
+    prev_day = d - timedelta(days=1)
+    next_day = d + timedelta(days=1)
+
+    return render_template(
+        "day.html",
+        **load_day(d, shared),
+        MEAL_TYPES=lookups().meal_types.choices(),
+        STRENGTH_CATEGORIES=shared.catalog.categories,
+        prev_day=prev_day,
+        next_day=next_day,
+        diet_foods_version=diet_foods_version(),
+    )
+
+def load_day(d, shared):
+    """單日頁的資料（dict，key 就是 day.html 的變數）；/api/batch 的 day: 也用這裡"""
     # [2] 因為有 @login_required，我們不需要再判斷 if auth 了
     # 直接假定 current_user 存在，並強制過濾 user_id
 
-    # 1. 行事曆
-    items = (
-        CalendarItem.query
-        .filter(CalendarItem.date == d)
-        .filter(CalendarItem.user_id == current_user.id) # <--- 強制過濾
-        .order_by(CalendarItem.start_time.asc())
-        .all()
-    )
+    # 1. 行事曆：自己 + 分享給我的人（只有這一段看得到別人的資料，以下都是自己的）
+    # 已封存的日期：從冷資料解壓（唯讀），之後補記的還在熱資料表，兩邊合併
+    owners = shared.owners
+    items = calendar_rows(CalendarDayRow, CalendarItem, tuple(owners), d, d, key=lambda it: it.start_time)
 
     # 2. 飲食
     diets = (
@@ -797,6 +2256,7 @@ def day_view(datestr):
         .order_by(DietEntry.created_at.asc())
         .all()
     )
+    diets = with_archived(diets, current_user.id, DietEntry, d, d, key=lambda x: x.created_at or datetime.min)
     totals_diet = {
         "kcal": sum(x.kcal or 0 for x in diets),
         "protein_g": sum(x.protein_g or 0 for x in diets),
@@ -815,9 +2275,11 @@ def day_view(datestr):
         .order_by(DiaryEntry.created_at.asc())
         .all()
     )
+    diary_entries = with_archived(diary_entries, current_user.id, DiaryEntry, d, d,
+                                  key=lambda x: x.created_at or datetime.min)
 
     # 4. 全域營養目標
-    goal = get_global_nutrition_goal() # 這個函數裡面我們已經修過，會檢查 user_id
+    goal = shared.goal # 只會拿到自己的（快取，寫入後自動失效）
     nutrition_goal = goal
     nutrition_diff = None
     nutrition_percent = None
@@ -855,13 +2317,16 @@ def day_view(datestr):
         .order_by(StrengthSet.created_at.asc())
         .all()
     )
+    sets_ = with_archived(sets_, current_user.id, StrengthSet, d, d, key=lambda s: s.created_at or datetime.min)
     total_weight = sum((s.weight_kg or 0) * (s.reps or 0) for s in sets_)
 
+    catalog = shared.catalog  # 動作 id -> 部位 / 名稱（記憶體裡，不 JOIN）
     strength_by_part = {}
     by_exercise = {}
     for s in sets_:
-        strength_by_part.setdefault(s.body_part, {}).setdefault(s.exercise_name, []).append(s)
-        by_exercise.setdefault(s.exercise_name, []).append(s)
+        ex = catalog.by_id[s.exercise_id]
+        strength_by_part.setdefault(ex.body_part, {}).setdefault(ex.name, []).append(s)
+        by_exercise.setdefault(ex.name, []).append(s)
 
     exercise_best_set_id = {}
     for ex_name, lst in by_exercise.items():
@@ -885,40 +2350,67 @@ def day_view(datestr):
         .first()
     )
     
+    # 更早的日子封存了的話，改看彙總（同一天熱資料表也有補記時兩邊相加）
+    has_archived_sets = bool(archived_months(current_user.id, "strength_sets", end=d - timedelta(days=1)))
+    if has_archived_sets:
+        archived_row = (
+            db.session.query(ArchivedDay.date, ArchivedDay.strength_volume)
+            .filter(ArchivedDay.user_id == current_user.id)
+            .filter(ArchivedDay.date < d, ArchivedDay.strength_sets > 0)
+            .order_by(ArchivedDay.date.desc())
+            .first()
+        )
+        if archived_row and (prev_row is None or archived_row[0] > prev_row[0]):
+            prev_row = archived_row
+        elif archived_row and archived_row[0] == prev_row[0]:
+            prev_row = (prev_row[0], (prev_row[1] or 0.0) + archived_row[1])
+
     if prev_row:
         prev_total_date = prev_row[0]
         prev_total_weight = float(prev_row[1] or 0.0)
         total_diff_vs_prev = total_weight - prev_total_weight
 
-    # 7. 上次最大重量 (複雜查詢)
+    # 7. 上次最大重量 (複雜查詢)：依整數的動作 id 分組，最後才換成名稱（下拉選單用名稱查）
     last_max_weight = {}
     rows = (
         db.session.query(
-            StrengthSet.exercise_name,
+            StrengthSet.exercise_id,
             StrengthSet.date,
             func.max(StrengthSet.weight_kg),
         )
         .filter(StrengthSet.user_id == current_user.id) # <--- 強制過濾
         .filter(StrengthSet.date < d)
-        .group_by(StrengthSet.exercise_name, StrengthSet.date)
+        .group_by(StrengthSet.exercise_id, StrengthSet.date)
         .all()
     )
-    for ex_name, ex_date, max_w in rows:
+    if has_archived_sets:
+        # 每個動作只要最近一天：SQLite 的 MAX() 聚合會讓同一列的其他欄位（max_weight）取自 date 最大的那列
+        rows += (
+            db.session.query(
+                ArchivedExerciseDay.exercise_id,
+                func.max(ArchivedExerciseDay.date),
+                ArchivedExerciseDay.max_weight,
+            )
+            .filter(ArchivedExerciseDay.user_id == current_user.id)
+            .filter(ArchivedExerciseDay.date < d)
+            .group_by(ArchivedExerciseDay.exercise_id)
+            .all()
+        )
+    for ex_id, ex_date, max_w in rows:
+        ex_name = catalog.by_id[ex_id].name
         entry = last_max_weight.get(ex_name)
         if entry is None or ex_date > entry["date"]:
             last_max_weight[ex_name] = {"date": ex_date, "weight": float(max_w or 0.0)}
+        elif ex_date == entry["date"]:
+            entry["weight"] = max(entry["weight"], float(max_w or 0.0))
     last_max_weight_simple = {name: v["weight"] for name, v in last_max_weight.items()}
 
-    prev_day = d - timedelta(days=1)
-    next_day = d + timedelta(days=1)
-
-    return render_template(
-        "day.html",
+    return dict(
         d=d,
         items=items,
+        owners=owners,
         diets_by_meal=diets_by_meal,
         totals_diet=totals_diet,
-        MEAL_TYPES=MEAL_TYPES,
         nutrition_goal=nutrition_goal,
         nutrition_diff=nutrition_diff,
         nutrition_percent=nutrition_percent,
@@ -929,9 +2421,6 @@ def day_view(datestr):
         prev_total_weight=prev_total_weight,
         prev_total_date=prev_total_date,
         total_diff_vs_prev=total_diff_vs_prev,
-        STRENGTH_CATEGORIES=STRENGTH_CATEGORIES,
-        prev_day=prev_day,
-        next_day=next_day,
         diary_entries=diary_entries,
     )
 
@@ -939,30 +2428,65 @@ def day_view(datestr):
 @login_required
 def important():
     # 這裡只負責顯示列表，新增功能已經移到 /add 了
-    items = ImportantItem.query.filter(ImportantItem.user_id == current_user.id).order_by(ImportantItem.date.asc()).all()
+    # 分成「即將到來」（由近到遠）與「已過」（由近到遠）兩段，各自分頁
     today = date.today()
-    items_with_delta = []
-    for it in items:
-        days_left = (it.date - today).days
-        items_with_delta.append((it, days_left))
+    upcoming, upcoming_next = important_page("upcoming", request.args.get("upcoming"), IMPORTANT_PAGE_SIZE)
+    past, past_next = important_page("past", request.args.get("past"), IMPORTANT_PAGE_SIZE)
 
-    next_item, next_days = get_next_important()
+    if upcoming and not request.args.get("upcoming"):
+        next_item, next_days = upcoming[0], (upcoming[0].date - today).days
+    else:
+        next_item, next_days = get_next_important()
 
     return render_template(
         "important.html",
-        items_with_delta=items_with_delta,
+        upcoming=upcoming,
+        upcoming_next=upcoming_next,
+        past=past,
+        past_next=past_next,
         today=today,
         next_item=next_item,
         next_days=next_days,
     )
 
+IMPORTANT_PAGE_SIZE = 20
+IMPORTANT_SECTIONS = ("upcoming", "past")
+
+def important_page(section, cursor, limit):
+    query = ImportantRow.query().filter(ImportantItem.user_id == current_user.id)
+    if section == "upcoming":
+        query = query.filter(ImportantItem.date >= date.today())
+    else:
+        query = query.filter(ImportantItem.date < date.today())
+    return keyset_page(query, ImportantItem, cursor, limit, descending=(section == "past"), row_type=ImportantRow)
+
+@app.route("/api/important")
+@login_required
+def important_json():
+    """/important 的無限捲動：?section=upcoming|past&after=<cursor>&limit=20"""
+    section = request.args.get("section", "upcoming")
+    if section not in IMPORTANT_SECTIONS:
+        abort(400)
+    rows, next_cursor = important_page(section, request.args.get("after"), page_size(IMPORTANT_PAGE_SIZE))
+    today = date.today()
+    items = [
+        {"id": it.id, "date": it.date.isoformat(), "title": it.title,
+         "description": it.description, "days_left": (it.date - today).days}
+        for it in rows
+    ]
+    rows_html = get_template_attribute("_important_rows.html", "rows")(rows, today)
+    return keyset_json(rows, next_cursor, items, rows_html, "important_json", section=section)
+
 
 @app.route("/important/delete/<int:item_id>", methods=["POST"])
 @login_required
 def important_delete(item_id):
     item = ImportantItem.query.filter(ImportantItem.user_id == current_user.id, ImportantItem.id == item_id).first_or_404()
+    clear_reminders(current_user.id, "important", item.id)
     db.session.delete(item)
     db.session.commit()
+    bump_version(current_user.id, "important")
+    notify_reminder_scheduler()
     flash("已刪除重要事項", "info")
     return redirect(url_for("important"))
 
@@ -995,6 +2519,7 @@ def save_nutrition_goal():
     goal.fat_target = fat_t
 
     db.session.commit()
+    bump_version(current_user.id, "goals")
     flash("已更新全域營養目標", "success")
     return redirect(url_for("nutrition_goal_page"))
 
@@ -1011,7 +2536,8 @@ def diet_add():
         fat_g = float(request.form.get("fat_g", 0) or 0)
         carb_g = float(request.form.get("carb_g", 0) or 0)
 
-        if meal_type not in [t for t in dict(MEAL_TYPES)]:
+        meal_type_id = lookups().meal_types.id(meal_type)
+        if meal_type_id is None:
             flash("餐別不支援", "warning")
             return redirect(url_for("day_view", datestr=d.strftime("%Y-%m-%d")))
         if not food_name:
@@ -1021,7 +2547,7 @@ def diet_add():
         db.session.add(DietEntry(
             user_id=current_user.id,
             date=d,
-            meal_type=meal_type,
+            meal_type_id=meal_type_id,
             food_name=food_name,
             kcal=kcal,
             protein_g=protein_g,
@@ -1029,6 +2555,7 @@ def diet_add():
             carb_g=carb_g,
         ))
         db.session.commit()
+        bump_version(current_user.id, "diet")
         flash("已新增飲食紀錄", "success")
     except Exception as e:
         flash(f"新增失敗：{e}", "danger")
@@ -1042,6 +2569,7 @@ def diet_delete(diet_id):
     d = de.date
     db.session.delete(de)
     db.session.commit()
+    bump_version(current_user.id, "diet")
     flash("已刪除飲食紀錄", "info")
     return redirect(url_for("day_view", datestr=d.strftime("%Y-%m-%d")))
 
@@ -1056,26 +2584,52 @@ def strength_add():
         weight_kg = float(request.form.get("weight_kg", 0) or 0)
         reps = int(request.form.get("reps", 0) or 0)
 
-        all_exercises = set(sum(STRENGTH_CATEGORIES.values(), []))
-        if body_part not in STRENGTH_CATEGORIES or exercise_name not in all_exercises:
+        exercise_id = exercise_catalog(current_user.id).by_key.get((body_part, exercise_name))
+        if exercise_id is None:
             flash("重訓分類/動作不支援", "warning")
             return redirect(url_for("day_view", datestr=d.strftime("%Y-%m-%d")))
 
         db.session.add(StrengthSet(
             user_id=current_user.id,
             date=d,
-            body_part=body_part,
-            exercise_name=exercise_name,
+            exercise_id=exercise_id,
             weight_kg=weight_kg,
             reps=reps,
         ))
         db.session.commit()
+        bump_version(current_user.id, "strength")
         flash("已新增重訓一組", "success")
     except Exception as e:
         flash(f"新增失敗：{e}", "danger")
 
     return redirect(url_for("day_view", datestr=d.strftime("%Y-%m-%d")))
 
+@app.route("/strength/exercises", methods=["POST"])
+@login_required
+def exercise_add():
+    """自訂重訓動作（只有自己看得到）；新增後出現在該部位的動作選單裡"""
+    datestr = request.form.get("date") or date.today().strftime("%Y-%m-%d")
+    body_part = request.form.get("body_part", "")
+    name = request.form.get("exercise_name", "").strip()
+    back = redirect(url_for("day_view", datestr=datestr))
+
+    body_part_id = lookups().body_parts.id(body_part)
+    if body_part_id is None or not name:
+        flash("請選擇部位並輸入動作名稱", "warning")
+        return back
+    if len(name) > 50:
+        flash("動作名稱最多 50 個字", "warning")
+        return back
+    if (body_part, name) in exercise_catalog(current_user.id).by_key:
+        flash(f"{body_part}已經有「{name}」了", "info")
+        return back
+
+    db.session.add(Exercise(user_id=current_user.id, body_part_id=body_part_id, name=name))
+    db.session.commit()
+    bump_version(current_user.id, "exercises")
+    flash(f"已新增自訂動作「{name}」", "success")
+    return back
+
 @app.route("/strength/delete/<int:set_id>", methods=["POST"])
 @login_required
 def strength_delete(set_id):
@@ -1083,6 +2637,7 @@ def strength_delete(set_id):
     d = s.date
     db.session.delete(s)
     db.session.commit()
+    bump_version(current_user.id, "strength")
     flash("已刪除重訓組數", "info")
     return redirect(url_for("day_view", datestr=d.strftime("%Y-%m-%d")))
 
@@ -1091,6 +2646,8 @@ def strength_delete(set_id):
 @login_required
 def add():
     if request.method == "POST":
+        # 加到誰的行事曆：自己，或分享給我且可編輯的人
+        owner_id = writable_owner(request.form.get("owner", current_user.id, type=int)).id
         try:
             # 1. 取得共同欄位
             title = request.form["title"].strip()
@@ -1103,7 +2660,8 @@ def add():
             if not title:
                 flash("標題不可為空", "warning")
                 return redirect(request.url)
-            if item_type not in [t for t in dict(ITEM_TYPES)]:
+            item_type_id = lookups().item_types.id(item_type)
+            if item_type_id is None and item_type != IMPORTANT_CHOICE[0]:
                 flash("不支援的項目類型", "warning")
                 return redirect(request.url)
 
@@ -1112,7 +2670,10 @@ def add():
             # ===== [分支邏輯] =====
             
             # 情境 A: 如果是 "重要事項"
-            if item_type == "重要":
+            if item_type == IMPORTANT_CHOICE[0]:
+                if owner_id != current_user.id:
+                    flash("重要事項只能加在自己的行事曆", "warning")
+                    return redirect(request.url)
                 # 重要事項不需要時間，所以我們忽略 start_time/end_time
                 item = ImportantItem(
                     user_id=current_user.id,
@@ -1121,7 +2682,14 @@ def add():
                     description=content  # 把表單的 content 存入 description
                 )
                 db.session.add(item)
+                db.session.flush()  # 要先拿到 id 才能建立提醒
+                leads, channel = reminder_form("important")
+                set_reminders(current_user.id, "important", item.id, title,
+                              reminder_event_at("important", d), leads, channel)
                 db.session.commit()
+                bump_version(current_user.id, "important")
+                if leads:
+                    notify_reminder_scheduler()
                 flash("已新增重要事項", "success")
                 # 新增完後，可以導向 "重要事項列表" 或 "首頁"
                 return redirect(url_for("important"))
@@ -1144,17 +2712,28 @@ def add():
                     flash("結束時間必須晚於開始時間", "warning")
                     return redirect(request.url)
 
-                # 存入 CalendarItem
-                db.session.add(CalendarItem(
-                    user_id=current_user.id,
-                    title=title,
-                    item_type=item_type,
-                    date=d,
-                    start_time=st,
-                    end_time=et,
-                    content=content,
-                ))
-                db.session.commit()
+                # 存入 CalendarItem（分檔模式寫進 owner 的檔案）
+                with using_shard(owner_id):
+                    item = CalendarItem(
+                        user_id=owner_id,
+                        title=title,
+                        item_type_id=item_type_id,
+                        date=d,
+                        start_time=st,
+                        end_time=et,
+                        content=content,
+                    )
+                    db.session.add(item)
+                    db.session.flush()
+                    leads = set()
+                    if owner_id == current_user.id:  # 提醒是個人的，幫別人新增的項目不設
+                        leads, channel = reminder_form("calendar")
+                        set_reminders(current_user.id, "calendar", item.id, title,
+                                      reminder_event_at("calendar", d, st), leads, channel)
+                    db.session.commit()
+                bump_version(owner_id, "calendar")
+                if leads:
+                    notify_reminder_scheduler()
                 flash("已新增項目", "success")
                 return redirect(url_for("index", year=d.year, month=d.month))
 
@@ -1163,13 +2742,22 @@ def add():
             return redirect(request.url)
 
     default_date = request.args.get("date", date.today().strftime("%Y-%m-%d"))
-    return render_template("form.html", mode="add", ITEM_TYPES=ITEM_TYPES,
-                           default_date=default_date)
+    return render_template("form.html", mode="add", ITEM_TYPES=item_type_choices(),
+                           default_date=default_date, REMINDER_LEADS=REMINDER_LEADS,
+                           reminder_channels=reminder_channels(), reminders=(set(), "inbox"),
+                           owners=[o for o in visible_calendar_owners() if o.can_write])
 
+# 別人分享給我、可編輯的項目：網址帶 ?owner=<id>（分檔模式下項目 id 只在 owner 自己的檔案裡唯一）
 @app.route("/edit/<int:item_id>", methods=["GET", "POST"])
 @login_required
 def edit(item_id):
-    it = CalendarItem.query.filter(CalendarItem.user_id == current_user.id, CalendarItem.id == item_id).first_or_404()
+    owner_id = writable_owner(request.args.get("owner", current_user.id, type=int)).id
+    with using_shard(owner_id):
+        return _edit_calendar_item(owner_id, item_id)
+
+def _edit_calendar_item(owner_id, item_id):
+    it = CalendarItem.query.filter(CalendarItem.user_id == owner_id, CalendarItem.id == item_id).first_or_404()
+    own = owner_id == current_user.id
     if request.method == "POST":
         try:
             title = request.form["title"].strip()
@@ -1182,12 +2770,13 @@ def edit(item_id):
             if not title:
                 flash("標題不可為空", "warning")
                 return redirect(request.url)
-            if item_type not in [t for t in dict(ITEM_TYPES)]:
+            item_type_id = lookups().item_types.id(item_type)
+            if item_type_id is None:
                 flash("不支援的項目類型", "warning")
                 return redirect(request.url)
 
             it.title = title
-            it.item_type = item_type
+            it.item_type_id = item_type_id
             it.date = datetime.strptime(date_str, "%Y-%m-%d").date()
             it.start_time = datetime.strptime(start_str, "%H:%M").time()
             it.end_time = datetime.strptime(end_str, "%H:%M").time()
@@ -1197,22 +2786,38 @@ def edit(item_id):
                 flash("結束時間必須晚於開始時間", "warning")
                 return redirect(request.url)
 
+            if own:
+                leads, channel = reminder_form("calendar")
+            else:
+                # 提醒是 owner 自己設的：照原本的設定，只跟著新的日期 / 時間走
+                leads, channel = item_reminders(owner_id, "calendar", it.id)
+            set_reminders(owner_id, "calendar", it.id, it.title,
+                          reminder_event_at("calendar", it.date, it.start_time), leads, channel)
             db.session.commit()
+            bump_version(owner_id, "calendar")
+            notify_reminder_scheduler()
             flash("已更新項目", "success")
             return redirect(url_for("index", year=it.date.year, month=it.date.month))
         except Exception as e:
             flash(f"發生錯誤：{e}", "danger")
             return redirect(request.url)
 
-    return render_template("form.html", mode="edit", ITEM_TYPES=ITEM_TYPES, item=it)
+    return render_template("form.html", mode="edit", ITEM_TYPES=item_type_choices(), item=it,
+                           REMINDER_LEADS=REMINDER_LEADS, reminder_channels=reminder_channels(),
+                           reminders=item_reminders(owner_id, "calendar", it.id) if own else None)
 
 @app.route("/delete/<int:item_id>", methods=["POST"])
 @login_required
 def delete(item_id):
-    it = CalendarItem.query.filter(CalendarItem.user_id == current_user.id, CalendarItem.id == item_id).first_or_404()
-    y, m = it.date.year, it.date.month
-    db.session.delete(it)
-    db.session.commit()
+    owner_id = writable_owner(request.args.get("owner", current_user.id, type=int)).id
+    with using_shard(owner_id):
+        it = CalendarItem.query.filter(CalendarItem.user_id == owner_id, CalendarItem.id == item_id).first_or_404()
+        y, m = it.date.year, it.date.month
+        clear_reminders(owner_id, "calendar", it.id)
+        db.session.delete(it)
+        db.session.commit()
+    bump_version(owner_id, "calendar")
+    notify_reminder_scheduler()
     flash("已刪除項目", "info")
     return redirect(url_for("index", year=y, month=m))
 
@@ -1228,6 +2833,10 @@ def diet_suggest():
     if not q:
         return jsonify([])
 
+    # 每打一個字就查一次，同一個前綴在飲食紀錄沒變之前都用快取
+    return jsonify(DIET_SUGGEST_CACHE.get_or_load(current_user.id, q, lambda: _load_diet_suggestions(q)))
+
+def _load_diet_suggestions(q):
     # (1) 找出每個 food_name 的最大(最新) ID，限定為目前使用者
     subquery = (
         db.session.query(func.max(DietEntry.id))
@@ -1259,8 +2868,45 @@ def diet_suggest():
         for s in suggestions
     ]
     
-    return jsonify(results)
+    return tuple(results)
+
 
+# 前端（diet_suggest.js）一次下載整份食物字典存在 IndexedDB，打字時在瀏覽器裡比對前綴；
+# 網址帶著 "diet" 版本號，只有 diet_add / diet_delete（或飲食被封存）之後才需要重新下載
+DIET_FOODS_FIELDS = ("name", "kcal", "protein", "fat", "carb")
+
+def diet_foods_version():
+    # 帶上 user_id：同一台電腦換人登入時網址與版本都不同，不會拿到別人的字典
+    return f"{current_user.id}-{VERSIONS.token('diet', current_user.id)}"
+
+@app.route("/api/diet/foods")
+@login_required
+def diet_foods():
+    version = diet_foods_version()
+    foods = DIET_FOODS_CACHE.get_or_load(current_user.id, "all", _load_diet_foods)
+    response = jsonify({"version": version, "fields": DIET_FOODS_FIELDS, "foods": foods})
+    if request.args.get("v") == version:
+        # 同一個版本的內容不會再變，瀏覽器可以一直用
+        response.headers["Cache-Control"] = "private, max-age=31536000, immutable"
+    else:
+        response.headers["Cache-Control"] = "private, no-cache"
+    response.set_etag(version)
+    return response.make_conditional(request)
+
+def _load_diet_foods():
+    """每個品名最新一筆的營養值，依名稱排序：((name, kcal, protein, fat, carb), ...)"""
+    latest_ids = (
+        db.select(func.max(DietEntry.id))
+        .where(DietEntry.user_id == current_user.id)
+        .group_by(DietEntry.food_name)
+    )
+    rows = (
+        db.session.query(DietEntry.food_name, DietEntry.kcal, DietEntry.protein_g, DietEntry.fat_g, DietEntry.carb_g)
+        .filter(DietEntry.id.in_(latest_ids), DietEntry.user_id == current_user.id)
+        .order_by(DietEntry.food_name)
+        .all()
+    )
+    return tuple(tuple(row) for row in rows)
 
 
 #=====日記功能======
@@ -1332,32 +2978,218 @@ def rest_timer():
 @app.route("/progress/<exercise_name>")
 @login_required
 def progress(exercise_name):
+    dates, weights = PROGRESS_CACHE.get_or_load(
+        current_user.id, exercise_name, lambda: _load_progress(exercise_name))
+
+    return render_template(
+        "progress.html",
+        exercise_name=exercise_name,
+        dates=dates,
+        weights=weights
+    )
+
+def _load_progress(exercise_name):
     # 這裡對應夥伴原本的 SQL：
     # SELECT date, MAX(weight_kg) FROM strength_sets ... GROUP BY date
-    
+    # 名稱先在記憶體換成動作 id（同名動作可能掛在不同部位，一起算），再走 (user_id, exercise_id, date) 索引
+    exercise_ids = exercise_catalog(current_user.id).ids_by_name.get(exercise_name)
+    if not exercise_ids:
+        return (), ()
+
     results = (
         db.session.query(
             StrengthSet.date,
             func.max(StrengthSet.weight_kg) # 找出當天最大重量
         )
         .filter(StrengthSet.user_id == current_user.id) # [關鍵] 只抓自己的
-        .filter(StrengthSet.exercise_name == exercise_name) # 只抓特定動作
+        .filter(StrengthSet.exercise_id.in_(exercise_ids)) # 只抓特定動作
         .group_by(StrengthSet.date) # 每天只留一筆最強的
         .order_by(StrengthSet.date.asc()) # 依照日期排序
         .all()
     )
+    if archived_months(current_user.id, "strength_sets"):
+        # 已封存的日子改讀 archived_exercise_days（每個動作每天一列，已經是當天最大重量）
+        best = {day: w for day, w in results}
+        archived = (
+            db.session.query(ArchivedExerciseDay.date, func.max(ArchivedExerciseDay.max_weight))
+            .filter(ArchivedExerciseDay.user_id == current_user.id)
+            .filter(ArchivedExerciseDay.exercise_id.in_(exercise_ids))
+            .group_by(ArchivedExerciseDay.date)
+        )
+        for day, w in archived:
+            best[day] = max(best.get(day) or 0.0, w)
+        results = sorted(best.items())
 
     # 把資料轉成 Python 列表，傳給網頁畫圖用
     # r[0] 是 date, r[1] 是 max_weight
-    dates = [r[0].strftime('%Y-%m-%d') for r in results]
-    weights = [r[1] for r in results]
+    dates = tuple(r[0].strftime('%Y-%m-%d') for r in results)
+    weights = tuple(r[1] for r in results)
+    return dates, weights
+
+# ===== 體重趨勢 (EWMA) =====
+# 每天的平均體重用指數加權移動平均平滑：trend = 前一天的 trend + α × (今天體重 − 前一天的 trend)，
+# 中間隔了 n 天沒量時，前一個趨勢值的權重是 (1 − α)^n。結果存在 weight_trend_days / weight_trends：
+# - 新增最新一天（或同一天再量一次）只需要前一天的趨勢值，O(1)
+# - 新增 / 刪除過去的紀錄時從那天往後重算；舊值的影響每天衰減成 (1 − α) 倍，
+#   重算出的趨勢跟原本存的差距小於 WEIGHT_TREND_EPSILON 就停，不用一路算到最新一天
+WEIGHT_TREND_ALPHA = 0.1
+WEIGHT_TREND_EPSILON = 0.001      # kg，遠小於畫面顯示的精度
+WEIGHT_TREND_BATCH = 100          # 往後重算時每次讀幾天
+WEIGHT_TARGET_TOLERANCE = 0.1     # 趨勢離目標這麼近就算達成（kg）
+WEIGHT_PROJECTION_MAX_DAYS = 730  # 照目前的速度兩年內到不了就不預估
+
+def ewma_step(prev_trend, gap_days, weight):
+    """前一個趨勢值隔了 gap_days 天之後，加入當天的平均體重"""
+    if prev_trend is None:
+        return weight
+    keep = (1 - WEIGHT_TREND_ALPHA) ** gap_days
+    return weight + keep * (prev_trend - weight)
+
+def _trend_day_before(user_id, day, inclusive=False):
+    """day 之前（inclusive 時含 day）最近的一天"""
+    cond = WeightTrendDay.date <= day if inclusive else WeightTrendDay.date < day
+    return (
+        WeightTrendDay.query
+        .filter(WeightTrendDay.user_id == user_id, cond)
+        .order_by(WeightTrendDay.date.desc())
+        .first()
+    )
 
-    return render_template(
-        "progress.html",
-        exercise_name=exercise_name,
-        dates=dates,
-        weights=weights
+def _weekly_rate(last, days):
+    """最近 days 天趨勢值的變化，換算成 kg/週；資料不夠久時回傳 None"""
+    base = _trend_day_before(last.user_id, last.date - timedelta(days=days), inclusive=True)
+    if base is None:
+        return None
+    return (last.trend - base.trend) / (last.date - base.date).days * 7
+
+def project_target_date(summary):
+    """照 30 天（不足時用 7 天）的速度推算哪天達到目標；方向相反、太久或已達成時回傳 None"""
+    if summary.target_kg is None or summary.trend is None or summary.reached:
+        return None
+    rate = summary.rate_30 if summary.rate_30 is not None else summary.rate_7
+    if not rate:
+        return None
+    days = (summary.target_kg - summary.trend) / (rate / 7)
+    if days <= 0 or days > WEIGHT_PROJECTION_MAX_DAYS:
+        return None
+    return summary.last_date + timedelta(days=math.ceil(days))
+
+def refresh_weight_summary(summary):
+    """依 weight_trend_days 最新一天更新摘要（趨勢、變化率、預估日）"""
+    last = (
+        WeightTrendDay.query
+        .filter(WeightTrendDay.user_id == summary.user_id)
+        .order_by(WeightTrendDay.date.desc())
+        .first()
+    )
+    if last is None:
+        summary.last_date = summary.trend = summary.rate_7 = summary.rate_30 = None
+    else:
+        summary.last_date, summary.trend = last.date, last.trend
+        summary.rate_7 = _weekly_rate(last, 7)
+        summary.rate_30 = _weekly_rate(last, 30)
+    summary.projected_date = project_target_date(summary)
+
+def rebuild_weight_trend(user_id):
+    """從頭重算某人的趨勢（第一次用到或資料修復時），不 commit，回傳 WeightTrend"""
+    WeightTrendDay.query.filter(WeightTrendDay.user_id == user_id).delete(synchronize_session=False)
+    days = (
+        db.session.query(WeightEntry.date, func.sum(WeightEntry.weight_kg), func.count(WeightEntry.id))
+        .filter(WeightEntry.user_id == user_id)
+        .group_by(WeightEntry.date)
+        .order_by(WeightEntry.date.asc())
+        .all()
+    )
+    rows, trend, prev_date = [], None, None
+    for d, total, n in days:
+        trend = ewma_step(trend, (d - prev_date).days if prev_date else 0, total / n)
+        rows.append(dict(user_id=user_id, date=d, weight_sum=total, count=n, trend=trend))
+        prev_date = d
+    if rows:
+        db.session.execute(WeightTrendDay.__table__.insert(), rows)
+
+    summary = db.session.get(WeightTrend, user_id)
+    if summary is None:
+        summary = WeightTrend(user_id=user_id)
+        db.session.add(summary)
+    refresh_weight_summary(summary)
+    return summary
+
+def update_weight_trend(user_id, day):
+    """新增 / 刪除 day 的體重紀錄之後、commit 之前呼叫，增量更新趨勢與摘要"""
+    summary = db.session.get(WeightTrend, user_id)
+    if summary is None:
+        return rebuild_weight_trend(user_id)
+
+    total, n = (
+        db.session.query(func.sum(WeightEntry.weight_kg), func.count(WeightEntry.id))
+        .filter(WeightEntry.user_id == user_id, WeightEntry.date == day)
+        .one()
+    )
+    row = WeightTrendDay.query.filter_by(user_id=user_id, date=day).first()
+    if n == 0:
+        if row is not None:
+            db.session.delete(row)
+        row = None
+    elif row is None:
+        row = WeightTrendDay(user_id=user_id, date=day, weight_sum=total, count=n, trend=0.0)
+        db.session.add(row)
+    else:
+        row.weight_sum, row.count = total, n
+
+    prev = _trend_day_before(user_id, day)
+    trend, prev_date = (prev.trend, prev.date) if prev else (None, None)
+    if row is not None:
+        trend = row.trend = ewma_step(trend, (day - prev_date).days if prev_date else 0, row.weight)
+        prev_date = day
+
+    if summary.last_date is not None and day < summary.last_date:
+        # 改到過去的資料：往後重算，直到跟原本存的趨勢值收斂
+        after, converged = day, False
+        while not converged:
+            batch = (
+                WeightTrendDay.query
+                .filter(WeightTrendDay.user_id == user_id, WeightTrendDay.date > after)
+                .order_by(WeightTrendDay.date.asc())
+                .limit(WEIGHT_TREND_BATCH)
+                .all()
+            )
+            for later in batch:
+                trend = ewma_step(trend, (later.date - prev_date).days if prev_date else 0, later.weight)
+                prev_date = later.date
+                if abs(trend - later.trend) < WEIGHT_TREND_EPSILON:
+                    converged = True
+                    break
+                later.trend = trend
+            if len(batch) < WEIGHT_TREND_BATCH:
+                break
+            after = batch[-1].date
+
+    refresh_weight_summary(summary)
+    return summary
+
+def get_weight_trend(user_id):
+    """讀取趨勢摘要；還沒算過（功能上線前就有的紀錄）時先整個算一次"""
+    summary = db.session.get(WeightTrend, user_id)
+    if summary is None:
+        summary = rebuild_weight_trend(user_id)
+        try:
+            db.session.commit()
+        except IntegrityError:
+            # 同一個人的另一個請求剛好也在算，用它算好的
+            db.session.rollback()
+            summary = db.session.get(WeightTrend, user_id)
+    return summary
+
+def weight_trend_series(user_id, chart_all=False):
+    """曲線用的每日平均體重與趨勢值；預設只取最近 WEIGHT_CHART_DAYS 天"""
+    query = (
+        db.session.query(WeightTrendDay.date, WeightTrendDay.weight_sum, WeightTrendDay.count, WeightTrendDay.trend)
+        .filter(WeightTrendDay.user_id == user_id)
     )
+    if not chart_all:
+        query = query.filter(WeightTrendDay.date >= date.today() - timedelta(days=WEIGHT_CHART_DAYS))
+    return [(d, round(total / n, 2), round(trend, 2)) for d, total, n, trend in query.order_by(WeightTrendDay.date.asc())]
 
 @app.route("/weight", methods=["GET", "POST"])
 @login_required
@@ -1383,30 +3215,55 @@ def weight_page():
             )
             
             db.session.add(entry)
+            update_weight_trend(current_user.id, d)
             db.session.commit()
+            bump_version(current_user.id, "weight")
             flash("已新增體重紀錄", "success")
         except Exception as e:
             flash(f"新增失敗：{e}", "danger")
         return redirect(url_for("weight_page"))
 
-    # GET: 讀出所有體重紀錄（按日期排序）並傳給 template
-    rows = (
-        WeightEntry.query
-        .filter_by(user_id=current_user.id) # [修正 2] 查詢時只抓自己的資料
-        .order_by(WeightEntry.date.asc())
-        .all()
-    )
-    
+    # GET: 歷史紀錄由新到舊分頁；曲線預設只畫最近 WEIGHT_CHART_DAYS 天（?chart=all 畫全部）
+    rows, next_cursor = weight_history_page(request.args.get("after"), WEIGHT_PAGE_SIZE)
+    trend = get_weight_trend(current_user.id)
+
+    chart_all = request.args.get("chart") == "all"
+    series = weight_trend_series(current_user.id, chart_all)
+
     # template 偏好 arrays of strings/floats
-    dates = [r.date.strftime("%Y-%m-%d") for r in rows]
-    weights = [r.weight_kg for r in rows]
+    dates = [d.strftime("%Y-%m-%d") for d, _, _ in series]
+    weights = [w for _, w, _ in series]
+    trends = [t for _, _, t in series]
 
+    latest = rows[0] if rows and not request.args.get("after") else None
     return render_template(
         "weight.html",
         rows=rows,
+        next_cursor=next_cursor,
+        latest=latest,
         dates=dates,
         weights=weights,
+        trends=trends,
+        trend=trend,
+        chart_all=chart_all,
+        chart_days=WEIGHT_CHART_DAYS,
     )
+
+WEIGHT_PAGE_SIZE = 30
+WEIGHT_CHART_DAYS = 365
+
+def weight_history_page(cursor, limit):
+    query = WeightRow.query().filter(WeightEntry.user_id == current_user.id)
+    return keyset_page(query, WeightEntry, cursor, limit, descending=True, row_type=WeightRow)
+
+@app.route("/api/weight")
+@login_required
+def weight_json():
+    """/weight 歷史紀錄的無限捲動：?after=<cursor>&limit=30"""
+    rows, next_cursor = weight_history_page(request.args.get("after"), page_size(WEIGHT_PAGE_SIZE))
+    items = [{"id": r.id, "date": r.date.isoformat(), "weight_kg": r.weight_kg} for r in rows]
+    rows_html = get_template_attribute("_weight_rows.html", "rows")(rows)
+    return keyset_json(rows, next_cursor, items, rows_html, "weight_json")
 @app.route("/weight/delete/<int:entry_id>", methods=["POST"])
 @login_required
 def weight_delete(entry_id):
@@ -1414,10 +3271,761 @@ def weight_delete(entry_id):
     entry = WeightEntry.query.filter_by(id=entry_id, user_id=current_user.id).first_or_404()
     
     db.session.delete(entry)
+    update_weight_trend(current_user.id, entry.date)
     db.session.commit()
+    bump_version(current_user.id, "weight")
     flash("已刪除體重紀錄", "info")
     return redirect(url_for("weight_page"))
 
+@app.route("/weight/target", methods=["POST"])
+@login_required
+def weight_target():
+    """設定 / 清除目標體重（空白 = 清除）"""
+    value = (request.form.get("target_kg") or "").strip()
+    try:
+        target = float(value) if value else None
+        if target is not None and target <= 0:
+            raise ValueError("目標體重必須大於 0")
+    except ValueError as e:
+        flash(f"設定失敗：{e}", "danger")
+        return redirect(url_for("weight_page"))
+
+    summary = get_weight_trend(current_user.id)
+    summary.target_kg = target
+    summary.projected_date = project_target_date(summary)
+    db.session.commit()
+    flash("已更新目標體重" if target is not None else "已清除目標體重", "success")
+    return redirect(url_for("weight_page"))
+
+@app.route("/api/weight/trend")
+@login_required
+def weight_trend_json():
+    """趨勢摘要與每日的平均體重 / 趨勢值：?chart=all 取全部，預設最近 WEIGHT_CHART_DAYS 天"""
+    summary = get_weight_trend(current_user.id)
+    series = weight_trend_series(current_user.id, request.args.get("chart") == "all")
+    return jsonify({
+        "summary": summary.to_dict(),
+        "series": [{"date": d.isoformat(), "weight": w, "trend": t} for d, w, t in series],
+    })
+
+
+# ===== 批次 API (/api/batch) =====
+# 前端（或手機 App）一次要好幾個畫面的資料時，不用一頁一頁打：
+#     GET  /api/batch?r=day:2026-10-17&r=week:2026-10-12&r=progress:深蹲
+#     POST /api/batch  {"requests": ["day:2026-10-17", "week:2026-10-12", "progress:深蹲"]}
+# 登入檢查、營養目標、動作代碼表、「我看得到誰的行事曆」整個批次只拿一次（page_lookups），
+# 每個子請求照順序執行，結果依原本的順序放在 results（list；jsonify 會排序 key，所以不用 dict），
+# 各自帶 status 與執行時間 ms，一個子請求出錯（格式錯、找不到）不影響其他的。
+BATCH_MAX_REQUESTS = 20
+BATCH_RESOURCES = {}
+
+class BatchError(Exception):
+    """子請求的錯誤：只影響這一筆 results 的 status / error"""
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+def batch_resource(kind):
+    """註冊批次資源：handler(arg, shared) 回傳可 JSON 化的資料；shared 是整個批次共用的 PageLookups"""
+    def decorator(fn):
+        BATCH_RESOURCES[kind] = fn
+        return fn
+    return decorator
+
+# 週 / 單日的前後幾天要做日期加減，太靠近 date.min / date.max 會 OverflowError
+BATCH_DATE_RANGE = (date(1900, 1, 1), date(9999, 12, 1))
+
+def _batch_date(arg):
+    try:
+        d = datetime.strptime(arg, "%Y-%m-%d").date()
+    except ValueError:
+        raise BatchError(400, f"日期格式錯誤：{arg!r}（要 YYYY-MM-DD）")
+    lo, hi = BATCH_DATE_RANGE
+    if not lo <= d <= hi:
+        raise BatchError(400, f"日期超出範圍：{arg}（{lo} ~ {hi}）")
+    return d
+
+def _hhmm(t):
+    return t.strftime("%H:%M") if t else None
+
+def _calendar_item_dict(it, owners):
+    owner = owners[it.user_id]
+    return {
+        "id": it.id, "owner_id": it.user_id, "owner": owner.name, "color": owner.color,
+        "type": it.item_type, "title": it.title, "date": it.date.isoformat(),
+        "start_time": _hhmm(it.start_time), "end_time": _hhmm(it.end_time), "content": it.content,
+        "archived": it.archived, "editable": owner.can_write and not it.archived,
+    }
+
+def _important_dict(it, owners):
+    return {"id": it.id, "owner_id": it.user_id, "owner": owners[it.user_id].name,
+            "date": it.date.isoformat(), "title": it.title, "description": it.description}
+
+@batch_resource("day")
+def batch_day(arg, shared):
+    """day:YYYY-MM-DD：單日頁的全部內容（行事曆、飲食與營養目標、重訓與 PR、日記）"""
+    data = load_day(_batch_date(arg), shared)
+    last_max = data["last_max_weight"]
+    exercises = []
+    for body_part, by_name in data["strength_by_part"].items():
+        for name, sets_ in by_name.items():
+            max_weight = max((s.weight_kg or 0) for s in sets_)
+            exercises.append({
+                "body_part": body_part, "exercise": name,
+                "sets": [{"id": s.id, "weight_kg": s.weight_kg, "reps": s.reps, "archived": s.archived} for s in sets_],
+                "best_set_id": data["exercise_best_set_id"][name],
+                "max_weight": max_weight,
+                "previous_max_weight": last_max.get(name),
+                "new_max": max_weight > (last_max.get(name) or 0),
+            })
+    prev_date = data["prev_total_date"]
+    goal = data["nutrition_goal"]
+    return {
+        "date": data["d"].isoformat(),
+        "calendar": [_calendar_item_dict(it, shared.owners) for it in data["items"]],
+        "meals": [
+            {"meal_type": meal, "entries": [
+                {"id": x.id, "food_name": x.food_name, "kcal": x.kcal, "protein_g": x.protein_g,
+                 "fat_g": x.fat_g, "carb_g": x.carb_g, "archived": x.archived} for x in entries]}
+            for meal, entries in data["diets_by_meal"].items()
+        ],
+        "totals": data["totals_diet"],
+        "nutrition": {"diff": data["nutrition_diff"], "percent": data["nutrition_percent"]} if goal else None,
+        "strength": {
+            "exercises": exercises,
+            "total_volume": data["total_weight"],
+            "previous": {"date": prev_date.isoformat(), "volume": data["prev_total_weight"],
+                         "diff": data["total_diff_vs_prev"]} if prev_date else None,
+        },
+        "diary": [{"id": e.id, "title": e.title, "content": e.content, "archived": e.archived}
+                  for e in data["diary_entries"]],
+    }
+
+@batch_resource("week")
+def batch_week(arg, shared):
+    """week:YYYY-MM-DD：從這天開始的 7 天（跟 /week?start= 一樣，不會自動對齊到星期一）"""
+    data = load_week(_batch_date(arg), shared)
+    items_by_date, important_by_date = data["items_by_date"], data["important_by_date"]
+    return {"days": [
+        {"date": d.isoformat(),
+         "calendar": [_calendar_item_dict(it, shared.owners) for it in items_by_date.get(d, ())],
+         "important": [_important_dict(it, shared.owners) for it in important_by_date.get(d, ())],
+         "strength": d in data["strength_dates"]}
+        for d in data["days"]
+    ]}
+
+@batch_resource("progress")
+def batch_progress(name, shared):
+    """progress:<動作名稱>：每天的最大重量（跟 /progress/<動作名稱> 共用快取）"""
+    if name not in shared.catalog.ids_by_name:
+        raise BatchError(404, f"沒有這個動作：{name}")
+    dates, weights = PROGRESS_CACHE.get_or_load(current_user.id, name, lambda: _load_progress(name))
+    return {"exercise": name, "points": [{"date": d, "max_weight": w} for d, w in zip(dates, weights)]}
+
+def run_batch_resource(spec, shared):
+    kind, _, arg = spec.partition(":")
+    t0 = time.perf_counter()
+    try:
+        handler = BATCH_RESOURCES.get(kind)
+        if handler is None:
+            raise BatchError(400, f"不支援的資源：{kind!r}（可用：{', '.join(BATCH_RESOURCES)}）")
+        result = {"status": 200, "data": handler(arg, shared)}
+    except BatchError as e:
+        result = {"status": e.status, "error": str(e)}
+    except Exception:
+        # 非預期的錯誤也只算這一筆失敗；交易可能已經壞了，先 rollback 再跑下一個子請求
+        db.session.rollback()
+        app.logger.exception("/api/batch 子請求失敗：%s", spec)
+        result = {"status": 500, "error": "伺服器錯誤"}
+    elapsed = time.perf_counter() - t0
+    metrics.BATCH_RESOURCE_SECONDS.observe(elapsed, kind if kind in BATCH_RESOURCES else "unknown")
+    return {"resource": spec, "ms": round(elapsed * 1000, 2), **result}
+
+@app.route("/api/batch", methods=["GET", "POST"])
+@login_required
+def batch_api():
+    """多個資源一次回傳：?r=day:YYYY-MM-DD&r=week:YYYY-MM-DD&r=progress:動作，或 POST {"requests": [...]}"""
+    if request.method == "POST":
+        body = request.get_json(silent=True)
+        specs = body.get("requests") if isinstance(body, dict) else None
+    else:
+        specs = request.args.getlist("r")
+    if (not isinstance(specs, list) or not specs or len(specs) > BATCH_MAX_REQUESTS
+            or not all(isinstance(s, str) for s in specs)):
+        abort(400)
+
+    t0 = time.perf_counter()
+    shared = page_lookups()
+    results = [run_batch_resource(spec, shared) for spec in specs]
+    return jsonify({
+        "user": {"id": current_user.id, "name": current_user.name, "email": current_user.email},
+        "nutrition_goal": shared.goal._asdict() if shared.goal else None,
+        "calendars": [
+            {"owner_id": o.id, "name": o.name, "color": o.color, "can_write": o.can_write}
+            for o in shared.owners.values()
+        ],
+        "results": results,
+        "ms": round((time.perf_counter() - t0) * 1000, 2),
+    })
+
+
+# ===== 監控指標 (/metrics) =====
+@app.before_request
+def _metrics_start():
+    request._metrics_t0 = time.perf_counter()
+
+@app.after_request
+def _metrics_record(response):
+    t0 = getattr(request, "_metrics_t0", None)
+    if t0 is not None:
+        request._metrics_t0 = None
+        metrics.observe_request(request.endpoint or "unmatched", request.method,
+                                response.status_code, time.perf_counter() - t0)
+    return response
+
+@app.teardown_request
+def _metrics_record_error(exc):
+    # 未處理的例外不會經過 after_request，這裡補記一筆 500
+    t0 = getattr(request, "_metrics_t0", None)
+    if t0 is not None:
+        metrics.observe_request(request.endpoint or "unmatched", request.method,
+                                500, time.perf_counter() - t0)
+
+@app.route("/metrics")
+def metrics_endpoint():
+    # 路由、SQL 耗時、使用者數量級都看得到，沒設定 token 就不公開（跟 /login/test 一樣回 404）
+    token = app.config.get('METRICS_TOKEN')
+    if not token:
+        abort(404)
+    if not hmac.compare_digest(request.headers.get("Authorization", "").encode(), f"Bearer {token}".encode()):
+        return "unauthorized\n", 401
+    return metrics.REGISTRY.exposition(), 200, {"Content-Type": "text/plain; version=0.0.4; charset=utf-8"}
+
+
+# ===== 效能剖析 (profiling) =====
+# 管理員在 /admin/profiles 產生一組有時效的 token，請回報很慢的使用者打開
+# 「原網址?_profile=<token>」（或帶 X-Profile-Token header），那次請求就會被剖析，
+# 結果存在 instance/profiles/，可下載 .folded 丟到 speedscope / flamegraph.pl 看火焰圖。
+PROFILE_TOKEN_MAX_AGE = 24 * 3600
+
+def is_admin():
+    return current_user.is_authenticated and (current_user.email or "").lower() in app.config['ADMIN_EMAILS']
+
+def _profile_serializer():
+    from itsdangerous import URLSafeTimedSerializer
+    return URLSafeTimedSerializer(app.config["SECRET_KEY"], salt="request-profile")
+
+def _should_profile():
+    if request.endpoint in ("static", "asset", "metrics_endpoint"):
+        return False
+    token = request.headers.get("X-Profile-Token") or request.args.get("_profile")
+    if token:
+        from itsdangerous import BadSignature
+        try:
+            _profile_serializer().loads(token, max_age=PROFILE_TOKEN_MAX_AGE)
+            return True
+        except BadSignature:
+            return False
+    percent = app.config['PROFILE_SAMPLE_PERCENT']
+    return percent > 0 and random.random() * 100 < percent
+
+@app.before_request
+def _profile_start():
+    if _should_profile():
+        request._profiler = profiler.RequestProfiler().start()
+
+@app.after_request
+def _profile_finish(response):
+    p = getattr(request, "_profiler", None)
+    if p is not None:
+        request._profiler = None
+        p.stop()
+        p.save(app.config['PROFILE_DIR'], {
+            "endpoint": request.endpoint,
+            "method": request.method,
+            "path": _profile_path(),
+            "status": response.status_code,
+            "user_id": current_user.get_id(),
+        })
+    return response
+
+def _profile_path():
+    """存檔用的路徑：拿掉 ?_profile=<token>（24 小時內有效，不能出現在 /admin/profiles 與檔案裡）"""
+    args = [(k, v) for k, v in request.args.items(multi=True) if k != "_profile"]
+    return request.path + ("?" + urlencode(args) if args else "")
+
+@app.route("/admin/profiles")
+@login_required
+def admin_profiles():
+    if not is_admin():
+        abort(403)
+    return render_template(
+        "profiles.html",
+        profiles=profiler.list_profiles(app.config['PROFILE_DIR']),
+        token=_profile_serializer().dumps({"by": current_user.id}),
+        token_hours=PROFILE_TOKEN_MAX_AGE // 3600,
+        sample_percent=app.config['PROFILE_SAMPLE_PERCENT'],
+    )
+
+@app.route("/admin/profiles/<name>.folded")
+@login_required
+def admin_profile_download(name):
+    if not is_admin():
+        abort(403)
+    return send_from_directory(app.config['PROFILE_DIR'], f"{name}.folded", as_attachment=True)
+
+
+# ===== 提醒（站內通知；排程與 email / webhook 送出在 reminders.py）=====
+# 每種項目可選的提前時間（分鐘）
+REMINDER_LEADS = {
+    "calendar": [(10, "10 分鐘前"), (60, "1 小時前"), (24 * 60, "1 天前")],
+    "important": [(24 * 60, "1 天前"), (3 * 24 * 60, "3 天前"), (7 * 24 * 60, "1 週前")],
+}
+REMINDER_CHANNELS = [("inbox", "站內通知"), ("email", "Email"), ("webhook", "Webhook")]
+INBOX_PAGE_SIZE = 50
+# 排程器把提醒寫進 inbox 後會 bump 這位使用者的 "inbox"，導覽列的未讀數才會更新
+INBOX_UNREAD_CACHE = VersionedCache("inbox_unread", "inbox", maxsize=4096)
+
+def reminder_channels():
+    """目前能用的 channel：email / webhook 要有設定對應的環境變數"""
+    enabled = {
+        "inbox": True,
+        "email": bool(app.config['REMINDER_SMTP_HOST']),
+        "webhook": bool(app.config['REMINDER_WEBHOOK_URL']),
+    }
+    return [(key, label) for key, label in REMINDER_CHANNELS if enabled[key]]
+
+def reminder_event_at(source, d, start_time=None):
+    """提醒以這個時間點往前推；重要事項整天都算，用 REMINDER_ALL_DAY_AT"""
+    if source == "important":
+        start_time = app.config['REMINDER_ALL_DAY_AT']
+    return datetime.combine(d, start_time)
+
+def reminder_fire_at(event_at, lead_minutes, now):
+    """提前量已經過了但事情還沒發生就馬上送；事情已經過了就不送（None）"""
+    if event_at <= now:
+        return None
+    return max(event_at - timedelta(minutes=lead_minutes), now)
+
+def reminder_form(source):
+    """表單勾選的提前時間（只收這種項目允許的值）與 channel"""
+    allowed = {lead for lead, _ in REMINDER_LEADS[source]}
+    leads = {int(v) for v in request.form.getlist("remind") if v.isdigit() and int(v) in allowed}
+    channel = request.form.get("remind_channel", "inbox")
+    if channel not in dict(reminder_channels()):
+        channel = "inbox"
+    return leads, channel
+
+def set_reminders(user_id, source, item_id, title, event_at, leads, channel):
+    """
+    把這個項目的提醒換成 leads（分鐘）。時間沒變的提醒保留原狀（已經送過的不會再送一次）。
+    只加進 session，呼叫端 commit 之後要 notify_reminder_scheduler()。
+    """
+    existing = {
+        r.lead_minutes: r
+        for r in Reminder.query.filter_by(user_id=user_id, source=source, item_id=item_id)
+    }
+    now = datetime.now()
+    for lead, r in existing.items():
+        if lead not in leads:
+            db.session.delete(r)
+    for lead in leads:
+        r = existing.get(lead)
+        if r is None:
+            db.session.add(Reminder(
+                user_id=user_id, source=source, item_id=item_id, title=title, event_at=event_at,
+                lead_minutes=lead, channel=channel, next_fire_at=reminder_fire_at(event_at, lead, now),
+            ))
+            continue
+        r.title = title
+        r.channel = channel
+        if r.event_at != event_at:
+            r.event_at = event_at
+            r.next_fire_at = reminder_fire_at(event_at, lead, now)
+            r.attempts, r.fired_at, r.error = 0, None, None
+
+def clear_reminders(user_id, source, item_id):
+    Reminder.query.filter_by(user_id=user_id, source=source, item_id=item_id).delete(synchronize_session=False)
+
+def item_reminders(user_id, source, item_id):
+    """編輯表單用：(已勾選的提前時間, channel)"""
+    rows = Reminder.query.filter_by(user_id=user_id, source=source, item_id=item_id).all()
+    return {r.lead_minutes for r in rows}, (rows[0].channel if rows else "inbox")
+
+def notify_reminder_scheduler():
+    """
+    reminders 有變動（commit 之後呼叫）：把共用的 "reminders" 版本號 +1。
+    排程器只讀這 8 bytes 的 mmap 判斷要不要重新載入，不用一直查資料表。
+    """
+    VERSIONS.bump("reminders", 0)
+
+def inbox_unread_count():
+    if not current_user.is_authenticated:
+        return 0
+
+    def load():
+        return (db.session.query(func.count(InboxMessage.id))
+                .filter(InboxMessage.user_id == current_user.id, InboxMessage.read_at.is_(None))
+                .scalar())
+
+    return INBOX_UNREAD_CACHE.get_or_load(current_user.id, "unread", load)
+
+@app.context_processor
+def inject_inbox():
+    # 傳函式而不是數字：只有真的畫到導覽列的頁面才會去讀（大多數時候是快取）
+    return {"inbox_unread_count": inbox_unread_count}
+
+@app.route("/inbox")
+@login_required
+def inbox():
+    """最近的站內通知；打開就算已讀"""
+    messages = (
+        InboxMessage.query
+        .filter(InboxMessage.user_id == current_user.id)
+        .order_by(InboxMessage.id.desc())
+        .limit(INBOX_PAGE_SIZE)
+        .all()
+    )
+    unread = {m.id for m in messages if m.read_at is None}
+    if unread:
+        (InboxMessage.query
+         .filter(InboxMessage.user_id == current_user.id, InboxMessage.read_at.is_(None))
+         .update({"read_at": datetime.now()}, synchronize_session=False))
+        db.session.commit()
+        bump_version(current_user.id, "inbox")
+    return render_template("inbox.html", messages=messages, unread=unread)
+
+
+# ===== 行事曆訂閱 (ICS) 與匯入 =====
+# 手機的行事曆 app 訂閱 /feeds/<token>/<feed>.ics，每隔幾分鐘到幾小時就會來問一次。
+# ETag 直接用資料的版本號（calendar / important / timetable，寫入後 bump），
+# 沒有變動時只要查一次 token、讀 mmap 裡的版本號就能回 304，不用重新產生；
+# 有變動時邊查邊輸出，不會把整份行事曆先組在記憶體裡：依 (date, id) keyset 每次讀 ICS_QUERY_BATCH 筆成 list，
+# 讀完就結束交易再送出。不能用 yield_per 開著 cursor 慢慢送——SQLite（rollback journal）的讀鎖
+# 會一直握到 cursor 關掉，訂閱端收得慢時全站的寫入都會 "database is locked"。
+ICS_FEEDS = {
+    # feed: (行事曆名稱, 版本號領域)
+    "calendar": ("行事曆", "calendar"),
+    "important": ("重要事項", "important"),
+    "timetable": ("課表", "timetable"),
+}
+ICS_STREAM_BATCH = 200   # 每幾個 VEVENT 送出一次
+ICS_QUERY_BATCH = 500    # 每次查幾筆（查完就放掉讀鎖）
+ICS_IMPORT_BATCH = 500   # 匯入時每幾筆 insert 一次
+ICS_IMPORT_DIR = os.path.join(app.instance_path, "imports")
+ICS_UID_DOMAIN = "super-calendar"
+ICS_EPOCH = datetime(2000, 1, 1)  # 沒有建立時間的資料用固定的 DTSTAMP，輸出才不會每次都不一樣
+# Last-Modified：這個 worker 第一次看到某個版本的時間（版本號本身不帶時間）
+ICS_LAST_MODIFIED = LRUCache("ics_last_modified", maxsize=4096)
+
+# 台科大節次時間（課表訂閱用）
+SECTION_TIMES = {
+    "0": ("07:10", "08:00"), "1": ("08:10", "09:00"), "2": ("09:10", "10:00"),
+    "3": ("10:20", "11:10"), "4": ("11:20", "12:10"), "5": ("12:20", "13:10"),
+    "6": ("13:20", "14:10"), "7": ("14:20", "15:10"), "8": ("15:30", "16:20"),
+    "9": ("16:30", "17:20"), "10": ("17:30", "18:20"), "A": ("18:25", "19:15"),
+    "B": ("19:20", "20:10"), "C": ("20:15", "21:05"), "D": ("21:10", "22:00"),
+}
+WEEKDAY_INDEX = {code: i for i, (code, _) in enumerate(WEEKDAY_CHOICES)}  # M -> 0 ... U -> 6
+
+def timetable_term(today=None):
+    """課表訂閱的重複區間：有設定 TIMETABLE_TERM_START / END 就用，不然依今天推算上 / 下學期"""
+    start, end = app.config['TIMETABLE_TERM_START'], app.config['TIMETABLE_TERM_END']
+    if start and end:
+        return date.fromisoformat(start), date.fromisoformat(end)
+    today = today or date.today()
+    if 2 <= today.month <= 7:
+        return date(today.year, 2, 1), date(today.year, 6, 30)
+    year = today.year if today.month >= 8 else today.year - 1
+    return date(year, 9, 1), date(year + 1, 1, 31)
+
+def _ics_uid(kind, user_id, row_id):
+    # 分檔模式下各使用者的 id 會重複，一定要帶 user_id
+    return f"{kind}-{user_id}-{row_id}@{ICS_UID_DOMAIN}"
+
+def _keyset_batches(query, model, size=ICS_QUERY_BATCH):
+    """依 (date, id) 分批讀出 query 的所有列；每批是 list，產出前已經結束交易（不握著讀鎖）"""
+    after = None
+    while True:
+        page = query
+        if after is not None:
+            page = page.filter(tuple_(model.date, model.id) > after)
+        rows = page.order_by(model.date.asc(), model.id.asc()).limit(size).all()
+        db.session.close()  # 還回連線、結束讀取交易，之後才把資料交給慢的訂閱端
+        yield from rows
+        if len(rows) < size:
+            return
+        after = (rows[-1].date, rows[-1].id)
+
+def _calendar_events(user_id):
+    rows = _keyset_batches(
+        db.session.query(CalendarItem.id, CalendarItem.title, CalendarItem.item_type_id, CalendarItem.date,
+                         CalendarItem.start_time, CalendarItem.end_time, CalendarItem.content, CalendarItem.created_at)
+        .filter(CalendarItem.user_id == user_id),
+        CalendarItem,
+    )
+    item_types = lookups().item_types
+    # 已封存的月份比熱資料表裡的都舊，先輸出（訂閱端看不到的事件會被刪掉，不能只給熱資料）
+    archived = (
+        (r["id"], r["title"], r["item_type_id"], r["date"], r["start_time"], r["end_time"], r["content"], r["created_at"])
+        for r in sorted(archived_rows(user_id, CalendarItem), key=lambda r: (r["date"], r["id"]))
+    )
+    for row_id, title, item_type_id, d, st, et, content, created_at in itertools.chain(archived, rows):
+        yield ics.event(
+            _ics_uid("calendar", user_id, row_id), created_at or ICS_EPOCH, title,
+            datetime.combine(d, st), datetime.combine(d, et),
+            description=content, categories=item_types.name(item_type_id),
+        )
+
+def _important_events(user_id):
+    rows = _keyset_batches(
+        db.session.query(ImportantItem.id, ImportantItem.title, ImportantItem.date,
+                         ImportantItem.description, ImportantItem.created_at)
+        .filter(ImportantItem.user_id == user_id),
+        ImportantItem,
+    )
+    for row_id, title, d, description, created_at in rows:
+        yield ics.event(
+            _ics_uid("important", user_id, row_id), created_at or ICS_EPOCH, title,
+            d, d + timedelta(days=1), description=description, categories="重要事項",
+        )
+
+def _timetable_events(user_id):
+    """每門課每週重複一次；同一天連續的節次（同課名、同教室）合併成一個事件"""
+    term_start, term_end = timetable_term()
+    order = {s: i for i, s in enumerate(SECTION_CHOICES)}
+    entries = sorted(
+        TimetableEntry.query.filter(TimetableEntry.user_id == user_id).all(),
+        key=lambda e: (WEEKDAY_INDEX.get(e.weekday_code, 7), order.get(e.section, 99)),
+    )
+    blocks = []  # [第一筆, 最後一節]
+    for e in entries:
+        if e.weekday_code not in WEEKDAY_INDEX or e.section not in SECTION_TIMES:
+            continue
+        last = blocks[-1] if blocks else None
+        if (last and last[0].weekday_code == e.weekday_code and order[last[1]] + 1 == order[e.section]
+                and (last[0].course_name, last[0].classroom) == (e.course_name, e.classroom)):
+            last[1] = e.section
+        else:
+            blocks.append([e, e.section])
+
+    until = f"{term_end.strftime('%Y%m%d')}T235959"
+    for first, last_section in blocks:
+        day = term_start + timedelta(days=(WEEKDAY_INDEX[first.weekday_code] - term_start.weekday()) % 7)
+        st = datetime.strptime(SECTION_TIMES[first.section][0], "%H:%M").time()
+        et = datetime.strptime(SECTION_TIMES[last_section][1], "%H:%M").time()
+        details = [x for x in (first.classroom and f"教室：{first.classroom}",
+                               first.teacher and f"老師：{first.teacher}", first.note) if x]
+        yield ics.event(
+            _ics_uid("timetable", user_id, first.id), ICS_EPOCH, first.course_name,
+            datetime.combine(day, st), datetime.combine(day, et),
+            description="\n".join(details), categories="課表", rrule=f"FREQ=WEEKLY;UNTIL={until}",
+        )
+
+ICS_FEED_EVENTS = {
+    "calendar": _calendar_events,
+    "important": _important_events,
+    "timetable": _timetable_events,
+}
+
+def _ics_feed_chunks(user_id, feed):
+    with using_shard(user_id):  # 訂閱請求沒有登入，分檔模式下要自己指定是誰的資料
+        yield ics.calendar_header(ICS_FEEDS[feed][0])
+        buf = []
+        for event in ICS_FEED_EVENTS[feed](user_id):
+            buf.append(event)
+            if len(buf) >= ICS_STREAM_BATCH:
+                yield "".join(buf)
+                buf = []
+        buf.append(ics.CALENDAR_FOOTER)
+        yield "".join(buf)
+
+def get_feed_token(user_id, reset=False):
+    """取得（沒有就建立）使用者的訂閱 token；reset=True 時換一組新的，舊網址立刻失效"""
+    feed = db.session.get(FeedToken, user_id)
+    if feed is None:
+        feed = FeedToken(user_id=user_id)
+        db.session.add(feed)
+    elif not reset:
+        return feed.token
+    feed.token = secrets.token_urlsafe(24)
+    db.session.commit()
+    return feed.token
+
+@app.route("/feeds/<token>/<feed>.ics")
+def ics_feed(token, feed):
+    if feed not in ICS_FEEDS:
+        abort(404)
+    owner = FeedToken.query.filter(FeedToken.token == token).first()
+    if owner is None:
+        abort(404)
+    user_id = owner.user_id
+
+    etag = f"{feed}-{user_id}-{VERSIONS.token(ICS_FEEDS[feed][1], user_id)}"
+    if feed == "timetable":
+        etag += "-" + "-".join(d.isoformat() for d in timetable_term())
+    last_modified = ICS_LAST_MODIFIED.get_or_load(
+        (user_id, etag), lambda: datetime.now(timezone.utc).replace(microsecond=0))
+
+    # 先自己比對 If-None-Match / If-Modified-Since：make_conditional 為了算 Content-Length
+    # 會把串流整個讀完，等於每次都重新產生
+    if is_resource_modified(request.environ, etag=etag, last_modified=last_modified):
+        response = Response(stream_with_context(_ics_feed_chunks(user_id, feed)), mimetype="text/calendar")
+    else:
+        response = Response(status=304)
+    response.set_etag(etag)
+    response.last_modified = last_modified
+    response.headers["Cache-Control"] = "private, no-cache"
+    return response
+
+@app.route("/feeds")
+@login_required
+def feeds_page():
+    token = get_feed_token(current_user.id)
+    feeds = [
+        (name, url_for("ics_feed", token=token, feed=feed, _external=True))
+        for feed, (name, _) in ICS_FEEDS.items()
+    ]
+    imports = (
+        Job.query.filter(Job.user_id == current_user.id, Job.kind == "import_ics")
+        .order_by(Job.id.desc()).limit(5).all()
+    )
+    return render_template("feeds.html", feeds=feeds, imports=imports,
+                           term=timetable_term(), max_mb=app.config['ICS_IMPORT_MAX_MB'])
+
+@app.route("/feeds/reset", methods=["POST"])
+@login_required
+def feeds_reset():
+    get_feed_token(current_user.id, reset=True)
+    flash("已產生新的訂閱網址，舊的網址已失效", "success")
+    return redirect(url_for("feeds_page"))
+
+@app.route("/import/ics", methods=["POST"])
+@login_required
+def import_ics_upload():
+    upload = request.files.get("file")
+    if upload is None or not upload.filename:
+        flash("請選擇 .ics 檔案", "warning")
+        return redirect(url_for("feeds_page"))
+    max_bytes = app.config['ICS_IMPORT_MAX_MB'] * 1024 * 1024
+    if request.content_length and request.content_length > max_bytes:
+        flash(f"檔案太大（上限 {app.config['ICS_IMPORT_MAX_MB']} MB）", "warning")
+        return redirect(url_for("feeds_page"))
+
+    # 先存到磁碟，由 worker 慢慢解析，網頁請求不用等
+    os.makedirs(ICS_IMPORT_DIR, exist_ok=True)
+    filename = f"user{current_user.id}_{uuid.uuid4().hex}.ics"
+    upload.save(os.path.join(ICS_IMPORT_DIR, filename))
+    # 已經寫進去的批次不會回滾，重試會重複匯入，所以只跑一次
+    job = enqueue_job("import_ics", {"filename": filename}, user_id=current_user.id, max_attempts=1)
+    flash(f"已開始匯入（工作 #{job.id}），完成後重新整理這一頁就會看到結果", "success")
+    return redirect(url_for("feeds_page"))
+
+def _ics_import_row(user_id, ev):
+    """VEVENT -> ("important" | "calendar", 要 insert 的 dict)；整天的事件當成重要事項"""
+    title = (ev.summary or "").strip()[:120] or "(無標題)"
+    content = "\n".join(x for x in (ev.description, ev.location and f"地點：{ev.location}") if x)
+    if not isinstance(ev.start, datetime):
+        return "important", dict(user_id=user_id, title=title, date=ev.start, description=content)
+
+    end = ev.end if isinstance(ev.end, datetime) else ev.start + timedelta(hours=1)
+    st = ev.start.time()
+    # 跨日的事件只保留第一天（end_time 最晚到 23:59:59）
+    et = end.time() if end.date() == ev.start.date() else dtime(23, 59, 59)
+    if et <= st:
+        # 沒有合理的結束時間：當成一小時，最晚到當天結束
+        et = dtime(23, 59, 59) if st.hour == 23 else (ev.start + timedelta(hours=1)).time()
+        if et <= st:
+            return None, None
+    return "calendar", dict(user_id=user_id, title=title, item_type_id=lookups().item_types.id("活動"),
+                            date=ev.start.date(), start_time=st, end_time=et, content=content)
+
+@job_handler("import_ics")
+def import_ics(job, payload):
+    """逐行解析上傳的 .ics，每 ICS_IMPORT_BATCH 筆 insert 一次；重複的規則只匯入第一次"""
+    path = os.path.join(ICS_IMPORT_DIR, os.path.basename(payload["filename"]))
+    size = os.path.getsize(path) or 1
+    counts = {"calendar": 0, "important": 0, "recurring": 0, "skipped": 0}
+    batches = {"calendar": [], "important": []}
+    tables = {"calendar": CalendarItem.__table__, "important": ImportantItem.__table__}
+
+    def flush():
+        for kind, rows in batches.items():
+            if rows:
+                db.session.execute(tables[kind].insert(), rows)
+                counts[kind] += len(rows)
+                rows.clear()
+        db.session.commit()
+
+    with open(path, "rb") as f:
+        for ev in ics.iter_events(f, tz=app.config['ICS_TIMEZONE']):
+            kind, row = _ics_import_row(job.user_id, ev)
+            if kind is None:
+                counts["skipped"] += 1
+                continue
+            if ev.rrule:
+                counts["recurring"] += 1
+            batches[kind].append(row)
+            if len(batches["calendar"]) + len(batches["important"]) >= ICS_IMPORT_BATCH:
+                flush()
+                job_progress(job, f.tell() * 100.0 / size,
+                             f"已匯入 {counts['calendar'] + counts['important']} 筆")
+    flush()
+    os.remove(path)
+    bump_version(job.user_id, "calendar", "important")
+    return counts
+
+
+# ===== 背景工作：排入佇列 / 查詢狀態 =====
+@app.route("/export", methods=["POST"])
+@login_required
+def export_data():
+    # 匯出可能很久，只排入佇列，立刻回傳 202 + 查詢網址
+    job = enqueue_job("export_user_data", user_id=current_user.id)
+    return jsonify({
+        "job_id": job.id,
+        "status_url": url_for("job_status", job_id=job.id),
+    }), 202
+
+@app.route("/recompute", methods=["POST"])
+@login_required
+def recompute_data():
+    # 趨勢或封存彙總對不上原始資料時重建；已經有一筆在排隊或執行中就回傳那一筆，不重複排
+    job = (
+        Job.query
+        .filter(Job.user_id == current_user.id, Job.kind == "recompute", Job.status.in_(("queued", "running")))
+        .first()
+    ) or enqueue_job("recompute", user_id=current_user.id)
+    return jsonify({
+        "job_id": job.id,
+        "status_url": url_for("job_status", job_id=job.id),
+    }), 202
+
+@app.route("/jobs/<int:job_id>")
+@login_required
+def job_status(job_id):
+    job = Job.query.filter(Job.user_id == current_user.id, Job.id == job_id).first_or_404()
+    data = job.to_dict()
+    if job.kind == "export_user_data" and job.status == "done":
+        data["download_url"] = url_for("job_download", job_id=job.id)
+    return jsonify(data)
+
+@app.route("/jobs/<int:job_id>/download")
+@login_required
+def job_download(job_id):
+    job = Job.query.filter(
+        Job.user_id == current_user.id,
+        Job.id == job_id,
+        Job.kind == "export_user_data",
+        Job.status == "done",
+    ).first_or_404()
+    filename = json.loads(job.result)["filename"]
+    return send_from_directory(EXPORT_DIR, filename, as_attachment=True)
+
+
+create_app()  # import 時就初始化全域的 app（worker.py、recompute.py、tools/ 直接用 app.app）
 
 if __name__ == "__main__":
+    # 開發模式：直接 python app.py 時順便建表
+    init_schema()
     app.run(debug=True)
\ No newline at end of file
@@ -0,0 +1,224 @@
+"""
+靜態檔指紋化、預先壓縮，以及 HTML / JSON 回應壓縮
+
+    python assets.py build     # 部署前執行（Dockerfile 會自動跑）：產生 static/dist/ 與 manifest.json
+
+build 會把 static/ 下每個檔案複製成 `原檔名.<內容 hash>.副檔名`，文字檔另外預先壓好 .gz
+（有安裝 brotli 套件時也會產生 .br）。模板裡照舊寫 url_for('static', filename=...)，
+有 manifest 時會被換成 /assets/<指紋檔名>：
+- 檔名跟著內容變，所以可以放心給 `Cache-Control: immutable`，瀏覽器一年內不會再問
+- 依 Accept-Encoding 直接送出壓好的 .br / .gz，不用每次壓縮
+沒有 build 過（或開 debug）時退回 Flask 原本的 /static/，開發時改檔不用重 build。
+
+另外 HTML / JSON / ICS 回應超過 COMPRESS_MIN_SIZE bytes 時即時 gzip（串流回應逐塊壓縮），
+前面已經有 nginx 等 proxy 負責壓縮時可設 COMPRESS_RESPONSES=0 關掉。
+"""
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import shutil
+import sys
+import zlib
+
+try:  # 選用：pip install brotli 之後 build 才會產生 .br
+    import brotli
+except ImportError:
+    brotli = None
+
+DIST = "dist"
+MANIFEST = "manifest.json"
+IMMUTABLE = "public, max-age=31536000, immutable"
+COMPRESSIBLE = {".css", ".js", ".svg", ".json", ".txt", ".html", ".map", ".ico"}
+COMPRESS_MIMETYPES = {"text/html", "application/json", "text/calendar"}
+# 預先壓縮的變體，依偏好順序
+ENCODINGS = (("br", ".br"), ("gzip", ".gz"))
+
+
+def _fingerprint(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(65536), b""):
+            h.update(chunk)
+    return h.hexdigest()[:12]
+
+
+def _write_if_smaller(path, data, original_size):
+    # 壓縮後沒變小（例如很小的檔案）就不留，送原檔就好
+    if len(data) < original_size:
+        with open(path, "wb") as f:
+            f.write(data)
+
+
+def build(static_dir, dist_dir=None):
+    """產生指紋檔名的複本與壓縮檔，回傳 manifest（原路徑 -> 指紋路徑）"""
+    dist_dir = dist_dir or os.path.join(static_dir, DIST)
+    tmp_dir = dist_dir + ".tmp"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+
+    manifest = {}
+    for root, dirs, files in os.walk(static_dir):
+        dirs[:] = sorted(d for d in dirs if os.path.join(root, d) not in (dist_dir, tmp_dir))
+        for name in sorted(files):
+            src = os.path.join(root, name)
+            rel = os.path.relpath(src, static_dir).replace(os.sep, "/")
+            stem, ext = os.path.splitext(rel)
+            hashed = f"{stem}.{_fingerprint(src)}{ext}"
+            dst = os.path.join(tmp_dir, hashed)
+            os.makedirs(os.path.dirname(dst), exist_ok=True)
+            shutil.copyfile(src, dst)
+            manifest[rel] = hashed
+
+            if ext.lower() in COMPRESSIBLE:
+                with open(src, "rb") as f:
+                    data = f.read()
+                # mtime=0：同樣內容每次 build 出來的 .gz 都一樣
+                _write_if_smaller(dst + ".gz", gzip.compress(data, compresslevel=9, mtime=0), len(data))
+                if brotli is not None:
+                    _write_if_smaller(dst + ".br", brotli.compress(data, quality=11), len(data))
+
+    with open(os.path.join(tmp_dir, MANIFEST), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2, sort_keys=True)
+    shutil.rmtree(dist_dir, ignore_errors=True)
+    os.rename(tmp_dir, dist_dir)
+    return manifest
+
+
+class Assets:
+    def __init__(self):
+        self.app = None
+        self.dist_dir = None
+        self.manifest = {}
+
+    def init_app(self, app):
+        self.app = app
+        self.dist_dir = app.config.setdefault("ASSET_DIST_DIR", os.path.join(app.static_folder, DIST))
+        self.load()
+
+        app.add_url_rule("/assets/<path:filename>", "asset", self.send)
+        app.jinja_env.globals["url_for"] = self.url_for
+        app.after_request(compress_response)
+
+    def load(self):
+        """讀 manifest；debug 模式或還沒 build 時不使用指紋檔名"""
+        self.manifest = {}
+        path = os.path.join(self.dist_dir, MANIFEST)
+        if not self.app.debug and os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                self.manifest = json.load(f)
+
+    def url_for(self, endpoint, **values):
+        """模板用的 url_for：static 檔案有指紋版本時改指到 /assets/"""
+        from flask import url_for
+        if endpoint == "static" and self.manifest:
+            hashed = self.manifest.get(values.get("filename"))
+            if hashed is not None:
+                values["filename"] = hashed
+                return url_for("asset", **values)
+        return url_for(endpoint, **values)
+
+    def send(self, filename):
+        from flask import abort, request, send_from_directory
+        from werkzeug.security import safe_join
+
+        path = safe_join(self.dist_dir, filename)
+        if path is None or not os.path.isfile(path):
+            abort(404)
+        mimetype = mimetypes.guess_type(filename)[0] or "application/octet-stream"
+
+        encoding = None
+        for name, suffix in ENCODINGS:
+            if request.accept_encodings[name] > 0 and os.path.isfile(path + suffix):
+                encoding, filename = name, filename + suffix
+                break
+
+        response = send_from_directory(self.dist_dir, filename, mimetype=mimetype, conditional=True)
+        if encoding:
+            response.headers["Content-Encoding"] = encoding
+            response.headers.pop("Content-Disposition", None)  # 不要讓瀏覽器看到 .gz / .br 檔名
+        response.vary.add("Accept-Encoding")
+        response.headers["Cache-Control"] = IMMUTABLE
+        return response
+
+
+def _gzip_stream(chunks, level):
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)  # wbits=31：gzip 格式
+    try:
+        for chunk in chunks:
+            if isinstance(chunk, str):
+                chunk = chunk.encode("utf-8")
+            data = compressor.compress(chunk)
+            # 每塊都 flush，瀏覽器才能邊收邊顯示
+            data += compressor.flush(zlib.Z_SYNC_FLUSH)
+            if data:
+                yield data
+        yield compressor.flush()
+    finally:
+        if hasattr(chunks, "close"):  # 例如 stream_with_context 要靠 close 收尾
+            chunks.close()
+
+
+def _weaken_etag(response):
+    # 壓縮過的 bytes 跟原本的不同，不能共用同一個強 ETag；改成弱 ETag（If-None-Match 本來就用弱比對，304 照常）
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(etag, weak=True)
+
+
+def compress_response(response):
+    """after_request：HTML / JSON / ICS 回應在客戶端支援時用 gzip 壓縮"""
+    from flask import current_app, request
+
+    config = current_app.config
+    if (response.status_code == 304 and config.get("COMPRESS_RESPONSES", True)
+            and request.accept_encodings["gzip"] > 0):
+        _weaken_etag(response)  # 跟壓縮過的 200 回應一致
+        return response
+    if (not config.get("COMPRESS_RESPONSES", True)
+            or response.mimetype not in COMPRESS_MIMETYPES
+            or response.direct_passthrough
+            or "Content-Encoding" in response.headers
+            or not 200 <= response.status_code < 300 or response.status_code == 204
+            or request.method == "HEAD"):
+        return response
+
+    response.vary.add("Accept-Encoding")
+    if request.accept_encodings["gzip"] <= 0:
+        return response
+
+    level = config.get("COMPRESS_LEVEL", 6)
+    if response.is_streamed:
+        response.response = _gzip_stream(response.response, level)
+        response.headers.pop("Content-Length", None)
+    else:
+        data = response.get_data()
+        if len(data) < config.get("COMPRESS_MIN_SIZE", 1024):
+            return response
+        response.set_data(gzip.compress(data, compresslevel=level, mtime=0))
+    response.headers["Content-Encoding"] = "gzip"
+    _weaken_etag(response)
+    return response
+
+
+ASSETS = Assets()
+
+
+def main():
+    if len(sys.argv) != 2 or sys.argv[1] != "build":
+        raise SystemExit("用法：python assets.py build")
+    static_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "static")
+    dist_dir = os.environ.get("ASSET_DIST_DIR") or os.path.join(static_dir, DIST)
+    manifest = build(static_dir, dist_dir)
+    for src, hashed in manifest.items():
+        variants = [suffix for _, suffix in ENCODINGS if os.path.exists(os.path.join(dist_dir, hashed + suffix))]
+        size = os.path.getsize(os.path.join(dist_dir, hashed))
+        print(f"  {src:<28} -> {hashed}  {size} bytes {' '.join(variants)}")
+    if brotli is None:
+        print("（沒有安裝 brotli，只產生 .gz）")
+    print(f"{len(manifest)} 個檔案 -> {dist_dir}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,214 @@
+"""
+冷資料封存：封存前後熱資料表的大小、單日頁（最近的日期）的查詢與整頁時間，以及查舊日期時解壓的代價
+
+    python benchmarks/bench_archive.py                       # 50 位使用者 × 3 年，保留最近 365 天
+    python benchmarks/bench_archive.py --users 200 --days 1825 --keep 180 -n 30
+
+暫存資料庫，不會動到 instance/calendar.db。每人每天 4 餐、2 個行事曆項目，每兩天練 3 個動作各 4 組，
+每 3 天一篇日記。量的是：
+- 四張表（含索引）佔幾 KB（dbstat），以及封存的壓縮 BLOB 佔多少
+- 單日頁「上次最大重量」「上次重訓總量」這兩句往回看整段歷史的查詢（封存後加上彙總表的查詢一起算）
+- GET /day/<昨天> 整頁（封存後多讀一次版本號，沒有冷資料要解壓）
+- GET /day/<兩年前>：第一次（查 BLOB + 解壓）與之後（解壓結果在快取裡）
+"""
+import argparse
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+from datetime import date, datetime, time as dtime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+TABLES = ("calendar_items", "diet_entries", "strength_sets", "diary_entries")
+DIARY = "<div>今天練完腿，晚上讀書兩小時，記得明天交作業。</div>" * 3
+
+
+def seed(m, users, days):
+    rng = random.Random(42)
+    today = date.today()
+    base = m.lookups()
+    item_types = [code for code, name in base.item_types.rows]
+    meals = [code for code, name in base.meal_types.rows]
+    exercises = [ex.id for ex in base.exercises]
+    for uid in range(1, users + 1):
+        calendar, diet, strength, diary = [], [], [], []
+        routine = rng.sample(exercises, 6)
+        for i in range(days):
+            d = today - timedelta(days=i)
+            created = datetime.combine(d, dtime(12))
+            for k in range(2):
+                calendar.append(dict(user_id=uid, title=f"事項 {i}-{k}", item_type_id=rng.choice(item_types), date=d,
+                                     start_time=dtime(9 + k * 4), end_time=dtime(10 + k * 4), created_at=created))
+            for meal in meals:
+                diet.append(dict(user_id=uid, date=d, meal_type_id=meal, food_name=f"便當 {rng.randint(1, 40)}",
+                                 kcal=500.0 + rng.randint(0, 300), protein_g=25.0, fat_g=20.0, carb_g=70.0,
+                                 created_at=created))
+            if i % 2 == 0:
+                for ex in routine[(i // 2) % 2 * 3:][:3]:
+                    for _ in range(4):
+                        strength.append(dict(user_id=uid, date=d, exercise_id=ex, weight_kg=40.0 + rng.randint(0, 40),
+                                             reps=8, created_at=created))
+            if i % 3 == 0:
+                diary.append(dict(user_id=uid, date=d, title=f"日記 {i}", content=DIARY, created_at=created))
+        for model, rows in ((m.CalendarItem, calendar), (m.DietEntry, diet),
+                            (m.StrengthSet, strength), (m.DiaryEntry, diary)):
+            m.db.session.execute(model.__table__.insert(), rows)
+        m.db.session.add(m.User(id=uid, email=f"a{uid}@bench.local", name=f"a{uid}"))
+    m.db.session.commit()
+    with m.db.engine.begin() as conn:
+        conn.exec_driver_sql("ANALYZE")
+
+
+def table_kb(path, tables):
+    """{表名: 資料 + 索引 KB}（dbstat）"""
+    conn = sqlite3.connect(path)
+    owners = dict(conn.execute("SELECT name, tbl_name FROM sqlite_master WHERE type IN ('table', 'index')"))
+    sizes = {}
+    for name, size in conn.execute("SELECT name, SUM(pgsize) FROM dbstat GROUP BY name"):
+        table = owners.get(name, name)
+        sizes[table] = sizes.get(table, 0) + size / 1024
+    conn.close()
+    return {t: sizes.get(t, 0.0) for t in tables}
+
+
+def best_ms(repeat, fn, calls):
+    """每輪把 calls 裡的參數各跑一次，跑 repeat 輪，回傳最快那一輪的每次平均 ms"""
+    rounds = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        for args in calls:
+            fn(*args)
+        rounds.append((time.perf_counter() - t0) * 1000 / len(calls))
+    return min(rounds)
+
+
+def history_queries(m, archived):
+    """單日頁往回看整段歷史的兩句（archived=True 時加上 app 在有冷資料時多查的彙總表）"""
+    db, S, func = m.db, m.StrengthSet, m.func
+
+    def run(uid, d):
+        prev = (db.session.query(S.date, func.sum(S.weight_kg * S.reps))
+                .filter(S.user_id == uid, S.date < d).group_by(S.date).order_by(S.date.desc()).first())
+        rows = (db.session.query(S.exercise_id, S.date, func.max(S.weight_kg))
+                .filter(S.user_id == uid, S.date < d).group_by(S.exercise_id, S.date).all())
+        if archived:
+            A, E = m.ArchivedDay, m.ArchivedExerciseDay
+            (db.session.query(A.date, A.strength_volume)
+             .filter(A.user_id == uid, A.date < d, A.strength_sets > 0).order_by(A.date.desc()).first())
+            (db.session.query(E.exercise_id, func.max(E.date), E.max_weight)
+             .filter(E.user_id == uid, E.date < d).group_by(E.exercise_id).all())
+        db.session.rollback()
+        return prev, rows
+
+    return run
+
+
+def login(m, uid):
+    client = m.app.test_client()
+    with client.session_transaction() as sess:
+        sess["_user_id"] = str(uid)
+        sess["_fresh"] = True
+    return client
+
+
+def page_ms(clients, path, repeat):
+    def get(client):
+        resp = client.get(path)
+        assert resp.status_code == 200, resp.status_code
+    return best_ms(repeat, get, [(c,) for c in clients])
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--days", type=int, default=1095, help="每人幾天的資料（從今天往回）")
+    parser.add_argument("--keep", type=int, default=365, help="ARCHIVE_AFTER_DAYS：熱資料表保留幾天")
+    parser.add_argument("-n", "--repeat", type=int, default=10, help="每種量測跑幾輪（每輪每位使用者一次，取最快的一輪）")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "bench.db")
+        os.environ.update(
+            DATABASE_URL=f"sqlite:///{path}",
+            METRICS_DIR=os.path.join(tmp, "metrics"),
+            CACHE_VERSIONS_PATH=os.path.join(tmp, "cache_versions.bin"),
+            JINJA_CACHE_DIR=os.path.join(tmp, "jinja"),
+            GOOGLE_CLIENT_ID=os.environ.get("GOOGLE_CLIENT_ID", "bench"),
+        )
+        import app as m
+        m.init_schema()
+
+        with m.app.app_context():
+            t0 = time.perf_counter()
+            seed(m, args.users, args.days)
+            m.db.session.remove()
+        conn = sqlite3.connect(path)
+        counts = {t: conn.execute(f"SELECT COUNT(*) FROM {t}").fetchone()[0] for t in TABLES}
+        conn.close()
+        print(f"{args.users} 位使用者 × {args.days} 天："
+              + "、".join(f"{t} {n:,}" for t, n in counts.items())
+              + f" 列（建立 {time.perf_counter() - t0:.1f}s）\n")
+
+        users = range(1, args.users + 1)
+        yesterday = (date.today() - timedelta(days=1))
+        old_day = date.today() - timedelta(days=min(args.days - 1, 730))
+        clients = [login(m, uid) for uid in users]
+        recent_path = f"/day/{yesterday.isoformat()}"
+
+        def measure(archived):
+            with m.app.app_context():
+                history = best_ms(args.repeat, history_queries(m, archived), [(uid, yesterday) for uid in users])
+                m.db.session.remove()
+            return {
+                "sizes": table_kb(path, TABLES),
+                "history": history,
+                "page": page_ms(clients, recent_path, args.repeat),
+            }
+
+        before = measure(archived=False)
+
+        with m.app.app_context():
+            t0 = time.perf_counter()
+            cutoff, totals, _ = m.archive_all(days=args.keep)
+            archive_seconds = time.perf_counter() - t0
+            m.db.session.remove()
+        with sqlite3.connect(path) as conn:
+            conn.execute("ANALYZE")
+            blob_kb, partitions = conn.execute(
+                "SELECT SUM(LENGTH(payload)) / 1024.0, COUNT(*) FROM archive_partitions").fetchone()
+        after = measure(archived=True)
+        archive_sizes = table_kb(path, ("archive_partitions", "archived_days", "archived_exercise_days"))
+
+        moved = sum(totals.values())
+        print(f"封存 {cutoff.isoformat()} 之前的 {moved:,} 列：{partitions:,} 個分區（每人每表每月一個），"
+              f"{archive_seconds:.1f}s（{moved / archive_seconds:,.0f} 列/秒）\n")
+        print(f"{'':<26}{'封存前':>12}{'封存後':>12}{'差異':>9}")
+        for t in TABLES:
+            b, a = before["sizes"][t], after["sizes"][t]
+            print(f"{t + '（KB）':<26}{b:>12,.0f}{a:>12,.0f}{(a / b - 1) * 100:>8.0f}%")
+        hot_before, hot_after = sum(before["sizes"].values()), sum(after["sizes"].values())
+        print(f"{'四張表合計（KB）':<22}{hot_before:>12,.0f}{hot_after:>12,.0f}{(hot_after / hot_before - 1) * 100:>8.0f}%")
+        for key, label in (("history", "上次最大重量 + 總量（ms）"), ("page", "GET /day/昨天（ms）")):
+            b, a = before[key], after[key]
+            print(f"{label:<20}{b:>12.3f}{a:>12.3f}{(a / b - 1) * 100:>8.0f}%")
+        print(f"\n冷資料：壓縮 BLOB {blob_kb:,.0f} KB（archive_partitions 含頁面開銷 "
+              f"{archive_sizes['archive_partitions']:,.0f} KB），彙總表 "
+              f"{archive_sizes['archived_days'] + archive_sizes['archived_exercise_days']:,.0f} KB")
+
+        # 舊日期：第一次要查出 4 個 BLOB 並解壓；之後（同一個月）直接用快取裡解壓好的列
+        old_path = f"/day/{old_day.isoformat()}"
+        m.ARCHIVE_PARTITION_CACHE.clear()
+        t0 = time.perf_counter()
+        for c in clients:
+            assert c.get(old_path).status_code == 200
+        cold = (time.perf_counter() - t0) * 1000 / len(clients)
+        warm = page_ms(clients, old_path, args.repeat)
+        print(f"GET /day/{old_day.isoformat()}（已封存）：第一次 {cold:.3f} ms（查 BLOB + 解壓），之後 {warm:.3f} ms")
+
+
+if __name__ == "__main__":
+    main()
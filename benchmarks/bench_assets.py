@@ -0,0 +1,131 @@
+"""
+每個頁面實際傳輸的 bytes：原本（/static/ + 不壓縮）vs. 指紋檔名 + immutable + 壓縮
+
+    python benchmarks/bench_assets.py
+    python benchmarks/bench_assets.py -n 200     # 每頁量 200 次算平均回應時間
+
+用 Flask test client 在同一個程序裡跑（暫存資料庫，不會動到 instance/calendar.db），
+先塞一位使用者一個月的資料，再對每個頁面量：
+- HTML 本身的 bytes
+- 頁面引用的本機靜態檔（/static/ 或 /assets/）第一次造訪要下載的 bytes
+- 再次造訪時：immutable 的檔案瀏覽器不會再發請求；其餘要發條件式請求（回 304）
+CDN 上的 pico / trix / chart.js 不經過這個服務，不計入。
+"""
+import argparse
+import gzip
+import os
+import re
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+ASSET_RE = re.compile(r'(?:src|href)="(/(?:static|assets)/[^"]+)"')
+ACCEPT = {"Accept-Encoding": "br, gzip"}
+
+
+def seed(client):
+    client.post("/login/test", data={"token": "bench", "email": "assets@bench.local"})
+    today = date.today()
+    for i in range(30):
+        ds = (today - timedelta(days=i)).isoformat()
+        client.post("/add", data={"title": f"讀書會 {i}", "item_type": "活動", "date": ds,
+                                  "start_time": "19:00", "end_time": "21:00", "content": "第三章習題"})
+        client.post("/diet/add", data={"date": ds, "meal_type": "午餐", "food_name": "雞胸肉便當",
+                                       "kcal": "650", "protein_g": "40", "fat_g": "18", "carb_g": "75"})
+        client.post("/strength/add", data={"date": ds, "body_part": "胸部", "exercise_name": "臥推",
+                                           "weight_kg": str(50 + i % 10), "reps": "8"})
+        client.post("/weight", data={"date": ds, "weight_kg": f"{70 - i * 0.05:.1f}"})
+    for i in range(8):
+        client.post("/add", data={"title": f"期中考 {i}", "item_type": "重要",
+                                  "date": (today + timedelta(days=i * 7)).isoformat(), "content": ""})
+    for wd in "MTWRF":
+        for sec in ("1", "2", "3"):
+            client.post("/timetable/add", data={"weekday_code": wd, "section": sec,
+                                                "course_name": f"課程{wd}", "classroom": "EE101"})
+
+
+def measure(client, path, optimized, repeat):
+    headers = ACCEPT if optimized else {}
+    r = client.get(path, headers=headers)
+    assert r.status_code == 200, (path, r.status_code)
+    html = len(r.data)
+
+    t0 = time.perf_counter()
+    for _ in range(repeat):
+        client.get(path, headers=headers)
+    ms = (time.perf_counter() - t0) / repeat * 1000
+
+    body = r.data
+    if r.headers.get("Content-Encoding") == "gzip":
+        body = gzip.decompress(body)
+    first, revalidate = 0, 0
+    for url in sorted(set(ASSET_RE.findall(body.decode("utf-8")))):
+        a = client.get(url, headers=headers)
+        assert a.status_code == 200, (url, a.status_code)
+        first += len(a.data)
+        if "immutable" not in a.headers.get("Cache-Control", ""):
+            # 瀏覽器再次造訪時會帶 If-None-Match 問一次，回 304 沒有 body，但還是一次來回
+            again = client.get(url, headers={**headers, "If-None-Match": a.headers.get("ETag", "")})
+            assert again.status_code == 304, (url, again.status_code)
+            revalidate += 1
+    return {"html": html, "assets": first, "revalidate": revalidate, "ms": ms}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", "--repeat", type=int, default=50, help="每頁量幾次回應時間")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ.update(
+            DATABASE_URL=f"sqlite:///{os.path.join(tmp, 'bench.db')}",
+            METRICS_DIR=os.path.join(tmp, "metrics"),
+            CACHE_VERSIONS_PATH=os.path.join(tmp, "cache_versions.bin"),
+            JINJA_CACHE_DIR=os.path.join(tmp, "jinja"),
+            ASSET_DIST_DIR=os.path.join(tmp, "dist"),
+            TEST_LOGIN_TOKEN="bench",
+            GOOGLE_CLIENT_ID=os.environ.get("GOOGLE_CLIENT_ID", "bench"),
+        )
+        import app as m
+        import assets
+
+        assets.build(m.app.static_folder, m.app.config["ASSET_DIST_DIR"])
+        m.init_schema()
+        client = m.app.test_client()
+        seed(client)
+
+        today = date.today().isoformat()
+        pages = ["/", f"/day/{today}", "/timetable", "/important", "/weight", "/progress/臥推",
+                 "/api/diet/suggest?q=雞"]
+        results = {}
+        for optimized in (False, True):
+            m.app.config["COMPRESS_RESPONSES"] = optimized
+            if optimized:
+                m.ASSETS.load()
+            else:
+                m.ASSETS.manifest = {}
+            for path in pages:
+                results[path, optimized] = measure(client, path, optimized, args.repeat)
+
+    print(f"{'page':<24}{'html':>8}{'→ gz':>8}{'assets':>8}{'→ dist':>8}"
+          f"{'1st':>8}{'→ new':>8}{'304s':>6}{'→ new':>6}{'ms':>7}{'→ new':>7}")
+    first, repeat = [0, 0], [0, 0]
+    for path in pages:
+        a, b = results[path, False], results[path, True]
+        first[0] += a["html"] + a["assets"]
+        first[1] += b["html"] + b["assets"]
+        repeat[0] += a["html"]
+        repeat[1] += b["html"]
+        print(f"{path[:23]:<24}{a['html']:>8}{b['html']:>8}{a['assets']:>8}{b['assets']:>8}"
+              f"{a['html'] + a['assets']:>8}{b['html'] + b['assets']:>8}"
+              f"{a['revalidate']:>6}{b['revalidate']:>6}{a['ms']:>7.2f}{b['ms']:>7.2f}")
+    print(f"\n第一次造訪合計 {first[0]} -> {first[1]} bytes（少 {100 * (1 - first[1] / first[0]):.0f}%）")
+    print(f"再次造訪合計   {repeat[0]} -> {repeat[1]} bytes（少 {100 * (1 - repeat[1] / repeat[0]):.0f}%），"
+          "靜態檔不再發 304 請求")
+
+if __name__ == "__main__":
+    main()
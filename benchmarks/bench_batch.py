@@ -0,0 +1,156 @@
+"""
+批次 API：一次 /api/batch vs. 分開打每一頁
+
+    python benchmarks/bench_batch.py                 # 一週 + 7 天 + 3 個動作的進步圖
+    python benchmarks/bench_batch.py --days 3 -n 50
+    SHARD_BY_USER=1 python benchmarks/bench_batch.py
+
+暫存資料庫，不會動到 instance/calendar.db。一位使用者、1 年的行事曆 / 飲食 / 重訓，再加一位分享給他的人。
+同一組資料分別用
+- 分開打：GET /week、GET /day/<日期> × N、GET /progress/<動作> × M（HTML，每個請求各自登入檢查、拿營養目標與代碼表）
+- 一次打：GET /api/batch?r=week:...&r=day:...&r=progress:...
+量 test client 的中位數延遲、送出的 SQL 句數與回應大小。test client 沒有網路，真實環境每個請求還要多一趟來回。
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from datetime import date, time as dtime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def seed(m, days):
+    rng = random.Random(42)
+    today = date.today()
+    work = m.lookups().item_types.id("工作")
+    meals = list(m.lookups().meal_types.by_id)
+    catalog = m.exercise_catalog(1)
+    exercise_ids = list(catalog.by_id)[:6]
+    m.db.session.add_all([m.User(id=1, email="me@bench.local", name="我"),
+                          m.User(id=2, email="friend@bench.local", name="朋友")])
+    m.db.session.commit()
+    dates = [today - timedelta(days=d - 30) for d in range(days)]
+    for uid in (1, 2):
+        with m.using_shard(uid):
+            m.db.session.execute(m.CalendarItem.__table__.insert(), [
+                dict(user_id=uid, title=f"事項 {d}-{k}", item_type_id=work, date=d,
+                     start_time=dtime(8 + k), end_time=dtime(9 + k), content="內容" * rng.randint(1, 40))
+                for d in dates for k in range(3)])
+            m.db.session.execute(m.ImportantItem.__table__.insert(), [
+                dict(user_id=uid, title=f"重要 {d}", date=d) for d in dates[::7]])
+            m.db.session.commit()
+    with m.using_shard(1):
+        m.db.session.execute(m.DietEntry.__table__.insert(), [
+            dict(user_id=1, date=d, meal_type_id=rng.choice(meals), food_name=f"食物 {k}",
+                 kcal=rng.uniform(100, 600), protein_g=rng.uniform(5, 40), fat_g=rng.uniform(2, 30),
+                 carb_g=rng.uniform(10, 80))
+            for d in dates for k in range(5)])
+        m.db.session.execute(m.StrengthSet.__table__.insert(), [
+            dict(user_id=1, date=d, exercise_id=rng.choice(exercise_ids),
+                 weight_kg=rng.randint(20, 120), reps=rng.randint(3, 12))
+            for d in dates[::2] for _ in range(12)])
+        m.db.session.execute(m.DiaryEntry.__table__.insert(), [
+            dict(user_id=1, date=d, title="日記", content="今天" * 50) for d in dates[::3]])
+        m.db.session.add(m.CalendarShare(owner_id=2, viewer_id=1))
+        m.db.session.commit()
+    return [catalog.by_id[i].name for i in exercise_ids]
+
+
+def median_ms(fn, repeat):
+    samples = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - t0)
+    return statistics.median(samples) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--days", type=int, default=7, help="要幾天的單日頁")
+    parser.add_argument("--progress", type=int, default=3, help="要幾個動作的進步圖")
+    parser.add_argument("-n", "--repeat", type=int, default=30)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ.update(
+            DATABASE_URL=f"sqlite:///{os.path.join(tmp, 'bench.db')}",
+            METRICS_DIR=os.path.join(tmp, "metrics"),
+            CACHE_VERSIONS_PATH=os.path.join(tmp, "cache_versions.bin"),
+            JINJA_CACHE_DIR=os.path.join(tmp, "jinja"),
+            SHARD_DIR=os.path.join(tmp, "shards"),
+            GOOGLE_CLIENT_ID=os.environ.get("GOOGLE_CLIENT_ID", "bench"),
+        )
+        import app as m
+        from sqlalchemy import event
+        m.init_schema()
+
+        with m.app.test_request_context():
+            m.login_user(m.User(id=1))
+            names = seed(m, 365)[:args.progress]
+            m.db.session.remove()
+
+        statements = []
+        engines = []
+
+        def record(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+
+        def listen(engine):
+            event.listen(engine, "before_cursor_execute", record)
+            engines.append(engine)
+
+        with m.app.app_context():
+            listen(m.db.engine)
+        m.ROUTER.dispose_all()  # 分檔模式：seed 時開過的 engine 丟掉，之後重開的才有掛上計數
+        m.ROUTER.on_engine_created.append(listen)
+
+        client = m.app.test_client()
+        with client.session_transaction() as sess:
+            sess["_user_id"] = "1"
+            sess["_fresh"] = True
+
+        monday = m.week_start(date.today())
+        days = [monday + timedelta(days=i) for i in range(args.days)]
+        pages = ([f"/week?start={monday}"] + [f"/day/{d}" for d in days]
+                 + [f"/progress/{name}" for name in names])
+        specs = [f"week:{monday}"] + [f"day:{d}" for d in days] + [f"progress:{name}" for name in names]
+        batch_url = "/api/batch?" + "&".join(f"r={spec}" for spec in specs)
+
+        def separate():
+            size = 0
+            for url in pages:
+                resp = client.get(url)
+                assert resp.status_code == 200, url
+                size += len(resp.data)
+            return size
+
+        def batch():
+            resp = client.get(batch_url)
+            assert resp.status_code == 200 and all(r["status"] == 200 for r in resp.get_json()["results"])
+            return len(resp.data)
+
+        print(f"{'分檔' if m.ROUTER.enabled else '單一資料庫'}：1 週 + {args.days} 天 + {len(names)} 個動作"
+              f"（分開打 {len(pages)} 個請求）")
+        print(f"\n{'':>8}{'請求':>6}{'ms':>10}{'SQL':>8}{'KB':>9}")
+        for label, fn, requests in (("分開打", separate, len(pages)), ("批次", batch, 1)):
+            size = fn()  # 暖機：代碼表、營養目標、「我看得到誰」、進步圖進快取
+            statements.clear()
+            ms = median_ms(fn, args.repeat)
+            sql = len(statements) / args.repeat
+            print(f"{label:>8}{requests:>6}{ms:>10.2f}{sql:>8.1f}{size / 1024:>9.1f}")
+
+        resp = client.get(batch_url).get_json()
+        print("\n批次裡各子請求的 ms：" + "、".join(f"{r['resource']} {r['ms']:.2f}" for r in resp["results"]))
+
+        for engine in engines:
+            event.remove(engine, "before_cursor_execute", record)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,224 @@
+"""
+代碼表：舊版「直接存名稱」的資料表 vs. 轉成代碼表 id 之後的大小與分組查詢速度
+
+    python benchmarks/bench_lookups.py
+    python benchmarks/bench_lookups.py --users 300 --days 1095 -n 50
+
+暫存資料庫，不會動到 instance/calendar.db。先用舊版 schema 塞假資料（每人每兩天練 3 個動作各 4 組、
+每天 4 餐、2 個行事曆項目），量完之後用 tools/migrate_lookups.py 原地轉換再量一次。量的是：
+- 三張表（含索引）佔幾 KB（dbstat；SQLite 沒編進 dbstat 時只印整個檔案）
+- 單日頁「上次最大重量」：依動作 + 日期 GROUP BY（名稱 vs. 整數 id）
+- progress 圖表：某個動作每天的最大重量（exercise_name = ? vs. exercise_id IN (...)）
+- 新增重訓時的驗證：每次重建 STRENGTH_CATEGORIES 的動作 set vs. 記憶體裡的代碼表
+"""
+import argparse
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+import timeit
+from datetime import date, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "tools"))
+
+TABLES = ("calendar_items", "diet_entries", "strength_sets")
+
+# 轉換前的 schema（只有這三張表跟代碼有關，其他表不影響量測）
+LEGACY_DDL = """
+CREATE TABLE calendar_items (
+    user_id INTEGER NOT NULL, id INTEGER NOT NULL PRIMARY KEY, title VARCHAR(120) NOT NULL,
+    item_type VARCHAR(10) NOT NULL, date DATE NOT NULL, start_time TIME NOT NULL, end_time TIME NOT NULL,
+    content TEXT, created_at DATETIME);
+CREATE INDEX ix_calendar_items_user_date ON calendar_items (user_id, date);
+CREATE TABLE diet_entries (
+    user_id INTEGER NOT NULL, id INTEGER NOT NULL PRIMARY KEY, date DATE NOT NULL,
+    meal_type VARCHAR(10) NOT NULL, food_name VARCHAR(120) NOT NULL,
+    kcal FLOAT, protein_g FLOAT, fat_g FLOAT, carb_g FLOAT, created_at DATETIME);
+CREATE INDEX ix_diet_entries_date ON diet_entries (date);
+CREATE INDEX ix_diet_entries_user_date ON diet_entries (user_id, date);
+CREATE INDEX ix_diet_entries_user_food ON diet_entries (user_id, food_name);
+CREATE TABLE strength_sets (
+    user_id INTEGER NOT NULL, id INTEGER NOT NULL PRIMARY KEY, date DATE NOT NULL,
+    body_part VARCHAR(10) NOT NULL, exercise_name VARCHAR(50) NOT NULL,
+    weight_kg FLOAT, reps INTEGER, created_at DATETIME);
+CREATE INDEX ix_strength_sets_date ON strength_sets (date);
+CREATE INDEX ix_strength_sets_user_date ON strength_sets (user_id, date);
+CREATE INDEX ix_strength_sets_user_exercise_date ON strength_sets (user_id, exercise_name, date);
+"""
+
+
+def seed_legacy(path, m, users, days):
+    rng = random.Random(42)
+    start = date.today() - timedelta(days=days)
+    exercises = [(part, name) for part, names in m.STRENGTH_CATEGORIES.items() for name in names]
+    item_types = [value for value, _ in m.ITEM_TYPES if value != m.IMPORTANT_CHOICE[0]]
+    meals = [value for value, _ in m.MEAL_TYPES]
+    created = "2026-01-01 12:00:00.000000"
+    conn = sqlite3.connect(path)
+    conn.executescript(LEGACY_DDL)
+    for uid in range(1, users + 1):
+        calendar, diet, strength = [], [], []
+        routine = rng.sample(exercises, 6)
+        for i in range(days):
+            d = (start + timedelta(days=i)).isoformat()
+            for k in range(2):
+                calendar.append((uid, f"事項 {i}-{k}", rng.choice(item_types), d,
+                                 f"{9 + k * 4:02d}:00:00.000000", f"{10 + k * 4:02d}:00:00.000000", None, created))
+            for meal in meals:
+                diet.append((uid, d, meal, f"{meal}便當", 600.0, 25.0, 20.0, 70.0, created))
+            if i % 2 == 0:
+                for part, name in routine[(i // 2) % 2 * 3:][:3]:
+                    for _ in range(4):
+                        strength.append((uid, d, part, name, 40.0 + rng.randint(0, 40), 8, created))
+        conn.executemany("INSERT INTO calendar_items (user_id, title, item_type, date, start_time, end_time, "
+                         "content, created_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?)", calendar)
+        conn.executemany("INSERT INTO diet_entries (user_id, date, meal_type, food_name, kcal, protein_g, fat_g, "
+                         "carb_g, created_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", diet)
+        conn.executemany("INSERT INTO strength_sets (user_id, date, body_part, exercise_name, weight_kg, reps, "
+                         "created_at) VALUES (?, ?, ?, ?, ?, ?, ?)", strength)
+    conn.commit()
+    conn.execute("ANALYZE")
+    conn.close()
+
+
+def table_sizes(path):
+    """{表名: (資料 + 索引 KB)}；沒有 dbstat 時回傳 None"""
+    conn = sqlite3.connect(path)
+    try:
+        owners = dict(conn.execute("SELECT name, tbl_name FROM sqlite_master WHERE type IN ('table', 'index')"))
+        sizes = {}
+        for name, size in conn.execute("SELECT name, SUM(pgsize) FROM dbstat GROUP BY name"):
+            table = owners.get(name, name)
+            sizes[table] = sizes.get(table, 0) + size / 1024
+        return {t: sizes.get(t, 0.0) for t in TABLES}
+    except sqlite3.OperationalError:
+        return None
+    finally:
+        conn.close()
+
+
+def used_kb(path):
+    conn = sqlite3.connect(path)
+    page_size, pages, free = (conn.execute(f"PRAGMA {p}").fetchone()[0]
+                              for p in ("page_size", "page_count", "freelist_count"))
+    conn.close()
+    return (pages - free) * page_size / 1024
+
+
+def timed_queries(path, repeat, params, sql_for):
+    """每輪每組參數各跑一次 sql_for(params) 的查詢，跑 repeat 輪；回傳最快那一輪的每次查詢平均 ms"""
+    conn = sqlite3.connect(path)
+    rounds = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        for p in params:
+            conn.execute(sql_for(p), p).fetchall()
+        rounds.append((time.perf_counter() - t0) * 1000 / len(params))
+    conn.close()
+    return min(rounds)
+
+
+def first_exercise(path, column):
+    """每位使用者第一筆重訓的動作（progress 圖表要查的那個）"""
+    conn = sqlite3.connect(path)
+    rows = dict(conn.execute(f"SELECT user_id, {column} FROM strength_sets "
+                             "WHERE id IN (SELECT MIN(id) FROM strength_sets GROUP BY user_id)"))
+    conn.close()
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--days", type=int, default=730)
+    parser.add_argument("-n", "--repeat", type=int, default=20, help="每種查詢跑幾輪（每輪每位使用者一次，取最快的一輪）")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "bench.db")
+        os.environ.update(
+            DATABASE_URL=f"sqlite:///{path}",
+            METRICS_DIR=os.path.join(tmp, "metrics"),
+            CACHE_VERSIONS_PATH=os.path.join(tmp, "cache_versions.bin"),
+            SHARD_DIR=os.path.join(tmp, "shards"),
+            GOOGLE_CLIENT_ID=os.environ.get("GOOGLE_CLIENT_ID", "bench"),
+        )
+        import app as m
+        import migrate_lookups
+        from sharding import ensure_schema
+
+        t0 = time.perf_counter()
+        seed_legacy(path, m, args.users, args.days)
+        conn = sqlite3.connect(path)
+        counts = {t: conn.execute(f"SELECT COUNT(*) FROM {t}").fetchone()[0] for t in TABLES}
+        conn.close()
+        print(f"{args.users} 位使用者 × {args.days} 天："
+              + "、".join(f"{t} {n:,}" for t, n in counts.items())
+              + f" 列（建立 {time.perf_counter() - t0:.1f}s）\n")
+
+        cutoff = date.today().isoformat()
+        users = range(1, args.users + 1)
+        last_max_sql = ("SELECT {0}, date, MAX(weight_kg) FROM strength_sets "
+                        "WHERE user_id = ? AND date < ? GROUP BY {0}, date")
+        legacy = {
+            "sizes": table_sizes(path),
+            "used": used_kb(path),
+            "last_max": timed_queries(path, args.repeat, [(uid, cutoff) for uid in users],
+                                      lambda p: last_max_sql.format("exercise_name")),
+            "progress": timed_queries(
+                path, args.repeat, list(first_exercise(path, "exercise_name").items()),
+                lambda p: "SELECT date, MAX(weight_kg) FROM strength_sets "
+                          "WHERE user_id = ? AND exercise_name = ? GROUP BY date ORDER BY date"),
+        }
+
+        with m.app.app_context():
+            ensure_schema(m.db.engine, [model.__table__ for model in (m.ItemType, m.MealType, m.BodyPart, m.Exercise)])
+            m.seed_lookups()
+            t0 = time.perf_counter()
+            migrate_lookups.migrate_file(m, path, vacuum=True)
+            migrate_seconds = time.perf_counter() - t0
+
+            # progress 跟 app 一樣用名稱找出所有同名動作的 id：同名動作最多掛在兩個部位（例如啞鈴飛鳥），
+            # 兩個 id 時 SQLite 要多一個暫存 B-tree 合併分組
+            progress_params = []
+            for uid, ex_id in first_exercise(path, "exercise_id").items():
+                catalog = m.exercise_catalog(uid)
+                progress_params.append((uid, *catalog.ids_by_name[catalog.by_id[ex_id].name]))
+            coded = {
+                "sizes": table_sizes(path),
+                "used": used_kb(path),
+                "last_max": timed_queries(path, args.repeat, [(uid, cutoff) for uid in users],
+                                          lambda p: last_max_sql.format("exercise_id")),
+                "progress": timed_queries(
+                    path, args.repeat, progress_params,
+                    lambda p: "SELECT date, MAX(weight_kg) FROM strength_sets WHERE user_id = ? "
+                              f"AND exercise_id IN ({', '.join('?' * (len(p) - 1))}) GROUP BY date ORDER BY date"),
+            }
+
+            print(f"轉換（含 VACUUM）：{migrate_seconds:.1f}s\n")
+            print(f"{'':<22}{'名稱':>12}{'代碼 id':>12}{'差異':>9}")
+            if legacy["sizes"] and coded["sizes"]:
+                for t in TABLES:
+                    before, after = legacy["sizes"][t], coded["sizes"][t]
+                    print(f"{t + '（KB）':<22}{before:>12,.0f}{after:>12,.0f}{(after / before - 1) * 100:>8.0f}%")
+            print(f"{'整個檔案（KB）':<20}{legacy['used']:>12,.0f}{coded['used']:>12,.0f}"
+                  f"{(coded['used'] / legacy['used'] - 1) * 100:>8.0f}%")
+            for key, label in (("last_max", "上次最大重量（ms）"), ("progress", "progress 圖表（ms）")):
+                print(f"{label:<18}{legacy[key]:>12.3f}{coded[key]:>12.3f}"
+                      f"{(coded[key] / legacy[key] - 1) * 100:>8.0f}%")
+
+            n = 20000
+            old = timeit.timeit(
+                lambda: "臥推" in set(sum(m.STRENGTH_CATEGORIES.values(), [])) and "胸部" in m.STRENGTH_CATEGORIES,
+                number=n) / n * 1e6
+            new = timeit.timeit(lambda: m.exercise_catalog(1).by_key.get(("胸部", "臥推")), number=n) / n * 1e6
+            print(f"\n新增重訓的驗證：每次重建動作 set {old:.2f} µs vs. 代碼表（含讀版本號）{new:.2f} µs")
+            m.db.session.remove()
+
+
+if __name__ == "__main__":
+    main()
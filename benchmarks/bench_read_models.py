@@ -0,0 +1,143 @@
+"""
+唯讀頁面的查詢：完整 ORM 物件 vs. read model（只選需要的欄位組成 namedtuple）
+
+    python benchmarks/bench_read_models.py              # 一位使用者 3 年、每天 20 筆行事曆
+    python benchmarks/bench_read_models.py --per-day 40 --years 5 -n 50
+
+暫存資料庫，不會動到 instance/calendar.db。每一種查詢都量：
+- 延遲：中位數（每次都開新的 session，ORM 的 identity map 不會被上一輪重複利用）
+- 記憶體：查詢過程的峰值，以及結果留在記憶體裡的大小（tracemalloc）
+"""
+import argparse
+import gc
+import os
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import date, time as dtime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+CONTENT = "今天的會議記錄：討論期末專題分工、資料庫設計與前端頁面，下次開會前要完成各自的部分並上傳到 GitHub。" * 6
+
+
+def seed(m, user_id, years, per_day):
+    today = date.today()
+    days = 365 * years
+    work = m.lookups().item_types.id("工作")
+    items = [
+        dict(user_id=user_id, title=f"事項 {d}-{k}", item_type_id=work, date=today - timedelta(days=d),
+             start_time=dtime(8 + k % 12), end_time=dtime(9 + k % 12), content=CONTENT)
+        for d in range(days) for k in range(per_day)
+    ]
+    m.db.session.execute(m.CalendarItem.__table__.insert(), items)
+    m.db.session.execute(m.ImportantItem.__table__.insert(), [
+        dict(user_id=user_id, title=f"重要 {d}", date=today + timedelta(days=d - days // 2), description=CONTENT[:80])
+        for d in range(days)
+    ])
+    m.db.session.execute(m.WeightEntry.__table__.insert(), [
+        dict(user_id=user_id, date=today - timedelta(days=d), weight_kg=70 + (d % 30) / 10) for d in range(days)
+    ])
+    m.db.session.commit()
+    return len(items)
+
+
+def cases(m, user_id):
+    CalendarItem, ImportantItem, WeightEntry = m.CalendarItem, m.ImportantItem, m.WeightEntry
+    today = date.today()
+    first_day, last_day = m.month_range(today.year, today.month)
+    monday = today - timedelta(days=today.weekday())
+    year_ago = today - timedelta(days=365)
+
+    def calendar_between(start, end):
+        def orm():
+            return (CalendarItem.query
+                    .filter(CalendarItem.user_id == user_id, CalendarItem.date.between(start, end))
+                    .order_by(CalendarItem.date.asc(), CalendarItem.start_time.asc()).all())
+
+        def rows():
+            return m.CalendarItemRow.fetch(
+                m.CalendarItemRow.query()
+                .filter(CalendarItem.user_id == user_id, CalendarItem.date.between(start, end))
+                .order_by(CalendarItem.date.asc(), CalendarItem.start_time.asc()))
+        return orm, rows
+
+    def keyset(model, row_type, limit, descending):
+        def orm():
+            return m.keyset_page(model.query.filter(model.user_id == user_id), model, None, limit, descending)[0]
+
+        def rows():
+            return m.keyset_page(row_type.query().filter(model.user_id == user_id), model, None, limit,
+                                 descending, row_type=row_type)[0]
+        return orm, rows
+
+    return [
+        ("月曆（本月）", *calendar_between(first_day, last_day)),
+        ("週檢視", *calendar_between(monday, monday + timedelta(days=6))),
+        ("一年的行事曆", *calendar_between(year_ago, today)),
+        ("重要事項 100 筆", *keyset(ImportantItem, m.ImportantRow, 100, False)),
+        ("體重 100 筆", *keyset(WeightEntry, m.WeightRow, 100, True)),
+    ]
+
+
+def timed(m, fn, repeat):
+    samples = []
+    for _ in range(repeat):
+        m.db.session.remove()
+        t0 = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - t0)
+    return statistics.median(samples) * 1000
+
+
+def memory(m, fn):
+    m.db.session.remove()
+    gc.collect()
+    tracemalloc.start()
+    base = tracemalloc.get_traced_memory()[0]
+    result = fn()  # 量測時結果要還在記憶體裡
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+    return (current - base) / 1024, (peak - base) / 1024
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--years", type=int, default=3)
+    parser.add_argument("--per-day", type=int, default=20, help="每天幾筆行事曆")
+    parser.add_argument("-n", "--repeat", type=int, default=30)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ.update(
+            DATABASE_URL=f"sqlite:///{os.path.join(tmp, 'bench.db')}",
+            METRICS_DIR=os.path.join(tmp, "metrics"),
+            CACHE_VERSIONS_PATH=os.path.join(tmp, "cache_versions.bin"),
+            GOOGLE_CLIENT_ID=os.environ.get("GOOGLE_CLIENT_ID", "bench"),
+        )
+        import app as m
+        m.init_schema()
+        with m.app.app_context():
+            user = m.User(email="bench@local", name="bench")
+            m.db.session.add(user)
+            m.db.session.commit()
+            n_items = seed(m, user.id, args.years, args.per_day)
+            print(f"{n_items} 筆行事曆、{365 * args.years} 筆重要事項 / 體重，每項跑 {args.repeat} 次\n")
+
+            print(f"{'query':<14}{'rows':>7}{'ORM ms':>9}{'rows ms':>9}{'ORM KB':>10}{'rows KB':>10}"
+                  f"{'ORM peak':>10}{'rows peak':>10}")
+            for name, orm, rows in cases(m, user.id):
+                count = len(rows())
+                orm_ms, rows_ms = timed(m, orm, args.repeat), timed(m, rows, args.repeat)
+                (orm_kb, orm_peak), (rows_kb, rows_peak) = memory(m, orm), memory(m, rows)
+                print(f"{name:<12}{count:>7}{orm_ms:>9.2f}{rows_ms:>9.2f}{orm_kb:>10.0f}{rows_kb:>10.0f}"
+                      f"{orm_peak:>10.0f}{rows_peak:>10.0f}")
+            m.db.session.remove()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,150 @@
+"""
+重算衍生資料（recompute.py）：worker 數對吞吐量的影響，以及節流（duty）對同時寫入的網站延遲的影響
+
+    python benchmarks/bench_recompute.py                 # 單一資料庫，80 位使用者 × 3 年體重紀錄
+    SHARD_BY_USER=1 python benchmarks/bench_recompute.py # 分檔模式
+    python benchmarks/bench_recompute.py --users 200 --days 1825 -w 1,2,4,8 --duty 1,0.5,0.2
+
+暫存資料庫，不會動到 instance/calendar.db。每人每天 1~2 筆體重紀錄，重算 weight_trend
+（每人 --days 天的趨勢值，分批 UPSERT）。量的是：
+- 不節流（duty 1）時 -w 個 worker 各跑一次全部使用者：花多久、位/秒、列/秒
+- 固定 worker 數、不同 duty：重算期間另一條連線每 20ms 新增 + 刪除一筆體重紀錄（模擬網站寫入），
+  這筆寫入 commit 的 p50 / p95 / 最大延遲，以及重算本身變慢多少
+"""
+import argparse
+import multiprocessing
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "benchmarks"))
+from loadtest import pct  # noqa: E402
+
+WRITE_EVERY = 0.02
+
+
+def seed(m, users, days):
+    rng = random.Random(42)
+    today = date.today()
+    with m.app.app_context():
+        for uid in range(1, users + 1):
+            m.db.session.add(m.User(id=uid, email=f"a{uid}@bench.local", name=f"a{uid}"))
+        m.db.session.commit()
+        for uid in range(1, users + 1):
+            rows = []
+            weight = 70.0 + rng.random() * 30
+            for i in range(days):
+                d = today - timedelta(days=days - i)
+                weight += rng.uniform(-0.3, 0.28)
+                for _ in range(rng.choice((1, 1, 2))):
+                    rows.append(dict(user_id=uid, date=d, weight_kg=round(weight + rng.uniform(-0.5, 0.5), 1)))
+            with m.using_shard(uid):
+                m.db.session.execute(m.WeightEntry.__table__.insert(), rows)
+                m.db.session.commit()
+        m.db.session.remove()
+
+
+def site_writer(path, stop, results):
+    """
+    模擬網站：每 WRITE_EVERY 秒新增再刪掉一筆 user 1 的體重紀錄，記下每次 commit 花多久。
+    跑在另一個 process（跟真的網站一樣）：SQLite 連線不能被 fork 出去的 recompute worker 繼承
+    """
+    conn = sqlite3.connect(path, timeout=15)
+    day = (date.today() + timedelta(days=365)).isoformat()
+    latencies = []
+    while not stop.is_set():
+        t0 = time.perf_counter()
+        cur = conn.execute("INSERT INTO weight_entries (user_id, date, weight_kg) VALUES (1, ?, 80)", (day,))
+        conn.commit()
+        conn.execute("DELETE FROM weight_entries WHERE id = ?", (cur.lastrowid,))
+        conn.commit()
+        latencies.append((time.perf_counter() - t0) * 1000)
+        time.sleep(WRITE_EVERY)
+    conn.close()
+    results.put(latencies)
+
+
+def start_site_writer(path):
+    ctx = multiprocessing.get_context("fork")
+    stop, results = ctx.Event(), ctx.Queue()
+    proc = ctx.Process(target=site_writer, args=(path, stop, results), daemon=True)
+    proc.start()
+
+    def finish():
+        stop.set()
+        latencies = results.get()
+        proc.join()
+        return latencies
+    return finish
+
+
+def run_once(recompute, workers, duty, writer_path=None):
+    """回傳 (秒數, 列數, 同時寫入的延遲 ms 列表)"""
+    finish = start_site_writer(writer_path) if writer_path else None
+    t0 = time.perf_counter()
+    checkpoint = recompute.run(["weight_trend"], workers=workers, duty=duty, restart=True)
+    elapsed = time.perf_counter() - t0
+    return elapsed, checkpoint.rows["weight_trend"], finish() if finish else []
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=80)
+    parser.add_argument("--days", type=int, default=1095)
+    parser.add_argument("-w", "--workers", default="1,2,4", help="吞吐量要比較的 worker 數（逗號分隔）")
+    parser.add_argument("--duty", default="1,0.5,0.2", help="延遲要比較的 duty（逗號分隔）")
+    args = parser.parse_args()
+    worker_counts = [int(w) for w in args.workers.split(",")]
+    duties = [float(d) for d in args.duty.split(",")]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "bench.db")
+        os.environ.update(
+            DATABASE_URL=f"sqlite:///{path}",
+            METRICS_DIR=os.path.join(tmp, "metrics"),
+            CACHE_VERSIONS_PATH=os.path.join(tmp, "cache_versions.bin"),
+            JINJA_CACHE_DIR=os.path.join(tmp, "jinja"),
+            SHARD_DIR=os.path.join(tmp, "shards"),
+            GOOGLE_CLIENT_ID=os.environ.get("GOOGLE_CLIENT_ID", "bench"),
+            RECOMPUTE_REPORT_EVERY="3600",  # 只看最後的總結
+        )
+        import app as m
+        import recompute
+        m.app.instance_path = tmp  # checkpoint 也寫在暫存目錄
+        m.init_schema()
+
+        t0 = time.perf_counter()
+        seed(m, args.users, args.days)
+        sharded = m.app.config["SHARD_BY_USER"]
+        writer_path = m.ROUTER.path_for(1) if sharded else path
+        print(f"{'分檔' if sharded else '單一資料庫'}：{args.users} 位使用者 × {args.days} 天體重紀錄"
+              f"（建立 {time.perf_counter() - t0:.1f}s）\n")
+
+        throughput = {w: run_once(recompute, w, 1.0) for w in worker_counts}
+        latency_workers = max(worker_counts)
+        finish = start_site_writer(writer_path)
+        time.sleep(2)
+        baseline = finish()
+        latency = {d: run_once(recompute, latency_workers, d, writer_path) for d in duties}
+
+        print(f"\n{'worker':>6}{'秒數':>10}{'位/秒':>10}{'列/秒':>12}{'加速':>8}")
+        base = throughput[worker_counts[0]][0]
+        for w, (elapsed, rows, _) in throughput.items():
+            print(f"{w:>6}{elapsed:>10.2f}{args.users / elapsed:>10.1f}{rows / elapsed:>12,.0f}{base / elapsed:>7.1f}x")
+
+        print(f"\n{latency_workers} 個 worker，重算期間網站寫入 user 1 的 commit 延遲（ms）")
+        print(f"{'duty':>8}{'重算秒數':>10}{'p50':>9}{'p95':>9}{'最大':>9}{'寫入次數':>9}")
+        print(f"{'沒重算':>5}{'':>12}{pct(baseline, 50):>9.2f}{pct(baseline, 95):>9.2f}"
+              f"{max(baseline):>9.2f}{len(baseline):>11}")
+        for d, (elapsed, _, lat) in latency.items():
+            print(f"{d:>8g}{elapsed:>12.2f}{pct(lat, 50):>9.2f}{pct(lat, 95):>9.2f}{max(lat):>9.2f}{len(lat):>11}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,150 @@
+"""
+提醒排程器：幾十萬筆待送提醒時的載入、記憶體、送出速度，以及閒置時查了幾次資料庫
+
+    python benchmarks/bench_reminders.py                 # 30 萬筆分散在未來 60 天、2000 筆馬上到期
+    python benchmarks/bench_reminders.py --pending 1000000 --idle 10
+
+暫存資料庫，不會動到 instance/calendar.db。量的是：
+- 時間窗載入（REMINDER_HORIZON 內）vs. 全部載入 heap：查詢時間與 heap 佔的記憶體
+- 2000 筆同時到期時，用 inbox channel 全部送出要多久
+- 閒置 --idle 秒：排程器（只讀 mmap 版本號）vs. 每 tick 查一次資料表的輪詢，各發出幾句 SQL
+- 網頁改了一筆提醒之後，排程器重新載入時間窗要多久
+"""
+import argparse
+import gc
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def seed(m, pending, due_now, users):
+    rng = random.Random(42)
+    now = datetime.now()
+    m.db.session.execute(m.User.__table__.insert(), [
+        dict(id=uid, email=f"r{uid}@bench.local", name=f"r{uid}") for uid in range(1, users + 1)])
+    rows = []
+    for i in range(pending + due_now):
+        if i < due_now:
+            fire_at = now - timedelta(seconds=rng.random() * 5)
+        else:
+            fire_at = now + timedelta(seconds=rng.random() * 60 * 86400)
+        rows.append(dict(user_id=rng.randint(1, users), source="calendar", item_id=i, title=f"事項 {i}",
+                         event_at=fire_at + timedelta(minutes=10), lead_minutes=10, channel="inbox",
+                         next_fire_at=fire_at, attempts=0))
+        if len(rows) >= 50000:
+            m.db.session.execute(m.Reminder.__table__.insert(), rows)
+            rows = []
+    if rows:
+        m.db.session.execute(m.Reminder.__table__.insert(), rows)
+    m.db.session.commit()
+
+
+def heap_memory(load):
+    gc.collect()
+    tracemalloc.start()
+    t0 = time.perf_counter()
+    heap = load()
+    ms = (time.perf_counter() - t0) * 1000
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return len(heap), ms, size / 1024 / 1024
+
+
+class StatementCounter:
+    def __init__(self, engine):
+        from sqlalchemy import event
+        self.count = 0
+        event.listen(engine, "before_cursor_execute", self._count)
+
+    def _count(self, *args):
+        self.count += 1
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--pending", type=int, default=300_000, help="未來 60 天內待送的提醒")
+    parser.add_argument("--due", type=int, default=2000, help="一開始就到期的提醒")
+    parser.add_argument("--users", type=int, default=5000)
+    parser.add_argument("--idle", type=float, default=5.0, help="閒置量測幾秒")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ.update(
+            DATABASE_URL=f"sqlite:///{os.path.join(tmp, 'bench.db')}",
+            METRICS_DIR=os.path.join(tmp, "metrics"),
+            CACHE_VERSIONS_PATH=os.path.join(tmp, "cache_versions.bin"),
+            GOOGLE_CLIENT_ID=os.environ.get("GOOGLE_CLIENT_ID", "bench"),
+        )
+        import app as m
+        import reminders
+        m.init_schema()
+        with m.app.app_context():
+            t0 = time.perf_counter()
+            seed(m, args.pending, args.due, args.users)
+            print(f"{args.pending + args.due} 筆提醒（{args.due} 筆已到期），{args.users} 位使用者，"
+                  f"建立 {time.perf_counter() - t0:.1f}s\n")
+            Reminder = m.Reminder
+
+            sched = reminders.ReminderScheduler()
+            n, ms, mb = heap_memory(lambda: (sched.load_window(datetime.now()), sched.heap)[1])
+            print(f"時間窗載入（{reminders.HORIZON}s）  {n:>8} 筆  {ms:8.1f} ms  heap {mb:6.2f} MB")
+
+            def load_all():
+                rows = (m.db.session.query(Reminder.next_fire_at, Reminder.id)
+                        .filter(Reminder.next_fire_at.isnot(None)).order_by(Reminder.next_fire_at).all())
+                m.db.session.rollback()
+                return [tuple(r) for r in rows]
+            n_all, ms_all, mb_all = heap_memory(load_all)
+            print(f"全部載入                {n_all:>8} 筆  {ms_all:8.1f} ms  heap {mb_all:6.2f} MB\n")
+
+            t0 = time.perf_counter()
+            sent = sched.run_due(datetime.now())
+            elapsed = time.perf_counter() - t0
+            print(f"送出 {sent} 筆到期提醒（inbox）：{elapsed * 1000:.0f} ms，{sent / elapsed:,.0f} 筆/秒")
+
+            counter = StatementCounter(m.db.engine)
+            deadline = time.monotonic() + args.idle
+            ticks = 0
+            while time.monotonic() < deadline:
+                now = datetime.now()
+                if sched.needs_reload(now):
+                    sched.load_window(now)
+                sched.run_due(now)
+                ticks += 1
+                time.sleep(sched.sleep_seconds(datetime.now()))
+            print(f"\n閒置 {args.idle:.0f}s（{ticks} 個 tick）")
+            print(f"  排程器（讀版本號）  {counter.count:>6} 句 SQL")
+
+            counter.count = 0
+            poll_ms = []
+            for _ in range(ticks):
+                t0 = time.perf_counter()
+                (m.db.session.query(Reminder.id)
+                 .filter(Reminder.next_fire_at <= datetime.now()).limit(reminders.BATCH).all())
+                m.db.session.rollback()
+                poll_ms.append((time.perf_counter() - t0) * 1000)
+            print(f"  每 tick 輪詢資料表  {counter.count:>6} 句 SQL（每次 {sum(poll_ms) / len(poll_ms):.3f} ms）")
+
+            # 網頁改了一筆提醒：commit 後 bump 版本號，排程器下一個 tick 重新載入時間窗
+            row = Reminder.query.filter(Reminder.next_fire_at.isnot(None)).first()
+            row.next_fire_at = datetime.now() + timedelta(minutes=1)
+            m.db.session.commit()
+            m.notify_reminder_scheduler()
+            counter.count = 0
+            t0 = time.perf_counter()
+            assert sched.needs_reload(datetime.now())
+            sched.load_window(datetime.now())
+            print(f"\n改一筆之後重新載入時間窗：{(time.perf_counter() - t0) * 1000:.1f} ms，{counter.count} 句 SQL，"
+                  f"heap {len(sched.heap)} 筆")
+            m.db.session.remove()
+
+
+if __name__ == "__main__":
+    main()
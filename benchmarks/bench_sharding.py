@@ -0,0 +1,118 @@
+"""
+多人同時寫入的吞吐量：單一資料庫 vs. 每人一個 SQLite 檔（SHARD_BY_USER=1）
+
+    python benchmarks/bench_sharding.py                       # worker 數 1,2,4,8 各跑 10 秒
+    python benchmarks/bench_sharding.py -w 2,4 -u 32 -d 20
+
+每組設定都起一個全新的 gunicorn（暫存資料庫），-u 位虛擬使用者不停交錯送出
+diet_add / strength_add。diet_add 失敗時只會 flash 訊息，所以吞吐量是跑完後
+直接數資料庫（或所有 shard）裡實際寫進去的列數，而不是看 HTTP 狀態碼。
+"""
+import argparse
+import os
+import secrets
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+from types import SimpleNamespace
+
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from loadtest import lock_errors, pct, start_gunicorn  # noqa: E402
+
+TABLES = ("diet_entries", "strength_sets")
+
+
+def count_rows(tmp, sharded):
+    paths = [os.path.join(tmp, "load.db")]
+    if sharded:
+        shard_dir = os.path.join(tmp, "shards")
+        paths = [os.path.join(shard_dir, f) for f in os.listdir(shard_dir) if f.endswith(".db")]
+    total = 0
+    for path in paths:
+        conn = sqlite3.connect(path)
+        total += sum(conn.execute(f"SELECT COUNT(*) FROM {t}").fetchone()[0] for t in TABLES)
+        conn.close()
+    return total
+
+
+def writer(n, url, token, deadline, latencies, lock):
+    http = requests.Session()
+    http.post(f"{url}/login/test", data={"token": token, "email": f"w{n}@bench.local"},
+              timeout=30).raise_for_status()
+    mine = []
+    i = 0
+    while time.perf_counter() < deadline:
+        if i % 2 == 0:
+            path, data = "/diet/add", {"date": "2026-10-17", "meal_type": "午餐",
+                                       "food_name": f"食物{i % 7}", "kcal": "300"}
+        else:
+            path, data = "/strength/add", {"date": "2026-10-17", "body_part": "胸部",
+                                           "exercise_name": "臥推", "weight_kg": "60", "reps": "8"}
+        t0 = time.perf_counter()
+        try:
+            http.post(url + path, data=data, allow_redirects=False, timeout=60)
+        except requests.RequestException:
+            pass
+        mine.append(time.perf_counter() - t0)
+        i += 1
+    with lock:
+        latencies.extend(mine)
+
+
+def run(workers, sharded, args):
+    with tempfile.TemporaryDirectory() as tmp:
+        token = secrets.token_urlsafe(16)
+        extra = {"SHARD_BY_USER": "1" if sharded else "0", "SHARD_DIR": os.path.join(tmp, "shards"),
+                 "CACHE_VERSIONS_PATH": os.path.join(tmp, "cache_versions.bin")}
+        opts = SimpleNamespace(workers=workers, worker_class="sync", threads=0)
+        proc, url = start_gunicorn(opts, tmp, token, extra)
+        try:
+            before = lock_errors(url, token)
+            latencies, lock = [], threading.Lock()
+            t0 = time.perf_counter()
+            threads = [threading.Thread(target=writer, args=(n, url, token, t0 + args.duration, latencies, lock))
+                       for n in range(args.users)]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+            elapsed = time.perf_counter() - t0
+            time.sleep(1.5)  # 等各 worker 把指標寫到磁碟
+            after = lock_errors(url, token)
+        finally:
+            proc.terminate()
+            proc.wait()
+        rows = count_rows(tmp, sharded)
+    ms = [v * 1000 for v in latencies]
+    return {
+        "writes_per_s": rows / elapsed,
+        "failed": len(ms) - rows,
+        "p50": pct(ms, 50),
+        "p95": pct(ms, 95),
+        "lock_errors": int(after - before) if before is not None and after is not None else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-w", "--workers", default="1,2,4,8", help="要比較的 gunicorn worker 數（逗號分隔）")
+    parser.add_argument("-u", "--users", type=int, default=16, help="同時寫入的使用者數")
+    parser.add_argument("-d", "--duration", type=float, default=10)
+    args = parser.parse_args()
+
+    print(f"{args.users} 位使用者同時寫入，每組 {args.duration:.0f} 秒\n")
+    print(f"{'mode':<8}{'workers':>8}{'writes/s':>10}{'failed':>8}{'p50 ms':>9}{'p95 ms':>9}{'locks':>7}")
+    for workers in [int(w) for w in args.workers.split(",")]:
+        for sharded in (False, True):
+            r = run(workers, sharded, args)
+            locks = "n/a" if r["lock_errors"] is None else r["lock_errors"]
+            print(f"{'shard' if sharded else 'single':<8}{workers:>8}{r['writes_per_s']:>10.1f}{r['failed']:>8}"
+                  f"{r['p50']:>9.1f}{r['p95']:>9.1f}{locks:>7}", flush=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,161 @@
+"""
+共用行事曆：一句 user_id IN (...) vs. 每個 owner 各查一次
+
+    python benchmarks/bench_shared_calendar.py                   # 10 人的群組 + 200 位其他使用者，各 1 年、每天 3 筆
+    python benchmarks/bench_shared_calendar.py --members 20 --per-day 6 -n 50
+    SHARD_BY_USER=1 python benchmarks/bench_shared_calendar.py   # 分檔模式只能每人查一次，對照用
+
+暫存資料庫，不會動到 instance/calendar.db。群組裡的第 1 位是 viewer，其他人都分享給他。
+依看得到的人數（1 / 一半 / 全部）量：
+- 只查這個月的行事曆項目：calendar_rows（IN）與逐一查每個 owner 的中位數延遲
+- 整個月曆頁 GET /（test client，「我看得到誰」已快取）：中位數延遲與每個請求送出幾句 SQL
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from datetime import date, time as dtime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def seed(m, members, others, days, per_day):
+    rng = random.Random(42)
+    today = date.today()
+    work = m.lookups().item_types.id("工作")
+    users = members + others
+    m.db.session.add_all([m.User(id=uid, email=f"u{uid}@bench.local", name=f"成員 {uid}") for uid in range(1, users + 1)])
+    m.db.session.commit()
+    for uid in range(1, users + 1):
+        items = [
+            dict(user_id=uid, title=f"事項 {d}-{k}", item_type_id=work, date=today - timedelta(days=d - days // 2),
+                 start_time=dtime(8 + k), end_time=dtime(9 + k), content="內容" * rng.randint(1, 40))
+            for d in range(days) for k in range(per_day)
+        ]
+        importants = [dict(user_id=uid, title=f"重要 {d}", date=today - timedelta(days=d - days // 2))
+                      for d in range(0, days, 7)]
+        with m.using_shard(uid):
+            m.db.session.execute(m.CalendarItem.__table__.insert(), items)
+            m.db.session.execute(m.ImportantItem.__table__.insert(), importants)
+            m.db.session.commit()
+
+
+def share(m, viewer, owners):
+    """viewer 看得到的人換成 owners"""
+    m.CalendarShare.query.filter(m.CalendarShare.viewer_id == viewer).delete()
+    m.db.session.add_all([m.CalendarShare(owner_id=o, viewer_id=viewer) for o in owners])
+    m.db.session.commit()
+    m.bump_version(viewer, "sharing")
+
+
+def per_owner(m, owner_ids, start, end):
+    """改之前的作法：每個 owner 各查一次再合併"""
+    CalendarItem, CalendarItemRow = m.CalendarItem, m.CalendarItemRow
+    rows = []
+    for uid in owner_ids:
+        with m.using_shard(uid):
+            rows += CalendarItemRow.fetch(
+                CalendarItemRow.query()
+                .filter(CalendarItem.user_id == uid, CalendarItem.date.between(start, end))
+                .order_by(CalendarItem.date.asc(), CalendarItem.start_time.asc()))
+    return sorted(rows, key=lambda it: (it.date, it.start_time))
+
+
+def median_ms(fn, repeat):
+    samples = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - t0)
+    return statistics.median(samples) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--members", type=int, default=10, help="群組人數（含 viewer）")
+    parser.add_argument("--others", type=int, default=200, help="群組以外的使用者（讓資料表接近真實大小）")
+    parser.add_argument("--days", type=int, default=365)
+    parser.add_argument("--per-day", type=int, default=3, help="每人每天幾筆行事曆")
+    parser.add_argument("-n", "--repeat", type=int, default=30)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ.update(
+            DATABASE_URL=f"sqlite:///{os.path.join(tmp, 'bench.db')}",
+            METRICS_DIR=os.path.join(tmp, "metrics"),
+            CACHE_VERSIONS_PATH=os.path.join(tmp, "cache_versions.bin"),
+            JINJA_CACHE_DIR=os.path.join(tmp, "jinja"),
+            SHARD_DIR=os.path.join(tmp, "shards"),
+            GOOGLE_CLIENT_ID=os.environ.get("GOOGLE_CLIENT_ID", "bench"),
+        )
+        import app as m
+        from sqlalchemy import event
+        m.init_schema()
+
+        t0 = time.perf_counter()
+        with m.app.app_context():
+            seed(m, args.members, args.others, args.days, args.per_day)
+            if not m.ROUTER.enabled:
+                with m.db.engine.begin() as conn:
+                    conn.exec_driver_sql("ANALYZE")
+            m.db.session.remove()
+        print(f"{'分檔' if m.ROUTER.enabled else '單一資料庫'}：{args.members} 人的群組 + {args.others} 位其他使用者，"
+              f"每人 {args.days} 天 × {args.per_day} 筆（建立 {time.perf_counter() - t0:.1f}s）")
+
+        statements = []
+        engines = []
+
+        def record(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+
+        def listen(engine):
+            event.listen(engine, "before_cursor_execute", record)
+            engines.append(engine)
+
+        with m.app.app_context():
+            listen(m.db.engine)
+        m.ROUTER.dispose_all()  # 分檔模式：seed 時開過的 engine 丟掉，之後重開的才有掛上計數
+        m.ROUTER.on_engine_created.append(listen)
+
+        client = m.app.test_client()
+        with client.session_transaction() as sess:
+            sess["_user_id"] = "1"
+            sess["_fresh"] = True
+
+        today = date.today()
+        first_day, last_day = m.month_range(today.year, today.month)
+        url = f"/?year={today.year}&month={today.month}"
+        sizes = sorted({1, max(1, args.members // 2), args.members})
+
+        print(f"\n{'看得到':>6}{'項目':>7}{'IN ms':>9}{'逐一 ms':>10}{'頁面 ms':>10}{'頁面 SQL':>10}{'行事曆 SQL':>11}")
+        for k in sizes:
+            owner_ids = tuple(range(1, k + 1))
+            with m.app.app_context():
+                share(m, 1, owner_ids[1:])
+                rows = m.calendar_rows(m.CalendarItemRow, m.CalendarItem, owner_ids, first_day, last_day,
+                                       key=lambda it: (it.date, it.start_time))
+                assert len(rows) == len(per_owner(m, owner_ids, first_day, last_day))
+                in_ms = median_ms(lambda: m.calendar_rows(
+                    m.CalendarItemRow, m.CalendarItem, owner_ids, first_day, last_day,
+                    key=lambda it: (it.date, it.start_time)), args.repeat)
+                loop_ms = median_ms(lambda: per_owner(m, owner_ids, first_day, last_day), args.repeat)
+                m.db.session.remove()
+
+            client.get(url)  # 暖機：「我看得到誰」、封存索引、代碼表進快取
+            statements.clear()
+            page_ms = median_ms(lambda: client.get(url).close(), args.repeat)
+            per_request = len(statements) / args.repeat
+            calendar_sql = sum("FROM calendar_items" in s for s in statements) / args.repeat
+            print(f"{k:>6}{len(rows):>9}{in_ms:>9.2f}{loop_ms:>10.2f}{page_ms:>10.2f}{per_request:>10.1f}"
+                  f"{calendar_sql:>11.1f}")
+
+        for engine in engines:
+            event.remove(engine, "before_cursor_execute", record)
+
+
+if __name__ == "__main__":
+    main()
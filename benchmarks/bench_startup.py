@@ -0,0 +1,105 @@
+"""
+啟動時間 benchmark：量測 worker 冷啟動要花多久
+
+    python benchmarks/bench_startup.py            # import + 第一個請求
+    python benchmarks/bench_startup.py --gunicorn # 另外量 gunicorn 從啟動到可以回應的時間
+
+每一輪都在全新的 Python 子程序裡跑，才量得到真正的冷啟動（沒有 import 快取）。
+資料庫使用暫存檔，不會動到 instance/calendar.db。
+"""
+import argparse
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# 在子程序中執行：import app → 第一個請求，並回報哪些重量級套件被載入
+CHILD = r"""
+import sys, time, json
+t0 = time.perf_counter()
+import app as m
+t1 = time.perf_counter()
+resp = m.app.test_client().get("/login")
+t2 = time.perf_counter()
+heavy = [name for name in ("authlib.integrations.flask_client", "authlib.jose", "requests", "oidc")
+         if name in sys.modules]
+print(json.dumps({"import_ms": (t1 - t0) * 1000, "first_request_ms": (t2 - t1) * 1000,
+                  "status": resp.status_code, "heavy_modules": heavy}))
+"""
+
+
+def run_child(env):
+    out = subprocess.run(
+        [sys.executable, "-c", CHILD], cwd=ROOT, env=env,
+        capture_output=True, text=True, check=True,
+    ).stdout
+    import json
+    return json.loads(out.strip().splitlines()[-1])
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def gunicorn_boot_ms(env, workers):
+    """從啟動 gunicorn 到所有 worker 都能回應 /login 的時間"""
+    port = free_port()
+    t0 = time.perf_counter()
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py", "app:app"],
+        cwd=ROOT,
+        env=dict(env, GUNICORN_BIND=f"127.0.0.1:{port}", WEB_CONCURRENCY=str(workers)),
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    try:
+        ok = 0
+        while ok < workers * 2:  # 連續成功數次，大致確保每個 worker 都起來了
+            try:
+                urllib.request.urlopen(f"http://127.0.0.1:{port}/login", timeout=1).read()
+                ok += 1
+            except OSError:
+                ok = 0
+                time.sleep(0.01)
+            if time.perf_counter() - t0 > 30:
+                raise RuntimeError("gunicorn 30 秒內沒有啟動")
+        return (time.perf_counter() - t0) * 1000
+    finally:
+        proc.terminate()
+        proc.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", "--runs", type=int, default=7)
+    parser.add_argument("--gunicorn", action="store_true")
+    parser.add_argument("--workers", type=int, default=4)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        env = dict(os.environ, DATABASE_URL=f"sqlite:///{os.path.join(tmp, 'bench.db')}",
+                   GOOGLE_CLIENT_ID="bench")
+        results = [run_child(env) for _ in range(args.runs)]
+
+        imp = [r["import_ms"] for r in results]
+        first = [r["first_request_ms"] for r in results]
+        print(f"runs                : {args.runs}")
+        print(f"import app          : median {statistics.median(imp):7.1f} ms  (min {min(imp):.1f})")
+        print(f"first request       : median {statistics.median(first):7.1f} ms  (min {min(first):.1f})")
+        print(f"import + first req  : median {statistics.median(a + b for a, b in zip(imp, first)):7.1f} ms")
+        print(f"heavy modules loaded: {results[0]['heavy_modules'] or 'none'}")
+
+        if args.gunicorn:
+            boots = [gunicorn_boot_ms(env, args.workers) for _ in range(3)]
+            print(f"gunicorn boot (-w {args.workers}): median {statistics.median(boots):7.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
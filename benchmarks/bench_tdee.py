@@ -0,0 +1,151 @@
+"""
+自適應 TDEE：長期使用者（預設 5 年飲食 + 體重紀錄）的計算時間與準確度
+
+    python benchmarks/bench_tdee.py
+    python benchmarks/bench_tdee.py --years 8 -n 50
+
+暫存資料庫，不會動到 instance/calendar.db。假資料照「真實 TDEE」產生：
+每天攝取在真實 TDEE 附近隨機變動，體重依能量差 / 7700 變化再加上每天 ±0.8 kg 的水分雜訊，
+偶爾漏記幾天。量的是：
+- 滑動視窗：每個視窗都重新加總（O(天數 × 視窗)）vs. 前綴和（O(天數)），結果要一致
+- get_tdee_estimate()：第一次（查資料庫 + 計算）vs. 之後（版本號沒變，直接用快取）
+- 最後的估計值跟真實 TDEE 差多少
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from bisect import bisect_left, bisect_right
+from datetime import date, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+TRUE_TDEE = 2400
+
+
+def true_tdee(day_index):
+    # 每年慢慢往下飄一點，看估計能不能跟上
+    return TRUE_TDEE - day_index * 0.1
+
+
+def seed(m, user_id, years):
+    rng = random.Random(42)
+    days = 365 * years
+    start = date.today() - timedelta(days=days)
+    diet, weights = [], []
+    meal_types = m.lookups().meal_types
+    weight = 80.0
+    for i in range(days):
+        d = start + timedelta(days=i)
+        intake = true_tdee(i) + rng.gauss(-150, 400)
+        if rng.random() > 0.15:  # 偶爾漏記
+            for meal, share in (("早餐", 0.25), ("午餐", 0.35), ("晚餐", 0.3), ("點心", 0.1)):
+                diet.append(dict(user_id=user_id, date=d, meal_type_id=meal_types.id(meal), food_name=f"{meal}便當",
+                                 kcal=intake * share, protein_g=20, fat_g=15, carb_g=60))
+        weight += (intake - true_tdee(i)) / 7700
+        if rng.random() > 0.2:
+            weights.append(dict(user_id=user_id, date=d, weight_kg=round(weight + rng.gauss(0, 0.8), 1)))
+    m.db.session.execute(m.DietEntry.__table__.insert(), diet)
+    m.db.session.execute(m.WeightEntry.__table__.insert(), weights)
+    m.db.session.commit()
+    return len(diet), len(weights)
+
+
+def naive_rolling(m, intake, trend, window):
+    """每個視窗重新加總一次，跟 rolling_tdee 做對照"""
+    intake = [(d, k) for d, k in intake if k >= m.TDEE_MIN_DAY_KCAL]
+    start = min(intake[0][0], trend[0][0])
+    end = max(intake[-1][0], trend[-1][0])
+    intake_days, trend_days = [day for day, _ in intake], [day for day, _ in trend]
+    out = []
+    d = start
+    while d <= end:
+        first = max(start, d - timedelta(days=window - 1))
+        kcals = [k for _, k in intake[bisect_left(intake_days, first):bisect_right(intake_days, d)]]
+        points = [((day - start).days, t)
+                  for day, t in trend[bisect_left(trend_days, first):bisect_right(trend_days, d)]]
+        if len(kcals) >= m.TDEE_MIN_INTAKE_DAYS and len(points) >= m.TDEE_MIN_WEIGHT_DAYS:
+            mx = statistics.fmean(x for x, _ in points)
+            my = statistics.fmean(y for _, y in points)
+            var = sum((x - mx) ** 2 for x, _ in points)
+            if var > 0:
+                slope = sum((x - mx) * (y - my) for x, y in points) / var
+                mean = statistics.fmean(kcals)
+                out.append((d, mean - m.KCAL_PER_KG * slope))
+        d += timedelta(days=1)
+    return out
+
+
+def timed(fn, repeat):
+    samples = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - t0)
+    return statistics.median(samples) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--years", type=int, default=5)
+    parser.add_argument("-n", "--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ.update(
+            DATABASE_URL=f"sqlite:///{os.path.join(tmp, 'bench.db')}",
+            METRICS_DIR=os.path.join(tmp, "metrics"),
+            CACHE_VERSIONS_PATH=os.path.join(tmp, "cache_versions.bin"),
+            GOOGLE_CLIENT_ID=os.environ.get("GOOGLE_CLIENT_ID", "bench"),
+        )
+        import app as m
+        from cache import bump_version
+        m.init_schema()
+        with m.app.app_context():
+            user = m.User(email="tdee@bench.local", name="bench")
+            m.db.session.add(user)
+            m.db.session.commit()
+            n_diet, n_weight = seed(m, user.id, args.years)
+            m.db.session.commit()
+            m.get_weight_trend(user.id)
+            print(f"{args.years} 年：{n_diet} 筆飲食、{n_weight} 筆體重，每項跑 {args.repeat} 次\n")
+
+            end = date.today() - timedelta(days=1)
+            intake = (m.db.session.query(m.DietEntry.date, m.func.sum(m.DietEntry.kcal))
+                      .filter(m.DietEntry.user_id == user.id, m.DietEntry.date <= end)
+                      .group_by(m.DietEntry.date).order_by(m.DietEntry.date).all())
+            trend = (m.db.session.query(m.WeightTrendDay.date, m.WeightTrendDay.trend)
+                     .filter(m.WeightTrendDay.user_id == user.id, m.WeightTrendDay.date <= end)
+                     .order_by(m.WeightTrendDay.date).all())
+
+            fast = m.rolling_tdee(intake, trend)
+            slow = naive_rolling(m, intake, trend, m.TDEE_WINDOW_DAYS)
+            assert [w.end for w in fast] == [d for d, _ in slow]
+            diff = max(abs(w.kcal - k) for w, (_, k) in zip(fast, slow))
+            print(f"滑動視窗 {len(fast)} 個，兩種算法最大差 {diff:.6f} kcal")
+
+            naive_ms = timed(lambda: naive_rolling(m, intake, trend, m.TDEE_WINDOW_DAYS), max(1, args.repeat // 10))
+            fast_ms = timed(lambda: m.rolling_tdee(intake, trend), args.repeat)
+            print(f"  每個視窗重新加總 {naive_ms:9.2f} ms")
+            print(f"  前綴和           {fast_ms:9.2f} ms")
+
+            def cold():
+                bump_version(user.id, "diet")
+                m.get_tdee_estimate(user.id)
+            cold_ms = timed(cold, args.repeat)
+            warm_ms = timed(lambda: m.get_tdee_estimate(user.id), args.repeat * 10)
+            print(f"get_tdee_estimate：有新資料 {cold_ms:.2f} ms，沒有新資料（快取）{warm_ms:.4f} ms")
+
+            estimate = m.get_tdee_estimate(user.id)
+            actual = true_tdee((end - (date.today() - timedelta(days=365 * args.years))).days)
+            print(f"\n最新估計 {estimate.kcal:.0f} kcal，真實 {actual:.0f} kcal"
+                  f"（差 {estimate.kcal - actual:+.0f}；{estimate.intake_days} 天飲食、{estimate.weight_days} 天體重）")
+            m.db.session.remove()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+"""
+gunicorn worker 類型：sync vs. gthread vs. gevent 的吞吐量與尾端延遲
+
+    python benchmarks/bench_workers.py                          # 2 個 worker，16 人逛網站 + 4 人不停用 LINE 登入，各 15 秒
+    python benchmarks/bench_workers.py -m sync,gthread -u 32 --line-delay 0.5
+
+每種模式起一個全新的 gunicorn（GUNICORN_MODE，暫存資料庫），worker 數相同：
+- -u 位虛擬使用者跑 loadtest.py 的流程（月曆 → 某一天 → diet_add → strength_add ×N → progress）
+- --line 位使用者不停走完整的 LINE 登入：/login/line → 本機假的 provider（tools/stub_oidc.py）
+  → /auth/line/callback，callback 裡換 token 的 POST 由 provider 故意拖 --line-delay 秒，
+  模擬 line_auth 裡會佔住 worker 的那個對外 HTTP 請求
+印出每種模式的 req/s、一般頁面的 p50 / p95 / p99，以及 LINE 登入的次數與 p95。
+"""
+import argparse
+import os
+import secrets
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from types import SimpleNamespace
+
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from loadtest import ROOT, STEPS, Stats, VirtualUser, free_port, pct, start_gunicorn  # noqa: E402
+
+
+def start_stub(delay):
+    port = free_port()
+    env = dict(os.environ, STUB_OIDC_PORT=str(port), STUB_OIDC_TOKEN_DELAY=str(delay))
+    proc = subprocess.Popen([sys.executable, os.path.join(ROOT, "tools", "stub_oidc.py")], env=env,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    url = f"http://127.0.0.1:{port}"
+    deadline = time.time() + 15
+    while True:
+        try:
+            requests.get(f"{url}/.well-known/openid-configuration", timeout=1)
+            return proc, url
+        except requests.RequestException:
+            if proc.poll() is not None or time.time() > deadline:
+                proc.terminate()
+                raise RuntimeError("stub_oidc 沒有啟動成功")
+            time.sleep(0.05)
+
+
+def line_logins(url, deadline, latencies, errors, lock):
+    while time.perf_counter() < deadline:
+        http = requests.Session()
+        t0 = time.perf_counter()
+        try:
+            r = http.get(f"{url}/login/line", timeout=60)  # 跟著轉址一路走到登入後的月曆
+            ok = r.status_code == 200 and "/login" not in r.url
+        except requests.RequestException:
+            ok = False
+        with lock:
+            latencies.append(time.perf_counter() - t0)
+            errors[0] += not ok
+
+
+def run_mode(mode, args, stub_url):
+    token = secrets.token_urlsafe(16)
+    extra_env = dict(
+        LINE_METADATA_URL=f"{stub_url}/.well-known/openid-configuration",
+        LINE_CLIENT_ID="stub-client",
+        LINE_CLIENT_SECRET="stub-secret",
+    )
+    opts = SimpleNamespace(workers=args.workers, worker_class=mode, threads=args.threads if mode == "gthread" else 0)
+    with tempfile.TemporaryDirectory() as tmp:
+        proc, url = start_gunicorn(opts, tmp, token, extra_env)
+        try:
+            stats = Stats()
+            vu_args = SimpleNamespace(sets=3, legacy_suggest=False, think_ms=0)
+            users = [VirtualUser(n, url, token, vu_args, stats, 0) for n in range(args.users)]
+            for vu in users:
+                vu.login()
+            logins, login_errors, lock = [], [0], threading.Lock()
+            t0 = time.perf_counter()
+            deadline = t0 + args.duration
+            line_threads = [threading.Thread(target=line_logins, args=(url, deadline, logins, login_errors, lock),
+                                             daemon=True) for _ in range(args.line)]
+            for vu in users:
+                vu.deadline = deadline
+                vu.start()
+            for t in line_threads:
+                t.start()
+            for t in [*users, *line_threads]:
+                t.join()
+            elapsed = time.perf_counter() - t0
+        finally:
+            proc.terminate()
+            proc.wait()
+
+    pages = [x * 1000 for step in STEPS for x in stats.latency[step]]
+    return {
+        "rps": len(pages) / elapsed,
+        "errors": sum(stats.errors.values()),
+        "p50": pct(pages, 50), "p95": pct(pages, 95), "p99": pct(pages, 99),
+        "logins": len(logins), "login_errors": login_errors[0],
+        "login_p95": pct([x * 1000 for x in logins], 95),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-m", "--modes", default="sync,gthread,gevent", help="要比較的 GUNICORN_MODE（逗號分隔）")
+    parser.add_argument("-w", "--workers", type=int, default=2, help="每種模式的 worker 數")
+    parser.add_argument("--threads", type=int, default=8, help="gthread 每個 worker 的 thread 數")
+    parser.add_argument("-u", "--users", type=int, default=16, help="逛網站的虛擬使用者數")
+    parser.add_argument("--line", type=int, default=4, help="同時走 LINE 登入的使用者數")
+    parser.add_argument("--line-delay", type=float, default=0.3, help="假 provider 換 token 要等幾秒")
+    parser.add_argument("-d", "--duration", type=float, default=15, help="每種模式壓測幾秒")
+    args = parser.parse_args()
+    modes = args.modes.split(",")
+
+    stub, stub_url = start_stub(args.line_delay)
+    results = {}
+    try:
+        for mode in modes:
+            results[mode] = run_mode(mode, args, stub_url)
+            print(f"{mode}: {results[mode]['rps']:.1f} req/s", flush=True)
+    finally:
+        stub.terminate()
+        stub.wait()
+
+    print(f"\n{args.workers} 個 worker，{args.users} 人逛網站 + {args.line} 人 LINE 登入（換 token 等 {args.line_delay}s），"
+          f"各 {args.duration:g} 秒")
+    print(f"{'模式':<8}{'req/s':>8}{'p50':>9}{'p95':>9}{'p99':>9}{'錯誤':>6}{'LINE 登入':>10}{'登入 p95':>10}   (ms)")
+    for mode, r in results.items():
+        print(f"{mode:<10}{r['rps']:>8.1f}{r['p50']:>9.1f}{r['p95']:>9.1f}{r['p99']:>9.1f}{r['errors']:>6}"
+              f"{r['logins']:>10}{r['login_p95']:>12.1f}"
+              + (f"（失敗 {r['login_errors']}）" if r["login_errors"] else ""))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,273 @@
+"""
+壓力測試：很多虛擬使用者同時走完一段真實的操作流程
+
+    python benchmarks/loadtest.py                           # 自己起 gunicorn（4 個 sync worker），20 人跑 20 秒
+    python benchmarks/loadtest.py -u 50 -d 60 -w 8
+    python benchmarks/loadtest.py -k gthread --threads 4    # 換 worker 類型（sync / gthread / gevent，見 gunicorn.conf.py）
+    python benchmarks/loadtest.py --url http://127.0.0.1:5000 --token <TEST_LOGIN_TOKEN>  # 打已經在跑的服務
+
+每個虛擬使用者用 /login/test（TEST_LOGIN_TOKEN）登入，之後重複：
+    月曆 → 某一天（版本變了才下載食物字典 /api/diet/foods，跟瀏覽器的 IndexedDB 快取一樣）
+    → diet_add → strength_add ×N → progress
+加 --legacy-suggest 改成舊的前端行為：在飲食欄位逐字輸入，每個字打一次 /api/diet/suggest。
+最後印出吞吐量、各步驟的延遲百分位數、錯誤數，以及 /metrics 的 sqlite_lock_errors_total 增加了多少。
+
+自己起 gunicorn 時資料庫與 /metrics 目錄都用暫存檔，不會動到 instance/calendar.db。
+POST 不跟隨 302 轉址，量到的是寫入本身的延遲。
+"""
+import argparse
+import os
+import random
+import re
+import secrets
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import date, timedelta
+
+import requests
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+FOODS = [
+    ("雞胸肉", 165, 31, 3.6, 0), ("白飯", 280, 5, 0.5, 62), ("茶葉蛋", 75, 7, 5, 0.6),
+    ("燕麥奶", 130, 3, 4, 20), ("鮭魚便當", 720, 35, 25, 85), ("地瓜", 120, 2, 0.2, 28),
+    ("希臘優格", 100, 10, 0, 4), ("香蕉", 105, 1.3, 0.4, 27), ("牛肉麵", 650, 30, 20, 80),
+]
+MEALS = ["早餐", "午餐", "晚餐", "點心"]
+EXERCISES = [("胸部", "臥推"), ("腿部", "深蹲"), ("背部", "引體向上"), ("肩部", "肩推")]
+STEPS = ["month", "day", "foods", "suggest", "diet_add", "strength_add", "progress"]
+FOODS_URL_RE = re.compile(r'data-foods-url="([^"]+)"')
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_gunicorn(args, tmp, token, extra_env=None):
+    port = free_port()
+    env = dict(
+        os.environ,
+        **(extra_env or {}),
+        DATABASE_URL=f"sqlite:///{os.path.join(tmp, 'load.db')}",
+        METRICS_DIR=os.path.join(tmp, "metrics"),
+        TEST_LOGIN_TOKEN=token,
+        METRICS_TOKEN=token,
+        GUNICORN_BIND=f"127.0.0.1:{port}",
+        GUNICORN_MODE=args.worker_class,  # gevent 要在 gunicorn.conf.py 裡先 monkey patch，不能只用 -k
+        WEB_CONCURRENCY=str(args.workers),
+        GOOGLE_CLIENT_ID=os.environ.get("GOOGLE_CLIENT_ID", "loadtest"),
+    )
+    if args.threads:
+        env["GUNICORN_THREADS"] = str(args.threads)
+    cmd = [sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py"]
+    proc = subprocess.Popen(cmd + ["app:app"], cwd=ROOT, env=env,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    url = f"http://127.0.0.1:{port}"
+    deadline = time.time() + 30
+    while True:
+        try:
+            requests.get(f"{url}/login", timeout=1)
+            return proc, url
+        except requests.RequestException:
+            if proc.poll() is not None or time.time() > deadline:
+                proc.terminate()
+                raise RuntimeError("gunicorn 沒有啟動成功")
+            time.sleep(0.05)
+
+
+def lock_errors(url, metrics_token=None):
+    headers = {"Authorization": f"Bearer {metrics_token}"} if metrics_token else {}
+    try:
+        resp = requests.get(f"{url}/metrics", headers=headers, timeout=10)
+    except requests.RequestException:
+        return None
+    if resp.status_code != 200:  # 沒設定 METRICS_TOKEN（404）或 token 不對（401）
+        return None
+    m = re.search(r"^sqlite_lock_errors_total (\S+)$", resp.text, re.M)
+    return float(m.group(1)) if m else 0.0
+
+
+class Stats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latency = {step: [] for step in STEPS}
+        self.errors = {step: 0 for step in STEPS}
+        self.journeys = 0
+
+    def record(self, step, seconds, ok):
+        with self.lock:
+            self.latency[step].append(seconds)
+            if not ok:
+                self.errors[step] += 1
+
+
+class VirtualUser(threading.Thread):
+    def __init__(self, n, url, token, args, stats, deadline):
+        super().__init__(daemon=True)
+        self.n = n
+        self.url = url
+        self.token = token
+        self.args = args
+        self.stats = stats
+        self.deadline = deadline
+        self.rng = random.Random(n)
+        self.http = requests.Session()
+        self.foods_url = None  # 模擬 IndexedDB：記住上次下載的字典版本
+
+    def login(self):
+        r = self.http.post(f"{self.url}/login/test",
+                           data={"token": self.token, "email": f"vu{self.n}@loadtest.local"},
+                           timeout=30)
+        r.raise_for_status()
+
+    def call(self, step, method, path, **kwargs):
+        t0 = time.perf_counter()
+        r = None
+        try:
+            r = self.http.request(method, self.url + path, allow_redirects=False, timeout=60, **kwargs)
+            ok = r.status_code < 400 and not (
+                # 沒登入會被轉去 /login，也算失敗
+                r.status_code in (301, 302) and "/login" in r.headers.get("Location", ""))
+        except requests.RequestException:
+            ok = False
+        self.stats.record(step, time.perf_counter() - t0, ok)
+        return r
+
+    def think(self):
+        if self.args.think_ms:
+            time.sleep(self.rng.uniform(0.5, 1.5) * self.args.think_ms / 1000)
+
+    def journey(self):
+        d = date.today() - timedelta(days=self.rng.randrange(60))
+        ds = d.isoformat()
+        self.call("month", "GET", f"/?year={d.year}&month={d.month}")
+        self.think()
+        r = self.call("day", "GET", f"/day/{ds}")
+        self.think()
+
+        name, kcal, protein, fat, carb = self.rng.choice(FOODS)
+        if self.args.legacy_suggest:
+            for i in range(1, len(name) + 1):  # 逐字輸入，每打一個字查一次
+                self.call("suggest", "GET", "/api/diet/suggest", params={"q": name[:i]})
+        else:
+            m = FOODS_URL_RE.search(r.text) if r is not None and r.status_code == 200 else None
+            foods_url = m.group(1).replace("&amp;", "&") if m else None
+            if foods_url and foods_url != self.foods_url:
+                self.foods_url = foods_url
+                self.call("foods", "GET", foods_url)
+        self.call("diet_add", "POST", "/diet/add", data={
+            "date": ds, "meal_type": self.rng.choice(MEALS), "food_name": name,
+            "kcal": kcal, "protein_g": protein, "fat_g": fat, "carb_g": carb,
+        })
+        self.think()
+
+        body_part, exercise = self.rng.choice(EXERCISES)
+        for _ in range(self.args.sets):
+            self.call("strength_add", "POST", "/strength/add", data={
+                "date": ds, "body_part": body_part, "exercise_name": exercise,
+                "weight_kg": self.rng.choice([40, 50, 60, 70, 80]), "reps": self.rng.randint(5, 12),
+            })
+            self.think()
+        self.call("progress", "GET", f"/progress/{exercise}")
+        with self.stats.lock:
+            self.stats.journeys += 1
+
+    def run(self):
+        while time.perf_counter() < self.deadline:
+            self.journey()
+
+
+def pct(values, p):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+
+def report(stats, elapsed, lock_delta):
+    total = sum(len(v) for v in stats.latency.values())
+    errors = sum(stats.errors.values())
+    print(f"elapsed             : {elapsed:.1f} s")
+    print(f"journeys            : {stats.journeys}  ({stats.journeys / elapsed:.1f}/s)")
+    print(f"requests            : {total}  ({total / elapsed:.1f} req/s)")
+    print(f"errors              : {errors}")
+    print(f"sqlite lock errors  : {'n/a' if lock_delta is None else int(lock_delta)}")
+    print()
+    print(f"{'step':<14}{'count':>8}{'err':>6}{'p50':>9}{'p90':>9}{'p95':>9}{'p99':>9}{'max':>9}   (ms)")
+    rows = [(step, stats.latency[step], stats.errors[step]) for step in STEPS]
+    rows.append(("ALL", [x for v in stats.latency.values() for x in v], errors))
+    for step, values, err in rows:
+        ms = [v * 1000 for v in values]
+        print(f"{step:<14}{len(ms):>8}{err:>6}"
+              + "".join(f"{pct(ms, p):>9.1f}" for p in (50, 90, 95, 99))
+              + f"{max(ms, default=0):>9.1f}")
+    if total:
+        all_ms = [x * 1000 for v in stats.latency.values() for x in v]
+        print(f"\nmean {statistics.mean(all_ms):.1f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-u", "--users", type=int, default=20, help="同時的虛擬使用者數")
+    parser.add_argument("-d", "--duration", type=float, default=20, help="壓測秒數")
+    parser.add_argument("--sets", type=int, default=3, help="每趟流程 strength_add 的組數")
+    parser.add_argument("--legacy-suggest", action="store_true",
+                        help="模擬舊前端：每打一個字就呼叫一次 /api/diet/suggest")
+    parser.add_argument("--think-ms", type=float, default=0, help="每一步之間的平均停頓（毫秒）")
+    parser.add_argument("-w", "--workers", type=int, default=4, help="gunicorn worker 數")
+    parser.add_argument("-k", "--worker-class", default="sync", choices=("sync", "gthread", "gevent"),
+                        help="gunicorn worker 類型（GUNICORN_MODE）")
+    parser.add_argument("--threads", type=int, default=0, help="gthread 每個 worker 的 thread 數（預設 8）")
+    parser.add_argument("--url", help="改打已經在跑的服務（需同時設定 TEST_LOGIN_TOKEN）")
+    parser.add_argument("--token", default=os.environ.get("TEST_LOGIN_TOKEN"))
+    parser.add_argument("--metrics-token", default=os.environ.get("METRICS_TOKEN"),
+                        help="搭配 --url：伺服器端的 METRICS_TOKEN（自己起 gunicorn 時用 --token 那組）")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        proc = None
+        if args.url:
+            if not args.token:
+                parser.error("--url 需要搭配 --token（伺服器端的 TEST_LOGIN_TOKEN）")
+            url, token = args.url.rstrip("/"), args.token
+            metrics_token = args.metrics_token
+        else:
+            token = metrics_token = secrets.token_urlsafe(16)
+            proc, url = start_gunicorn(args, tmp, token)
+            print(f"gunicorn -w {args.workers} -k {args.worker_class}"
+                  + (f" --threads {args.threads}" if args.threads else "") + f" @ {url}")
+        try:
+            stats = Stats()
+            users = [VirtualUser(n, url, token, args, stats, 0) for n in range(args.users)]
+            for vu in users:
+                vu.login()
+
+            before = lock_errors(url, metrics_token)
+            t0 = time.perf_counter()
+            for vu in users:
+                vu.deadline = t0 + args.duration
+                vu.start()
+            for vu in users:
+                vu.join()
+            elapsed = time.perf_counter() - t0
+            time.sleep(1.5)  # 等各 worker 把指標寫到磁碟
+            after = lock_errors(url, metrics_token)
+        finally:
+            if proc is not None:
+                proc.terminate()
+                proc.wait()
+
+    delta = after - before if before is not None and after is not None else None
+    print(f"virtual users       : {args.users}")
+    report(stats, elapsed, delta)
+
+
+if __name__ == "__main__":
+    main()
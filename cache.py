@@ -0,0 +1,182 @@
+"""
+跨 worker 的快取失效：每位使用者、每個資料領域（goals / diet / strength / timetable / weight …）一個版本號
+
+版本號放在 instance/cache_versions.bin 這個共用的 mmap 檔裡（每格 8 bytes），
+所有 gunicorn worker 與 worker.py 都映射同一個檔案，所以：
+- 讀版本號 = 從共享記憶體讀 8 bytes（微秒等級，不查資料庫）
+- 寫入資料後 bump_version() 把對應的格子 +1（用 flock 互斥），其他 worker 下次讀就會發現過期
+
+(domain, user_id) 以 hash 對應到固定數量的格子，碰撞只會讓別人的快取多失效一次，不會讀到舊資料。
+
+用法：
+    GOALS = VersionedCache("nutrition_goal", "goals")
+    goal = GOALS.get_or_load(user_id, "global", load_goal)   # 版本沒變就直接回傳上次的結果
+    ...寫入並 commit 之後...
+    bump_version(user_id, "goals")
+"""
+import fcntl
+import mmap
+import os
+import struct
+import threading
+import zlib
+from collections import OrderedDict
+
+from metrics import register_cache
+
+SLOTS = int(os.environ.get("CACHE_VERSION_SLOTS", "65536"))
+_SLOT = struct.Struct("<Q")
+
+
+class VersionCounters:
+    def __init__(self, path=None, slots=SLOTS):
+        self.path = path
+        self.slots = slots
+        self._mm = None
+        self._fd = None
+        self._pid = None
+        self._ino = 0
+        self._lock = threading.Lock()
+
+    def set_path(self, path):
+        self.close()
+        self.path = path
+
+    def close(self):
+        if self._mm is not None:
+            self._mm.close()
+            os.close(self._fd)
+        self._mm = None
+        self._fd = None
+
+    def _map(self):
+        # fork 之後要重新開檔：flock 是綁在「開檔」上的，跟 master 共用同一個 fd 會互斥不到彼此
+        pid = os.getpid()
+        if self._mm is not None and self._pid == pid:
+            return self._mm
+        with self._lock:
+            if self._mm is None or self._pid != pid:
+                os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+                fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+                size = self.slots * _SLOT.size
+                fcntl.flock(fd, fcntl.LOCK_EX)
+                try:
+                    if os.fstat(fd).st_size < size:
+                        os.ftruncate(fd, size)  # 新的部分補 0
+                finally:
+                    fcntl.flock(fd, fcntl.LOCK_UN)
+                self._fd = fd
+                self._pid = pid
+                self._ino = os.fstat(fd).st_ino
+                self._mm = mmap.mmap(fd, size, mmap.MAP_SHARED, mmap.PROT_READ | mmap.PROT_WRITE)
+        return self._mm
+
+    def _offset(self, domain, user_id):
+        return (zlib.crc32(f"{domain}:{user_id}".encode("utf-8")) % self.slots) * _SLOT.size
+
+    def get(self, domain, user_id):
+        if self.path is None:
+            return 0
+        return _SLOT.unpack_from(self._map(), self._offset(domain, user_id))[0]
+
+    def token(self, domain, user_id):
+        """
+        給瀏覽器端快取用的版本字串。版本號檔案被刪掉重建時計數會從 0 開始，
+        所以前面加上檔案的 inode，避免客戶端把舊資料誤認成新版本。
+        """
+        version = self.get(domain, user_id)
+        return f"{self._ino:x}.{version}"
+
+    def bump(self, domain, user_id):
+        if self.path is None:
+            return 0
+        mm = self._map()
+        offset = self._offset(domain, user_id)
+        fcntl.flock(self._fd, fcntl.LOCK_EX)
+        try:
+            version = _SLOT.unpack_from(mm, offset)[0] + 1
+            _SLOT.pack_into(mm, offset, version)
+        finally:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+        return version
+
+
+VERSIONS = VersionCounters()
+
+
+def bump_version(user_id, *domains):
+    """資料 commit 之後呼叫：讓所有 worker 裡這位使用者這些領域的快取失效"""
+    for domain in domains:
+        VERSIONS.bump(domain, user_id)
+
+
+class VersionedCache:
+    """
+    程序內的 LRU 快取，每筆記錄寫入當下的版本號；讀取時版本號不同就當作沒有。
+    loader 回傳的值會被多個請求 / thread 共用，請回傳不可變的資料（tuple、namedtuple、str…），
+    不要放 SQLAlchemy 物件（離開 session 後就不能用了）。
+    domain 可以是 tuple（例如 ("diet", "weight")）：任何一個領域 bump 都會失效。
+    """
+
+    def __init__(self, name, domain, maxsize=2048):
+        self.name = name
+        self.domain = domain
+        self._domains = (domain,) if isinstance(domain, str) else tuple(domain)
+        self.maxsize = maxsize
+        self._data = OrderedDict()  # (user_id, key) -> (version, value)
+        self._lock = threading.Lock()
+        self.stats = register_cache(name)
+
+    def get_or_load(self, user_id, key, loader):
+        # 一定要先讀版本號再載入資料：載入途中有人寫入的話，存進去的版本號已經是舊的，下次就會重載
+        version = tuple(VERSIONS.get(domain, user_id) for domain in self._domains)
+        k = (user_id, key)
+        with self._lock:
+            hit = self._data.get(k)
+            if hit is not None and hit[0] == version:
+                self._data.move_to_end(k)
+                self.stats.hit()
+                return hit[1]
+        self.stats.miss()
+
+        value = loader()
+        with self._lock:
+            self._data[k] = (version, value)
+            self._data.move_to_end(k)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+class LRUCache:
+    """只跟參數有關、不會因為寫入而失效的程序內 LRU（例如每個月固定的月曆骨架）"""
+
+    def __init__(self, name, maxsize=256):
+        self.name = name
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = register_cache(name)
+
+    def get_or_load(self, key, loader):
+        with self._lock:
+            if key in self._data:
+                self._data.move_to_end(key)
+                self.stats.hit()
+                return self._data[key]
+        self.stats.miss()
+
+        value = loader()
+        with self._lock:
+            self._data[key] = value
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
@@ -0,0 +1,79 @@
+"""
+gunicorn 的 worker 類型（sync / gthread / gevent）與 app 之間的相容處理
+
+gunicorn.conf.py 依 GUNICORN_MODE 選 worker_class，並用環境變數 DB_POOL_SIZE 告訴 app 每個 worker 的並行數：
+- sync：一個 worker 同時只處理一個請求，慢的客戶端或對外 HTTP 會佔住整個 worker
+- gthread：每個 worker GUNICORN_THREADS 條 thread。Flask-SQLAlchemy 的 session 綁在 app context（contextvar）上，
+  每個請求各自向連線池借一條 SQLite 連線、用完歸還，連線不會同時被兩條 thread 使用；
+  連線池大小設成 thread 數，尖峰時不會一直開關溢出的連線
+- gevent：gunicorn.conf.py 在載入 app 之前 monkey.patch_all()，socket / ssl / threading / queue 都變成協作式，
+  requests（LINE 換 token、OIDC metadata / JWKS）等網路時會讓給其他請求，連線池也變成 greenlet 之間的號誌。
+  但 sqlite3 是 C 擴充：SQLite 自己的 busy handler 等鎖時會卡住整個 worker 的所有 greenlet，
+  所以 gevent 下連線改用 CooperativeConnection：timeout=0，遇到 "database is locked" 在 Python 裡用
+  gevent.sleep 退避重試，總等待時間跟原本的 busy timeout 一樣
+"""
+import sqlite3
+import sys
+import time
+
+import metrics
+
+BUSY_RETRY_FIRST = 0.002  # 秒，之後每次加倍
+BUSY_RETRY_MAX = 0.1
+
+
+def gevent_patched():
+    """目前的程序是否已經被 gevent monkey patch（gunicorn -k gevent / GUNICORN_MODE=gevent）"""
+    monkey = sys.modules.get("gevent.monkey")
+    return monkey is not None and monkey.is_module_patched("socket")
+
+
+def _retry_busy(fn, timeout):
+    import gevent
+
+    deadline, delay = None, BUSY_RETRY_FIRST
+    while True:
+        try:
+            return fn()
+        except sqlite3.OperationalError as e:
+            if "database is locked" not in str(e):
+                raise
+            now = time.monotonic()
+            if deadline is None:
+                deadline = now + timeout
+            if now >= deadline:
+                raise
+            metrics.SQLITE_LOCK_RETRIES.inc()
+            gevent.sleep(min(delay, deadline - now))
+            delay = min(delay * 2, BUSY_RETRY_MAX)
+
+
+class CooperativeCursor(sqlite3.Cursor):
+    # 失敗的 statement 不會改變交易狀態（SQLite 回 BUSY 時什麼都沒寫），所以可以原樣重送
+    def execute(self, sql, parameters=()):
+        return _retry_busy(lambda: sqlite3.Cursor.execute(self, sql, parameters), self.connection.busy_timeout)
+
+    def executemany(self, sql, seq_of_parameters):
+        seq_of_parameters = list(seq_of_parameters)  # 重試時要能再迭代一次
+        return _retry_busy(lambda: sqlite3.Cursor.executemany(self, sql, seq_of_parameters),
+                           self.connection.busy_timeout)
+
+
+class CooperativeConnection(sqlite3.Connection):
+    """等鎖時讓出給其他 greenlet 的 SQLite 連線（sqlite_connect_args() 在 gevent 下才會用）"""
+    busy_timeout = 15.0
+
+    def cursor(self, factory=CooperativeCursor):
+        return super().cursor(factory)
+
+    def commit(self):
+        # COMMIT 回 BUSY 時交易還在，等讀取的人離開後重送即可
+        _retry_busy(super().commit, self.busy_timeout)
+
+
+def sqlite_connect_args(busy_timeout):
+    """create_engine 的 connect_args：sync / gthread 用 SQLite 內建的 busy timeout，gevent 改成協作式重試"""
+    if gevent_patched():
+        CooperativeConnection.busy_timeout = busy_timeout
+        return {"timeout": 0, "factory": CooperativeConnection}
+    return {"timeout": busy_timeout}
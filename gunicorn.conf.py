@@ -0,0 +1,64 @@
+"""
+Gunicorn 設定檔：gunicorn -c gunicorn.conf.py app:app
+
+preload_app = True：master 先 import app 一次並建表，再 fork 出 worker，
+worker 不用各自重新 import / 檢查 schema，啟動更快也更省記憶體（copy-on-write）。
+
+GUNICORN_MODE 選 worker 類型（app 這邊的相容處理見 concurrency.py）：
+    gthread  （預設）每個 worker GUNICORN_THREADS 條 thread（預設 4 個 worker × 8 條）；
+             慢的客戶端與對外 HTTP（例如 LINE 換 token）只佔一條 thread，不會卡住整個 worker
+    sync     每個 worker 一次處理一個請求；WEB_CONCURRENCY 個 worker（預設 4）
+    gevent   每個 worker 最多 GUNICORN_WORKER_CONNECTIONS 個 greenlet（預設 CPU 數個 worker × 1000），
+             等網路時讓出給其他請求；需要 gevent 套件
+DB_POOL_SIZE（每個 worker 的 SQLite 連線池大小）沒設定時，gthread 跟 thread 數一樣，gevent 是 8：
+同時用資料庫的 greenlet 超過時在連線池排隊（協作式等待，不會卡住其他請求）。
+三種模式的比較：python benchmarks/bench_workers.py
+"""
+import os
+
+MODE = os.environ.get("GUNICORN_MODE", "gthread")
+if MODE == "gevent":
+    # 要在 preload 載入 app（連帶 requests / ssl / threading）之前 patch，之後建立的 socket、鎖、連線池才是協作式的
+    from gevent import monkey
+    monkey.patch_all()
+
+bind = os.environ.get("GUNICORN_BIND", "0.0.0.0:5000")
+preload_app = True
+
+if MODE == "sync":
+    workers = int(os.environ.get("WEB_CONCURRENCY", "4"))
+elif MODE == "gthread":
+    worker_class = "gthread"
+    workers = int(os.environ.get("WEB_CONCURRENCY", "4"))
+    threads = int(os.environ.get("GUNICORN_THREADS", "8"))
+    os.environ.setdefault("DB_POOL_SIZE", str(threads))
+elif MODE == "gevent":
+    worker_class = "gevent"
+    workers = int(os.environ.get("WEB_CONCURRENCY", str(os.cpu_count() or 1)))
+    worker_connections = int(os.environ.get("GUNICORN_WORKER_CONNECTIONS", "1000"))
+    os.environ.setdefault("DB_POOL_SIZE", "8")
+else:
+    raise ValueError(f"GUNICORN_MODE 只能是 sync / gthread / gevent，收到 {MODE!r}")
+
+if MODE != "sync":
+    # sync worker 每個請求後就關連線；gthread / gevent 可以讓瀏覽器重用連線
+    keepalive = int(os.environ.get("GUNICORN_KEEPALIVE", "5"))
+
+
+def on_starting(server):
+    # 只在 master 執行一次
+    from app import init_schema, warm_lookups, warm_templates
+    import metrics
+    init_schema()
+    warm_templates()  # 模板在 master 編譯一次，fork 出去的 worker 直接共用
+    warm_lookups()    # 代碼表（項目類型 / 餐別 / 部位 / 動作）也是
+    metrics.REGISTRY.clear_directory()  # 清掉上次執行留下的 /metrics 檔案
+
+
+def post_fork(server, worker):
+    # master 建表時開過的 SQLite 連線不能跨 process 共用，丟掉讓 worker 自己重連
+    from app import app, db
+    import metrics
+    with app.app_context():
+        db.engine.dispose(close=False)
+    metrics.REGISTRY.reset()
@@ -0,0 +1,231 @@
+"""
+iCalendar（RFC 5545）的最小實作：訂閱網址輸出用的跳脫 / 折行，以及匯入用的逐行解析器
+
+只處理這個專案用得到的部分：VEVENT 的 UID / SUMMARY / DESCRIPTION / LOCATION /
+DTSTART / DTEND / DURATION / RRULE / CATEGORIES。
+
+- 輸出：event() 回傳一個 VEVENT 的字串，呼叫端自己決定多少個一起送出（串流回應）
+- 解析：iter_events(檔案) 一次只讀一行、只保留目前這一個 VEVENT，檔案再大記憶體用量都固定
+
+時間一律用「不帶時區的當地時間」（跟資料庫裡存的一樣）：輸出時不加 TZID，
+讓手機用自己的時區解讀；匯入時 UTC（...Z）與 TZID=... 的時間會換算成 tz 參數指定的時區
+（沒給就用伺服器的時區）。
+"""
+import re
+from collections import namedtuple
+from datetime import datetime, timedelta, timezone
+from functools import lru_cache
+
+PRODID = "-//Flask Super Calendar//ZH-TW"
+CRLF = "\r\n"
+LINE_LIMIT = 75  # bytes，不含換行
+CALENDAR_FOOTER = "END:VCALENDAR" + CRLF
+
+Event = namedtuple("Event", "uid summary description location categories start end rrule")
+
+
+# ===== 輸出 =====
+def escape_text(value):
+    return (
+        (value or "")
+        .replace("\\", "\\\\")
+        .replace(";", "\\;")
+        .replace(",", "\\,")
+        .replace("\r\n", "\\n")
+        .replace("\n", "\\n")
+    )
+
+
+def fold(line):
+    """超過 75 bytes 的行折成多行（後面的行以一個空白開頭），不會切斷 UTF-8 字元"""
+    if len(line.encode("utf-8")) <= LINE_LIMIT:
+        return line + CRLF
+    parts, current, size, limit = [], [], 0, LINE_LIMIT
+    for ch in line:
+        n = len(ch.encode("utf-8"))
+        if size + n > limit:
+            parts.append("".join(current))
+            current, size, limit = [], 0, LINE_LIMIT - 1  # 開頭的空白也算 1 byte
+        current.append(ch)
+        size += n
+    parts.append("".join(current))
+    return (CRLF + " ").join(parts) + CRLF
+
+
+def _dt_prop(name, value):
+    # datetime 也是 date 的子類別，要先判斷
+    if isinstance(value, datetime):
+        return fold(f"{name}:{value.strftime('%Y%m%dT%H%M%S')}")
+    return fold(f"{name};VALUE=DATE:{value.strftime('%Y%m%d')}")
+
+
+def calendar_header(name):
+    return "".join([
+        fold("BEGIN:VCALENDAR"),
+        fold("VERSION:2.0"),
+        fold(f"PRODID:{PRODID}"),
+        fold("CALSCALE:GREGORIAN"),
+        fold("METHOD:PUBLISH"),
+        fold(f"X-WR-CALNAME:{escape_text(name)}"),
+    ])
+
+
+def event(uid, dtstamp, summary, start, end, description=None, categories=None, rrule=None):
+    """
+    一個 VEVENT。start / end 是 date（整天，end 是隔天）或不帶時區的 datetime；
+    dtstamp 是 UTC 的 datetime（內容沒變時要給同樣的值，輸出才會一模一樣）。
+    """
+    lines = [
+        fold("BEGIN:VEVENT"),
+        fold(f"UID:{uid}"),
+        fold(f"DTSTAMP:{dtstamp.strftime('%Y%m%dT%H%M%SZ')}"),
+        _dt_prop("DTSTART", start),
+        _dt_prop("DTEND", end),
+        fold(f"SUMMARY:{escape_text(summary)}"),
+    ]
+    if description:
+        lines.append(fold(f"DESCRIPTION:{escape_text(description)}"))
+    if categories:
+        lines.append(fold(f"CATEGORIES:{escape_text(categories)}"))
+    if rrule:
+        lines.append(fold(f"RRULE:{rrule}"))
+    lines.append(fold("END:VEVENT"))
+    return "".join(lines)
+
+
+# ===== 解析 =====
+_UNESCAPE_RE = re.compile(r"\\([\\;,nN])")
+_DURATION_RE = re.compile(
+    r"^([+-])?P(?:(\d+)W)?(?:(\d+)D)?(?:T(?:(\d+)H)?(?:(\d+)M)?(?:(\d+)S)?)?$")
+
+
+def unescape_text(value):
+    return _UNESCAPE_RE.sub(lambda m: "\n" if m.group(1) in "nN" else m.group(1), value)
+
+
+def iter_lines(fileobj):
+    """
+    從二進位檔逐行讀出「接回折行之後」的內容行。
+    折行可能把一個 UTF-8 字元拆在兩行，所以先接成 bytes 再解碼。
+    """
+    pending = None
+    for raw in fileobj:
+        raw = raw.rstrip(b"\r\n")
+        if raw[:1] in (b" ", b"\t") and pending is not None:
+            pending += raw[1:]
+            continue
+        if pending is not None:
+            yield pending.decode("utf-8", errors="replace")
+        pending = raw
+    if pending:
+        yield pending.decode("utf-8", errors="replace")
+
+
+def parse_line(line):
+    """'DTSTART;TZID=Asia/Taipei:20260318T090000' -> ('DTSTART', {'TZID': 'Asia/Taipei'}, '20260318T090000')"""
+    in_quote = False
+    for i, ch in enumerate(line):
+        if ch == '"':
+            in_quote = not in_quote
+        elif ch == ":" and not in_quote:
+            break
+    else:
+        return None
+    name, *params = line[:i].split(";")
+    return (
+        name.strip().upper(),
+        {k.strip().upper(): v.strip('"') for k, _, v in (p.partition("=") for p in params)},
+        line[i + 1:],
+    )
+
+
+@lru_cache(maxsize=64)
+def _zone(tzid):
+    from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+    try:
+        return ZoneInfo(tzid)
+    except (ZoneInfoNotFoundError, ValueError):
+        return None
+
+
+def parse_datetime(value, params, tz=None):
+    """回傳 date（整天）或換算到 tz（IANA 名稱，None = 伺服器時區）的不帶時區 datetime；格式錯誤丟 ValueError"""
+    value = value.strip()
+    if params.get("VALUE") == "DATE" or len(value) == 8:
+        return datetime.strptime(value[:8], "%Y%m%d").date()
+    dt = datetime.strptime(value.rstrip("Zz"), "%Y%m%dT%H%M%S")
+    if value[-1:] in ("Z", "z"):
+        source = timezone.utc
+    elif "TZID" in params:
+        source = _zone(params["TZID"])
+    else:
+        return dt  # 本來就是當地時間
+    if source is None:  # 不認得的 TZID 就當成當地時間
+        return dt
+    return dt.replace(tzinfo=source).astimezone(_zone(tz) if tz else None).replace(tzinfo=None)
+
+
+def parse_duration(value):
+    m = _DURATION_RE.match(value.strip())
+    if not m:
+        raise ValueError(f"DURATION 格式錯誤：{value}")
+    sign, weeks, days, hours, minutes, seconds = m.groups()
+    delta = timedelta(weeks=int(weeks or 0), days=int(days or 0), hours=int(hours or 0),
+                      minutes=int(minutes or 0), seconds=int(seconds or 0))
+    return -delta if sign == "-" else delta
+
+
+def _build_event(props, tz):
+    if "DTSTART" not in props:
+        return None
+    try:
+        start = parse_datetime(props["DTSTART"][1], props["DTSTART"][0], tz)
+        if "DTEND" in props:
+            end = parse_datetime(props["DTEND"][1], props["DTEND"][0], tz)
+        elif "DURATION" in props:
+            end = start + parse_duration(props["DURATION"][1])
+        else:
+            end = None
+    except ValueError:
+        return None
+
+    def text(name):
+        return unescape_text(props[name][1]) if name in props else None
+
+    return Event(
+        uid=text("UID"),
+        summary=text("SUMMARY"),
+        description=text("DESCRIPTION"),
+        location=text("LOCATION"),
+        categories=text("CATEGORIES"),
+        start=start,
+        end=end,
+        rrule=props["RRULE"][1] if "RRULE" in props else None,
+    )
+
+
+def iter_events(fileobj, tz=None):
+    """逐一產生檔案裡的 VEVENT（Event）；VEVENT 裡面的 VALARM 等子元件與格式錯誤的事件會略過"""
+    current, depth = None, 0
+    for line in iter_lines(fileobj):
+        parsed = parse_line(line)
+        if parsed is None:
+            continue
+        name, params, value = parsed
+        if name == "BEGIN":
+            if current is not None:
+                depth += 1
+            elif value.strip().upper() == "VEVENT":
+                current = {}
+        elif name == "END":
+            if current is None:
+                continue
+            if depth:
+                depth -= 1
+            elif value.strip().upper() == "VEVENT":
+                ev = _build_event(current, tz)
+                current = None
+                if ev is not None:
+                    yield ev
+        elif current is not None and depth == 0:
+            current.setdefault(name, (params, value))
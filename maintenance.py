@@ -0,0 +1,332 @@
+"""
+資料庫維護：線上備份、ANALYZE / optimize、incremental vacuum、quick_check（不用停機）
+
+    python maintenance.py backup      # 線上備份到 instance/backups/<時間>/，並依保留數輪替
+    python maintenance.py optimize    # PRAGMA optimize（--full 改跑有上限的 ANALYZE）
+    python maintenance.py vacuum      # PRAGMA incremental_vacuum，釋放空頁
+    python maintenance.py check       # PRAGMA quick_check
+    python maintenance.py archive     # 舊月份搬進壓縮的冷資料（同 flask --app app archive，見 app.py「冷資料封存」）
+    python maintenance.py all         # 以上全部各跑一次
+    python maintenance.py schedule    # 常駐，依下面的間隔定時執行（跟 worker.py 一樣用獨立容器跑）
+
+分檔模式（SHARD_BY_USER=1）時，每個使用者的 shard 也會一起處理。
+
+備份用 SQLite 的 online backup API，每次只複製 BACKUP_PAGES 頁、中間停 BACKUP_PAUSE 秒，
+每一批只短暫持有讀鎖，寫入的請求不會被卡住太久；備份期間來源被改寫太多次才改成一次複製完。
+
+環境變數：
+    BACKUP_DIR              備份目錄（預設 instance/backups）
+    BACKUP_KEEP             保留最近幾份（預設 14）
+    BACKUP_PAGES            每批複製幾頁（預設 256）
+    BACKUP_PAUSE            每批之間停幾秒（預設 0.01）
+    MAINT_BACKUP_EVERY      schedule 模式的間隔（秒），預設備份 6 小時
+    MAINT_OPTIMIZE_EVERY    optimize 預設 24 小時
+    MAINT_VACUUM_EVERY      incremental vacuum 預設 24 小時
+    MAINT_CHECK_EVERY       quick_check 預設 24 小時
+    MAINT_ARCHIVE_EVERY     冷資料封存預設 24 小時（只搬早於 ARCHIVE_AFTER_DAYS 的整個月，沒有新月份時很快）
+    VACUUM_PAGES            每次 incremental vacuum 最多釋放幾頁（預設 2000）
+"""
+import argparse
+import json
+import os
+import shutil
+import sqlite3
+import time
+from datetime import datetime
+
+import metrics
+
+BACKUP_KEEP = int(os.environ.get("BACKUP_KEEP", "14"))
+BACKUP_PAGES = int(os.environ.get("BACKUP_PAGES", "256"))
+BACKUP_PAUSE = float(os.environ.get("BACKUP_PAUSE", "0.01"))
+VACUUM_PAGES = int(os.environ.get("VACUUM_PAGES", "2000"))
+MAX_RESTARTS = 5
+BUSY_TIMEOUT = 15
+
+SCHEDULE = {
+    "backup": int(os.environ.get("MAINT_BACKUP_EVERY", str(6 * 3600))),
+    "optimize": int(os.environ.get("MAINT_OPTIMIZE_EVERY", str(24 * 3600))),
+    "vacuum": int(os.environ.get("MAINT_VACUUM_EVERY", str(24 * 3600))),
+    "check": int(os.environ.get("MAINT_CHECK_EVERY", str(24 * 3600))),
+    "archive": int(os.environ.get("MAINT_ARCHIVE_EVERY", str(24 * 3600))),
+}
+
+
+def _connect(path):
+    conn = sqlite3.connect(path, timeout=BUSY_TIMEOUT)
+    conn.isolation_level = None  # PRAGMA / VACUUM 不要被包在交易裡
+    return conn
+
+
+# ===== 備份 =====
+class _TooManyRestarts(Exception):
+    pass
+
+
+def backup_file(src_path, dest_path, pages=BACKUP_PAGES, pause=BACKUP_PAUSE):
+    """
+    線上備份單一檔案，回傳 {"pages", "steps", "restarts", "seconds", "bytes"}。
+    先寫到 .tmp 再改名，備份目錄裡不會留下複製到一半的檔案。
+    """
+    t0 = time.perf_counter()
+    tmp = dest_path + ".tmp"
+    state = {"steps": 0, "restarts": 0, "last_remaining": None, "total": 0}
+
+    def progress(status, remaining, total):
+        # 來源被其他連線改寫時 SQLite 會從頭重來，remaining 會變大
+        if state["last_remaining"] is not None and remaining > state["last_remaining"]:
+            state["restarts"] += 1
+            if state["restarts"] > MAX_RESTARTS:
+                raise _TooManyRestarts()
+        state["last_remaining"] = remaining
+        state["total"] = total
+        state["steps"] += 1
+        if pause and remaining:
+            time.sleep(pause)
+
+    src = _connect(src_path)
+    try:
+        dst = sqlite3.connect(tmp)
+        try:
+            try:
+                src.backup(dst, pages=pages, progress=progress)
+            except _TooManyRestarts:
+                # 寫入太頻繁，分批永遠追不上：改成一次複製完（只持有一次讀鎖）
+                src.backup(dst, pages=-1)
+                state["steps"] += 1
+            total = dst.execute("PRAGMA page_count").fetchone()[0]
+        finally:
+            dst.close()
+    finally:
+        src.close()
+    os.replace(tmp, dest_path)
+    return {
+        "pages": total,
+        "steps": state["steps"],
+        "restarts": state["restarts"],
+        "seconds": time.perf_counter() - t0,
+        "bytes": os.path.getsize(dest_path),
+    }
+
+
+def rotate(backup_dir, keep=BACKUP_KEEP):
+    """只保留最新的 keep 份備份（每份是一個以時間命名的資料夾）"""
+    runs = sorted(d for d in os.listdir(backup_dir)
+                  if os.path.isdir(os.path.join(backup_dir, d)) and not d.startswith("."))
+    removed = runs[:-keep] if keep > 0 and len(runs) > keep else []
+    for name in removed:
+        shutil.rmtree(os.path.join(backup_dir, name), ignore_errors=True)
+    return removed
+
+
+def backup(files, backup_dir, keep=BACKUP_KEEP):
+    """把 files（{相對名稱: 路徑}）備份到 backup_dir/<時間>/，驗證後輪替"""
+    run_dir = os.path.join(backup_dir, datetime.now().strftime("%Y%m%d-%H%M%S"))
+    os.makedirs(run_dir, exist_ok=True)
+    report = {}
+    for name, path in files.items():
+        dest = os.path.join(run_dir, name)
+        os.makedirs(os.path.dirname(dest), exist_ok=True)
+        info = backup_file(path, dest)
+        info["check"] = quick_check(dest)["result"]
+        report[name] = info
+    report_path = os.path.join(run_dir, "backup.json")
+    with open(report_path, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    removed = rotate(backup_dir, keep)
+    return run_dir, report, removed
+
+
+# ===== ANALYZE / optimize =====
+def optimize(path, full=False):
+    """
+    預設 PRAGMA optimize：只重新分析「統計可能過期」的表，平常幾毫秒。
+    full=True 時跑 ANALYZE，但用 analysis_limit 限制每個索引只抽樣一部分，大表也不會跑太久。
+    """
+    t0 = time.perf_counter()
+    conn = _connect(path)
+    try:
+        if full:
+            conn.execute("PRAGMA analysis_limit=1000")
+            conn.execute("ANALYZE")
+        else:
+            conn.execute("PRAGMA optimize")
+    finally:
+        conn.close()
+    return {"mode": "analyze" if full else "optimize", "seconds": time.perf_counter() - t0}
+
+
+# ===== incremental vacuum =====
+def enable_incremental_vacuum(path):
+    """
+    改成 auto_vacuum=INCREMENTAL。SQLite 規定要做一次完整的 VACUUM 才會生效，
+    這一次會鎖住整個資料庫（時間約等於複製一次檔案），請在離峰時間手動執行。
+    """
+    t0 = time.perf_counter()
+    conn = _connect(path)
+    try:
+        conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        conn.execute("VACUUM")
+    finally:
+        conn.close()
+    return {"seconds": time.perf_counter() - t0}
+
+
+def incremental_vacuum(path, max_pages=VACUUM_PAGES):
+    """每次最多釋放 max_pages 個空頁，寫入鎖只持有很短的時間"""
+    t0 = time.perf_counter()
+    conn = _connect(path)
+    try:
+        mode = conn.execute("PRAGMA auto_vacuum").fetchone()[0]
+        before = conn.execute("PRAGMA freelist_count").fetchone()[0]
+        if mode == 2:  # INCREMENTAL
+            # execute() 只會跑一步（釋放一頁），executescript 才會跑完整個 PRAGMA
+            conn.executescript(f"PRAGMA incremental_vacuum({int(max_pages)});")
+        after = conn.execute("PRAGMA freelist_count").fetchone()[0]
+    finally:
+        conn.close()
+    return {
+        "enabled": mode == 2,
+        "pages": before - after,
+        "free_pages": after,
+        "seconds": time.perf_counter() - t0,
+    }
+
+
+# ===== 完整性檢查 =====
+def quick_check(path):
+    t0 = time.perf_counter()
+    conn = _connect(path)
+    try:
+        rows = [r[0] for r in conn.execute("PRAGMA quick_check")]
+    finally:
+        conn.close()
+    return {"result": "ok" if rows == ["ok"] else "; ".join(rows[:10]), "seconds": time.perf_counter() - t0}
+
+
+# ===== 命令列 =====
+def database_files():
+    """{備份裡的相對名稱: 實際路徑}：主資料庫，加上分檔模式下所有 shard"""
+    from app import app, db
+    with app.app_context():
+        main = db.engine.url.database
+    files = {os.path.basename(main): main}
+    shard_dir = app.config["SHARD_DIR"]
+    if app.config["SHARD_BY_USER"] and os.path.isdir(shard_dir):
+        for name in sorted(os.listdir(shard_dir)):
+            if name.endswith(".db"):
+                files[os.path.join("shards", name)] = os.path.join(shard_dir, name)
+    return files
+
+
+def backup_dir():
+    from app import app
+    return os.environ.get("BACKUP_DIR", os.path.join(app.instance_path, "backups"))
+
+
+def _timed(task, fn):
+    t0 = time.perf_counter()
+    try:
+        result = fn()
+    except Exception:
+        metrics.MAINT_RUNS.inc(task, "error")
+        raise
+    metrics.MAINT_RUNS.inc(task, "ok")
+    metrics.MAINT_SECONDS.observe(time.perf_counter() - t0, task)
+    metrics.REGISTRY.ensure_flusher()
+    return result
+
+
+def run_task(task, full=False):
+    files = database_files()
+    t0 = time.perf_counter()
+    if task == "backup":
+        run_dir, report, removed = _timed(task, lambda: backup(files, backup_dir()))
+        pages = sum(r["pages"] for r in report.values())
+        size = sum(r["bytes"] for r in report.values()) / 1024 / 1024
+        for name, r in report.items():
+            print(f"  {name:<28}{r['pages']:>8} pages {r['steps']:>5} 批 {r['restarts']:>3} 次重來 "
+                  f"{r['seconds']:>7.2f}s  check={r['check']}")
+        print(f"[backup] {run_dir}：{len(report)} 個檔案、{pages} pages（{size:.1f} MB）"
+              f"，{time.perf_counter() - t0:.2f}s；輪替刪除 {len(removed)} 份舊備份")
+        bad = [n for n, r in report.items() if r["check"] != "ok"]
+        if bad:
+            raise SystemExit(f"[backup] 備份檔檢查失敗：{bad}")
+        return
+    if task == "archive":
+        from app import app, archive_all, archive_summary
+        with app.app_context():
+            cutoff, totals, users = _timed(task, archive_all)
+        print(f"[archive] {cutoff.isoformat()} 之前：{archive_summary(totals, users)}，{time.perf_counter() - t0:.2f}s")
+        return
+
+    fn = {
+        "optimize": lambda p: optimize(p, full=full),
+        "vacuum": incremental_vacuum,
+        "check": quick_check,
+    }[task]
+    results = _timed(task, lambda: {name: fn(path) for name, path in files.items()})
+    for name, r in results.items():
+        detail = ", ".join(f"{k}={v:.3f}" if isinstance(v, float) else f"{k}={v}" for k, v in r.items())
+        print(f"  {name:<28}{detail}")
+    print(f"[{task}] {len(results)} 個檔案，{time.perf_counter() - t0:.2f}s")
+    if task == "vacuum" and not all(r["enabled"] for r in results.values()):
+        print("  (auto_vacuum 不是 INCREMENTAL 的檔案不會釋放空間，"
+              "離峰時可執行 python maintenance.py vacuum --enable 轉換一次)")
+    if task == "check":
+        bad = [n for n, r in results.items() if r["result"] != "ok"]
+        if bad:
+            raise SystemExit(f"[check] quick_check 失敗：{bad}")
+
+
+def schedule():
+    """常駐模式：上次執行時間記在 BACKUP_DIR/.maintenance_state.json，重啟後不會全部重跑"""
+    state_path = os.path.join(backup_dir(), ".maintenance_state.json")
+    os.makedirs(os.path.dirname(state_path), exist_ok=True)
+    try:
+        with open(state_path, encoding="utf-8") as f:
+            last = json.load(f)
+    except (OSError, ValueError):
+        last = {}
+    print(f"[maintenance] 排程：{SCHEDULE}")
+    while True:
+        now = time.time()
+        for task, every in SCHEDULE.items():
+            if every <= 0 or now - last.get(task, 0) < every:
+                continue
+            try:
+                run_task(task)
+            except (Exception, SystemExit) as e:
+                print(f"[{task}] 失敗：{e}")
+            last[task] = time.time()
+            with open(state_path, "w", encoding="utf-8") as f:
+                json.dump(last, f)
+        time.sleep(30)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("task", choices=["backup", "optimize", "vacuum", "check", "archive", "all", "schedule"])
+    parser.add_argument("--full", action="store_true", help="optimize 時跑 ANALYZE 而不是 PRAGMA optimize")
+    parser.add_argument("--enable", action="store_true",
+                        help="vacuum 時先把 auto_vacuum 轉成 INCREMENTAL（會做一次完整 VACUUM，請在離峰執行）")
+    args = parser.parse_args()
+
+    if args.task == "schedule":
+        schedule()
+    elif args.task == "all":
+        for task in ("check", "backup", "archive", "optimize", "vacuum"):
+            run_task(task)
+    else:
+        if args.task == "vacuum" and args.enable:
+            for name, path in database_files().items():
+                print(f"  {name:<28}轉換為 INCREMENTAL，{enable_incremental_vacuum(path)['seconds']:.2f}s")
+        run_task(args.task, full=args.full)
+    metrics.REGISTRY.flush()
+
+
+if __name__ == "__main__":
+    try:
+        main()
+    except KeyboardInterrupt:
+        print("[maintenance] 結束")
@@ -0,0 +1,324 @@
+"""
+簡易 Prometheus 指標（不需要 prometheus_client）
+
+每個 process 在記憶體裡累加 counter / histogram（每次記錄只是幾個 list 加法，微秒等級），
+背景 thread 每隔 FLUSH_INTERVAL 秒把有變動的累計值整份寫到 METRICS_DIR/<pid>.json。
+/metrics 被抓取時把所有 worker 的檔案加總，輸出 Prometheus text format。
+
+用法：
+    from metrics import REGISTRY
+    hits = REGISTRY.counter("foo_total", "說明", ("kind",))
+    hits.inc("a")
+    latency = REGISTRY.histogram("bar_seconds", "說明", ("kind",))
+    latency.observe(0.012, "a")
+    cache = register_cache("goals")   # 任何快取都可以登記命中 / 未命中
+    cache.hit(); cache.miss()
+"""
+import bisect
+import json
+import os
+import threading
+import time
+
+FLUSH_INTERVAL = float(os.environ.get("METRICS_FLUSH_INTERVAL", "1"))
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, registry, name, documentation, labelnames):
+        self.registry = registry
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, *labelvalues, amount=1.0):
+        key = (self.name, labelvalues)
+        values = self.registry._values
+        with self.registry._lock:
+            values[key] = values.get(key, 0.0) + amount
+            self.registry._dirty = True
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, registry, name, documentation, labelnames, buckets=DEFAULT_BUCKETS):
+        super().__init__(registry, name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, *labelvalues):
+        # 每個 bucket 只記「落在這格」的次數，輸出時再轉成累計；最後兩格是 sum、count
+        i = bisect.bisect_left(self.buckets, value)
+        key = (self.name, labelvalues)
+        values = self.registry._values
+        with self.registry._lock:
+            row = values.get(key)
+            if row is None:
+                row = values[key] = [0.0] * (len(self.buckets) + 3)
+            row[i] += 1
+            row[-2] += value
+            row[-1] += 1
+            self.registry._dirty = True
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = {}
+        self.directory = None
+        self._values = {}
+        self._lock = threading.Lock()
+        self._dirty = False
+        self._flusher_pid = None
+
+    # ----- 定義 -----
+    def _add(self, metric):
+        existing = self.metrics.get(metric.name)
+        if existing is not None:
+            return existing
+        self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._add(Counter(self, name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._add(Histogram(self, name, documentation, labelnames, buckets))
+
+    # ----- 跨 process 共用 -----
+    def set_directory(self, directory):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+
+    def _path(self, pid=None):
+        return os.path.join(self.directory, f"{pid or os.getpid()}.json")
+
+    def flush(self):
+        """把本 process 的累計值寫到磁碟（原子替換，抓取時不會讀到寫一半的檔案）"""
+        if self.directory is None:
+            return
+        with self._lock:
+            snapshot = [[name, list(labels), value] for (name, labels), value in self._values.items()]
+            self._dirty = False
+        path = self._path()
+        tmp = f"{path}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(snapshot, f)
+        os.replace(tmp, path)
+
+    def _flush_loop(self):
+        pid = os.getpid()
+        while self._flusher_pid == pid:
+            time.sleep(FLUSH_INTERVAL)
+            if self._dirty:
+                try:
+                    self.flush()
+                except OSError:
+                    pass
+
+    def ensure_flusher(self):
+        """每個 process 第一次記錄時啟動一條 daemon thread 定期寫檔（fork 之後會重新啟動）"""
+        pid = os.getpid()
+        if self._flusher_pid == pid or self.directory is None:
+            return
+        with self._lock:
+            if self._flusher_pid == pid:
+                return
+            self._flusher_pid = pid
+        threading.Thread(target=self._flush_loop, name="metrics-flush", daemon=True).start()
+
+    def reset(self):
+        """gunicorn fork 之後呼叫：丟掉從 master 繼承來的數值，避免每個 worker 重複計算"""
+        with self._lock:
+            self._values = {}
+            self._dirty = False
+
+    def clear_directory(self):
+        """gunicorn master 啟動時清掉上一次留下的檔案"""
+        if self.directory is None:
+            return
+        for name in os.listdir(self.directory):
+            if name.endswith(".json") or name.endswith(".tmp"):
+                try:
+                    os.remove(os.path.join(self.directory, name))
+                except OSError:
+                    pass
+
+    def collect(self):
+        """加總所有 process 的值：{(name, labels): value 或 bucket list}"""
+        self.flush()
+        totals = {}
+        files = os.listdir(self.directory) if self.directory else []
+        sources = []
+        for name in files:
+            if not name.endswith(".json"):
+                continue
+            try:
+                with open(os.path.join(self.directory, name), encoding="utf-8") as f:
+                    sources.append(json.load(f))
+            except (OSError, ValueError):
+                continue  # 正在被替換的檔案，下次再算
+        if self.directory is None:
+            with self._lock:
+                sources.append([[n, list(l), v] for (n, l), v in self._values.items()])
+
+        for snapshot in sources:
+            for name, labels, value in snapshot:
+                key = (name, tuple(labels))
+                if isinstance(value, list):
+                    row = totals.get(key)
+                    if row is None:
+                        totals[key] = list(value)
+                    else:
+                        for i, v in enumerate(value):
+                            row[i] += v
+                else:
+                    totals[key] = totals.get(key, 0.0) + value
+        return totals
+
+    # ----- 輸出 -----
+    def exposition(self):
+        totals = self.collect()
+        by_name = {}
+        for (name, labels), value in totals.items():
+            by_name.setdefault(name, []).append((labels, value))
+
+        lines = []
+        for name in sorted(self.metrics):
+            metric = self.metrics[name]
+            lines.append(f"# HELP {name} {metric.documentation}")
+            lines.append(f"# TYPE {name} {metric.kind}")
+            for labels, value in sorted(by_name.get(name, [])):
+                pairs = list(zip(metric.labelnames, labels))
+                if metric.kind == "histogram":
+                    cumulative = 0.0
+                    for bound, count in zip(metric.buckets + (float("inf"),), value[:-2]):
+                        cumulative += count
+                        le = "+Inf" if bound == float("inf") else _fmt(bound)
+                        lines.append(f"{name}_bucket{_labels(pairs + [('le', le)])} {_fmt(cumulative)}")
+                    lines.append(f"{name}_sum{_labels(pairs)} {_fmt(value[-2])}")
+                    lines.append(f"{name}_count{_labels(pairs)} {_fmt(value[-1])}")
+                else:
+                    lines.append(f"{name}{_labels(pairs)} {_fmt(value)}")
+        return "\n".join(lines) + "\n"
+
+
+def _escape(v):
+    return str(v).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(pairs):
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs) + "}"
+
+
+def _fmt(v):
+    if v == int(v):
+        return str(int(v))
+    return repr(float(v))
+
+
+REGISTRY = Registry()
+
+# ===== 快取命中率 =====
+CACHE_HITS = REGISTRY.counter("cache_hits_total", "快取命中次數", ("cache",))
+CACHE_MISSES = REGISTRY.counter("cache_misses_total", "快取未命中次數", ("cache",))
+
+
+class CacheStats:
+    def __init__(self, name):
+        self.name = name
+
+    def hit(self):
+        CACHE_HITS.inc(self.name)
+
+    def miss(self):
+        CACHE_MISSES.inc(self.name)
+
+
+def register_cache(name):
+    return CacheStats(name)
+
+
+# ===== SQLAlchemy 連線池 / SQLite =====
+DB_CHECKOUTS = REGISTRY.counter("db_pool_checkouts_total", "從連線池借出連線的次數")
+DB_CHECKOUT_WAIT = REGISTRY.histogram(
+    "db_pool_checkout_wait_seconds", "向連線池借連線等待的時間",
+    buckets=(0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0),
+)
+DB_QUERY_SECONDS = REGISTRY.histogram("db_query_duration_seconds", "單一 SQL 執行時間")
+SQLITE_LOCK_ERRORS = REGISTRY.counter(
+    "sqlite_lock_errors_total", "busy timeout 用完仍拿不到鎖（database is locked）的次數")
+SQLITE_LOCK_RETRIES = REGISTRY.counter(
+    "sqlite_lock_retries_total", "因 database is locked 而退避重試的次數（gevent 模式的 CooperativeConnection）")
+
+
+def timed_pool_class(base):
+    """回傳會量測「借連線等了多久」的連線池類別（包住 _do_get）"""
+    class TimedPool(base):
+        def _do_get(self):
+            t0 = time.perf_counter()
+            try:
+                return super()._do_get()
+            finally:
+                DB_CHECKOUT_WAIT.observe(time.perf_counter() - t0)
+    TimedPool.__name__ = f"Timed{base.__name__}"
+    return TimedPool
+
+
+def instrument_engine(engine):
+    from sqlalchemy import event
+
+    @event.listens_for(engine, "checkout")
+    def _on_checkout(dbapi_conn, record, proxy):
+        DB_CHECKOUTS.inc()
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        conn.info["_metrics_t0"] = time.perf_counter()
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        t0 = conn.info.pop("_metrics_t0", None)
+        if t0 is not None:
+            DB_QUERY_SECONDS.observe(time.perf_counter() - t0)
+
+    @event.listens_for(engine, "handle_error")
+    def _on_error(ctx):
+        if "database is locked" in str(ctx.original_exception):
+            SQLITE_LOCK_ERRORS.inc()
+
+
+# ===== 資料庫維護（maintenance.py）=====
+MAINT_RUNS = REGISTRY.counter("maintenance_runs_total", "資料庫維護執行次數", ("task", "status"))
+MAINT_SECONDS = REGISTRY.histogram(
+    "maintenance_duration_seconds", "資料庫維護花費時間", ("task",),
+    buckets=(0.1, 0.5, 1.0, 5.0, 15.0, 60.0, 300.0, 1800.0),
+)
+REMINDERS_SENT = REGISTRY.counter("reminders_sent_total", "提醒送出次數", ("channel", "status"))
+REMINDER_DELAY = REGISTRY.histogram(
+    "reminder_delay_seconds", "提醒實際送出時間比預定晚多久", ("channel",),
+    buckets=(0.1, 0.5, 1.0, 2.0, 5.0, 15.0, 60.0, 300.0),
+)
+
+
+# ===== HTTP 請求 =====
+HTTP_REQUESTS = REGISTRY.counter(
+    "http_requests_total", "HTTP 請求數", ("endpoint", "method", "status"))
+HTTP_LATENCY = REGISTRY.histogram(
+    "http_request_duration_seconds", "HTTP 請求處理時間", ("endpoint",))
+BATCH_RESOURCE_SECONDS = REGISTRY.histogram(
+    "batch_resource_duration_seconds", "/api/batch 每個子請求的執行時間", ("resource",))
+
+
+def observe_request(endpoint, method, status, seconds):
+    HTTP_REQUESTS.inc(endpoint, method, str(status))
+    HTTP_LATENCY.observe(seconds, endpoint)
+    REGISTRY.ensure_flusher()
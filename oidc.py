@@ -0,0 +1,240 @@
+"""
+登入用的 HTTP / OIDC 共用工具
+
+- http_session(): 每個程序共用一個有連線池、timeout、重試退避的 requests.Session
+- OIDCCache: discovery metadata 與 JWKS 的快取（記憶體 + instance/ 底下的磁碟檔，各自有 TTL）
+- verify_id_token(): 用快取的 JWKS 驗證 id_token 的簽章與 iss / aud / exp / nonce
+
+Provider 的網址都由呼叫端傳入，所以可以把 metadata URL 指到本機的 stub provider
+（tools/stub_oidc.py）離線測試整個登入流程。
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from authlib.jose import JsonWebKey, JsonWebToken
+from authlib.jose.errors import JoseError
+
+from metrics import register_cache
+
+# (連線 timeout, 讀取 timeout)，單位秒
+HTTP_TIMEOUT = (
+    float(os.environ.get("HTTP_CONNECT_TIMEOUT", "3.05")),
+    float(os.environ.get("HTTP_READ_TIMEOUT", "10")),
+)
+METADATA_TTL = int(os.environ.get("OIDC_METADATA_TTL", str(24 * 3600)))
+JWKS_TTL = int(os.environ.get("OIDC_JWKS_TTL", "3600"))
+# 遇到不認識的 kid 時強制重抓 JWKS 的最短間隔（每個 jwks_uri）
+JWKS_MIN_REFRESH = int(os.environ.get("OIDC_JWKS_MIN_REFRESH", "60"))
+
+
+class IdTokenError(Exception):
+    """id_token 無法驗證（簽章錯誤、過期、iss/aud/nonce 不符、找不到金鑰…）"""
+
+
+# ===== 共用 HTTP Session =====
+class _TimeoutSession(requests.Session):
+    """沒有指定 timeout 的請求一律套用 HTTP_TIMEOUT，避免卡死 worker"""
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault("timeout", HTTP_TIMEOUT)
+        return super().request(method, url, **kwargs)
+
+
+_session = None
+_session_pid = None
+_session_lock = threading.Lock()
+
+
+def http_session():
+    """
+    取得本程序共用的 Session。
+    gunicorn fork 之後 pid 會變，這時重新建立，避免多個 worker 共用同一批 socket。
+    """
+    global _session, _session_pid
+    pid = os.getpid()
+    if _session is not None and _session_pid == pid:
+        return _session
+
+    with _session_lock:
+        if _session is None or _session_pid != pid:
+            # GET 可以安全重試；POST（例如用 code 換 token）只重試「還沒送出」的連線錯誤
+            retry = Retry(
+                total=3,
+                connect=3,
+                read=2,
+                status=2,
+                backoff_factor=0.3,
+                status_forcelist=(429, 500, 502, 503, 504),
+                allowed_methods=frozenset({"GET", "HEAD"}),
+                respect_retry_after_header=True,
+                raise_on_status=False,
+            )
+            adapter = HTTPAdapter(pool_connections=4, pool_maxsize=10, max_retries=retry)
+            s = _TimeoutSession()
+            s.mount("https://", adapter)
+            s.mount("http://", adapter)
+            _session = s
+            _session_pid = pid
+    return _session
+
+
+# ===== Metadata / JWKS 快取 =====
+class OIDCCache:
+    """
+    以 URL 為 key 的 JSON 快取：先看記憶體，再看磁碟，都過期才發請求。
+    下載失敗時如果手上還有過期的舊資料，就先用舊的（provider 暫時掛掉也還能登入）。
+    """
+
+    def __init__(self, cache_dir, metadata_ttl=METADATA_TTL, jwks_ttl=JWKS_TTL, jwks_min_refresh=JWKS_MIN_REFRESH):
+        self.cache_dir = cache_dir
+        self.metadata_ttl = metadata_ttl
+        self.jwks_ttl = jwks_ttl
+        self.jwks_min_refresh = jwks_min_refresh
+        self._mem = {}  # url -> (fetched_at, data)
+        self._forced = {}  # url -> 本程序上次強制重抓的時間
+        self._lock = threading.Lock()
+        self.stats = register_cache("oidc")
+
+    def _path(self, url):
+        name = hashlib.sha1(url.encode("utf-8")).hexdigest()
+        return os.path.join(self.cache_dir, f"{name}.json")
+
+    def _read_disk(self, url):
+        try:
+            with open(self._path(url), encoding="utf-8") as f:
+                doc = json.load(f)
+            return doc["fetched_at"], doc["data"]
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def _write_disk(self, url, fetched_at, data):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        path = self._path(url)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"url": url, "fetched_at": fetched_at, "data": data}, f)
+        os.replace(tmp, path)  # 原子替換，其他 worker 不會讀到寫一半的檔案
+
+    def _recent(self, url, now, interval):
+        """interval 秒內抓過（任一 worker，看磁碟的 fetched_at）或本程序強制重抓過時，回傳手上那份"""
+        hit = self._mem.get(url)
+        disk = self._read_disk(url)
+        if disk and (hit is None or disk[0] > hit[0]):
+            hit = disk
+        if hit and (now - hit[0] < interval or now - self._forced.get(url, 0) < interval):
+            return hit
+        return None
+
+    def get(self, url, ttl, force=False, min_interval=0):
+        """force=True 略過 TTL 重抓；但 min_interval 秒內抓過的就直接用，不再打 provider"""
+        now = time.time()
+        if not force:
+            hit = self._mem.get(url)
+            if hit and now - hit[0] < ttl:
+                self.stats.hit()
+                return hit[1]
+            hit = self._read_disk(url)
+            if hit and now - hit[0] < ttl:
+                self._mem[url] = hit
+                self.stats.hit()
+                return hit[1]
+
+        with self._lock:
+            if force and min_interval:
+                # 在鎖裡檢查：同時有好幾個請求帶著不認識的 kid 時只有第一個會真的去抓
+                hit = self._recent(url, time.time(), min_interval)
+                if hit:
+                    self.stats.hit()
+                    return hit[1]
+                self._forced[url] = now
+            self.stats.miss()
+            try:
+                resp = http_session().get(url)
+                resp.raise_for_status()
+                data = resp.json()
+            except (requests.RequestException, ValueError):
+                stale = self._mem.get(url) or self._read_disk(url)
+                if stale:
+                    return stale[1]
+                raise
+            self._mem[url] = (now, data)
+            self._write_disk(url, now, data)
+            return data
+
+    def metadata(self, metadata_url, force=False):
+        return self.get(metadata_url, self.metadata_ttl, force=force)
+
+    def jwks(self, jwks_uri, force=False):
+        return self.get(jwks_uri, self.jwks_ttl, force=force, min_interval=self.jwks_min_refresh)
+
+    def prime_oauth_client(self, client, metadata_url):
+        """
+        把快取的 metadata / JWKS 塞進 Authlib 的 client，
+        讓它不必在每個 worker 各自下載 discovery 文件與金鑰。
+        """
+        metadata = self.metadata(metadata_url)
+        loaded_at = client.server_metadata.get("_loaded_at", 0)
+        if time.time() - loaded_at < min(self.metadata_ttl, self.jwks_ttl):
+            return client
+        client.server_metadata.update(metadata)
+        if metadata.get("jwks_uri"):
+            client.server_metadata["jwks"] = self.jwks(metadata["jwks_uri"])
+        client.server_metadata["_loaded_at"] = time.time()
+        return client
+
+
+# ===== id_token 驗證 =====
+def verify_id_token(cache, id_token, metadata_url, client_id,
+                    client_secret=None, nonce=None, leeway=60):
+    """
+    驗證 id_token 並回傳 claims（dict）。
+    - ES256 / RS256：用 provider 的 JWKS（快取命中時完全不需要網路）
+    - HS256：LINE 網頁登入的 id_token 以 channel secret 簽章，需傳入 client_secret
+    遇到不認識的 kid（provider 換金鑰）會強制重抓一次 JWKS；每個 jwks_uri 每 JWKS_MIN_REFRESH 秒最多重抓一次，
+    亂填 kid 的 token 不會讓每次登入都多打一次 provider。
+    """
+    metadata = cache.metadata(metadata_url)
+    algs = list(metadata.get("id_token_signing_alg_values_supported") or ["RS256", "ES256"])
+    if client_secret and "HS256" not in algs:
+        algs.append("HS256")
+
+    def load_key(header, payload):
+        if header.get("alg") == "HS256":
+            if not client_secret:
+                raise IdTokenError("HS256 id_token 需要 client_secret")
+            return client_secret.encode("utf-8")
+
+        kid = header.get("kid")
+        jwks_uri = metadata.get("jwks_uri")
+        if not jwks_uri:
+            raise IdTokenError("metadata 缺少 jwks_uri")
+        try:
+            return JsonWebKey.import_key_set(cache.jwks(jwks_uri)).find_by_kid(kid)
+        except ValueError:
+            jwks = cache.jwks(jwks_uri, force=True)
+            try:
+                return JsonWebKey.import_key_set(jwks).find_by_kid(kid)
+            except ValueError:
+                raise IdTokenError(f"找不到簽章金鑰 kid={kid}")
+
+    claims_options = {
+        "iss": {"essential": True, "values": [metadata.get("issuer")]},
+        "aud": {"essential": True, "values": [client_id]},
+        "exp": {"essential": True},
+        "sub": {"essential": True},
+    }
+    if nonce is not None:
+        claims_options["nonce"] = {"essential": True, "value": nonce}
+
+    try:
+        claims = JsonWebToken(algs).decode(id_token, key=load_key, claims_options=claims_options)
+        claims.validate(leeway=leeway)
+    except JoseError as e:
+        raise IdTokenError(str(e)) from e
+    return dict(claims)
@@ -0,0 +1,186 @@
+"""
+單一請求的取樣式 profiler
+
+開始後另開一條 thread，每 PROFILE_INTERVAL 秒抓一次「被量測那條 thread」的呼叫堆疊，
+累計成 collapsed stack 格式（flamegraph.pl / https://www.speedscope.app 都能直接開）。
+同時用 SQLAlchemy 事件與 Flask 的 template 訊號把時間拆成 SQL / 模板 / 其餘 Python。
+
+只有被選中的請求才會啟動取樣 thread；沒在量測時 SQL / 模板的 hook 只多一次 thread-local 讀取。
+"""
+import json
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+from concurrency import gevent_patched
+
+INTERVAL = float(os.environ.get("PROFILE_INTERVAL", "0.002"))
+MAX_FILES = int(os.environ.get("PROFILE_MAX_FILES", "200"))
+
+_local = threading.local()
+
+
+def current():
+    """目前這條 thread 正在量測的 profiler（沒有就是 None）"""
+    return getattr(_local, "active", None)
+
+
+class RequestProfiler:
+    def __init__(self, interval=INTERVAL):
+        self.interval = interval
+        self.samples = Counter()
+        self.sql_seconds = 0.0
+        self.sql_count = 0
+        self.template_seconds = 0.0
+        self.started = None
+        self.total_seconds = 0.0
+        self._thread_id = None
+        self._stop = threading.Event()
+        self._sampler = None
+        self._sql_t0 = None
+        self._template_t0 = []
+
+    def start(self):
+        self._thread_id = threading.get_ident()
+        _local.active = self
+        self.started = time.perf_counter()
+        if not gevent_patched():
+            # gevent 下所有請求（greenlet）共用同一條 OS thread，抓到的堆疊不一定屬於這個請求，只記 SQL / 模板時間
+            self._sampler = threading.Thread(target=self._sample_loop, name="profiler", daemon=True)
+            self._sampler.start()
+        return self
+
+    def stop(self):
+        self.total_seconds = time.perf_counter() - self.started
+        _local.active = None
+        self._stop.set()
+        if self._sampler is not None:
+            self._sampler.join()
+        return self
+
+    def _sample_loop(self):
+        frames = sys._current_frames
+        while not self._stop.wait(self.interval):
+            frame = frames().get(self._thread_id)
+            if frame is None:
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            stack.reverse()
+            self.samples[";".join(stack)] += 1
+
+    # ----- SQL / 模板計時（由 hook 呼叫）-----
+    def sql_start(self):
+        self._sql_t0 = time.perf_counter()
+
+    def sql_end(self):
+        if self._sql_t0 is not None:
+            self.sql_seconds += time.perf_counter() - self._sql_t0
+            self.sql_count += 1
+            self._sql_t0 = None
+
+    def template_start(self):
+        self._template_t0.append(time.perf_counter())
+
+    def template_end(self):
+        # 巢狀 render_template 只算最外層，避免重複計算
+        if self._template_t0:
+            t0 = self._template_t0.pop()
+            if not self._template_t0:
+                self.template_seconds += time.perf_counter() - t0
+
+    # ----- 輸出 -----
+    def breakdown(self):
+        python = max(self.total_seconds - self.sql_seconds - self.template_seconds, 0.0)
+        return {
+            "total_ms": round(self.total_seconds * 1000, 2),
+            "sql_ms": round(self.sql_seconds * 1000, 2),
+            "sql_count": self.sql_count,
+            "template_ms": round(self.template_seconds * 1000, 2),
+            "python_ms": round(python * 1000, 2),
+            "samples": sum(self.samples.values()),
+        }
+
+    def collapsed(self):
+        return "".join(f"{stack} {count}\n" for stack, count in self.samples.most_common())
+
+    def save(self, directory, meta):
+        """寫出 <name>.folded（火焰圖）與 <name>.json（摘要），回傳 name"""
+        os.makedirs(directory, exist_ok=True)
+        meta = dict(meta, **self.breakdown(), created_at=time.time())
+        name = f"{int(meta['created_at'] * 1000)}-{os.getpid()}-{meta.get('endpoint') or 'unmatched'}"
+        with open(os.path.join(directory, f"{name}.folded"), "w", encoding="utf-8") as f:
+            f.write(self.collapsed())
+        with open(os.path.join(directory, f"{name}.json"), "w", encoding="utf-8") as f:
+            json.dump(dict(meta, name=name), f, ensure_ascii=False)
+        prune(directory)
+        return name
+
+
+def prune(directory, keep=MAX_FILES):
+    """只保留最新的 keep 份"""
+    metas = sorted(n for n in os.listdir(directory) if n.endswith(".json"))
+    for n in metas[:-keep] if len(metas) > keep else []:
+        for ext in (".json", ".folded"):
+            try:
+                os.remove(os.path.join(directory, n[:-5] + ext))
+            except OSError:
+                pass
+
+
+def list_profiles(directory, limit=50):
+    """依總時間由慢到快列出摘要"""
+    if not os.path.isdir(directory):
+        return []
+    rows = []
+    for n in os.listdir(directory):
+        if not n.endswith(".json"):
+            continue
+        try:
+            with open(os.path.join(directory, n), encoding="utf-8") as f:
+                row = json.load(f)
+        except (OSError, ValueError):
+            continue
+        row["created"] = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(row.get("created_at", 0)))
+        rows.append(row)
+    rows.sort(key=lambda r: r.get("total_ms", 0), reverse=True)
+    return rows[:limit]
+
+
+# ===== hooks =====
+def instrument_engine(engine):
+    from sqlalchemy import event
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        p = current()
+        if p is not None:
+            p.sql_start()
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        p = current()
+        if p is not None:
+            p.sql_end()
+
+
+def instrument_flask(app):
+    from flask import before_render_template, template_rendered
+
+    def _before(sender, template, context, **extra):
+        p = current()
+        if p is not None:
+            p.template_start()
+
+    def _after(sender, template, context, **extra):
+        p = current()
+        if p is not None:
+            p.template_end()
+
+    before_render_template.connect(_before, app, weak=False)
+    template_rendered.connect(_after, app, weak=False)
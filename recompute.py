@@ -0,0 +1,385 @@
+"""
+重算衍生資料：衍生表的格式或算法改了之後，替每位使用者從原始資料整個重建一次
+
+    flask --app app recompute                          # 所有工作、所有使用者；有 checkpoint 就接續
+    flask --app app recompute weight_trend -w 8        # 只重算體重趨勢，8 個 process
+    flask --app app recompute --user 3 --user 8        # 只算這幾位
+    flask --app app recompute --restart --duty 0.2     # 忽略 checkpoint 從頭來，寫入更保守
+    flask --app app recompute --queue                  # 每位使用者排一筆 recompute 背景工作，由 worker.py 慢慢算
+
+目前的工作（RECOMPUTE_TASKS，用 @recompute_task 註冊新的）：
+    weight_trend      weight_trend_days / weight_trends：依日期分批讀體重紀錄，重算每日總和與 EWMA 趨勢
+    archive_rollups   archived_days / archived_exercise_days：逐月解壓飲食與重訓的封存分區，重算彙總
+
+做法：
+- 以使用者為單位分給 process pool（fork，-w 個 worker）；worker 算完一位就把結果回報給主 process
+- worker 裡每個工作分批讀（RECOMPUTE_BATCH 天 / 一個封存分區），每批寫成一個短交易（UPSERT），
+  不會有一個大交易長時間握著 SQLite 的寫入鎖；重算途中網站讀到的都是完整的舊值或新值
+- 節流（--duty）：每批 commit 之後睡一下，讓 worker 忙碌（讀 + 寫）的時間不超過 duty 的比例。
+  單一資料庫時所有 worker 共用這個比例（每個分到 duty / worker 數）；分檔模式每人一個檔案，各自計算
+- checkpoint：instance/recompute/<工作>.json，記錄已完成 / 失敗的使用者，每 RECOMPUTE_CHECKPOINT_EVERY 秒
+  與中斷時寫入（先寫暫存檔再 rename）。Ctrl-C 或當掉後再跑同一組工作會跳過已完成的人；
+  全部成功後刪掉 checkpoint，有人失敗時保留，下次只重跑失敗與沒跑到的
+- 每 RECOMPUTE_REPORT_EVERY 秒印一次進度、吞吐量（位/秒、列/秒）與預估剩餘時間
+
+環境變數：
+    RECOMPUTE_BATCH             每批讀幾天（預設 500）
+    RECOMPUTE_DUTY              --duty 的預設值（預設 0.5；1 表示不節流，worker 全速跑）
+    RECOMPUTE_CHECKPOINT_EVERY  幾秒寫一次 checkpoint（預設 5）
+    RECOMPUTE_REPORT_EVERY      幾秒印一次進度（預設 10）
+"""
+import json
+import multiprocessing
+import os
+import time
+
+from sqlalchemy import func
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from app import (app, db, User, WeightEntry, WeightTrendDay, WeightTrend, ArchivePartition,
+                 ewma_step, refresh_weight_summary, decode_partition, rollup_archive_month, bump_version,
+                 enqueue_job)
+from sharding import ROUTER, using_shard
+
+RECOMPUTE_BATCH = int(os.environ.get("RECOMPUTE_BATCH", "500"))
+RECOMPUTE_DUTY = float(os.environ.get("RECOMPUTE_DUTY", "0.5"))
+CHECKPOINT_EVERY = float(os.environ.get("RECOMPUTE_CHECKPOINT_EVERY", "5"))
+REPORT_EVERY = float(os.environ.get("RECOMPUTE_REPORT_EVERY", "10"))
+
+RECOMPUTE_TASKS = {}  # 名稱 -> handler(user_id, writer)
+
+
+def recompute_task(name):
+    """註冊一種衍生資料的重算：handler(user_id, writer) 分批寫入，每批呼叫 writer.commit(列數)"""
+    def decorator(fn):
+        RECOMPUTE_TASKS[name] = fn
+        return fn
+    return decorator
+
+
+class ChunkWriter:
+    """每批寫完 commit 一次，之後依 share 睡一下，讓這個 worker 忙碌的時間比例不超過 share"""
+
+    def __init__(self, share=1.0):
+        self.share = share
+        self.rows = 0
+        self.commits = 0
+        self.slept = 0.0
+        self._mark = time.perf_counter()
+
+    def commit(self, rows=0):
+        db.session.commit()
+        self.rows += rows
+        self.commits += 1
+        if self.share < 1:
+            # 忙了 busy 秒就休息 busy × (1 / share − 1) 秒
+            wait = (time.perf_counter() - self._mark) * (1 / self.share - 1)
+            time.sleep(wait)
+            self.slept += wait
+        self._mark = time.perf_counter()
+
+
+# ===== 重算工作 =====
+
+# executemany 共用同一句編譯好的 SQL（每批 .values(rows) 的話光編譯就比寫入還慢）
+_UPSERT_TREND_DAY = sqlite_insert(WeightTrendDay.__table__)
+_UPSERT_TREND_DAY = _UPSERT_TREND_DAY.on_conflict_do_update(
+    index_elements=["user_id", "date"],
+    set_={c: _UPSERT_TREND_DAY.excluded[c] for c in ("weight_sum", "count", "trend")},
+)
+
+
+@recompute_task("weight_trend")
+def recompute_weight_trend(user_id, writer):
+    """
+    依日期分批（keyset，每批 RECOMPUTE_BATCH 天）讀體重紀錄，UPSERT 每日總和與趨勢值；
+    最後刪掉已經沒有紀錄的日子、更新摘要。跟 rebuild_weight_trend() 算出來的一樣，只是不一次刪光重寫
+    """
+    trend, prev_date, after = None, None, None
+    while True:
+        query = (
+            db.session.query(WeightEntry.date, func.sum(WeightEntry.weight_kg), func.count(WeightEntry.id))
+            .filter(WeightEntry.user_id == user_id)
+        )
+        if after is not None:
+            query = query.filter(WeightEntry.date > after)
+        days = query.group_by(WeightEntry.date).order_by(WeightEntry.date.asc()).limit(RECOMPUTE_BATCH).all()
+        if not days:
+            break
+        rows = []
+        for d, total, n in days:
+            trend = ewma_step(trend, (d - prev_date).days if prev_date else 0, total / n)
+            rows.append(dict(user_id=user_id, date=d, weight_sum=total, count=n, trend=trend))
+            prev_date = d
+        db.session.execute(_UPSERT_TREND_DAY, rows)
+        writer.commit(len(rows))
+        if len(days) < RECOMPUTE_BATCH:
+            break
+        after = days[-1][0]
+
+    stale = (
+        WeightTrendDay.query
+        .filter(WeightTrendDay.user_id == user_id,
+                WeightTrendDay.date.not_in(db.select(WeightEntry.date).where(WeightEntry.user_id == user_id)))
+        .delete(synchronize_session=False)
+    )
+    summary = db.session.get(WeightTrend, user_id)
+    if summary is None:
+        summary = WeightTrend(user_id=user_id)
+        db.session.add(summary)
+    refresh_weight_summary(summary)
+    writer.commit(stale)
+    bump_version(user_id, "weight")
+
+
+@recompute_task("archive_rollups")
+def recompute_archive_rollups(user_id, writer):
+    """每個飲食 / 重訓的封存分區解壓一次、重算那個月的彙總，一個分區一個交易"""
+    parts = (
+        db.session.query(ArchivePartition.id, ArchivePartition.table_name, ArchivePartition.month)
+        .filter(ArchivePartition.user_id == user_id,
+                ArchivePartition.table_name.in_(("diet_entries", "strength_sets")))
+        .order_by(ArchivePartition.month.asc(), ArchivePartition.table_name.asc())
+        .all()
+    )
+    for part_id, table, month in parts:
+        payload = db.session.query(ArchivePartition.payload).filter(ArchivePartition.id == part_id).scalar()
+        columns, rows = decode_partition(payload)
+        rollup_archive_month(user_id, table, month, columns, rows)
+        writer.commit(len(rows))
+    if parts:
+        bump_version(user_id, "diet", "strength")
+
+
+# ===== checkpoint =====
+
+class Checkpoint:
+    """已完成 / 失敗的使用者與累計的列數；檔案不存在時是空的"""
+
+    def __init__(self, path, tasks):
+        self.path = path
+        self.tasks = list(tasks)
+        self.done = set()
+        self.failed = {}   # user_id -> 錯誤訊息
+        self.rows = {name: 0 for name in self.tasks}
+        self.seconds = 0.0  # 之前幾次執行累計的時間
+
+    @classmethod
+    def load(cls, path, tasks):
+        cp = cls(path, tasks)
+        try:
+            with open(path, encoding="utf-8") as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return cp
+        cp.done = set(data["done"])
+        cp.failed = {int(k): v for k, v in data["failed"].items()}
+        cp.rows.update(data["rows"])
+        cp.seconds = data["seconds"]
+        return cp
+
+    def record(self, user_id, rows, error):
+        if error is None:
+            self.done.add(user_id)
+            self.failed.pop(user_id, None)
+        else:
+            self.failed[user_id] = error
+        for name, n in rows.items():
+            self.rows[name] += n
+
+    def save(self, seconds):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp = self.path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({
+                "tasks": self.tasks,
+                "done": sorted(self.done),
+                "failed": {str(k): v for k, v in sorted(self.failed.items())},
+                "rows": self.rows,
+                "seconds": round(self.seconds + seconds, 1),
+            }, f, ensure_ascii=False)
+        os.replace(tmp, self.path)
+
+    def remove(self):
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+
+def checkpoint_path(tasks):
+    return os.path.join(app.instance_path, "recompute", "+".join(tasks) + ".json")
+
+
+# ===== worker =====
+
+_WORKER = {}
+
+
+def _init_worker(tasks, share):
+    _WORKER.update(tasks=tasks, share=share)
+
+
+def _recompute_user(user_id):
+    """在 worker 裡重算一位使用者的所有工作；回傳 (user_id, {工作: 列數}, 秒數, 節流睡了幾秒, 錯誤或 None)"""
+    t0 = time.perf_counter()
+    writer = ChunkWriter(_WORKER["share"])
+    rows, error = {}, None
+    with app.app_context(), using_shard(user_id):
+        for name in _WORKER["tasks"]:
+            before = writer.rows
+            try:
+                RECOMPUTE_TASKS[name](user_id, writer)
+            except Exception as e:
+                db.session.rollback()
+                error = f"{name}: {type(e).__name__}: {e}"
+                break
+            finally:
+                rows[name] = writer.rows - before
+    return user_id, rows, time.perf_counter() - t0, writer.slept, error
+
+
+def _duration(seconds):
+    seconds = int(seconds)
+    if seconds >= 3600:
+        return f"{seconds // 3600}h{seconds % 3600 // 60:02d}m"
+    if seconds >= 60:
+        return f"{seconds // 60}m{seconds % 60:02d}s"
+    return f"{seconds}s"
+
+
+class Progress:
+    def __init__(self, total, skipped):
+        self.total = total
+        self.skipped = skipped
+        self.users = 0
+        self.rows = 0
+        self.busy = 0.0
+        self.slept = 0.0
+        self.started = time.perf_counter()
+        self._last = self.started
+
+    def add(self, rows, seconds, slept):
+        self.users += 1
+        self.rows += sum(rows.values())
+        self.busy += seconds - slept
+        self.slept += slept
+
+    @property
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+    def line(self):
+        elapsed = max(self.elapsed, 1e-9)
+        done = self.skipped + self.users
+        rate = self.users / elapsed
+        eta = f"，預估還要 {_duration((self.total - done) / rate)}" if rate and done < self.total else ""
+        return (f"[recompute] {done:,} / {self.total:,} 位使用者（{done / max(self.total, 1):.1%}），"
+                f"寫入 {self.rows:,} 列｜{rate:,.1f} 位/秒、{self.rows / elapsed:,.0f} 列/秒{eta}")
+
+    def due(self):
+        now = time.perf_counter()
+        if now - self._last >= REPORT_EVERY:
+            self._last = now
+            return True
+        return False
+
+
+def resolve_tasks(tasks=None):
+    """要跑的工作名稱（預設全部）；有不認得的名稱時 ValueError"""
+    tasks = list(tasks or RECOMPUTE_TASKS)
+    unknown = [t for t in tasks if t not in RECOMPUTE_TASKS]
+    if unknown:
+        raise ValueError(f"沒有這種重算工作：{'、'.join(unknown)}（可用：{'、'.join(RECOMPUTE_TASKS)}）")
+    return tasks
+
+
+def _all_user_ids():
+    return [uid for (uid,) in db.session.query(User.id).order_by(User.id.asc())]
+
+
+def enqueue(tasks=None, user_ids=None):
+    """每位使用者排一筆 recompute 背景工作（app.py 的 @job_handler("recompute")）；回傳排了幾筆"""
+    try:
+        tasks = resolve_tasks(tasks)
+    except ValueError as e:
+        raise SystemExit(str(e))
+    with app.app_context():
+        user_ids = user_ids or _all_user_ids()
+        for uid in user_ids:
+            enqueue_job("recompute", {"tasks": tasks}, user_id=uid)
+    return len(user_ids)
+
+
+def run(tasks=None, user_ids=None, workers=None, duty=None, restart=False):
+    """重算 tasks（預設全部）；回傳 Checkpoint。worker 數預設 min(CPU 數, 4)"""
+    try:
+        tasks = resolve_tasks(tasks)
+    except ValueError as e:
+        raise SystemExit(str(e))
+    workers = max(1, workers or min(os.cpu_count() or 1, 4))
+    duty = RECOMPUTE_DUTY if duty is None else duty
+    if not 0 < duty <= 1:
+        raise SystemExit("--duty 必須介於 0 與 1 之間")
+    sharded = app.config["SHARD_BY_USER"]
+    share = duty if sharded or duty == 1 else duty / workers
+
+    path = checkpoint_path(tasks)
+    checkpoint = Checkpoint(path, tasks) if restart else Checkpoint.load(path, tasks)
+    with app.app_context():
+        if not user_ids:
+            user_ids = _all_user_ids()
+        db.session.remove()
+        # fork 出去的 worker 不能沿用這裡開過的 SQLite 連線
+        db.engine.dispose()
+    ROUTER.dispose_all()
+
+    todo = [uid for uid in user_ids if uid not in checkpoint.done]
+    progress = Progress(len(user_ids), len(user_ids) - len(todo))
+    print(f"[recompute] {'、'.join(tasks)}：{len(todo):,} 位使用者要算"
+          + (f"（checkpoint 已完成 {progress.skipped:,} 位）" if progress.skipped else "")
+          + f"，{workers} 個 worker，duty {duty:g}（每個 worker {share:.0%}）")
+
+    pool = None
+    if workers == 1 or len(todo) <= 1:
+        _init_worker(tasks, share)
+        results = map(_recompute_user, todo)
+    else:
+        pool = multiprocessing.get_context("fork").Pool(workers, initializer=_init_worker, initargs=(tasks, share))
+        results = pool.imap_unordered(_recompute_user, todo)
+
+    saved = time.perf_counter()
+    try:
+        for user_id, rows, seconds, slept, error in results:
+            checkpoint.record(user_id, rows, error)
+            progress.add(rows, seconds, slept)
+            if error is not None:
+                print(f"[recompute] user {user_id} 失敗：{error}")
+            if time.perf_counter() - saved >= CHECKPOINT_EVERY:
+                checkpoint.save(progress.elapsed)
+                saved = time.perf_counter()
+            if progress.due() and progress.users < len(todo):
+                print(progress.line())
+    except KeyboardInterrupt:
+        if pool is not None:
+            pool.terminate()
+        checkpoint.save(progress.elapsed)
+        print(progress.line())
+        raise SystemExit(f"[recompute] 已中斷；再執行一次會從 {path} 接續")
+    if pool is not None:
+        pool.close()
+        pool.join()
+
+    print(progress.line())
+    elapsed = max(progress.elapsed, 1e-9)
+    busy = progress.busy + progress.slept
+    print(f"[recompute] 完成：{_duration(elapsed)}，"
+          + "、".join(f"{name} {checkpoint.rows[name]:,} 列" for name in tasks)
+          + ("（累計，含之前中斷的執行）" if progress.skipped else "") + f"；worker 節流睡了 {progress.slept / busy if busy else 0:.0%} 的時間")
+    if checkpoint.failed:
+        checkpoint.save(progress.elapsed)
+        print(f"[recompute] {len(checkpoint.failed)} 位失敗（例如 user {next(iter(checkpoint.failed))}），"
+              f"checkpoint 保留在 {path}，再執行一次只會重跑這些人")
+    else:
+        checkpoint.remove()
+    return checkpoint
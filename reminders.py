@@ -0,0 +1,271 @@
+"""
+提醒排程器：時間到時把提醒送到站內通知 / email / webhook（跟 worker.py 一樣是獨立程序）
+
+    python reminders.py
+
+不輪詢資料表：
+- 只把 next_fire_at 在 REMINDER_HORIZON 秒內的提醒載入記憶體的 heap
+  （走 ix_reminders_next_fire_at 的範圍查詢）；幾十萬筆還沒到的提醒留在資料庫，不佔記憶體
+- 網頁新增 / 修改 / 刪除提醒後會把共用版本號（cache.py 的 mmap，"reminders" 領域）+1，
+  排程器每 REMINDER_TICK 秒讀一次這 8 bytes，有變才重新載入時間窗
+- 沒有任何變動時，只有時間窗到期（每 REMINDER_HORIZON 秒）才查一次資料庫
+
+送出前用「WHERE next_fire_at <= 現在」的條件式 UPDATE ... RETURNING 搶下到期的提醒：
+網頁剛好把時間改晚、刪掉，或同時開了兩個排程器，都不會重複送。
+送出失敗以指數退避重試，超過 REMINDER_MAX_ATTEMPTS 次就放棄（error 欄位留下原因）。
+
+新增送出方式：
+    @reminder_sink("line")
+    def send_line(batch):        # batch 是同一個 channel 的 Due list
+        ...                      # 回傳 {reminder_id: 錯誤訊息} 表示部分失敗；丟例外表示整批失敗
+
+環境變數：
+    REMINDER_HORIZON       一次載入未來幾秒內的提醒（預設 3600）
+    REMINDER_TICK          多久檢查一次版本號（秒，預設 0.5；提醒最多晚這麼久送出）
+    REMINDER_BATCH         一次搶幾筆（預設 500）
+    REMINDER_MAX_ATTEMPTS  送出失敗最多試幾次（預設 5）
+    REMINDER_RETRY_BASE    第 n 次失敗後等 base * 2^(n-1) 秒（預設 30）
+    REMINDER_SMTP_HOST / REMINDER_SMTP_PORT / REMINDER_MAIL_FROM、REMINDER_WEBHOOK_URL、PUBLIC_BASE_URL
+                           見 app.py（本機測試可用 tools/stub_notify.py 當 SMTP / webhook）
+"""
+import heapq
+import os
+import smtplib
+import time
+from collections import defaultdict, namedtuple
+from datetime import datetime, timedelta
+from email.message import EmailMessage
+
+import sqlalchemy as sa
+
+import metrics
+from app import app, db, InboxMessage, Reminder, User, init_schema
+from cache import VERSIONS, bump_version
+
+HORIZON = int(os.environ.get("REMINDER_HORIZON", "3600"))
+TICK = float(os.environ.get("REMINDER_TICK", "0.5"))
+BATCH = int(os.environ.get("REMINDER_BATCH", "500"))
+MAX_ATTEMPTS = int(os.environ.get("REMINDER_MAX_ATTEMPTS", "5"))
+RETRY_BASE = int(os.environ.get("REMINDER_RETRY_BASE", "30"))
+
+Due = namedtuple("Due", "id user_id source item_id title event_at lead_minutes channel attempts scheduled_at")
+
+SINKS = {}
+
+
+def reminder_sink(channel):
+    """註冊送出方式：sink(batch) 回傳 {id: 錯誤訊息}（部分失敗）或 None"""
+    def decorator(fn):
+        SINKS[channel] = fn
+        return fn
+    return decorator
+
+
+def _lead_text(minutes):
+    if minutes % (24 * 60) == 0:
+        return f"{minutes // (24 * 60)} 天"
+    if minutes % 60 == 0:
+        return f"{minutes // 60} 小時"
+    return f"{minutes} 分鐘"
+
+
+def _message(due):
+    """(標題, 內文, 站內連結)"""
+    when = due.event_at.strftime("%Y-%m-%d") if due.source == "important" else due.event_at.strftime("%Y-%m-%d %H:%M")
+    kind = "重要事項" if due.source == "important" else "行事曆"
+    return (
+        f"提醒：{due.title}",
+        f"{kind}「{due.title}」在 {when}（提前 {_lead_text(due.lead_minutes)}通知）",
+        f"/day/{due.event_at.date().isoformat()}",
+    )
+
+
+# ===== 送出方式 =====
+@reminder_sink("inbox")
+def send_inbox(batch):
+    now = datetime.now()
+    rows = []
+    for due in batch:
+        title, body, link = _message(due)
+        rows.append(dict(user_id=due.user_id, title=title, body=body, link=link, created_at=now))
+    db.session.execute(InboxMessage.__table__.insert(), rows)
+    db.session.commit()
+    for user_id in {due.user_id for due in batch}:
+        bump_version(user_id, "inbox")  # 導覽列的未讀數
+
+
+@reminder_sink("email")
+def send_email(batch):
+    emails = dict(
+        db.session.query(User.id, User.email).filter(User.id.in_({due.user_id for due in batch})).all())
+    base_url = app.config["PUBLIC_BASE_URL"]
+    failed = {}
+    # 同一批共用一條 SMTP 連線；連不上就整批失敗（丟例外），單一收件者被拒只算那一筆
+    with smtplib.SMTP(app.config["REMINDER_SMTP_HOST"], app.config["REMINDER_SMTP_PORT"], timeout=10) as smtp:
+        for due in batch:
+            if due.user_id not in emails:
+                failed[due.id] = "找不到使用者的 email"
+                continue
+            title, body, link = _message(due)
+            msg = EmailMessage()
+            msg["Subject"] = title
+            msg["From"] = app.config["REMINDER_MAIL_FROM"]
+            msg["To"] = emails[due.user_id]
+            msg.set_content(f"{body}\n\n{base_url}{link}")
+            try:
+                smtp.send_message(msg)
+            except smtplib.SMTPRecipientsRefused as e:
+                failed[due.id] = f"收件者被拒：{e}"[:200]
+    return failed
+
+
+@reminder_sink("webhook")
+def send_webhook(batch):
+    # 整批一個 POST；對方回非 2xx 就整批重試（接收端要用 id 去重）
+    from oidc import http_session
+    base_url = app.config["PUBLIC_BASE_URL"]
+    payload = {"reminders": []}
+    for due in batch:
+        title, body, link = _message(due)
+        payload["reminders"].append({
+            "id": due.id,
+            "user_id": due.user_id,
+            "source": due.source,
+            "item_id": due.item_id,
+            "title": title,
+            "body": body,
+            "event_at": due.event_at.isoformat(),
+            "lead_minutes": due.lead_minutes,
+            "url": f"{base_url}{link}",
+        })
+    resp = http_session().post(app.config["REMINDER_WEBHOOK_URL"], json=payload)
+    resp.raise_for_status()
+
+
+# ===== 排程 =====
+class ReminderScheduler:
+    """heap 裡放 (next_fire_at, id)，只涵蓋 [現在, window_end] 這段時間"""
+
+    def __init__(self, horizon=HORIZON):
+        self.horizon = timedelta(seconds=horizon)
+        self.heap = []
+        self.window_end = None
+        self.version = None
+        self.loads = 0
+
+    def load_window(self, now):
+        self.version = VERSIONS.get("reminders", 0)  # 先讀版本號：載入途中有變動的話下一輪會再載一次
+        self.window_end = now + self.horizon
+        rows = (
+            db.session.query(Reminder.next_fire_at, Reminder.id)
+            .filter(Reminder.next_fire_at <= self.window_end)
+            .order_by(Reminder.next_fire_at.asc())
+            .all()
+        )
+        db.session.rollback()  # 不要一直開著讀取交易，網頁才能寫入
+        self.heap = [tuple(r) for r in rows]  # 已經依時間排序，本身就是合法的 heap
+        self.loads += 1
+
+    def needs_reload(self, now):
+        return (self.window_end is None or now >= self.window_end
+                or VERSIONS.get("reminders", 0) != self.version)
+
+    def claim(self, ids, now):
+        """ids 是 [(id, 預定時間)]；搶下到期的提醒並回傳 Due，被改期或刪掉的不會出現在結果裡"""
+        scheduled = dict(ids)  # id -> heap 裡的預定時間（算延遲用）
+        stmt = (
+            sa.update(Reminder)
+            .where(Reminder.id.in_(scheduled), Reminder.next_fire_at <= now)
+            .values(next_fire_at=None, fired_at=now, attempts=Reminder.attempts + 1, error=None)
+            .returning(Reminder.id, Reminder.user_id, Reminder.source, Reminder.item_id, Reminder.title,
+                       Reminder.event_at, Reminder.lead_minutes, Reminder.channel, Reminder.attempts)
+        )
+        rows = db.session.execute(stmt, execution_options={"synchronize_session": False}).all()
+        db.session.commit()
+        return [Due(*r, scheduled_at=scheduled[r.id]) for r in rows]
+
+    def fail(self, due, error, now):
+        """送出失敗：還有次數就退避後重排，否則放棄"""
+        if due.attempts < MAX_ATTEMPTS:
+            retry_at = now + timedelta(seconds=RETRY_BASE * (2 ** (due.attempts - 1)))
+            values = {"next_fire_at": retry_at, "fired_at": None, "error": error[:200]}
+        else:
+            retry_at = None
+            values = {"fired_at": None, "error": f"放棄（已嘗試 {due.attempts} 次）：{error}"[:200]}
+        (Reminder.query
+         .filter(Reminder.id == due.id, Reminder.next_fire_at.is_(None))
+         .update(values, synchronize_session=False))
+        db.session.commit()
+        if retry_at is not None and retry_at <= self.window_end:
+            heapq.heappush(self.heap, (retry_at, due.id))
+        metrics.REMINDERS_SENT.inc(due.channel, "error")
+
+    def deliver(self, batch, now):
+        by_channel = defaultdict(list)
+        for due in batch:
+            by_channel[due.channel].append(due)
+        for channel, dues in by_channel.items():
+            sink = SINKS.get(channel)
+            try:
+                if sink is None:
+                    raise RuntimeError(f"沒有註冊的 channel：{channel}")
+                failed = sink(dues) or {}
+            except Exception as e:
+                db.session.rollback()
+                failed = {due.id: f"{type(e).__name__}: {e}" for due in dues}
+                print(f"[reminders] {channel} 送出失敗：{e}")
+            for due in dues:
+                if due.id in failed:
+                    self.fail(due, failed[due.id], now)
+                else:
+                    metrics.REMINDERS_SENT.inc(channel, "ok")
+                    metrics.REMINDER_DELAY.observe(max(0.0, (now - due.scheduled_at).total_seconds()), channel)
+
+    def run_due(self, now):
+        """送出所有到期的提醒，回傳送出（含失敗）筆數"""
+        total = 0
+        while self.heap and self.heap[0][0] <= now:
+            ids = []
+            while self.heap and self.heap[0][0] <= now and len(ids) < BATCH:
+                fire_at, reminder_id = heapq.heappop(self.heap)
+                ids.append((reminder_id, fire_at))
+            batch = self.claim(ids, now)
+            if batch:
+                self.deliver(batch, now)
+                total += len(batch)
+        if total:
+            metrics.REGISTRY.ensure_flusher()
+        return total
+
+    def sleep_seconds(self, now):
+        """睡到下一個提醒，但最多 TICK 秒（要回來看版本號）"""
+        if self.heap:
+            return max(0.0, min(TICK, (self.heap[0][0] - now).total_seconds()))
+        return TICK
+
+    def run(self, once=False):
+        while True:
+            now = datetime.now()
+            if self.needs_reload(now):
+                self.load_window(now)
+            sent = self.run_due(now)
+            if sent:
+                print(f"[reminders] 送出 {sent} 筆，時間窗內還有 {len(self.heap)} 筆")
+            if once:
+                return sent
+            time.sleep(self.sleep_seconds(datetime.now()))
+
+
+def run_scheduler(once=False):
+    """主迴圈；once=True 時送完目前到期的就結束（方便測試 / cron）"""
+    init_schema()
+    with app.app_context():
+        print(f"[reminders] 啟動，channels = {sorted(SINKS)}，時間窗 {HORIZON} 秒")
+        return ReminderScheduler().run(once=once)
+
+
+if __name__ == "__main__":
+    try:
+        run_scheduler(once=os.environ.get("REMINDER_RUN_ONCE") == "1")
+    except KeyboardInterrupt:
+        print("[reminders] 結束")
@@ -0,0 +1,149 @@
+"""
+依使用者分檔的 SQLite（選用，SHARD_BY_USER=1 開啟）
+
+所有人共用一個 calendar.db 時，任何人的寫入都在搶同一把資料庫鎖。
+開啟分檔後：
+- users / social_auths / jobs 等共用資料留在原本的資料庫（DATABASE_URL，稱為 directory）
+- 每位使用者自己的資料表（行事曆、飲食、重訓…）放在 SHARD_DIR/user_<id>.db
+不同使用者的寫入落在不同檔案，彼此不再互相等鎖。
+
+路由對既有程式碼是透明的：ShardedSession.get_bind() 看查詢的是哪張表，
+分檔的表就交給目前使用者的 engine（請求中是 current_user，背景工作用 using_shard(user_id)）。
+每個 shard 的 engine 會快取起來重複使用，超過 SHARD_MAX_OPEN 個時關掉最久沒用的那個。
+
+既有資料用 `python tools/shard_db.py split` 切開。
+"""
+import contextlib
+import contextvars
+import os
+import threading
+from collections import OrderedDict
+
+import sqlalchemy as sa
+from flask_sqlalchemy.session import Session
+
+_shard_user = contextvars.ContextVar("shard_user_id", default=None)
+
+
+@contextlib.contextmanager
+def using_shard(user_id):
+    """請求以外（背景工作、CLI）存取某位使用者的資料時用"""
+    token = _shard_user.set(user_id)
+    try:
+        yield
+    finally:
+        _shard_user.reset(token)
+
+
+def current_shard_user():
+    user_id = _shard_user.get()
+    if user_id is not None:
+        return user_id
+    from flask import has_request_context
+    from flask_login import current_user
+    if has_request_context() and current_user.is_authenticated:
+        return current_user.id
+    raise RuntimeError("存取分檔資料表時找不到目前的使用者（請求外請用 using_shard(user_id)）")
+
+
+def ensure_schema(engine, tables):
+    """建立缺少的資料表，並替已存在的表補上後來新增的索引"""
+    tables = list(tables)
+    if engine.dialect.name == "sqlite":
+        # 只對還沒有任何表的新檔案有效：之後刪資料留下的空頁可以用 maintenance.py vacuum 逐步釋放
+        with engine.begin() as conn:
+            conn.exec_driver_sql("PRAGMA auto_vacuum=INCREMENTAL")
+    tables[0].metadata.create_all(engine, tables=tables)
+    for table in tables:
+        for index in table.indexes:
+            index.create(engine, checkfirst=True)
+
+
+class ShardRouter:
+    def __init__(self):
+        self.enabled = False
+        self.directory = None
+        self.max_open = 64
+        self.tables = ()
+        self.table_names = frozenset()
+        self.engine_options = {}
+        self.on_engine_created = []  # callback(engine)，例如掛上 /metrics 與 profiler 的 hook
+        self._engines = OrderedDict()  # user_id -> Engine（LRU）
+        self._lock = threading.Lock()
+        self._pid = None
+
+    def configure(self, directory, tables, max_open=64, engine_options=None):
+        self.enabled = True
+        self.directory = directory
+        self.tables = tuple(tables)
+        self.table_names = frozenset(t.name for t in self.tables)
+        self.max_open = max_open
+        self.engine_options = dict(engine_options or {})
+        os.makedirs(directory, exist_ok=True)
+
+    def path_for(self, user_id):
+        return os.path.join(self.directory, f"user_{int(user_id)}.db")
+
+    def engine_for(self, user_id):
+        pid = os.getpid()
+        with self._lock:
+            if self._pid != pid:
+                # fork 之後不能沿用 master 的連線，丟掉重開
+                for engine in self._engines.values():
+                    engine.dispose(close=False)
+                self._engines.clear()
+                self._pid = pid
+
+            engine = self._engines.get(user_id)
+            if engine is not None:
+                self._engines.move_to_end(user_id)
+                return engine
+
+            engine = sa.create_engine(f"sqlite:///{self.path_for(user_id)}", **self.engine_options)
+            ensure_schema(engine, self.tables)
+            for callback in self.on_engine_created:
+                callback(engine)
+            self._engines[user_id] = engine
+
+            while len(self._engines) > self.max_open:
+                _, old = self._engines.popitem(last=False)
+                # 還在用的連線歸還時才會真正關閉，不會打斷進行中的請求
+                old.dispose()
+            return engine
+
+    def open_count(self):
+        return len(self._engines)
+
+    def dispose_all(self):
+        with self._lock:
+            for engine in self._engines.values():
+                engine.dispose()
+            self._engines.clear()
+
+
+ROUTER = ShardRouter()
+
+
+def _table_of(mapper, clause):
+    if mapper is not None:
+        return getattr(sa.inspect(mapper), "local_table", None)
+    if isinstance(clause, sa.Table):
+        return clause
+    if isinstance(clause, sa.sql.dml.UpdateBase) and isinstance(clause.table, sa.Table):
+        return clause.table
+    if isinstance(clause, sa.sql.Select):
+        for from_ in clause.get_final_froms():
+            if isinstance(from_, sa.Table):
+                return from_
+    return None
+
+
+class ShardedSession(Session):
+    """分檔開啟時，把每人一份的資料表導向目前使用者的 shard；其餘照 Flask-SQLAlchemy 原本的規則"""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and ROUTER.enabled:
+            table = _table_of(mapper, clause)
+            if table is not None and table.name in ROUTER.table_names:
+                return ROUTER.engine_for(current_shard_user())
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
@@ -1,9 +1,72 @@
+// 食物字典：整份下載一次存在 IndexedDB，版本號沒變（沒有新增 / 刪除飲食紀錄）就不用重新下載，
+// 打字時直接在瀏覽器裡比對前綴，不再每個字都打一次 API。
+// 瀏覽器不支援 IndexedDB 或下載失敗時，退回 /api/diet/suggest（停頓 150ms 才送，並取消還沒回來的舊請求）。
+const FOODS_DB = 'super-calendar';
+const FOODS_STORE = 'diet_foods';
+const FOODS_KEY = 'foods';
+const MAX_SUGGESTIONS = 10;
+const REMOTE_DEBOUNCE_MS = 150;
+
+function openFoodsDb() {
+    return new Promise((resolve, reject) => {
+        if (!window.indexedDB) {
+            reject(new Error('IndexedDB not supported'));
+            return;
+        }
+        const req = indexedDB.open(FOODS_DB, 1);
+        req.onupgradeneeded = () => req.result.createObjectStore(FOODS_STORE);
+        req.onsuccess = () => resolve(req.result);
+        req.onerror = () => reject(req.error);
+    });
+}
+
+function idbRequest(db, mode, action) {
+    return new Promise((resolve, reject) => {
+        const tx = db.transaction(FOODS_STORE, mode);
+        const req = action(tx.objectStore(FOODS_STORE));
+        req.onsuccess = () => resolve(req.result);
+        req.onerror = () => reject(req.error);
+    });
+}
+
+async function loadFoodDictionary(url, version) {
+    let db = null;
+    try {
+        db = await openFoodsDb();
+        const cached = await idbRequest(db, 'readonly', store => store.get(FOODS_KEY));
+        if (cached && cached.version === version) {
+            return cached.foods;
+        }
+    } catch (error) {
+        db = null; // 私密瀏覽等情況打不開 IndexedDB，就只放在記憶體裡
+    }
+
+    const response = await fetch(url);
+    if (!response.ok) {
+        throw new Error(`HTTP ${response.status}`);
+    }
+    const data = await response.json();
+    // 伺服器回傳 [name, kcal, protein, fat, carb] 陣列，省掉每筆重複的欄位名稱
+    const foods = data.foods.map(row => ({
+        name: row[0], key: row[0].toLowerCase(),
+        kcal: row[1], protein: row[2], fat: row[3], carb: row[4],
+    }));
+    if (db) {
+        try {
+            await idbRequest(db, 'readwrite', store => store.put({ version: data.version, foods }, FOODS_KEY));
+        } catch (error) {
+            // 存不進去（例如空間不足）也沒關係，下次再下載
+        }
+    }
+    return foods;
+}
+
 document.addEventListener('DOMContentLoaded', function() {
-    
+
     // 抓取我們剛剛在 day.html 設定好 ID 的所有 DOM 元素
     const foodInput = document.getElementById('food_name_input');
     const suggestionsBox = document.getElementById('suggestions_box');
-    
+
     const kcalInput = document.getElementById('kcal_input');
     const proteinInput = document.getElementById('protein_input');
     const fatInput = document.getElementById('fat_input');
@@ -15,59 +78,102 @@ document.addEventListener('DOMContentLoaded', function() {
         return;
     }
 
-    // 當使用者在 "食品名稱" 欄位打字時...
-    foodInput.addEventListener('input', async function() {
-        const query = foodInput.value;
-        
+    // 頁面一打開就先準備好字典（大多數時候只是從 IndexedDB 讀出來）
+    let dictionary = null;
+    if (foodInput.dataset.foodsUrl) {
+        loadFoodDictionary(foodInput.dataset.foodsUrl, foodInput.dataset.foodsVersion)
+            .then(foods => { dictionary = foods; })
+            .catch(error => console.warn('Food dictionary unavailable, using /api/diet/suggest:', error));
+    }
+
+    function localSuggestions(query) {
+        const q = query.toLowerCase();
+        const matches = [];
+        for (const food of dictionary) {  // 伺服器已依名稱排序
+            if (food.key.startsWith(q)) {
+                matches.push(food);
+                if (matches.length >= MAX_SUGGESTIONS) break;
+            }
+        }
+        return matches;
+    }
+
+    function showSuggestions(suggestions) {
         // 清空舊的建議
         suggestionsBox.innerHTML = '';
-        
+
+        if (suggestions.length === 0) {
+            suggestionsBox.style.display = 'none'; // 沒建議就隱藏
+            return;
+        }
+        suggestionsBox.style.display = 'block'; // 顯示建議框
+
+        suggestions.forEach(item => {
+            // 建立每一個建議選項
+            const suggestionItem = document.createElement('div');
+            suggestionItem.className = 'suggestion-item'; // 方便我們寫 CSS
+
+            // 顯示名稱和熱量
+            suggestionItem.textContent = `${item.name} (${item.kcal || 0} kcal)`;
+
+            // 當 "點擊" 某個建議時...
+            suggestionItem.addEventListener('click', function() {
+                // 1. 自動填入所有欄位
+                foodInput.value = item.name;
+                kcalInput.value = item.kcal || 0;
+                proteinInput.value = item.protein || 0;
+                fatInput.value = item.fat || 0;
+                carbInput.value = item.carb || 0;
+
+                // 2. 隱藏建議列表
+                suggestionsBox.innerHTML = '';
+                suggestionsBox.style.display = 'none';
+            });
+
+            suggestionsBox.appendChild(suggestionItem);
+        });
+    }
+
+    // 字典還沒準備好時才用：停頓一下才送出，新的輸入會取消還在等的舊請求
+    let remoteTimer = null;
+    let remoteController = null;
+
+    function remoteSuggestions(query) {
+        clearTimeout(remoteTimer);
+        remoteTimer = setTimeout(async () => {
+            if (remoteController) remoteController.abort();
+            remoteController = new AbortController();
+            try {
+                const response = await fetch(`/api/diet/suggest?q=${encodeURIComponent(query)}`,
+                                             { signal: remoteController.signal });
+                if (!response.ok) return;
+                const suggestions = await response.json();
+                if (foodInput.value === query) {  // 回來時使用者可能已經改字了
+                    showSuggestions(suggestions);
+                }
+            } catch (error) {
+                if (error.name === 'AbortError') return;
+                console.error('Error fetching diet suggestions:', error);
+                suggestionsBox.style.display = 'none';
+            }
+        }, REMOTE_DEBOUNCE_MS);
+    }
+
+    // 當使用者在 "食品名稱" 欄位打字時...
+    foodInput.addEventListener('input', function() {
+        const query = foodInput.value;
+
         if (query.length < 1) {
+            clearTimeout(remoteTimer);
+            suggestionsBox.innerHTML = '';
             suggestionsBox.style.display = 'none';
             return; // 至少要輸入一個字
         }
 
-        // 去呼叫我們的後端 API
-        try {
-            const response = await fetch(`/api/diet/suggest?q=${encodeURIComponent(query)}`);
-            if (!response.ok) return;
-            
-            const suggestions = await response.json();
-
-            if (suggestions.length > 0) {
-                // 如果 API 有回傳建議...
-                suggestionsBox.style.display = 'block'; // 顯示建議框
-                
-                suggestions.forEach(item => {
-                    // 建立每一個建議選項
-                    const suggestionItem = document.createElement('div');
-                    suggestionItem.className = 'suggestion-item'; // 方便我們寫 CSS
-                    
-                    // 顯示名稱和熱量
-                    suggestionItem.textContent = `${item.name} (${item.kcal || 0} kcal)`;
-                    
-                    // 當 "點擊" 某個建議時...
-                    suggestionItem.addEventListener('click', function() {
-                        // 1. 自動填入所有欄位
-                        foodInput.value = item.name;
-                        kcalInput.value = item.kcal || 0;
-                        proteinInput.value = item.protein || 0;
-                        fatInput.value = item.fat || 0;
-                        carbInput.value = item.carb || 0;
-                        
-                        // 2. 隱藏建議列表
-                        suggestionsBox.innerHTML = '';
-                        suggestionsBox.style.display = 'none';
-                    });
-                    
-                    suggestionsBox.appendChild(suggestionItem);
-                });
-            } else {
-                suggestionsBox.style.display = 'none'; // 沒建議就隱藏
-            }
-        } catch (error) {
-            console.error('Error fetching diet suggestions:', error);
-            suggestionsBox.style.display = 'none';
+        if (dictionary) {
+            showSuggestions(localSuggestions(query));
+        } else {
+            remoteSuggestions(query);
         }
     });
 
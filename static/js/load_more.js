@@ -0,0 +1,46 @@
+// 「載入更多」：沒有 JavaScript 時就是一般連結（換到下一頁）；
+// 有的話改抓 data-json 的 JSON（/api/important、/api/weight），把 html 接在 data-target 後面。
+// 按鈕捲進畫面時自動載入下一頁（無限捲動）。
+document.addEventListener('DOMContentLoaded', function() {
+    const buttons = document.querySelectorAll('.load-more[data-json]');
+
+    const observer = 'IntersectionObserver' in window
+        ? new IntersectionObserver(entries => {
+            entries.forEach(entry => { if (entry.isIntersecting) loadMore(entry.target); });
+        })
+        : null;
+
+    async function loadMore(button) {
+        if (button.dataset.loading) return;
+        button.dataset.loading = '1';
+        try {
+            const response = await fetch(button.dataset.json, { headers: { 'Accept': 'application/json' } });
+            if (!response.ok) throw new Error(`HTTP ${response.status}`);
+            const page = await response.json();
+
+            document.querySelector(button.dataset.target).insertAdjacentHTML('beforeend', page.html);
+            if (page.next_url) {
+                button.dataset.json = page.next_url;
+                if (observer) {  // 新的列不夠把按鈕推出畫面時，重新觀察才會再觸發一次
+                    observer.unobserve(button);
+                    observer.observe(button);
+                }
+            } else {
+                button.remove();
+                return;
+            }
+        } catch (error) {
+            console.error('Error loading more rows:', error);
+        } finally {
+            delete button.dataset.loading;
+        }
+    }
+
+    buttons.forEach(button => {
+        button.addEventListener('click', function(e) {
+            e.preventDefault();
+            loadMore(button);
+        });
+        if (observer) observer.observe(button);
+    });
+});
@@ -0,0 +1,231 @@
+"""
+查詢計畫回歸檢查：確認熱門頁面的查詢都有用到索引
+
+    python tools/check_query_plans.py        # 有問題時 exit code 1，可以放進 CI
+    python tools/check_query_plans.py -v     # 順便印出每一句 SQL 的 EXPLAIN QUERY PLAN
+
+做法：在暫存資料庫塞一批多使用者的假資料並 ANALYZE，以其中一位使用者的身分
+實際打一次 HOT_ROUTES 裡的每個網址，攔下這些請求送出的 SELECT / UPDATE / DELETE，
+再用同樣的參數跑 EXPLAIN QUERY PLAN。只要出現對「每人一份」資料表（有 user_id 欄位的表）的
+SCAN（整張表或整個索引掃過一遍），就算失敗。
+
+新增要檢查的頁面：在 HOT_ROUTES 加一行 route("名稱", "/網址")；
+確定可以接受全表掃描的表（例如資料量固定很小）用 allow_scan=("表名",) 豁免。
+"""
+import argparse
+import os
+import re
+import sys
+import tempfile
+from dataclasses import dataclass, field
+from datetime import date, datetime, time, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@dataclass
+class HotRoute:
+    name: str
+    path: str
+    method: str = "GET"
+    data: dict = None
+    allow_scan: tuple = ()
+    statements: list = field(default_factory=list)
+
+
+def route(name, path, method="GET", data=None, allow_scan=()):
+    return HotRoute(name, path, method, data, tuple(allow_scan))
+
+
+SEED_DAY = date(2026, 3, 18)
+
+HOT_ROUTES = [
+    route("月曆", "/?year=2026&month=3"),
+    route("週檢視", "/week?start=2026-03-16"),
+    route("單日", "/day/2026-03-18"),
+    route("單日（已封存）", "/day/2026-01-20"),
+    route("月曆（已封存）", "/?year=2026&month=1"),
+    route("課表", "/timetable"),
+    route("重要事項", "/important"),
+    route("重要事項下頁", "/api/important?section=past&after=2026-02-01.1"),
+    route("飲食建議", "/api/diet/suggest?q=雞"),
+    route("食物字典", "/api/diet/foods"),
+    route("重訓進度", "/progress/臥推"),
+    route("體重", "/weight"),
+    route("體重下一頁", "/api/weight?after=2026-02-01.1"),
+    route("體重趨勢", "/api/weight/trend"),
+    route("新增體重", "/weight", "POST", {"date": "2026-03-18", "weight_kg": "69.5"}),
+    route("營養目標", "/nutrition_goal"),
+    route("通知", "/inbox"),
+    route("共用設定", "/sharing"),
+    route("批次 API", "/api/batch?r=day:2026-03-18&r=week:2026-03-16&r=progress:臥推"),
+    route("新增項目（含提醒）", "/add", "POST", {
+        "title": "開會", "item_type": "工作", "date": "2099-03-18", "start_time": "09:00", "end_time": "10:00",
+        "remind": "10"}),
+    route("訂閱：行事曆", "/feeds/feed1/calendar.ics"),
+    route("訂閱：重要事項", "/feeds/feed1/important.ics"),
+    route("訂閱：課表", "/feeds/feed1/timetable.ics"),
+    route("新增飲食", "/diet/add", "POST", {
+        "date": "2026-03-18", "meal_type": "午餐", "food_name": "雞胸肉", "kcal": "165"}),
+    route("新增重訓", "/strength/add", "POST", {
+        "date": "2026-03-18", "body_part": "胸部", "exercise_name": "臥推", "weight_kg": "60", "reps": "8"}),
+    route("新增自訂動作", "/strength/exercises", "POST", {
+        "date": "2026-03-18", "body_part": "背部", "exercise_name": "直臂下拉"}),
+]
+
+SCAN_RE = re.compile(r"^SCAN (\w+)")
+ARCHIVE_BEFORE = date(2026, 2, 1)   # seed 的第一個月（1 月）封存起來，熱門頁面也會查到冷資料與彙總
+
+
+def seed(m, users=30, days=120):
+    """每位使用者各塞幾百筆，讓 ANALYZE 後的統計接近真實的多使用者資料庫"""
+    foods = ["雞胸肉", "雞腿便當", "白飯", "茶葉蛋", "燕麥奶", "地瓜", "香蕉", "牛肉麵", "鮭魚", "豆漿"]
+    exercises = [("胸部", "臥推"), ("腿部", "深蹲"), ("背部", "引體向上"), ("肩部", "肩推")]
+    weekdays = [c for c, _ in m.WEEKDAY_CHOICES]
+    base = m.lookups()
+    work, lunch = base.item_types.id("工作"), base.meal_types.id("午餐")
+    exercise_ids = {(ex.body_part, ex.name): ex.id for ex in base.exercises}
+    rows = []
+    for uid in range(1, users + 1):
+        rows.append(m.User(id=uid, email=f"u{uid}@seed.local", name=f"u{uid}"))
+        rows.append(m.FeedToken(user_id=uid, token=f"feed{uid}"))
+        rows.append(m.Exercise(user_id=uid, body_part_id=base.body_parts.id("腿部"), name=f"自訂 {uid}"))
+        for k in range(5):
+            rows.append(m.InboxMessage(user_id=uid, title=f"提醒 {k}"))
+        for i in range(days):
+            d = SEED_DAY - timedelta(days=days // 2) + timedelta(days=i)
+            rows.append(m.CalendarItem(user_id=uid, title=f"item {i}", item_type_id=work, date=d,
+                                       start_time=time(9), end_time=time(10)))
+            for j in range(3):
+                rows.append(m.DietEntry(user_id=uid, date=d, meal_type_id=lunch,
+                                        food_name=foods[(i + j) % len(foods)], kcal=300))
+            part, ex = exercises[i % len(exercises)]
+            for _ in range(3):
+                rows.append(m.StrengthSet(user_id=uid, date=d, exercise_id=exercise_ids[part, ex],
+                                          weight_kg=60, reps=8))
+            rows.append(m.WeightEntry(user_id=uid, date=d, weight_kg=70))
+            if i % 5 == 0:
+                rows.append(m.DiaryEntry(user_id=uid, date=d, title="日記", content="..."))
+                rows.append(m.ImportantItem(user_id=uid, title=f"重要 {i}", date=d))
+                rows.append(m.Reminder(user_id=uid, source="important", item_id=i, title=f"重要 {i}",
+                                       event_at=datetime.combine(d, time(9)), lead_minutes=1440,
+                                       next_fire_at=datetime.combine(d, time(9)) - timedelta(days=1)))
+        for k in range(20):
+            rows.append(m.TimetableEntry(user_id=uid, weekday_code=weekdays[k % 7],
+                                         section=m.SECTION_CHOICES[k % 10], course_name=f"課 {k}"))
+    # user 1 看得到 2 ~ 10 的行事曆：月曆 / 週 / 單日是 user_id IN (...) 查詢
+    for owner in range(2, 11):
+        rows.append(m.CalendarShare(owner_id=owner, viewer_id=1, can_write=owner % 2 == 0))
+    # daily_nutrition_goals.date 是 unique，全域目標只能有一筆
+    rows.append(m.DailyNutritionGoal(user_id=1, date=m.GLOBAL_GOAL_DATE, kcal_target=2000))
+    m.db.session.add_all(rows)
+    m.db.session.commit()
+    cutoff, _, _ = m.archive_all(days=(date.today() - ARCHIVE_BEFORE).days)
+    assert cutoff == ARCHIVE_BEFORE, cutoff
+    with m.db.engine.begin() as conn:
+        conn.exec_driver_sql("ANALYZE")
+
+
+def per_user_tables(m):
+    return {t.name for t in m.db.metadata.sorted_tables if "user_id" in t.c}
+
+
+def capture(m, hot, user_id=1):
+    """以 user_id 的身分打每個網址，記下送出的 SQL 與參數"""
+    from sqlalchemy import event
+
+    current = {"route": None}
+
+    def _record(conn, cursor, statement, parameters, context, executemany):
+        verb = statement.lstrip().split(None, 1)[0].upper()
+        if current["route"] is not None and verb in ("SELECT", "UPDATE", "DELETE"):
+            current["route"].statements.append((statement, parameters))
+
+    with m.app.app_context():
+        engine = m.db.engine
+    event.listen(engine, "before_cursor_execute", _record)
+    try:
+        client = m.app.test_client()
+        with client.session_transaction() as sess:
+            sess["_user_id"] = str(user_id)
+            sess["_fresh"] = True
+        for r in hot:
+            current["route"] = r
+            resp = client.open(r.path, method=r.method, data=r.data)
+            resp.get_data()  # 串流回應（例如 .ics 訂閱）要讀完才會真的執行查詢
+            resp.close()
+            current["route"] = None
+            if resp.status_code >= 400:
+                raise SystemExit(f"{r.name} {r.path} 回應 {resp.status_code}")
+    finally:
+        event.remove(engine, "before_cursor_execute", _record)
+
+
+def explain(m, statement, parameters):
+    with m.db.engine.connect() as conn:
+        rows = conn.exec_driver_sql(f"EXPLAIN QUERY PLAN {statement}", parameters).fetchall()
+    return [row[-1] for row in rows]
+
+
+def check(m, hot, verbose=False):
+    tables = per_user_tables(m)
+    failures = 0
+    for r in hot:
+        seen = set()
+        problems = []
+        for statement, parameters in r.statements:
+            if statement in seen:
+                continue
+            seen.add(statement)
+            plan = explain(m, statement, parameters)
+            bad = [line for line in plan
+                   if (mt := SCAN_RE.match(line)) and mt.group(1) in tables and mt.group(1) not in r.allow_scan]
+            if bad:
+                problems.append((statement, plan, bad))
+            elif verbose:
+                print(f"  [{r.name}] {' '.join(statement.split())[:100]}")
+                for line in plan:
+                    print(f"      {line}")
+
+        status = "FAIL" if problems else "ok"
+        print(f"{status:<5}{r.name:<10}{r.method:<5}{r.path}  ({len(seen)} 句 SQL)")
+        for statement, plan, bad in problems:
+            failures += 1
+            print(f"      SQL : {' '.join(statement.split())}")
+            for line in plan:
+                print(f"      {'>>' if line in bad else '  '} {line}")
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-v", "--verbose", action="store_true")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        # 一定要在 import app 之前設定，才不會動到 instance/calendar.db
+        os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(tmp, 'plans.db')}"
+        os.environ["METRICS_DIR"] = os.path.join(tmp, "metrics")
+        os.environ.setdefault("GOOGLE_CLIENT_ID", "query-plans")
+        sys.path.insert(0, ROOT)
+        import app as m
+
+        m.init_schema()
+        with m.app.app_context():
+            seed(m)
+            m.db.session.remove()
+        # 在 app context 外面打網址，每個請求才會有自己的 session（跟正式環境一樣）
+        capture(m, HOT_ROUTES)
+        with m.app.app_context():
+            failures = check(m, HOT_ROUTES, args.verbose)
+            m.db.session.remove()
+            m.db.engine.dispose()
+
+    if failures:
+        print(f"\n{failures} 句查詢對每人一份的資料表做了全表掃描")
+        sys.exit(1)
+    print("\n所有熱門查詢都有用到索引")
+
+
+if __name__ == "__main__":
+    main()
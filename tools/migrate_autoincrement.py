@@ -0,0 +1,151 @@
+"""
+把會被封存的資料表（calendar_items / diet_entries / strength_sets / diary_entries）改成 AUTOINCREMENT
+
+    python tools/migrate_autoincrement.py            # 主資料庫 + SHARD_DIR 底下每個分檔（可重複執行）
+    python tools/migrate_autoincrement.py --dry-run  # 只列出哪些檔案 / 表要轉
+
+沒有 AUTOINCREMENT 時 SQLite 的新 id 是 max(id) + 1：封存刪掉最新的列之後，新列會拿到封存裡已經有的 id，
+ICS 訂閱的 UID（calendar-<user>-<id>）重複、提醒 (user_id, source, item_id) 對到別的項目。
+- 每張表在一個交易裡重建：刪舊索引 -> 舊表改名 -> 建新表與索引 -> INSERT ... SELECT -> 核對筆數 -> 刪掉舊表。
+  id 與其他欄位原封不動，中途失敗整張表回滾
+- sqlite_sequence 設成 max(熱資料表最大 id, 封存裡最大 id)，之後的新列一定比封存過的 id 大
+  （已經是 AUTOINCREMENT 的表也會檢查這一步，所以可以重複執行）
+- 轉換前就已經被重用的 id 只能列出來（熱資料表與封存裡同一個 id 的列數），不會自動改
+
+執行前請先停掉網站、worker.py、reminders.py 與 maintenance.py schedule。
+"""
+import argparse
+import sqlite3
+
+from migrate_lookups import database_files, existing_columns, load_app
+
+
+def has_table(conn, name):
+    return conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (name,)).fetchone() is not None
+
+
+def has_autoincrement(conn, name):
+    sql = conn.execute("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = ?", (name,)).fetchone()[0]
+    return "AUTOINCREMENT" in sql.upper()
+
+
+def archived_ids(m, conn, table):
+    """封存裡這張表所有列的 id"""
+    ids = set()
+    if not has_table(conn, "archive_partitions"):
+        return ids
+    for (payload,) in conn.execute("SELECT payload FROM archive_partitions WHERE table_name = ?", (table,)):
+        columns, rows = m.decode_partition(payload)
+        i = columns.index("id")
+        ids.update(row[i] for row in rows)
+    return ids
+
+
+def rebuild(conn, table):
+    """用 AUTOINCREMENT 的 schema 重建 table（欄位相同），回傳搬了幾列"""
+    from sqlalchemy.dialects import sqlite as sqlite_dialect
+    from sqlalchemy.schema import CreateIndex, CreateTable
+
+    dialect = sqlite_dialect.dialect()
+    old_name = f"{table.name}__rowid"
+    old_columns = existing_columns(conn, table.name)
+    columns = ", ".join(f'"{c.name}"' for c in table.columns if c.name in old_columns)
+
+    conn.execute("BEGIN")
+    try:
+        indexes = [r[0] for r in conn.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = ? AND sql IS NOT NULL", (table.name,))]
+        for name in indexes:
+            conn.execute(f'DROP INDEX "{name}"')
+        conn.execute(f'ALTER TABLE "{table.name}" RENAME TO "{old_name}"')
+        conn.execute(str(CreateTable(table).compile(dialect=dialect)))
+        for index in table.indexes:
+            conn.execute(str(CreateIndex(index).compile(dialect=dialect)))
+        conn.execute(f'INSERT INTO "{table.name}" ({columns}) SELECT {columns} FROM "{old_name}" ORDER BY id')
+        before = conn.execute(f'SELECT COUNT(*) FROM "{old_name}"').fetchone()[0]
+        after = conn.execute(f'SELECT COUNT(*) FROM "{table.name}"').fetchone()[0]
+        if before != after:
+            raise RuntimeError(f"{table.name}：舊表 {before} 列，新表只有 {after} 列")
+        conn.execute(f'DROP TABLE "{old_name}"')
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    return after
+
+
+def raise_sequence(conn, table, floor):
+    """sqlite_sequence 至少是 floor；回傳調整後的值"""
+    row = conn.execute("SELECT seq FROM sqlite_sequence WHERE name = ?", (table,)).fetchone()
+    if row is None:
+        conn.execute("INSERT INTO sqlite_sequence (name, seq) VALUES (?, ?)", (table, floor))
+        return floor
+    if row[0] < floor:
+        conn.execute("UPDATE sqlite_sequence SET seq = ? WHERE name = ?", (floor, table))
+        return floor
+    return row[0]
+
+
+def migrate_file(m, path, dry_run=False):
+    """轉換一個 SQLite 檔；回傳 [(表名, 是否重建, 列數, sequence, 重用的 id 數)]"""
+    conn = sqlite3.connect(path, isolation_level=None)  # 交易自己控制
+    try:
+        report = []
+        for name, model in m.ARCHIVE_MODELS.items():
+            if not has_table(conn, name):
+                continue
+            legacy = not has_autoincrement(conn, name)
+            archived = archived_ids(m, conn, name)
+            reused = 0
+            if archived:
+                hot = {r[0] for r in conn.execute(f'SELECT id FROM "{name}"')}
+                reused = len(hot & archived)
+            if dry_run:
+                if legacy or reused:
+                    report.append((name, legacy, None, None, reused))
+                continue
+            rows = rebuild(conn, model.__table__) if legacy else None
+            hot_max = conn.execute(f'SELECT COALESCE(MAX(id), 0) FROM "{name}"').fetchone()[0]
+            seq = raise_sequence(conn, name, max([hot_max, *archived]))
+            report.append((name, legacy, rows, seq, reused))
+        return report
+    finally:
+        conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--dry-run", action="store_true", help="只列出要轉換的表")
+    args = parser.parse_args()
+
+    m, source = load_app()
+    converted = reused_total = 0
+    with m.app.app_context():
+        for path in database_files(m, source):
+            print(path)
+            report = migrate_file(m, path, dry_run=args.dry_run)
+            if not any(legacy for _, legacy, *_ in report):
+                print("    已經是 AUTOINCREMENT")
+            else:
+                converted += 1
+            for name, legacy, rows, seq, reused in report:
+                line = f"    {name:<16}"
+                if legacy:
+                    line += "要重建" if rows is None else f"重建 {rows:>9} 列"
+                if seq is not None:
+                    line += f"  下一個 id > {seq}"
+                if reused:
+                    line += f"  ⚠️ {reused} 個 id 在封存裡也有（轉換前就被重用）"
+                    reused_total += reused
+                print(line)
+
+    if args.dry_run:
+        print(f"{converted} 個檔案需要轉換（--dry-run，沒有改動任何資料）")
+    else:
+        print(f"完成，轉換了 {converted} 個檔案。重新啟動網站、worker.py、reminders.py 與 maintenance.py schedule")
+    if reused_total:
+        print(f"有 {reused_total} 個 id 在轉換前已經被重用：ICS 訂閱可能出現重複的 UID，請手動檢查這些項目的提醒")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,239 @@
+"""
+把舊版資料表裡直接存名稱的欄位換成代碼表的 id（item_types / meal_types / body_parts / exercises）
+
+    python tools/migrate_lookups.py              # 主資料庫 + SHARD_DIR 底下每個分檔（可重複執行）
+    python tools/migrate_lookups.py --dry-run    # 只列出哪些檔案 / 表要轉、會新增哪些代碼
+    python tools/migrate_lookups.py --vacuum     # 轉完順便 VACUUM，把省下來的空間還給檔案系統
+
+- calendar_items.item_type -> item_type_id、diet_entries.meal_type -> meal_type_id、
+  strength_sets.body_part + exercise_name -> exercise_id
+- 代碼表裡沒有的名稱：項目類型 / 餐別 / 部位加進代碼表；動作加成該使用者的自訂動作（別人看不到）
+- 每張表在一個交易裡重建：刪舊索引 -> 舊表改名 -> 建新表與索引 -> INSERT ... SELECT（JOIN 暫存的名稱對照表）
+  -> 核對筆數 -> 刪掉舊表。id 與其他欄位原封不動，中途失敗整張表回滾
+- 已經轉過的表（沒有舊欄位）會跳過
+
+執行前請先停掉網站、worker.py 與 reminders.py。
+"""
+import argparse
+import os
+import sqlite3
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# 新代碼排在內建的後面
+EXTRA_SORT_ORDER = 100
+
+
+def load_app():
+    import app as m
+    with m.app.app_context():
+        source = m.db.engine.url.database
+    if not source or source == ":memory:":
+        raise SystemExit("DATABASE_URL 必須是 SQLite 檔案")
+    return m, source
+
+
+def existing_columns(conn, table):
+    return {row[1] for row in conn.execute(f'PRAGMA main.table_info("{table}")')}
+
+
+def database_files(m, source):
+    files = [source]
+    shard_dir = m.app.config["SHARD_DIR"]
+    if os.path.isdir(shard_dir):
+        files += sorted(os.path.join(shard_dir, f) for f in os.listdir(shard_dir) if f.endswith(".db"))
+    return files
+
+
+def used_bytes(conn):
+    """扣掉 freelist 之後實際用到的頁數 × 頁面大小（沒 VACUUM 前檔案大小不會變）"""
+    page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+    pages = conn.execute("PRAGMA page_count").fetchone()[0] - conn.execute("PRAGMA freelist_count").fetchone()[0]
+    return pages * page_size
+
+
+def legacy_tables(m, conn):
+    return [t for t, col in m.LEGACY_LOOKUP_COLUMNS.items() if col in existing_columns(conn, t)]
+
+
+def collect_names(conn, tables):
+    names = {"item_types": set(), "meal_types": set(), "exercises": set()}
+    if "calendar_items" in tables:
+        names["item_types"] = {r[0] for r in conn.execute("SELECT DISTINCT item_type FROM calendar_items")}
+    if "diet_entries" in tables:
+        names["meal_types"] = {r[0] for r in conn.execute("SELECT DISTINCT meal_type FROM diet_entries")}
+    if "strength_sets" in tables:
+        names["exercises"] = set(conn.execute(
+            "SELECT DISTINCT user_id, body_part, exercise_name FROM strength_sets"))
+    return names
+
+
+def ensure_codes(m, names, dry_run=False):
+    """
+    代碼表裡沒有的名稱先新增，回傳 (新增了哪些, {項目類型: id}, {餐別: id}, {(user_id, 部位, 動作): id})；
+    dry_run=True 時什麼都不寫，只回傳會新增哪些
+    """
+    db = m.db
+    base = m.lookups()
+    missing = [
+        (model, name)
+        for model, table, wanted in ((m.ItemType, base.item_types, names["item_types"]),
+                                     (m.MealType, base.meal_types, names["meal_types"]),
+                                     (m.BodyPart, base.body_parts, {part for _, part, _ in names["exercises"]}))
+        for name in sorted(wanted - table.by_name.keys())
+    ]
+    added = [f"{model.__tablename__}: {name}" for model, name in missing]
+    if dry_run:
+        return added + [f"exercises: {name}（{part}，user {uid}）" for uid, part, name in sorted(names["exercises"])
+                        if (part, name) not in m.exercise_catalog(uid).by_key]
+    db.session.add_all(model(name=name, sort_order=EXTRA_SORT_ORDER) for model, name in missing)
+    db.session.commit()
+    if missing:
+        m.bump_version(0, "lookups")
+    base = m.lookups()
+
+    exercises = {}
+    for uid in sorted({uid for uid, _, _ in names["exercises"]}):
+        catalog = m.exercise_catalog(uid)
+        created = False
+        for _, part, name in sorted(k for k in names["exercises"] if k[0] == uid):
+            if (part, name) not in catalog.by_key:
+                db.session.add(m.Exercise(user_id=uid, body_part_id=base.body_parts.id(part), name=name,
+                                          sort_order=EXTRA_SORT_ORDER))
+                added.append(f"exercises: {name}（{part}，user {uid}）")
+                created = True
+        if created:
+            db.session.commit()
+            m.bump_version(uid, "exercises")
+            catalog = m.exercise_catalog(uid)
+        for _, part, name in (k for k in names["exercises"] if k[0] == uid):
+            exercises[uid, part, name] = catalog.by_key[part, name]
+
+    return added, base.item_types.by_name, base.meal_types.by_name, exercises
+
+
+def rebuild(conn, table, new_column, map_columns, join_on, mapping):
+    """
+    用新的 schema 重建 table：new_column 的值來自暫存對照表 _lookup_map（map_columns + id），
+    join_on 是舊表與對照表的 JOIN 條件。回傳搬了幾列。
+    """
+    from sqlalchemy.dialects import sqlite as sqlite_dialect
+    from sqlalchemy.schema import CreateIndex, CreateTable
+
+    dialect = sqlite_dialect.dialect()
+    old_name = f"{table.name}__legacy"
+    old_columns = existing_columns(conn, table.name)
+    select = []
+    for column in table.columns:
+        if column.name == new_column:
+            select.append("_lookup_map.id")
+        elif column.name in old_columns:
+            select.append(f'o."{column.name}"')
+        else:
+            select.append(None)
+    insert_columns = ", ".join(f'"{c.name}"' for c, expr in zip(table.columns, select) if expr)
+    select_sql = ", ".join(expr for expr in select if expr)
+
+    conn.execute("BEGIN")
+    try:
+        conn.execute(f"CREATE TEMP TABLE _lookup_map ({', '.join(map_columns)}, id INTEGER NOT NULL, "
+                     f"PRIMARY KEY ({', '.join(map_columns)}))")
+        conn.executemany(f"INSERT INTO _lookup_map VALUES ({', '.join('?' * (len(map_columns) + 1))})",
+                         [(*(key if isinstance(key, tuple) else (key,)), code) for key, code in mapping.items()])
+        indexes = [r[0] for r in conn.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = ? AND sql IS NOT NULL", (table.name,))]
+        for name in indexes:
+            conn.execute(f'DROP INDEX "{name}"')
+        conn.execute(f'ALTER TABLE "{table.name}" RENAME TO "{old_name}"')
+        conn.execute(str(CreateTable(table).compile(dialect=dialect)))
+        for index in table.indexes:
+            conn.execute(str(CreateIndex(index).compile(dialect=dialect)))
+        conn.execute(
+            f'INSERT INTO "{table.name}" ({insert_columns}) SELECT {select_sql} '
+            f'FROM "{old_name}" AS o JOIN _lookup_map ON {join_on} ORDER BY o.id')
+        before = conn.execute(f'SELECT COUNT(*) FROM "{old_name}"').fetchone()[0]
+        after = conn.execute(f'SELECT COUNT(*) FROM "{table.name}"').fetchone()[0]
+        if before != after:
+            raise RuntimeError(f"{table.name}：舊表 {before} 列，新表只有 {after} 列")
+        conn.execute(f'DROP TABLE "{old_name}"')
+        conn.execute("DROP TABLE _lookup_map")
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    return after
+
+
+def migrate_file(m, path, dry_run=False, vacuum=False):
+    """轉換一個 SQLite 檔；回傳 (轉了哪些表, 轉換前用到的 bytes, 轉換後用到的 bytes)"""
+    conn = sqlite3.connect(path, isolation_level=None)  # 交易自己控制
+    try:
+        tables = legacy_tables(m, conn)
+        if not tables:
+            return [], None, None
+        names = collect_names(conn, tables)
+        if dry_run:
+            for line in ensure_codes(m, names, dry_run=True):
+                print(f"    會新增 {line}")
+            return tables, None, None
+
+        before = used_bytes(conn)
+        added, item_types, meal_types, exercises = ensure_codes(m, names)
+        for line in added:
+            print(f"    新增 {line}")
+        specs = {
+            "calendar_items": (m.CalendarItem, "item_type_id", ["name"],
+                               "_lookup_map.name = o.item_type", item_types),
+            "diet_entries": (m.DietEntry, "meal_type_id", ["name"],
+                             "_lookup_map.name = o.meal_type", meal_types),
+            "strength_sets": (m.StrengthSet, "exercise_id", ["user_id", "body_part", "name"],
+                              "_lookup_map.user_id = o.user_id AND _lookup_map.body_part = o.body_part "
+                              "AND _lookup_map.name = o.exercise_name", exercises),
+        }
+        for name in tables:
+            model, new_column, map_columns, join_on, mapping = specs[name]
+            rows = rebuild(conn, model.__table__, new_column, map_columns, join_on, mapping)
+            print(f"    {name:<16}{rows:>9} 列")
+        conn.execute("ANALYZE")
+        if vacuum:
+            conn.execute("VACUUM")
+        return tables, before, used_bytes(conn)
+    finally:
+        conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--dry-run", action="store_true", help="只列出要轉換的表與會新增的代碼")
+    parser.add_argument("--vacuum", action="store_true", help="轉完之後 VACUUM，把空出來的頁還給檔案系統")
+    args = parser.parse_args()
+
+    m, source = load_app()
+    from sharding import ensure_schema
+    with m.app.app_context():
+        # 代碼表在 directory DB；先建好並補上內建代碼
+        ensure_schema(m.db.engine, [model.__table__ for model in (m.ItemType, m.MealType, m.BodyPart, m.Exercise)])
+        m.seed_lookups()
+
+        converted = 0
+        for path in database_files(m, source):
+            print(path)
+            tables, before, after = migrate_file(m, path, dry_run=args.dry_run, vacuum=args.vacuum)
+            if not tables:
+                print("    已經是新格式")
+                continue
+            converted += 1
+            if before is not None:
+                print(f"    資料用量 {before / 1024:,.0f} KB -> {after / 1024:,.0f} KB")
+        m.db.session.remove()
+
+    if args.dry_run:
+        print(f"{converted} 個檔案需要轉換（--dry-run，沒有改動任何資料）")
+    else:
+        print(f"完成，轉換了 {converted} 個檔案。重新啟動網站、worker.py 與 reminders.py")
+
+
+if __name__ == "__main__":
+    main()
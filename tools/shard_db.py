@@ -0,0 +1,132 @@
+"""
+把現有的單一資料庫切成「每位使用者一個 SQLite 檔」（搭配 SHARD_BY_USER=1）
+
+    python tools/shard_db.py split            # 依 DATABASE_URL / SHARD_DIR 搬資料（可重複執行）
+    python tools/shard_db.py split --purge    # 確認筆數一致後，把搬過去的列從原資料庫刪掉
+    python tools/shard_db.py status           # 列出各 shard 的筆數
+
+- users / social_auths / jobs 不動，原本的資料庫就是分檔模式的 directory DB
+- 每人一份的資料表（app.SHARDED_MODELS）依 user_id 複製到 SHARD_DIR/user_<id>.db，保留原本的 id
+- 用 INSERT OR IGNORE，中途失敗或重跑都不會重複
+- 沒有 --purge 時原資料庫保持原樣；要退回單一資料庫，拿掉 SHARD_BY_USER 即可（分檔期間的新資料不會回寫）
+
+執行前請先停掉網站與 worker.py，避免搬移途中有新的寫入。
+"""
+import argparse
+import os
+import sqlite3
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def load_app():
+    import app as m
+    from sharding import ROUTER, ensure_schema
+    with m.app.app_context():
+        source = m.db.engine.url.database
+    if not source or source == ":memory:":
+        raise SystemExit("DATABASE_URL 必須是 SQLite 檔案")
+    return m, ROUTER, ensure_schema, source
+
+
+def existing_columns(conn, schema, table):
+    return {row[1] for row in conn.execute(f'PRAGMA {schema}.table_info("{table}")')}
+
+
+def split(args):
+    m, router, ensure_schema, source = load_app()
+    import sqlalchemy as sa
+
+    shard_dir = m.app.config["SHARD_DIR"]
+    tables = [model.__table__ for model in m.SHARDED_MODELS]
+    os.makedirs(shard_dir, exist_ok=True)
+    router.directory = shard_dir  # path_for() 用；不需要啟用路由
+
+    conn = sqlite3.connect(source)
+    present = [t for t in tables if existing_columns(conn, "main", t.name)]
+    user_ids = sorted({
+        uid for t in present
+        for (uid,) in conn.execute(f'SELECT DISTINCT user_id FROM "{t.name}" WHERE user_id IS NOT NULL')
+    })
+    print(f"來源：{source}")
+    print(f"目標：{shard_dir}（{len(user_ids)} 位使用者、{len(present)} 張表）")
+
+    mismatches = 0
+    for uid in user_ids:
+        path = router.path_for(uid)
+        engine = sa.create_engine(f"sqlite:///{path}")
+        ensure_schema(engine, tables)
+        engine.dispose()
+
+        conn.execute("ATTACH DATABASE ? AS shard", (path,))
+        try:
+            copied = {}
+            for t in present:
+                cols = [c.name for c in t.columns if c.name in existing_columns(conn, "main", t.name)]
+                col_sql = ", ".join(f'"{c}"' for c in cols)
+                conn.execute(
+                    f'INSERT OR IGNORE INTO shard."{t.name}" ({col_sql}) '
+                    f'SELECT {col_sql} FROM main."{t.name}" WHERE user_id = ?', (uid,))
+                src = conn.execute(f'SELECT COUNT(*) FROM main."{t.name}" WHERE user_id = ?', (uid,)).fetchone()[0]
+                dst = conn.execute(f'SELECT COUNT(*) FROM shard."{t.name}" WHERE user_id = ?', (uid,)).fetchone()[0]
+                copied[t.name] = src
+                if dst < src:
+                    mismatches += 1
+                    print(f"  ! user {uid} {t.name}: 來源 {src} 筆，shard 只有 {dst} 筆（id 衝突？）")
+            conn.commit()
+        finally:
+            conn.execute("DETACH DATABASE shard")
+        print(f"  user {uid:<6} {sum(copied.values()):>7} 筆 -> {os.path.basename(path)}")
+
+    if mismatches:
+        conn.close()
+        raise SystemExit(f"{mismatches} 張表筆數不一致，未刪除任何資料")
+
+    if args.purge:
+        for t in present:
+            conn.execute(f'DELETE FROM "{t.name}" WHERE user_id IS NOT NULL')
+        conn.commit()
+        conn.close()
+        print("已從原資料庫刪除搬移過的資料（可再執行 VACUUM 釋放空間）")
+    else:
+        conn.close()
+    print("完成。設定 SHARD_BY_USER=1 後重新啟動網站與 worker.py")
+
+
+def status(args):
+    m, router, _, source = load_app()
+    shard_dir = m.app.config["SHARD_DIR"]
+    tables = [model.__table__.name for model in m.SHARDED_MODELS]
+    files = sorted(f for f in os.listdir(shard_dir) if f.endswith(".db")) if os.path.isdir(shard_dir) else []
+    print(f"directory DB：{source}")
+    print(f"shard 目錄  ：{shard_dir}（{len(files)} 個檔案）")
+    total = 0
+    for name in files:
+        conn = sqlite3.connect(os.path.join(shard_dir, name))
+        rows = sum(
+            conn.execute(f'SELECT COUNT(*) FROM "{t}"').fetchone()[0]
+            for t in tables if existing_columns(conn, "main", t)
+        )
+        conn.close()
+        total += rows
+        size = os.path.getsize(os.path.join(shard_dir, name)) / 1024
+        print(f"  {name:<20}{rows:>8} 筆 {size:>9.0f} KB")
+    print(f"合計 {total} 筆")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    sub = parser.add_subparsers(dest="command", required=True)
+    p = sub.add_parser("split", help="把每人一份的資料表搬到各自的 SQLite 檔")
+    p.add_argument("--purge", action="store_true", help="搬完並核對筆數後，刪除原資料庫裡的那些列")
+    p.set_defaults(func=split)
+    p = sub.add_parser("status", help="列出各 shard 的筆數")
+    p.set_defaults(func=status)
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+"""
+本機假的 webhook 接收端 + SMTP 伺服器，用來測試 reminders.py 的 email / webhook 送出
+
+    python tools/stub_notify.py            # webhook: http://127.0.0.1:5056/hook，SMTP: 127.0.0.1:1025
+
+然後讓排程器指向它：
+    REMINDER_WEBHOOK_URL=http://127.0.0.1:5056/hook
+    REMINDER_SMTP_HOST=127.0.0.1  REMINDER_SMTP_PORT=1025
+
+收到的內容會印出來，並一行一筆 JSON 附加到 STUB_NOTIFY_LOG（預設不寫檔）。
+STUB_WEBHOOK_FAIL=N 讓前 N 次 webhook 回 503，用來看重試。
+"""
+import json
+import os
+import socketserver
+import threading
+from email import message_from_bytes
+from email.policy import default as default_policy
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+HOST = os.environ.get("STUB_NOTIFY_HOST", "127.0.0.1")
+HTTP_PORT = int(os.environ.get("STUB_WEBHOOK_PORT", "5056"))
+SMTP_PORT = int(os.environ.get("STUB_SMTP_PORT", "1025"))
+LOG_PATH = os.environ.get("STUB_NOTIFY_LOG")
+
+_log_lock = threading.Lock()
+_webhook_failures = [int(os.environ.get("STUB_WEBHOOK_FAIL", "0"))]
+
+
+def record(kind, data):
+    print(f"[{kind}] {json.dumps(data, ensure_ascii=False)}")
+    if LOG_PATH:
+        with _log_lock, open(LOG_PATH, "a", encoding="utf-8") as f:
+            f.write(json.dumps({"kind": kind, **data}, ensure_ascii=False) + "\n")
+
+
+class WebhookHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        with _log_lock:
+            fail = _webhook_failures[0] > 0
+            _webhook_failures[0] -= fail
+        if fail:
+            self.send_response(503)
+            self.end_headers()
+            return
+        record("webhook", json.loads(body or b"{}"))
+        self.send_response(204)
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+class SMTPHandler(socketserver.StreamRequestHandler):
+    """只實作 smtplib 會用到的指令，收到的信不轉寄，只記錄下來"""
+
+    def reply(self, line):
+        self.wfile.write(f"{line}\r\n".encode())
+
+    def handle(self):
+        self.reply("220 stub-smtp ready")
+        sender, recipients = None, []
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = line.decode("utf-8", "replace").strip()
+            verb = command[:4].upper()
+            if verb in ("EHLO", "HELO"):
+                self.reply("250 stub-smtp")
+            elif verb == "MAIL":
+                sender, recipients = command.split(":", 1)[1].strip(), []
+                self.reply("250 OK")
+            elif verb == "RCPT":
+                recipients.append(command.split(":", 1)[1].strip().strip("<>"))
+                self.reply("250 OK")
+            elif verb == "DATA":
+                self.reply("354 End data with <CR><LF>.<CR><LF>")
+                lines = []
+                while True:
+                    data = self.rfile.readline()
+                    if data in (b".\r\n", b".\n", b""):
+                        break
+                    lines.append(data[1:] if data.startswith(b"..") else data)
+                msg = message_from_bytes(b"".join(lines), policy=default_policy)
+                record("email", {"from": sender, "to": recipients, "subject": msg["Subject"],
+                                 "body": msg.get_body().get_content().strip()})
+                self.reply("250 OK")
+            elif verb in ("RSET", "NOOP"):
+                self.reply("250 OK")
+            elif verb == "QUIT":
+                self.reply("221 Bye")
+                return
+            else:
+                self.reply("502 Command not implemented")
+
+
+class ThreadingTCPServer(socketserver.ThreadingTCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+
+if __name__ == "__main__":
+    smtp = ThreadingTCPServer((HOST, SMTP_PORT), SMTPHandler)
+    threading.Thread(target=smtp.serve_forever, daemon=True).start()
+    print(f"stub webhook: http://{HOST}:{HTTP_PORT}/hook  stub SMTP: {HOST}:{SMTP_PORT}")
+    try:
+        ThreadingHTTPServer((HOST, HTTP_PORT), WebhookHandler).serve_forever()
+    except KeyboardInterrupt:
+        pass
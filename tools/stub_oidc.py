@@ -0,0 +1,93 @@
+"""
+本機假的 OIDC provider（模擬 LINE / Google），用來離線測試登入流程
+
+    python tools/stub_oidc.py            # 預設 http://127.0.0.1:5055
+
+然後讓 app 指向它：
+    LINE_METADATA_URL=http://127.0.0.1:5055/.well-known/openid-configuration
+    LINE_CLIENT_ID=stub-client  LINE_CLIENT_SECRET=stub-secret
+
+/authorize 不會顯示任何畫面，直接帶 code 轉回 redirect_uri；
+/token 回傳用 ES256（與 LINE 原生一樣）簽章的 id_token，nonce 會原樣帶回；
+STUB_OIDC_TOKEN_DELAY=0.3 時 /token 每次先等 0.3 秒，模擬 provider 回應慢（benchmarks/bench_workers.py 用）。
+"""
+import os
+import secrets
+import time
+
+from flask import Flask, jsonify, redirect, request
+from authlib.jose import JsonWebKey, jwt
+from urllib.parse import urlencode
+
+HOST = os.environ.get("STUB_OIDC_HOST", "127.0.0.1")
+PORT = int(os.environ.get("STUB_OIDC_PORT", "5055"))
+ISSUER = os.environ.get("STUB_OIDC_ISSUER", f"http://{HOST}:{PORT}")
+TOKEN_DELAY = float(os.environ.get("STUB_OIDC_TOKEN_DELAY", "0"))
+
+KEY = JsonWebKey.generate_key("EC", "P-256", is_private=True, options={"kid": "stub-es256"})
+CODES = {}  # code -> 授權時的參數（client_id, nonce）
+
+stub = Flask(__name__)
+
+
+@stub.route("/.well-known/openid-configuration")
+def discovery():
+    return jsonify({
+        "issuer": ISSUER,
+        "authorization_endpoint": f"{ISSUER}/authorize",
+        "token_endpoint": f"{ISSUER}/token",
+        "jwks_uri": f"{ISSUER}/jwks",
+        "id_token_signing_alg_values_supported": ["ES256"],
+        "response_types_supported": ["code"],
+        "subject_types_supported": ["pairwise"],
+    })
+
+
+@stub.route("/jwks")
+def jwks():
+    return jsonify({"keys": [KEY.as_dict(is_private=False)]})
+
+
+@stub.route("/authorize")
+def authorize():
+    code = secrets.token_urlsafe(16)
+    CODES[code] = {
+        "client_id": request.args.get("client_id"),
+        "nonce": request.args.get("nonce"),
+    }
+    params = {"code": code, "state": request.args.get("state", "")}
+    return redirect(f"{request.args['redirect_uri']}?{urlencode(params)}")
+
+
+@stub.route("/token", methods=["POST"])
+def token():
+    if TOKEN_DELAY:
+        time.sleep(TOKEN_DELAY)
+    grant = CODES.pop(request.form.get("code", ""), None)
+    if grant is None:
+        return jsonify({"error": "invalid_grant"}), 400
+
+    now = int(time.time())
+    claims = {
+        "iss": ISSUER,
+        "sub": os.environ.get("STUB_OIDC_SUB", "U-stub-user"),
+        "aud": grant["client_id"],
+        "iat": now,
+        "exp": now + 3600,
+        "name": os.environ.get("STUB_OIDC_NAME", "Stub User"),
+        "email": os.environ.get("STUB_OIDC_EMAIL", "stub@example.com"),
+    }
+    if grant["nonce"]:
+        claims["nonce"] = grant["nonce"]
+    header = {"alg": "ES256", "kid": KEY.kid, "typ": "JWT"}
+    id_token = jwt.encode(header, claims, KEY).decode("ascii")
+    return jsonify({
+        "access_token": secrets.token_urlsafe(24),
+        "token_type": "Bearer",
+        "expires_in": 3600,
+        "id_token": id_token,
+    })
+
+
+if __name__ == "__main__":
+    stub.run(host=HOST, port=PORT, threaded=True)
@@ -0,0 +1,163 @@
+"""
+背景工作 worker：從 jobs 資料表取出工作並執行（不需要 Redis 之類的外部 broker）
+
+啟動方式（與 gunicorn 分開的獨立程序）：
+    python worker.py
+
+環境變數：
+    JOB_POLL_INTERVAL  沒有工作時多久檢查一次（秒，預設 1）
+    JOB_LOCK_TIMEOUT   running 的工作超過幾秒沒有心跳就視為 worker 掛掉，重新排入（預設 600）；
+                       執行中每 JOB_LOCK_TIMEOUT / 3 秒更新一次 locked_at，跑得再久也不會被重跑
+    JOB_RETRY_BASE     重試等待秒數的底數，第 n 次失敗等 base * 2^(n-1) 秒（預設 5）
+"""
+import os
+import socket
+import threading
+import time
+import traceback
+import json
+from datetime import datetime, timedelta
+
+from app import app, db, Job, JOB_HANDLERS, init_schema
+from sharding import using_shard
+
+POLL_INTERVAL = float(os.environ.get("JOB_POLL_INTERVAL", "1"))
+LOCK_TIMEOUT = int(os.environ.get("JOB_LOCK_TIMEOUT", "600"))
+RETRY_BASE = int(os.environ.get("JOB_RETRY_BASE", "5"))
+HEARTBEAT_INTERVAL = max(1.0, LOCK_TIMEOUT / 3)
+
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}"
+
+
+def requeue_stale_jobs():
+    """worker 當掉時會留下卡在 running 的工作，超過 LOCK_TIMEOUT 沒有心跳就放回佇列"""
+    cutoff = datetime.utcnow() - timedelta(seconds=LOCK_TIMEOUT)
+    n = (
+        Job.query
+        .filter(Job.status == "running", Job.locked_at < cutoff)
+        .update({"status": "queued", "locked_by": None, "locked_at": None},
+                synchronize_session=False)
+    )
+    db.session.commit()
+    return n
+
+
+def claim_next_job():
+    """
+    搶下一筆可執行的工作。
+    用「WHERE status='queued'」的條件式 UPDATE 當作鎖：多個 worker 同時搶時只有一個會更新成功。
+    """
+    now = datetime.utcnow()
+    while True:
+        candidate = (
+            db.session.query(Job.id)
+            .filter(Job.status == "queued", Job.run_after <= now)
+            .order_by(Job.run_after.asc(), Job.id.asc())
+            .first()
+        )
+        if candidate is None:
+            return None
+
+        claimed = (
+            Job.query
+            .filter(Job.id == candidate.id, Job.status == "queued")
+            .update({
+                "status": "running",
+                "locked_by": WORKER_ID,
+                "locked_at": now,
+                "attempts": Job.attempts + 1,
+            }, synchronize_session=False)
+        )
+        db.session.commit()
+        if claimed:
+            return db.session.get(Job, candidate.id)
+        # 被別的 worker 搶走了，再找下一筆
+
+
+def heartbeat(job_id, stop):
+    """
+    另一條 thread：工作執行中每 HEARTBEAT_INTERVAL 秒更新 locked_at。
+    handler 一整段都不呼叫 job_progress 時（例如一句很久的 SQL），也不會被 requeue_stale_jobs 當成掛掉而重跑
+    """
+    with app.app_context():
+        while not stop.wait(HEARTBEAT_INTERVAL):
+            try:
+                (Job.query
+                 .filter(Job.id == job_id, Job.status == "running", Job.locked_by == WORKER_ID)
+                 .update({"locked_at": datetime.utcnow()}, synchronize_session=False))
+                db.session.commit()
+            except Exception as e:  # 例如等鎖逾時：下一次再試，還有 LOCK_TIMEOUT 的餘裕
+                db.session.rollback()
+                print(f"[worker] job #{job_id} 心跳失敗：{e}")
+        db.session.remove()
+
+
+def run_job(job):
+    handler = JOB_HANDLERS.get(job.kind)
+    stop = threading.Event()
+    beat = threading.Thread(target=heartbeat, args=(job.id, stop), name=f"job-{job.id}-heartbeat", daemon=True)
+    beat.start()
+    try:
+        if handler is None:
+            raise RuntimeError(f"沒有註冊的工作類型：{job.kind}")
+        payload = json.loads(job.payload) if job.payload else {}
+        with using_shard(job.user_id):  # 分檔模式下讀寫這位使用者的資料檔
+            result = handler(job, payload)
+
+        job.status = "done"
+        job.progress = 100.0
+        job.result = json.dumps(result, ensure_ascii=False) if result is not None else None
+        job.error = None
+        job.locked_by = None
+        job.locked_at = None
+        db.session.commit()
+        print(f"[worker] job #{job.id} ({job.kind}) 完成")
+    except Exception:
+        db.session.rollback()
+        job = db.session.get(Job, job.id)
+        job.error = traceback.format_exc()[-4000:]
+        job.locked_by = None
+        job.locked_at = None
+        if job.attempts < job.max_attempts:
+            # 指數退避後重試
+            delay = RETRY_BASE * (2 ** (job.attempts - 1))
+            job.status = "queued"
+            job.run_after = datetime.utcnow() + timedelta(seconds=delay)
+            job.message = f"第 {job.attempts} 次失敗，{delay} 秒後重試"
+        else:
+            job.status = "failed"
+            job.message = f"失敗（已嘗試 {job.attempts} 次）"
+        db.session.commit()
+        print(f"[worker] job #{job.id} ({job.kind}) 失敗：{job.message}")
+    finally:
+        stop.set()
+        beat.join()
+
+
+def run_worker(once=False):
+    """主迴圈；once=True 時處理完目前的佇列就結束（方便測試 / cron）"""
+    print(f"[worker] {WORKER_ID} 啟動，handlers = {sorted(JOB_HANDLERS)}")
+    init_schema()  # worker 可能比網頁先啟動，確保 jobs 表存在
+    with app.app_context():
+        last_stale_check = 0.0
+        while True:
+            if time.monotonic() - last_stale_check > 60:
+                requeue_stale_jobs()
+                last_stale_check = time.monotonic()
+
+            job = claim_next_job()
+            if job is not None:
+                run_job(job)
+                db.session.remove()
+                continue
+
+            if once:
+                return
+            time.sleep(POLL_INTERVAL)
+
+
+if __name__ == "__main__":
+    try:
+        run_worker(once=os.environ.get("JOB_RUN_ONCE") == "1")
+    except KeyboardInterrupt:
+        print("[worker] 結束")